@@ -0,0 +1,39 @@
+// config_options.h
+
+// See ../../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABLITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+//
+
+#ifndef YAPYKALDI_CONFIG_OPTIONS_H_
+#define YAPYKALDI_CONFIG_OPTIONS_H_
+
+#include <istream>
+#include <string>
+
+#include "base/kaldi-common.h"
+#include "util/parse-options.h"
+
+namespace kaldi
+{
+// Reads options in config file syntax: one or more options per line, # starts
+// a comment. name identifies the options in error messages.
+void parse_options(std::istream &is, const std::string &name, ParseOptions *po);
+
+// the same for options in a string
+void parse_options(const std::string &options, const std::string &name, ParseOptions *po);
+
+}  // namespace kaldi
+
+#endif  // YAPYKALDI_CONFIG_OPTIONS_H_
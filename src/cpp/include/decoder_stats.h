@@ -0,0 +1,116 @@
+// decoder_stats.h
+
+// See ../../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABLITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+//
+
+#ifndef YAPYKALDI_DECODER_STATS_H_
+#define YAPYKALDI_DECODER_STATS_H_
+
+#include <vector>
+
+#include "base/kaldi-common.h"
+#include "base/timer.h"
+#include "lat/kaldi-lattice.h"
+
+namespace kaldi
+{
+// Search statistics of a decoder wrapper, for tuning beams and detecting
+// decoders falling behind. The counters run from the creation of the decoder
+// or the last reset.
+struct DecoderStats
+{
+  // bin 0 counts frames without tokens, bin i > 0 frames with 2^(i-1) up to
+  // 2^i - 1 tokens, the last bin all frames with more
+  static const int32 num_histogram_bins = 17;
+
+  DecoderStats() { reset(); }
+
+  void reset(void)
+  {
+    utterances = 0;
+    samples_received = 0;
+    frames_decoded = 0;
+    frames_pending = 0;
+    active_tokens_histogram.assign(num_histogram_bins, 0);
+    active_tokens_total = 0;
+    active_tokens_max = 0;
+    frames_at_max_active = 0;
+    lattice_states = 0;
+    lattice_arcs = 0;
+    accept_waveform_seconds = 0.0;
+    advance_decoding_seconds = 0.0;
+    finalize_seconds = 0.0;
+  }
+
+  void add_active_tokens(int32 num_tokens, int32 max_active)
+  {
+    int32 bin = 0;
+    while (bin < num_histogram_bins - 1 && num_tokens >= (1 << bin)) bin++;
+    active_tokens_histogram[bin]++;
+    active_tokens_total += num_tokens;
+    active_tokens_max = std::max(active_tokens_max, num_tokens);
+    if (num_tokens >= max_active) frames_at_max_active++;
+  }
+
+  void set_lattice(const CompactLattice &clat)
+  {
+    lattice_states = clat.NumStates();
+    lattice_arcs = 0;
+    for (int32 s = 0; s < lattice_states; s++) lattice_arcs += clat.NumArcs(s);
+  }
+
+  int64 utterances;
+  int64 samples_received;
+  // frames after frame subsampling
+  int64 frames_decoded;
+  // feature frames of the current utterance that are not decoded yet
+  int32 frames_pending;
+
+  // tokens per decoded frame, where the decoder exposes them
+  std::vector<int64> active_tokens_histogram;
+  int64 active_tokens_total;
+  int32 active_tokens_max;
+  int64 frames_at_max_active;
+
+  // final lattice of the last utterance
+  int32 lattice_states;
+  int64 lattice_arcs;
+
+  // wall time
+  double accept_waveform_seconds;
+  double advance_decoding_seconds;
+  double finalize_seconds;
+};  // struct DecoderStats
+
+// Counts the tokens of a frame of a lattice faster decoder, which keeps them
+// in a protected member. Counted right after the frame is decoded, these are
+// its active tokens, less those pruned within the same decoding call.
+template <class Decoder>
+class ActiveTokenCounter : public Decoder
+{
+ public:
+  static int32 count(const Decoder &decoder, int32 frame)
+  {
+    const auto &active_toks = decoder.*(&ActiveTokenCounter::active_toks_);
+    int32 num_tokens = 0;
+    for (auto *tok = active_toks[frame + 1].toks; tok != NULL; tok = tok->next) num_tokens++;
+    return num_tokens;
+  }
+};  // class ActiveTokenCounter
+
+}  // namespace kaldi
+
+#endif  // YAPYKALDI_DECODER_STATS_H_
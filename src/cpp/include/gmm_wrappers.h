@@ -22,6 +22,8 @@
 // limitations under the License.
 //
 
+#include <mutex>
+
 #include "feat/wave-reader.h"
 #include "fstext/fstext-lib.h"
 #include "lat/lattice-functions.h"
@@ -32,11 +34,29 @@
 #include "online2/online-timing.h"
 #include "online2/onlinebin-util.h"
 
+#include "config_options.h"
+#include "decoder_stats.h"
+#include "lattice_rescoring.h"
+
 namespace kaldi
 {
+// What decode does once the first pass of an utterance is finalized
+enum GmmSecondPassMode
+{
+  // estimate fMLLR and rescore the lattice with the adapted model (and LM)
+  // before decode returns
+  kSecondPassSync = 0,
+  // return the best path of the first pass, the second pass is left to a
+  // GmmSecondPass, see take_second_pass
+  kSecondPassDeferred = 1,
+  // no fMLLR estimation and no rescoring, for the lowest latency
+  kSecondPassSkip = 2
+};
+
 class GmmOnlineModelWrapper
 {
   friend class GmmOnlineDecoderWrapper;
+  friend class GmmSecondPass;
 
  public:
   GmmOnlineModelWrapper(BaseFloat beam, int32 max_active, int32 min_active,
@@ -45,7 +65,13 @@ class GmmOnlineModelWrapper
                         std::string &align_lex_filename);
   ~GmmOnlineModelWrapper();
 
+  void set_lm_rescoring(const std::string &old_lm_filename, const std::string &new_lm_filename);
+
  private:
+  // whether the dimensions of an adaptation state, e.g. one saved with
+  // another model, are those of the features of this model
+  bool adaptation_state_fits(const OnlineGmmAdaptationState &state) const;
+
   fst::SymbolTable *word_syms;
 
   OnlineGmmDecodingConfig decode_config;
@@ -56,39 +82,166 @@ class GmmOnlineModelWrapper
   OnlineEndpointConfig endpoint_config;
 
   OnlineGmmDecodingModels *gmm_models;
+  int32 cmvn_dim;
   fst::Fst<fst::StdArc> *decode_fst;
 
   // word alignment:
   std::vector<std::vector<int32>> word_alignment_lexicon;
 
+  // optional second pass LM rescoring of the final lattice
+  LatticeLmRescorer *rescorer;
+
 };  // class GmmOnlineModelWrapper
 
+// Second pass of a finalized utterance, run apart from the first so the
+// result of the first pass does not wait for it: fMLLR estimation, rescoring of
+// the lattice with the adapted model and LM rescoring. It owns the decoder of
+// the utterance, so the decoder wrapper goes on with the next utterance in the
+// meantime, and run may be called from another thread.
+class GmmSecondPass
+{
+  friend class GmmOnlineDecoderWrapper;
+
+ public:
+  ~GmmSecondPass();
+
+  // returns false if the lattice is empty
+  bool run(void);
+
+  void get_decoded_string(std::string &decoded_string, double &likelihood);
+  bool get_word_alignment(std::vector<string> &words, std::vector<int32> &times,
+                          std::vector<int32> &lengths);
+  bool get_word_confidences(std::vector<string> &words, std::vector<int32> &times,
+                            std::vector<int32> &lengths, std::vector<BaseFloat> &confidences);
+
+  // wall time run took
+  double get_seconds(void) { return seconds; }
+
+ private:
+  GmmSecondPass(GmmOnlineModelWrapper *aModel, OnlineGmmDecodingConfig *aConfig,
+                OnlineGmmAdaptationState *aInitialAdaptationState, SingleUtteranceGmmDecoder *aDecoder,
+                const CompactLattice &first_pass_best_path);
+  void free_decoder(void);
+
+  GmmOnlineModelWrapper *model;
+  // the decoder refers to its configuration and initial adaptation state
+  OnlineGmmDecodingConfig *config;
+  OnlineGmmAdaptationState *initial_adaptation_state;
+  SingleUtteranceGmmDecoder *decoder;
+
+  bool finished;
+  bool ok;
+  double seconds;
+  // adaptation state at the end of the utterance, with its fMLLR transform
+  OnlineGmmAdaptationState adaptation_state;
+
+  // the first pass best path until run is done
+  CompactLattice best_path_clat;
+  CompactLattice final_clat;
+
+};  // class GmmSecondPass
+
 class GmmOnlineDecoderWrapper
 {
+  friend class GmmSecondPass;
+
  public:
   GmmOnlineDecoderWrapper(GmmOnlineModelWrapper *aModel);
   ~GmmOnlineDecoderWrapper();
 
   bool decode(BaseFloat samp_freq, int32 num_frames, BaseFloat *frames,
               bool finalize);
+  // drop the current utterance without finalizing it
+  void reset(void);
 
   void get_decoded_string(std::string &decoded_string, double &likelihood);
   bool get_word_alignment(std::vector<string> &words, std::vector<int32> &times,
                           std::vector<int32> &lengths);
 
+  // words of the best path without silences, with their lattice posteriors
+  bool get_word_confidences(std::vector<string> &words, std::vector<int32> &times,
+                            std::vector<int32> &lengths, std::vector<BaseFloat> &confidences);
+
+  // speaker adaptation state in Kaldi binary format. Once set, the adaptation
+  // state is carried over from one utterance to the next
+  std::string get_adaptation_state(void);
+  void set_adaptation_state(const std::string &state);
+  void reset_adaptation_state(bool carry);
+
+  // beams and max_active tokens, from the next utterance on. They start out as
+  // configured in the model
+  void set_search_options(BaseFloat beam, int32 max_active, BaseFloat lattice_beam);
+  void get_search_options(BaseFloat &beam, int32 &max_active, BaseFloat &lattice_beam);
+
+  // endpointing: options in config file syntax, e.g.
+  // "--endpoint.silence-phones=1:2:3 --endpoint.rule2.min-trailing-silence=0.5",
+  // and whether the utterance in progress has reached an endpoint
+  void set_endpoint_options(const std::string &options);
+  bool endpoint_detected(void);
+
+  // search statistics since the decoder was created or last reset. The
+  // decoder does not expose its tokens, so there are no active token counts
+  DecoderStats get_stats(void);
+  void reset_stats(void);
+  // the statistics as they are, without updating frames_pending, for counters
+  // taken every chunk
+  const DecoderStats &get_counters(void) const { return stats; }
+
+  // see GmmSecondPassMode. Applies from the next finalized utterance on
+  void set_second_pass_mode(int32 mode);
+  int32 get_second_pass_mode(void) { return second_pass_mode; }
+  // in kSecondPassDeferred mode, the second pass of the utterance finalized
+  // last, or NULL if it was taken already. The caller owns it
+  GmmSecondPass *take_second_pass(void);
+  // with the adaptation state carried over, continue from the one the second
+  // pass reached. Utterances started before keep the first pass state. The
+  // final lattice of the second pass goes into the statistics, as in
+  // kSecondPassSync mode
+  void carry_adaptation_state_from(const GmmSecondPass &second_pass);
+
  private:
   void start_decoding(void);
   void free_decoder(void);
 
+  static void best_path_string(GmmOnlineModelWrapper *model, const Lattice &best_path_lat,
+                               std::string &decoded_string, double &likelihood);
+  static bool align_words(GmmOnlineModelWrapper *model, const CompactLattice &best_path_clat,
+                          std::vector<int32> &word_idxs, std::vector<int32> &times, std::vector<int32> &lengths);
+  static void lookup_words(GmmOnlineModelWrapper *model, const std::vector<int32> &word_idxs,
+                           std::vector<string> &words);
+  static bool word_confidences(GmmOnlineModelWrapper *model, const CompactLattice &best_path_clat,
+                               const CompactLattice &final_clat, std::vector<string> &words,
+                               std::vector<int32> &times, std::vector<int32> &lengths,
+                               std::vector<BaseFloat> &confidences);
+
   GmmOnlineModelWrapper *model;
+  // search options of this decoder, copied for every utterance since the
+  // decoder refers to its configuration and may outlive the utterance in a
+  // GmmSecondPass
+  OnlineGmmDecodingConfig decode_config;
+  OnlineGmmDecodingConfig *utterance_config;
+  OnlineEndpointConfig endpoint_config;
+
+  int32 second_pass_mode;
+  GmmSecondPass *pending_second_pass;
 
   OnlineGmmAdaptationState *adaptation_state;
+  OnlineGmmAdaptationState *utterance_adaptation_state;
+  bool carry_adaptation_state;
+  // guards adaptation_state and the lattice statistics, which
+  // carry_adaptation_state_from updates from the thread of the second passes
+  // while decode runs
+  std::mutex adaptation_mutex;
   SingleUtteranceGmmDecoder *decoder;
 
-  int32 tot_frames, tot_frames_decoded;
+  int64 tot_frames, tot_frames_decoded;
+  DecoderStats stats;
+  // feature frames of the current utterance decoded so far
+  int32 utterance_frames_decoded;
 
   // decoding result:
   CompactLattice best_path_clat;
+  CompactLattice final_clat;
 
 };  // GmmOnlineDecoderWrapper
 
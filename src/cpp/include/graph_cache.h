@@ -0,0 +1,106 @@
+// graph_cache.h
+//
+// Decoding graphs (HCLG.fst with its word symbol table and alignment
+// lexicon) kept separately from the acoustic model, so that a single model can
+// decode with several graphs and switch between them per utterance.
+
+// See ../../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABLITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+//
+
+#ifndef YAPYKALDI_GRAPH_CACHE_H_
+#define YAPYKALDI_GRAPH_CACHE_H_
+
+#include <functional>
+#include <list>
+#include <map>
+#include <memory>
+#include <mutex>
+
+#include "base/kaldi-common.h"
+#include "fstext/fstext-lib.h"
+
+namespace kaldi
+{
+struct DecodingGraph
+{
+  DecodingGraph(const std::string &name, const std::string &fst_in_str,
+                const std::string &word_syms_filename, const std::string &align_lex_filename);
+  // from streams, e.g. over the members of a model bundle
+  DecodingGraph(const std::string &name, std::istream &fst_is, std::istream &word_syms_is,
+                std::istream &align_lex_is, size_t size_bytes);
+  ~DecodingGraph();
+
+  std::string name;
+
+  fst::Fst<fst::StdArc> *decode_fst;
+  fst::SymbolTable *word_syms;
+
+  // word alignment:
+  std::vector<std::vector<int32> > word_alignment_lexicon;
+
+  // Approximate memory footprint, used for the memory cap of the cache
+  size_t size_bytes;
+};  // struct DecodingGraph
+
+// LRU cache of named decoding graphs.
+//
+// Graphs are registered by name and loaded on first use. When the loaded
+// graphs exceed max_bytes, the least recently used ones are dropped from the
+// cache; a decoder still holding a graph keeps it alive until its utterance
+// is done. A max_bytes of 0 disables eviction.
+class DecodingGraphCache
+{
+ public:
+  typedef std::function<DecodingGraph *()> GraphLoader;
+
+  explicit DecodingGraphCache(size_t max_bytes);
+
+  void add(const std::string &name, const std::string &fst_in_str, const std::string &word_syms_filename,
+           const std::string &align_lex_filename);
+  void add(const std::string &name, GraphLoader loader);
+  void remove(const std::string &name);
+  bool has(const std::string &name);
+
+  // Returns the graph, loading it if it is not in the cache
+  std::shared_ptr<const DecodingGraph> get(const std::string &name);
+
+  void set_max_bytes(size_t max_bytes);
+  size_t memory_usage();
+  std::vector<std::string> loaded_graphs();
+
+ private:
+  void evict(const std::string &keep);
+
+  typedef std::list<std::string> LruList;
+  struct CacheEntry
+  {
+    std::shared_ptr<const DecodingGraph> graph;
+    LruList::iterator lru_position;
+  };
+
+  std::map<std::string, GraphLoader> loaders;
+  std::map<std::string, CacheEntry> cache;
+  LruList lru;  // most recently used first
+
+  size_t max_bytes;
+  size_t used_bytes;
+
+  std::mutex mutex;
+};  // class DecodingGraphCache
+
+}  // namespace kaldi
+
+#endif  // YAPYKALDI_GRAPH_CACHE_H_
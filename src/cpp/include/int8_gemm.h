@@ -0,0 +1,119 @@
+// int8_gemm.h
+
+// See ../../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABLITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+//
+
+#ifndef YAPYKALDI_INT8_GEMM_H_
+#define YAPYKALDI_INT8_GEMM_H_
+
+#include <vector>
+
+#include "base/kaldi-error.h"
+#include "base/kaldi-types.h"
+
+namespace kaldi
+{
+// Matrix products of int8 quantized input rows and weights, accumulated in
+// int32, for the int8 components of nnet3_int8.h. Both are quantized
+// symmetrically to [-127, 127], with a scale per row.
+//
+// The weights are packed once, into panels of kInt8PanelRows rows whose
+// columns are interleaved in blocks of kInt8DepthBlock, so the kernel reads a
+// panel front to back. The kernel computes a tile of input rows by a panel at
+// a time: with 16-bit multiply-adds on CPUs with AVX2, which is checked at run
+// time as the extension is built without -march flags, and in plain loops on
+// the same layout elsewhere.
+
+// weight rows per panel, and columns per block of a panel
+const int32 kInt8PanelRows = 2;
+const int32 kInt8DepthBlock = 16;
+
+// Quantized weights, a row per output
+class Int8PackedMatrix
+{
+ public:
+  Int8PackedMatrix() : num_rows(0), num_cols(0), depth(0) {}
+
+  // quantize the num_rows x num_cols matrix at data, with rows row_stride
+  // apart
+  void quantize(const BaseFloat *data, int32 num_rows, int32 num_cols, int32 row_stride);
+  // already quantized values, row-major without padding, and their scales
+  void assign(const int8 *values, const BaseFloat *scales, int32 num_rows, int32 num_cols);
+
+  int32 NumRows() const { return num_rows; }
+  int32 NumCols() const { return num_cols; }
+  int8 value(int32 row, int32 col) const;
+  BaseFloat scale(int32 row) const { return scales[row]; }
+
+  // largest absolute difference between the dequantized weights and the
+  // matrix at data, with rows row_stride apart
+  BaseFloat max_error(const BaseFloat *data, int32 row_stride) const;
+
+  // columns padded to a multiple of kInt8DepthBlock, and the panels of that
+  // depth. Rows past NumRows() in the last panel are zero
+  int32 Depth() const { return depth; }
+  const int8 *panel(int32 index) const { return &packed[static_cast<size_t>(index) * kInt8PanelRows * depth]; }
+
+ private:
+  int32 num_rows, num_cols, depth;
+  std::vector<int8> packed;
+  std::vector<BaseFloat> scales;
+};  // class Int8PackedMatrix
+
+// Quantized input rows, one per frame, widened to int16 for the
+// multiply-adds. The memory is kept for the next rows quantized
+class Int8InputRows
+{
+ public:
+  Int8InputRows() : num_rows(0), num_cols(0), depth(0) {}
+
+  void quantize(const BaseFloat *data, int32 num_rows, int32 num_cols, int32 row_stride);
+
+  int32 NumRows() const { return num_rows; }
+  int32 NumCols() const { return num_cols; }
+  // row of Depth() values, zero past NumCols()
+  const int16 *row(int32 index) const { return &values[static_cast<size_t>(index) * depth]; }
+  BaseFloat scale(int32 index) const { return scales[index]; }
+
+ private:
+  int32 num_rows, num_cols, depth;
+  std::vector<int16> values;
+  std::vector<BaseFloat> scales;
+};  // class Int8InputRows
+
+// Kernels of Int8Gemm. kInt8GemmAuto is the AVX2 one on CPUs with AVX2 and
+// the generic one elsewhere; the others are for checking one against the other
+enum Int8GemmKernel
+{
+  kInt8GemmAuto = 0,
+  kInt8GemmGeneric = 1,
+  kInt8GemmAvx2 = 2
+};
+
+// whether Int8Gemm can run with kernel on this CPU
+bool Int8GemmKernelSupported(Int8GemmKernel kernel);
+
+// Adds the products of num_rows input rows and the weight rows to out, scaled
+// back to floats: out[r * out_stride + c] += input row first_row + r *
+// row_step times weight row c, for c < weights.NumRows(). The rows are taken
+// row_step apart for the time offsets of TDNN layers.
+void Int8Gemm(const Int8InputRows &input, int32 first_row, int32 row_step, int32 num_rows,
+              const Int8PackedMatrix &weights, BaseFloat *out, int32 out_stride,
+              Int8GemmKernel kernel = kInt8GemmAuto);
+
+}  // namespace kaldi
+
+#endif  // YAPYKALDI_INT8_GEMM_H_
@@ -0,0 +1,61 @@
+// lattice_rescoring.h
+//
+// based on Kaldi's latbin/lattice-lmrescore-const-arpa.cc and
+// latbin/lattice-lmrescore-pruned.cc
+
+// Copyright 2014  Johns Hopkins University (author: Daniel Povey)
+
+// See ../../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABLITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+//
+
+#ifndef YAPYKALDI_LATTICE_RESCORING_H_
+#define YAPYKALDI_LATTICE_RESCORING_H_
+
+#include "base/kaldi-common.h"
+#include "fstext/fstext-lib.h"
+#include "lat/kaldi-lattice.h"
+#include "lm/const-arpa-lm.h"
+
+namespace kaldi
+{
+// Second pass LM rescoring of the final lattice of an utterance.
+//
+// The LM scores of the first pass (the G.fst the decoding graph was compiled
+// with) are subtracted from the lattice and the scores of a larger LM are
+// added, i.e. the "LM difference" rescoring of lattice-lmrescore. The new LM
+// can either be an FST (G.fst) or a ConstArpaLm (G.carpa) as produced by
+// arpa-to-const-arpa.
+class LatticeLmRescorer
+{
+ public:
+  LatticeLmRescorer(const std::string &old_lm_filename, const std::string &new_lm_filename);
+  ~LatticeLmRescorer();
+
+  // Rescores clat in place. Returns false and leaves clat untouched if the
+  // rescored lattice is empty.
+  bool Rescore(CompactLattice *clat) const;
+
+ private:
+  fst::VectorFst<fst::StdArc> *old_lm_fst;
+
+  // Exactly one of these is set, depending on the format of the new LM
+  fst::VectorFst<fst::StdArc> *new_lm_fst;
+  ConstArpaLm *new_lm_carpa;
+};  // class LatticeLmRescorer
+
+}  // namespace kaldi
+
+#endif  // YAPYKALDI_LATTICE_RESCORING_H_
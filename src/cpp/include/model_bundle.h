@@ -0,0 +1,85 @@
+// model_bundle.h
+
+// See ../../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABLITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+//
+
+#ifndef YAPYKALDI_MODEL_BUNDLE_H_
+#define YAPYKALDI_MODEL_BUNDLE_H_
+
+#include <istream>
+#include <map>
+#include <memory>
+
+#include "base/kaldi-common.h"
+#include "online2/online-nnet2-feature-pipeline.h"
+
+#include "graph_cache.h"
+
+namespace kaldi
+{
+// Single-file nnet3 model, as written by yapykaldi.bundle.pack.
+//
+// Layout: the magic "YPKBNDL1", the length of the manifest as a little endian
+// uint64 and the manifest, one "name\toffset\tsize\tcrc32" line per member.
+// Members follow uncompressed, each at a page-aligned offset from the start
+// of the file. The file is memory-mapped and members are read in place.
+//
+// Members of an nnet3 bundle:
+//   final.mdl, HCLG.fst, words.txt, align_lexicon.int (the model and graph)
+//   mfcc.conf, online_cmvn.conf, splice.conf (front end options)
+//   final.mat, global_cmvn.stats, final.dubm, final.ie (i-vector extractor)
+class ModelBundle
+{
+ public:
+  // verify checks the CRC32 of every member against the manifest
+  explicit ModelBundle(const std::string &filename, bool verify = true);
+  ~ModelBundle();
+
+  bool has(const std::string &name) const;
+  size_t size(const std::string &name) const;
+  // stream over a member, valid as long as the bundle
+  std::unique_ptr<std::istream> open(const std::string &name) const;
+
+  // reads HCLG.fst, words.txt and align_lexicon.int
+  DecodingGraph *read_graph(const std::string &graph_name) const;
+  // reads the front end options and i-vector extractor. ivector_options are
+  // the scalar i-vector extraction options, as on a command line
+  OnlineNnet2FeaturePipelineInfo *read_feature_info(const std::string &ivector_options) const;
+
+  static const std::string magic;
+
+ private:
+  struct Member
+  {
+    size_t offset;
+    size_t size;
+    uint32 crc32;
+  };
+
+  const Member &member(const std::string &name) const;
+  void read_options(const std::string &name, ParseOptions *po) const;
+  template <class C>
+  void read_object(const std::string &name, C *object) const;
+
+  std::string filename;
+  char *data;
+  size_t length;
+  std::map<std::string, Member> members;
+};  // class ModelBundle
+
+}  // namespace kaldi
+
+#endif  // YAPYKALDI_MODEL_BUNDLE_H_
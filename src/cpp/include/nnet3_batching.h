@@ -0,0 +1,79 @@
+// nnet3_batching.h
+
+// See ../../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABLITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+//
+
+#ifndef YAPYKALDI_NNET3_BATCHING_H_
+#define YAPYKALDI_NNET3_BATCHING_H_
+
+#include <chrono>
+#include <condition_variable>
+#include <mutex>
+#include <thread>
+
+#include "base/kaldi-common.h"
+#include "itf/online-feature-itf.h"
+#include "nnet3/am-nnet-simple.h"
+#include "nnet3/nnet-batch-compute.h"
+
+namespace kaldi
+{
+// Acoustic scoring of the streams of all decoders sharing a model in shared
+// minibatches.
+//
+// Decoders split their features into fixed-size chunks (with the left and
+// right context of the nnet) and hand them to compute(), which blocks until
+// they are scored. A scheduler thread runs the nnet on the chunks submitted
+// by all streams: full minibatches as soon as they are there, the rest once
+// per tick, so chunks of concurrent streams end up in one batched computation
+// instead of many small ones.
+class NNet3BatchScheduler
+{
+ public:
+  NNet3BatchScheduler(const nnet3::NnetBatchComputerOptions &opts, const nnet3::AmNnetSimple &am_nnet,
+                      int32 tick_ms);
+  ~NNet3BatchScheduler();
+
+  // Log-likelihoods of the output frames of num_chunks chunks of input
+  // starting at input frame first_frame, as rows of loglikes. Frames before
+  // the first and after the last ready frame are replaced by those, as at the
+  // edges of an utterance. ivector may be NULL for models without i-vectors.
+  void compute(OnlineFeatureInterface *input, OnlineFeatureInterface *ivector, int32 first_frame,
+               int32 num_chunks, Matrix<BaseFloat> *loglikes);
+
+  // chunk size in input frames
+  int32 frames_per_chunk() const { return opts.frames_per_chunk; }
+  // input frames after the last output frame of a chunk needed to score it
+  int32 right_context() const { return nnet_right_context; }
+
+ private:
+  void run(void);
+
+  nnet3::NnetBatchComputerOptions opts;
+  nnet3::NnetBatchComputer *computer;
+  int32 nnet_left_context, nnet_right_context;
+
+  std::chrono::milliseconds tick;
+  std::thread thread;
+  std::mutex mutex;
+  std::condition_variable submitted;
+  int32 num_submitted;
+  bool stopping;
+};  // class NNet3BatchScheduler
+
+}  // namespace kaldi
+
+#endif  // YAPYKALDI_NNET3_BATCHING_H_
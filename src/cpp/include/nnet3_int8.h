@@ -0,0 +1,164 @@
+// nnet3_int8.h
+
+// See ../../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABLITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+//
+
+#ifndef YAPYKALDI_NNET3_INT8_H_
+#define YAPYKALDI_NNET3_INT8_H_
+
+#include <memory>
+#include <mutex>
+#include <vector>
+
+#include "base/kaldi-common.h"
+#include "nnet3/nnet-component-itf.h"
+#include "nnet3/nnet-convolutional-component.h"
+#include "nnet3/nnet-nnet.h"
+
+#include "int8_gemm.h"
+
+namespace kaldi
+{
+// Quantized inputs of the Propagate calls of an int8 component, kept for the
+// next calls. The decoders of a model propagate through the same components
+// from threads of their own, so every call takes a buffer no other call uses.
+class Int8InputBuffers
+{
+ public:
+  Int8InputBuffers() {}
+  // copies of a component start without buffers
+  Int8InputBuffers(const Int8InputBuffers &other) {}
+
+  std::unique_ptr<Int8InputRows> acquire(void);
+  void release(std::unique_ptr<Int8InputRows> buffer);
+
+ private:
+  std::mutex mutex;
+  std::vector<std::unique_ptr<Int8InputRows> > buffers;
+};  // class Int8InputBuffers
+
+// Inference-only replacement of an affine or linear component with int8
+// weights. Every row of the weight matrix (one per output) is quantized
+// symmetrically with a scale of its own, and every input row (one per frame)
+// is quantized the same way as it comes in. The product is computed in
+// integers, see Int8Gemm, and scaled back to floats, with the bias added in
+// float.
+//
+// The component cannot be trained, and is not written to models: it is made
+// from the float component after loading, see QuantizeNnetInt8.
+class Int8AffineComponent : public nnet3::Component
+{
+ public:
+  Int8AffineComponent() {}
+  // linear_params has a row per output. bias_params may be empty, for linear
+  // components
+  Int8AffineComponent(const MatrixBase<BaseFloat> &linear_params, const VectorBase<BaseFloat> &bias_params);
+
+  virtual std::string Type() const { return "Int8AffineComponent"; }
+  virtual void InitFromConfig(nnet3::ConfigLine *cfl);
+  virtual int32 InputDim() const { return weights.NumCols(); }
+  virtual int32 OutputDim() const { return weights.NumRows(); }
+  virtual int32 Properties() const { return nnet3::kSimpleComponent; }
+  virtual std::string Info() const;
+
+  virtual void *Propagate(const nnet3::ComponentPrecomputedIndexes *indexes, const CuMatrixBase<BaseFloat> &in,
+                          CuMatrixBase<BaseFloat> *out) const;
+  virtual void Backprop(const std::string &debug_info, const nnet3::ComponentPrecomputedIndexes *indexes,
+                        const CuMatrixBase<BaseFloat> &in_value, const CuMatrixBase<BaseFloat> &out_value,
+                        const CuMatrixBase<BaseFloat> &out_deriv, void *memo, nnet3::Component *to_update,
+                        CuMatrixBase<BaseFloat> *in_deriv) const;
+
+  virtual void Read(std::istream &is, bool binary);
+  virtual void Write(std::ostream &os, bool binary) const;
+  virtual nnet3::Component *Copy() const { return new Int8AffineComponent(*this); }
+
+  // largest absolute difference between the dequantized and the original
+  // weights, relative to the largest original weight
+  BaseFloat relative_error(const MatrixBase<BaseFloat> &linear_params) const;
+
+ private:
+  Int8PackedMatrix weights;
+  Vector<BaseFloat> bias;
+  mutable Int8InputBuffers inputs;
+};  // class Int8AffineComponent
+
+// Inference-only replacement of a TdnnComponent with int8 weights, quantized
+// as in Int8AffineComponent. The input rows are quantized once, and the
+// weights of every time offset multiplied with the rows at that offset. The
+// computation indexes are those of TdnnComponent, which the component derives
+// from for them. The float weights of its base are released once quantized,
+// so it keeps its dimensions, which the base derives from them, itself, and
+// is not updatable, as the parameter functions of the base would see no
+// weights.
+class Int8TdnnComponent : public nnet3::TdnnComponent
+{
+ public:
+  explicit Int8TdnnComponent(const nnet3::TdnnComponent &tdnn);
+
+  virtual std::string Type() const { return "Int8TdnnComponent"; }
+  virtual void InitFromConfig(nnet3::ConfigLine *cfl);
+  virtual int32 InputDim() const { return input_dim; }
+  virtual int32 OutputDim() const { return output_dim; }
+  virtual int32 Properties() const { return nnet3::TdnnComponent::Properties() & ~nnet3::kUpdatableComponent; }
+  virtual std::string Info() const;
+
+  virtual void *Propagate(const nnet3::ComponentPrecomputedIndexes *indexes, const CuMatrixBase<BaseFloat> &in,
+                          CuMatrixBase<BaseFloat> *out) const;
+  virtual void Backprop(const std::string &debug_info, const nnet3::ComponentPrecomputedIndexes *indexes,
+                        const CuMatrixBase<BaseFloat> &in_value, const CuMatrixBase<BaseFloat> &out_value,
+                        const CuMatrixBase<BaseFloat> &out_deriv, void *memo, nnet3::Component *to_update,
+                        CuMatrixBase<BaseFloat> *in_deriv) const;
+
+  virtual void Read(std::istream &is, bool binary);
+  virtual void Write(std::ostream &os, bool binary) const;
+  virtual nnet3::Component *Copy() const { return new Int8TdnnComponent(*this); }
+
+  // as Int8AffineComponent::relative_error, over the weights of all time
+  // offsets
+  BaseFloat relative_error(const MatrixBase<BaseFloat> &linear_params) const;
+
+ private:
+  int32 input_dim, output_dim;
+  // the weights of a time offset each, in the order of the time offsets
+  std::vector<Int8PackedMatrix> parts;
+  Vector<BaseFloat> bias;
+  mutable Int8InputBuffers inputs;
+};  // class Int8TdnnComponent
+
+struct Int8QuantizationStats
+{
+  Int8QuantizationStats()
+      : num_components(0), num_params(0), num_skipped(0), num_skipped_params(0), max_relative_error(0.0) {}
+
+  // components replaced and their weights, and updatable components left in
+  // float (e.g. convolutions, LSTMs) and their parameters
+  int32 num_components;
+  int64 num_params;
+  int32 num_skipped;
+  int64 num_skipped_params;
+  BaseFloat max_relative_error;
+};  // struct Int8QuantizationStats
+
+// Replace the affine, fixed affine, linear and TDNN components of nnet by
+// int8 ones. Call before compiling computations for nnet, e.g. before
+// creating a DecodableNnetSimpleLoopedInfo. Fails, leaving nnet as it is,
+// when more parameters would stay in float than are quantized, since the
+// model would then run mostly in float anyway.
+Int8QuantizationStats QuantizeNnetInt8(nnet3::Nnet *nnet);
+
+}  // namespace kaldi
+
+#endif  // YAPYKALDI_NNET3_INT8_H_
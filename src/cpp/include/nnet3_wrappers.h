@@ -22,20 +22,42 @@
 // limitations under the License.
 //
 
+#include <condition_variable>
+#include <mutex>
+#include <thread>
+
 #include "base/kaldi-common.h"
 #include "decoder/lattice-faster-decoder.h"
+#include "decoder/decodable-matrix.h"
+#include "decoder/lattice-faster-online-decoder.h"
+#include "feat/online-feature.h"
 #include "fstext/fstext-lib.h"
+#include "nnet3/decodable-online-looped.h"
 #include "nnet3/decodable-simple-looped.h"
 #include "nnet3/nnet-am-decodable-simple.h"
 #include "online2/online-nnet2-feature-pipeline.h"
+#include "online2/online-endpoint.h"
 #include "online2/online-nnet3-decoding.h"
 #include "util/common-utils.h"
 
+#include "config_options.h"
+#include "decoder_stats.h"
+#include "graph_cache.h"
+#include "lattice_rescoring.h"
+#include "model_bundle.h"
+#include "nnet3_batching.h"
+#include "nnet3_int8.h"
+
 namespace kaldi
 {
+// called with the name of an artifact when it is loaded, and the number of
+// artifacts loaded so far out of the total
+typedef std::function<void(const std::string &artifact, int32 num_loaded, int32 num_total)> LoadProgress;
+
 class NNet3OnlineModelWrapper
 {
   friend class NNet3OnlineDecoderWrapper;
+  friend class NNet3MultiGraphDecoderWrapper;
 
  public:
   NNet3OnlineModelWrapper(BaseFloat beam, int32 max_active, int32 min_active,
@@ -43,11 +65,46 @@ class NNet3OnlineModelWrapper
                           int32 frame_subsampling_factor, std::string &word_syms_filename,
                           std::string &model_in_filename, std::string &fst_in_str,
                           std::string &mfcc_config, std::string &ie_conf_filename,
-                          std::string &align_lex_filename);
+                          std::string &align_lex_filename, bool int8 = false,
+                          LoadProgress progress = LoadProgress());
+  // from a model bundle, see model_bundle.h. ivector_options are the scalar
+  // i-vector extraction options, as on a command line
+  NNet3OnlineModelWrapper(BaseFloat beam, int32 max_active, int32 min_active,
+                          BaseFloat lattice_beam, BaseFloat acoustic_scale,
+                          int32 frame_subsampling_factor, const std::string &bundle_filename,
+                          const std::string &ivector_options, bool verify, bool int8 = false,
+                          LoadProgress progress = LoadProgress());
   ~NNet3OnlineModelWrapper();
 
+  void set_lm_rescoring(const std::string &old_lm_filename, const std::string &new_lm_filename,
+                        const std::string &graph_name);
+
+  // decoding graphs. Registering a graph under a name drops the rescoring
+  // LMs set for the name, see set_lm_rescoring:
+  void add_graph(const std::string &name, const std::string &fst_in_str, const std::string &word_syms_filename,
+                 const std::string &align_lex_filename);
+  void remove_graph(const std::string &name);
+  bool has_graph(const std::string &name);
+  void load_graph(const std::string &name);
+  void set_graph_cache_size(size_t max_bytes);
+  size_t get_graph_cache_usage();
+  std::vector<std::string> get_loaded_graphs();
+
+  // score the chunks of all decoders of this model in shared minibatches,
+  // from their next utterance on. Decoders then need a thread each.
+  void enable_batching(int32 minibatch_size, int32 frames_per_chunk, int32 tick_ms);
+
+  // of the int8 quantization of the acoustic model when loaded with int8,
+  // see nnet3_int8.h
+  const Int8QuantizationStats &get_quantization(void) const { return quantization; }
+
+  static const std::string default_graph;
+
  private:
-  fst::SymbolTable *word_syms;
+  void init(BaseFloat beam, int32 max_active, int32 min_active, BaseFloat lattice_beam, BaseFloat acoustic_scale,
+            int32 frame_subsampling_factor, bool int8);
+  void read_model(std::istream &is, bool binary);
+  void load(std::function<void()> load_features, std::function<void()> load_model, LoadProgress progress);
 
   // feature_config includes configuration for the iVector adaptation,
   // as well as the basic features.
@@ -58,14 +115,25 @@ class NNet3OnlineModelWrapper
 
   nnet3::AmNnetSimple am_nnet;
   nnet3::NnetSimpleLoopedComputationOptions decodable_opts;
+  nnet3::DecodableNnetSimpleLoopedInfo *decodable_info;
+  NNet3BatchScheduler *batch_scheduler;
+
+  // the affine, linear and TDNN components are replaced by int8 ones when
+  // the model is read, before the looped computation is compiled
+  bool int8;
+  Int8QuantizationStats quantization;
 
   TransitionModel trans_model;
-  // fst::VectorFst<fst::StdArc>               *decode_fst;
-  fst::Fst<fst::StdArc> *decode_fst;
   std::string *ie_conf_filename;
 
-  // word alignment:
-  std::vector<std::vector<int32> > word_alignment_lexicon;
+  // HCLG.fst, word symbols and alignment lexicon, by graph name
+  DecodingGraphCache *graphs;
+
+  // optional second pass LM rescoring of the final lattice, by graph name
+  std::map<std::string, std::shared_ptr<const LatticeLmRescorer> > rescorers;
+  std::mutex rescorers_mutex;
+
+  std::shared_ptr<const LatticeLmRescorer> get_rescorer(const std::string &graph_name);
 };  // class NNet3OnlineModelWrapper
 
 class NNet3OnlineDecoderWrapper
@@ -75,28 +143,211 @@ class NNet3OnlineDecoderWrapper
   ~NNet3OnlineDecoderWrapper();
 
   bool decode(BaseFloat samp_freq, int32 num_frames, BaseFloat* frames, bool finalize);
+  // drop the current utterance without finalizing it
+  void reset(void);
+
+  // front end only: MFCC and i-vector features of a whole utterance, one row
+  // per frame. ivector_feats is empty for models without i-vectors
+  void extract_features(BaseFloat samp_freq, int32 num_frames, BaseFloat *frames, Matrix<BaseFloat> &input_feats,
+                        Matrix<BaseFloat> &ivector_feats);
+  // decode a whole utterance from precomputed features, skipping the front
+  // end. ivector_feats may be NULL for models without i-vectors. Not while an
+  // utterance is decoded with decode
+  bool decode_features(const MatrixBase<BaseFloat> &input_feats, const MatrixBase<BaseFloat> *ivector_feats);
 
   void get_decoded_string(std::string &decoded_string, double &likelihood);
   bool get_word_alignment(std::vector<string> &words, std::vector<int32> &times,
                           std::vector<int32> &lengths);
 
+  // words of the best path without silences, with their lattice posteriors
+  bool get_word_confidences(std::vector<string> &words, std::vector<int32> &times,
+                            std::vector<int32> &lengths, std::vector<BaseFloat> &confidences);
+
+  // speaker adaptation state in Kaldi binary format. Once set, the adaptation
+  // state is carried over from one utterance to the next
+  std::string get_adaptation_state(void);
+  void set_adaptation_state(const std::string &state);
+  void reset_adaptation_state(bool carry);
+
+  // graph used from the next utterance on
+  void set_graph(const std::string &name);
+  std::string get_graph(void);
+
+  // beams and max_active tokens, applied to the utterance in progress right
+  // away. They start out as configured in the model
+  void set_search_options(BaseFloat beam, int32 max_active, BaseFloat lattice_beam);
+  void get_search_options(BaseFloat &beam, int32 &max_active, BaseFloat &lattice_beam);
+
+  // endpointing: options in config file syntax, e.g.
+  // "--endpoint.silence-phones=1:2:3 --endpoint.rule2.min-trailing-silence=0.5",
+  // and whether the utterance in progress has reached an endpoint
+  void set_endpoint_options(const std::string &options);
+  bool endpoint_detected(void);
+
+  // search statistics since the decoder was created or last reset
+  DecoderStats get_stats(void);
+  void reset_stats(void);
+  // the statistics as they are, without updating frames_pending, for counters
+  // taken every chunk
+  const DecoderStats &get_counters(void) const { return stats; }
+
+  // with a lazy lattice, finalizing an utterance takes its best path straight
+  // from the traceback of the search and leaves lattice generation until the
+  // lattice is needed, for confidences. Not with LM rescoring, which needs the
+  // lattice for the best path.
+  void set_lazy_lattice(bool lazy);
+  bool get_lazy_lattice(void) { return lazy_lattice; }
+  // generates the lattice of the last finalized utterance if it was left for
+  // later. The search it comes from is dropped once the next utterance starts,
+  // so this returns false then
+  bool build_lattice(void);
+
  private:
   void start_decoding(void);
   void free_decoder(void);
+  bool finish_utterance(CompactLattice &clat);
+  bool finish_utterance_best_path(const LatticeFasterOnlineDecoder &search);
+  void keep_finished_search(void);
+  void free_finished_search(void);
+  void get_lattice(const LatticeFasterOnlineDecoder &search, CompactLattice *clat);
+  void advance_batched(bool finalize);
+  const LatticeFasterOnlineDecoder &current_search(void);
+  void add_search_stats(const LatticeFasterOnlineDecoder &search, int32 first_frame);
+  bool align_words(std::vector<int32> &word_idxs, std::vector<int32> &times, std::vector<int32> &lengths);
+  void lookup_words(const std::vector<int32> &word_idxs, std::vector<string> &words);
 
   NNet3OnlineModelWrapper *model;
 
+  std::string graph_name;
+  LatticeFasterDecoderConfig search_config;
+  OnlineEndpointConfig endpoint_config;
+  // graph of the current (or last finished) utterance
+  std::shared_ptr<const DecodingGraph> graph;
+
   OnlineIvectorExtractorAdaptationState *adaptation_state;
+  bool carry_adaptation_state;
   OnlineNnet2FeaturePipeline *feature_pipeline;
   OnlineSilenceWeighting *silence_weighting;
-  nnet3::DecodableNnetSimpleLoopedInfo *decodable_info;
   SingleUtteranceNnet3Decoder *decoder;
 
+  // batched scoring: the search of the current utterance, the scores of its
+  // chunks and the input frames scored so far
+  LatticeFasterOnlineDecoder *batch_search;
+  DecodableMatrixMappedOffset *batch_decodable;
+  int32 batch_input_frames;
+
   std::vector<std::pair<int32, BaseFloat> > delta_weights;
-  int32 tot_frames, tot_frames_decoded;
+
+  // lazy lattice: the search of the last finalized utterance, with what it
+  // refers to, until its lattice is generated or the next utterance starts
+  bool lazy_lattice;
+  SingleUtteranceNnet3Decoder *finished_decoder;
+  OnlineNnet2FeaturePipeline *finished_feature_pipeline;
+  LatticeFasterOnlineDecoder *finished_batch_search;
+  std::shared_ptr<const DecodingGraph> finished_graph;
+  int64 tot_frames, tot_frames_decoded;
+  DecoderStats stats;
 
   // decoding result:
   CompactLattice best_path_clat;
+  CompactLattice final_clat;
 };  // class NNet3OnlineDecoderWrapper
 
+// Decodes one stream with several graphs at once. A single front end and
+// acoustic scoring pass feeds a search per graph, and the searches advance in
+// threads of their own on the same scores, so another graph costs its search,
+// not another forward pass of the nnet. Results are per graph.
+class NNet3MultiGraphDecoderWrapper
+{
+ public:
+  NNet3MultiGraphDecoderWrapper(NNet3OnlineModelWrapper *aModel, const std::vector<std::string> &graph_names);
+  ~NNet3MultiGraphDecoderWrapper();
+
+  // true if decoding succeeded for at least one of the graphs
+  bool decode(BaseFloat samp_freq, int32 num_frames, BaseFloat *frames, bool finalize);
+  // drop the current utterance without finalizing it
+  void reset(void);
+
+  std::vector<std::string> get_graphs(void) { return graph_names; }
+
+  // results of the graph named graph_name. A graph the utterance failed to
+  // decode with has an empty result
+  void get_decoded_string(const std::string &graph_name, std::string &decoded_string, double &likelihood);
+  bool get_word_alignment(const std::string &graph_name, std::vector<string> &words, std::vector<int32> &times,
+                          std::vector<int32> &lengths);
+  bool get_word_confidences(const std::string &graph_name, std::vector<string> &words, std::vector<int32> &times,
+                            std::vector<int32> &lengths, std::vector<BaseFloat> &confidences);
+
+  // endpointing, on the search of the first graph
+  void set_endpoint_options(const std::string &options);
+  bool endpoint_detected(void);
+
+  // search statistics, with the active tokens of every search counted
+  DecoderStats get_stats(void);
+  void reset_stats(void);
+  // the statistics as they are, without updating frames_pending, for counters
+  // taken every chunk
+  const DecoderStats &get_counters(void) const { return stats; }
+
+ private:
+  struct GraphSearch
+  {
+    std::shared_ptr<const DecodingGraph> graph;
+    LatticeFasterOnlineDecoder *search;
+    bool ok;
+
+    // decoding result:
+    CompactLattice best_path_clat;
+    CompactLattice final_clat;
+  };
+
+  // the thread of a search but the first, which runs the steps for_each_search
+  // hands it for as long as the decoder exists
+  struct SearchWorker
+  {
+    std::thread thread;
+    bool pending;
+    std::exception_ptr error;
+  };
+
+  void start_decoding(void);
+  void free_decoder(void);
+  void score_frames(bool finalize);
+  void for_each_search(const std::function<void(GraphSearch &)> &step);
+  void run_worker(size_t index);
+  void finish_search(GraphSearch &graph_search);
+  GraphSearch &find_search(const std::string &graph_name);
+  bool align_words(const GraphSearch &graph_search, std::vector<int32> &word_idxs, std::vector<int32> &times,
+                   std::vector<int32> &lengths);
+  void lookup_words(const GraphSearch &graph_search, const std::vector<int32> &word_idxs,
+                    std::vector<string> &words);
+
+  NNet3OnlineModelWrapper *model;
+
+  std::vector<std::string> graph_names;
+  LatticeFasterDecoderConfig search_config;
+  OnlineEndpointConfig endpoint_config;
+
+  OnlineNnet2FeaturePipeline *feature_pipeline;
+  OnlineSilenceWeighting *silence_weighting;
+  // the nnet output of the shared front end, and its scores as the searches
+  // read them. Searches only read the scores, so they can run concurrently
+  nnet3::DecodableNnetLoopedOnline *scorer;
+  DecodableMatrixMappedOffset *decodable;
+  int32 frames_scored;
+
+  // one per graph, in the order of graph_names
+  std::vector<GraphSearch> searches;
+
+  // workers[i] runs the steps of searches[i + 1]
+  std::vector<SearchWorker> workers;
+  const std::function<void(GraphSearch &)> *worker_step;
+  std::mutex worker_mutex;
+  std::condition_variable work_ready, work_done;
+  bool stopping;
+
+  std::vector<std::pair<int32, BaseFloat> > delta_weights;
+  DecoderStats stats;
+};  // class NNet3MultiGraphDecoderWrapper
+
 }  // namespace kaldi
@@ -1,14 +1,109 @@
+#include <pybind11/functional.h>
+#include <pybind11/numpy.h>
 #include <pybind11/pybind11.h>
 #include <pybind11/stl_bind.h>
 #include <stdexcept>
 #include <string>
 #include "gmm_wrappers.h"
+#include "int8_gemm.h"
 #include "nnet3_wrappers.h"
 
 namespace py = pybind11;
 using StringList = std::vector<std::string>;
 using IntList = std::vector<int>;
 
+template <typename T>
+py::array_t<T> to_array(const std::vector<T> &values)
+{
+  return py::array_t<T>(values.size(), values.data());
+}
+
+// copy of a kaldi matrix as a 2-d numpy array
+py::array_t<kaldi::BaseFloat> to_array(const kaldi::MatrixBase<kaldi::BaseFloat> &mat)
+{
+  py::array_t<kaldi::BaseFloat> arr(
+      std::vector<size_t>{static_cast<size_t>(mat.NumRows()), static_cast<size_t>(mat.NumCols())});
+  for (kaldi::MatrixIndexT r = 0; r < mat.NumRows(); r++)
+  {
+    std::copy(mat.RowData(r), mat.RowData(r) + mat.NumCols(), arr.mutable_data(r));
+  }
+  return arr;
+}
+
+using FeatureArray = py::array_t<kaldi::BaseFloat, py::array::c_style | py::array::forcecast>;
+
+// kaldi view of a 2-d numpy array, without copying it. kaldi does not modify
+// the features, so read-only (e.g. memory-mapped) arrays are used as they are
+kaldi::SubMatrix<kaldi::BaseFloat> as_matrix(const FeatureArray &arr)
+{
+  if (arr.ndim() != 2)
+  {
+    throw std::runtime_error("Incompatible buffer dimensions");
+  }
+  return kaldi::SubMatrix<kaldi::BaseFloat>(const_cast<kaldi::BaseFloat *>(arr.data()), arr.shape(0), arr.shape(1),
+                                            arr.shape(1));
+}
+
+// (words, times, lengths, confidences) or None, with numpy arrays for the numbers
+template <typename DecoderWrapper>
+py::object get_word_confidences(DecoderWrapper &m)
+{
+  StringList words;
+  std::vector<kaldi::int32> times, lengths;
+  std::vector<kaldi::BaseFloat> confidences;
+  if (!m.get_word_confidences(words, times, lengths, confidences))
+  {
+    return py::none();
+  }
+  return py::make_tuple(words, to_array(times), to_array(lengths), to_array(confidences));
+}
+
+// (words, times, lengths, confidences) of a graph of a multi-graph decoder, or None
+py::object get_graph_word_confidences(kaldi::NNet3MultiGraphDecoderWrapper &m, const std::string &graph_name)
+{
+  StringList words;
+  std::vector<kaldi::int32> times, lengths;
+  std::vector<kaldi::BaseFloat> confidences;
+  if (!m.get_word_confidences(graph_name, words, times, lengths, confidences))
+  {
+    return py::none();
+  }
+  return py::make_tuple(words, to_array(times), to_array(lengths), to_array(confidences));
+}
+
+// decoder statistics as a dict, with the active token histogram as a numpy array
+template <typename DecoderWrapper>
+py::dict get_stats(DecoderWrapper &m)
+{
+  kaldi::DecoderStats stats = m.get_stats();
+  py::dict d;
+  d["utterances"] = stats.utterances;
+  d["samples_received"] = stats.samples_received;
+  d["frames_decoded"] = stats.frames_decoded;
+  d["frames_pending"] = stats.frames_pending;
+  d["active_tokens_histogram"] = to_array(stats.active_tokens_histogram);
+  d["active_tokens_total"] = stats.active_tokens_total;
+  d["active_tokens_max"] = stats.active_tokens_max;
+  d["frames_at_max_active"] = stats.frames_at_max_active;
+  d["lattice_states"] = stats.lattice_states;
+  d["lattice_arcs"] = stats.lattice_arcs;
+  d["accept_waveform_seconds"] = stats.accept_waveform_seconds;
+  d["advance_decoding_seconds"] = stats.advance_decoding_seconds;
+  d["finalize_seconds"] = stats.finalize_seconds;
+  return d;
+}
+
+// (utterances, frames_decoded, active_tokens_total, accept_waveform_seconds,
+// advance_decoding_seconds, finalize_seconds) of a decoder, the counters of
+// get_stats taken every chunk, without building its dict and histogram
+template <typename DecoderWrapper>
+py::tuple get_counters(const DecoderWrapper &m)
+{
+  const kaldi::DecoderStats &stats = m.get_counters();
+  return py::make_tuple(stats.utterances, stats.frames_decoded, stats.active_tokens_total,
+                        stats.accept_waveform_seconds, stats.advance_decoding_seconds, stats.finalize_seconds);
+}
+
 PYBIND11_MODULE(_Extensions, m)
 {
   // std::vector bindings to python lists
@@ -21,7 +116,8 @@ PYBIND11_MODULE(_Extensions, m)
   // GMM Online Model Wrapper
   py::class_<kaldi::GmmOnlineModelWrapper>(m, "GmmOnlineModelWrapper")
       .def(py::init<float, int, int, float, std::string &, std::string &, std::string &,
-                    std::string &>());
+                    std::string &>())
+      .def("set_lm_rescoring", &kaldi::GmmOnlineModelWrapper::set_lm_rescoring);
 
   // GMM Online Decoder Wrapper
   py::class_<kaldi::GmmOnlineDecoderWrapper>(m, "GmmOnlineDecoderWrapper")
@@ -34,6 +130,8 @@ PYBIND11_MODULE(_Extensions, m)
                throw std::runtime_error("Incompatible buffer dimensions");
              }
 
+             // the buffer stays pinned by info, other python threads keep running meanwhile
+             py::gil_scoped_release release;
              return m.decode(samp_freq, info.shape[0], static_cast<float *>(info.ptr), finalize);
            })
       .def("get_decoded_string",
@@ -42,15 +140,83 @@ PYBIND11_MODULE(_Extensions, m)
              m.get_decoded_string(decoded_string, likelihood);
              return std::tuple<std::string, double>(decoded_string, likelihood);
            })
-      .def("get_word_alignment", &kaldi::GmmOnlineDecoderWrapper::get_word_alignment);
+      .def("get_word_alignment", &kaldi::GmmOnlineDecoderWrapper::get_word_alignment)
+      .def("reset", &kaldi::GmmOnlineDecoderWrapper::reset)
+      .def("get_word_confidences", &get_word_confidences<kaldi::GmmOnlineDecoderWrapper>)
+      .def("get_adaptation_state",
+           [](kaldi::GmmOnlineDecoderWrapper &m) { return py::bytes(m.get_adaptation_state()); })
+      .def("set_adaptation_state", &kaldi::GmmOnlineDecoderWrapper::set_adaptation_state)
+      .def("reset_adaptation_state", &kaldi::GmmOnlineDecoderWrapper::reset_adaptation_state)
+      .def("set_search_options", &kaldi::GmmOnlineDecoderWrapper::set_search_options)
+      .def("get_search_options",
+           [](kaldi::GmmOnlineDecoderWrapper &m) {
+             kaldi::BaseFloat beam, lattice_beam;
+             kaldi::int32 max_active;
+             m.get_search_options(beam, max_active, lattice_beam);
+             return py::make_tuple(beam, max_active, lattice_beam);
+           })
+      .def("set_endpoint_options", &kaldi::GmmOnlineDecoderWrapper::set_endpoint_options)
+      .def("endpoint_detected", &kaldi::GmmOnlineDecoderWrapper::endpoint_detected)
+      .def("get_stats", &get_stats<kaldi::GmmOnlineDecoderWrapper>)
+      .def("get_counters", &get_counters<kaldi::GmmOnlineDecoderWrapper>)
+      .def("reset_stats", &kaldi::GmmOnlineDecoderWrapper::reset_stats)
+      .def("set_second_pass_mode", &kaldi::GmmOnlineDecoderWrapper::set_second_pass_mode)
+      .def("get_second_pass_mode", &kaldi::GmmOnlineDecoderWrapper::get_second_pass_mode)
+      // the second pass refers to the model, which the decoder keeps alive
+      .def("take_second_pass",
+           [](kaldi::GmmOnlineDecoderWrapper &m) {
+             return std::unique_ptr<kaldi::GmmSecondPass>(m.take_second_pass());
+           },
+           py::keep_alive<0, 1>())
+      .def("carry_adaptation_state_from", &kaldi::GmmOnlineDecoderWrapper::carry_adaptation_state_from);
+
+  // Deferred second pass of a GMM utterance
+  py::class_<kaldi::GmmSecondPass>(m, "GmmSecondPass")
+      // runs while other python threads go on decoding
+      .def("run", &kaldi::GmmSecondPass::run, py::call_guard<py::gil_scoped_release>())
+      .def("get_decoded_string",
+           [](kaldi::GmmSecondPass &m, double likelihood) {
+             std::string decoded_string = "";
+             m.get_decoded_string(decoded_string, likelihood);
+             return std::tuple<std::string, double>(decoded_string, likelihood);
+           })
+      .def("get_word_alignment", &kaldi::GmmSecondPass::get_word_alignment)
+      .def("get_word_confidences", &get_word_confidences<kaldi::GmmSecondPass>)
+      .def("get_seconds", &kaldi::GmmSecondPass::get_seconds);
 
   /*
    * nnet3_wrappers
    */
   // NNet3 Online Model Wrapper
   py::class_<kaldi::NNet3OnlineModelWrapper>(m, "NNet3OnlineModelWrapper")
+      // loading takes a while, other python threads keep running in the meantime
       .def(py::init<float, int, int, float, float, int, std::string &, std::string &, std::string &,
-                    std::string &, std::string &, std::string &>());
+                    std::string &, std::string &, std::string &, bool, kaldi::LoadProgress>(),
+           py::call_guard<py::gil_scoped_release>())
+      .def(py::init<float, int, int, float, float, int, const std::string &, const std::string &, bool, bool,
+                    kaldi::LoadProgress>(),
+           py::call_guard<py::gil_scoped_release>())
+      .def("set_lm_rescoring", &kaldi::NNet3OnlineModelWrapper::set_lm_rescoring)
+      .def("add_graph", &kaldi::NNet3OnlineModelWrapper::add_graph)
+      .def("remove_graph", &kaldi::NNet3OnlineModelWrapper::remove_graph)
+      .def("has_graph", &kaldi::NNet3OnlineModelWrapper::has_graph)
+      .def("load_graph", &kaldi::NNet3OnlineModelWrapper::load_graph)
+      .def("set_graph_cache_size", &kaldi::NNet3OnlineModelWrapper::set_graph_cache_size)
+      .def("get_graph_cache_usage", &kaldi::NNet3OnlineModelWrapper::get_graph_cache_usage)
+      .def("get_loaded_graphs", &kaldi::NNet3OnlineModelWrapper::get_loaded_graphs)
+      .def("enable_batching", &kaldi::NNet3OnlineModelWrapper::enable_batching)
+      .def("get_quantization",
+           [](const kaldi::NNet3OnlineModelWrapper &m) {
+             const kaldi::Int8QuantizationStats &stats = m.get_quantization();
+             py::dict d;
+             d["components"] = stats.num_components;
+             d["weights"] = stats.num_params;
+             d["skipped"] = stats.num_skipped;
+             d["skipped_parameters"] = stats.num_skipped_params;
+             d["max_relative_error"] = stats.max_relative_error;
+             return d;
+           })
+      .def_readonly_static("default_graph", &kaldi::NNet3OnlineModelWrapper::default_graph);
 
   // NNet3 Online Decoder Wrapper
   py::class_<kaldi::NNet3OnlineDecoderWrapper>(m, "NNet3OnlineDecoderWrapper")
@@ -63,6 +229,8 @@ PYBIND11_MODULE(_Extensions, m)
                throw std::runtime_error("Incompatible buffer dimensions");
              }
 
+             // with batched scoring, decode waits for the chunks of other streams
+             py::gil_scoped_release release;
              return m.decode(samp_freq, info.shape[0], static_cast<float *>(info.ptr), finalize);
            })
       .def("get_decoded_string",
@@ -71,5 +239,128 @@ PYBIND11_MODULE(_Extensions, m)
              m.get_decoded_string(decoded_string, likelihood);
              return std::tuple<std::string, double>(decoded_string, likelihood);
            })
-      .def("get_word_alignment", &kaldi::NNet3OnlineDecoderWrapper::get_word_alignment);
+      .def("get_word_alignment", &kaldi::NNet3OnlineDecoderWrapper::get_word_alignment)
+      .def("reset", &kaldi::NNet3OnlineDecoderWrapper::reset)
+      .def("get_word_confidences", &get_word_confidences<kaldi::NNet3OnlineDecoderWrapper>)
+      .def("get_adaptation_state",
+           [](kaldi::NNet3OnlineDecoderWrapper &m) { return py::bytes(m.get_adaptation_state()); })
+      .def("set_adaptation_state", &kaldi::NNet3OnlineDecoderWrapper::set_adaptation_state)
+      .def("reset_adaptation_state", &kaldi::NNet3OnlineDecoderWrapper::reset_adaptation_state)
+      .def("set_graph", &kaldi::NNet3OnlineDecoderWrapper::set_graph)
+      .def("get_graph", &kaldi::NNet3OnlineDecoderWrapper::get_graph)
+      .def("set_search_options", &kaldi::NNet3OnlineDecoderWrapper::set_search_options)
+      .def("get_search_options",
+           [](kaldi::NNet3OnlineDecoderWrapper &m) {
+             kaldi::BaseFloat beam, lattice_beam;
+             kaldi::int32 max_active;
+             m.get_search_options(beam, max_active, lattice_beam);
+             return py::make_tuple(beam, max_active, lattice_beam);
+           })
+      .def("set_endpoint_options", &kaldi::NNet3OnlineDecoderWrapper::set_endpoint_options)
+      .def("endpoint_detected", &kaldi::NNet3OnlineDecoderWrapper::endpoint_detected)
+      .def("get_stats", &get_stats<kaldi::NNet3OnlineDecoderWrapper>)
+      .def("get_counters", &get_counters<kaldi::NNet3OnlineDecoderWrapper>)
+      .def("reset_stats", &kaldi::NNet3OnlineDecoderWrapper::reset_stats)
+      .def("set_lazy_lattice", &kaldi::NNet3OnlineDecoderWrapper::set_lazy_lattice)
+      .def("get_lazy_lattice", &kaldi::NNet3OnlineDecoderWrapper::get_lazy_lattice)
+      .def("build_lattice", &kaldi::NNet3OnlineDecoderWrapper::build_lattice)
+      .def("extract_features",
+           [](kaldi::NNet3OnlineDecoderWrapper &m, float samp_freq, py::buffer frames_buffer) {
+             py::buffer_info info = frames_buffer.request();
+             if (info.ndim != 1)
+             {
+               throw std::runtime_error("Incompatible buffer dimensions");
+             }
+
+             kaldi::Matrix<kaldi::BaseFloat> input_feats, ivector_feats;
+             m.extract_features(samp_freq, info.shape[0], static_cast<float *>(info.ptr), input_feats,
+                                ivector_feats);
+             if (ivector_feats.NumRows() == 0)
+             {
+               return py::make_tuple(to_array(input_feats), py::none());
+             }
+             return py::make_tuple(to_array(input_feats), to_array(ivector_feats));
+           })
+      .def("decode_features",
+           [](kaldi::NNet3OnlineDecoderWrapper &m, FeatureArray input_feats, py::object ivector_feats) {
+             kaldi::SubMatrix<kaldi::BaseFloat> input = as_matrix(input_feats);
+             if (ivector_feats.is_none())
+             {
+               return m.decode_features(input, NULL);
+             }
+             FeatureArray ivector_arr = ivector_feats.cast<FeatureArray>();
+             kaldi::SubMatrix<kaldi::BaseFloat> ivector = as_matrix(ivector_arr);
+             return m.decode_features(input, &ivector);
+           },
+           py::arg("input_feats"), py::arg("ivector_feats") = py::none());
+
+  // NNet3 Multi-Graph Decoder Wrapper
+  py::class_<kaldi::NNet3MultiGraphDecoderWrapper>(m, "NNet3MultiGraphDecoderWrapper")
+      .def(py::init<kaldi::NNet3OnlineModelWrapper *, const StringList &>())
+      .def("decode",
+           [](kaldi::NNet3MultiGraphDecoderWrapper &m, float samp_freq, py::buffer frames_buffer, bool finalize) {
+             py::buffer_info info = frames_buffer.request();
+             if (info.ndim != 1)
+             {
+               throw std::runtime_error("Incompatible buffer dimensions");
+             }
+
+             // the searches run in threads of their own, other python threads keep running meanwhile
+             py::gil_scoped_release release;
+             return m.decode(samp_freq, info.shape[0], static_cast<float *>(info.ptr), finalize);
+           })
+      .def("reset", &kaldi::NNet3MultiGraphDecoderWrapper::reset)
+      .def("get_graphs", &kaldi::NNet3MultiGraphDecoderWrapper::get_graphs)
+      .def("get_decoded_string",
+           [](kaldi::NNet3MultiGraphDecoderWrapper &m, const std::string &graph_name, double likelihood) {
+             std::string decoded_string = "";
+             m.get_decoded_string(graph_name, decoded_string, likelihood);
+             return std::tuple<std::string, double>(decoded_string, likelihood);
+           })
+      .def("get_word_alignment", &kaldi::NNet3MultiGraphDecoderWrapper::get_word_alignment)
+      .def("get_word_confidences", &get_graph_word_confidences)
+      .def("set_endpoint_options", &kaldi::NNet3MultiGraphDecoderWrapper::set_endpoint_options)
+      .def("endpoint_detected", &kaldi::NNet3MultiGraphDecoderWrapper::endpoint_detected)
+      .def("get_stats", &get_stats<kaldi::NNet3MultiGraphDecoderWrapper>)
+      .def("get_counters", &get_counters<kaldi::NNet3MultiGraphDecoderWrapper>)
+      .def("reset_stats", &kaldi::NNet3MultiGraphDecoderWrapper::reset_stats);
+
+  /*
+   * int8_gemm
+   */
+  // the kernels of the int8 components the CPU runs, and the product of input
+  // rows and weight rows with one of them, both quantized as in the int8
+  // components, to check the kernels against float products
+  m.def("int8_gemm_kernels", []() {
+    StringList kernels{"generic"};
+    if (kaldi::Int8GemmKernelSupported(kaldi::kInt8GemmAvx2)) kernels.push_back("avx2");
+    return kernels;
+  });
+  m.def("int8_gemm", [](FeatureArray input_arr, FeatureArray weights_arr, const std::string &kernel_name) {
+    kaldi::SubMatrix<kaldi::BaseFloat> input = as_matrix(input_arr), weights = as_matrix(weights_arr);
+    if (input.NumCols() != weights.NumCols())
+    {
+      throw std::runtime_error("Input and weights have different numbers of columns");
+    }
+    kaldi::Int8GemmKernel kernel = kaldi::kInt8GemmAuto;
+    if (kernel_name == "generic")
+      kernel = kaldi::kInt8GemmGeneric;
+    else if (kernel_name == "avx2")
+      kernel = kaldi::kInt8GemmAvx2;
+    else if (kernel_name != "auto")
+      throw std::runtime_error("Unknown int8 kernel " + kernel_name);
+    if (!kaldi::Int8GemmKernelSupported(kernel))
+    {
+      throw std::runtime_error("The CPU does not support the int8 kernel " + kernel_name);
+    }
+
+    kaldi::Int8InputRows rows;
+    rows.quantize(input.Data(), input.NumRows(), input.NumCols(), input.Stride());
+    kaldi::Int8PackedMatrix packed;
+    packed.quantize(weights.Data(), weights.NumRows(), weights.NumCols(), weights.Stride());
+    kaldi::Matrix<kaldi::BaseFloat> out(input.NumRows(), weights.NumRows());
+    kaldi::Int8Gemm(rows, 0, 1, input.NumRows(), packed, out.Data(), out.Stride(), kernel);
+    return to_array(out);
+  },
+  py::arg("input"), py::arg("weights"), py::arg("kernel") = "auto");
 }
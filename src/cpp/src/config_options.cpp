@@ -0,0 +1,49 @@
+// config_options.cpp
+
+// See ../../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABLITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+//
+
+#include "config_options.h"
+
+#include <sstream>
+#include <vector>
+
+namespace kaldi
+{
+void parse_options(std::istream &is, const std::string &name, ParseOptions *po)
+{
+  std::vector<std::string> args(1, name);
+  std::string line;
+  while (std::getline(is, line))
+  {
+    std::istringstream words(line.substr(0, line.find('#')));
+    std::string word;
+    while (words >> word) args.push_back(word);
+  }
+
+  std::vector<const char *> argv;
+  for (size_t i = 0; i < args.size(); i++) argv.push_back(args[i].c_str());
+  po->Read(argv.size(), argv.data());
+  if (po->NumArgs() != 0) KALDI_ERR << "Unexpected arguments in " << name;
+}
+
+void parse_options(const std::string &options, const std::string &name, ParseOptions *po)
+{
+  std::istringstream is(options);
+  parse_options(is, name, po);
+}
+
+}  // namespace kaldi
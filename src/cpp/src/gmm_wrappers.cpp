@@ -27,6 +27,7 @@
 #include "feat/wave-reader.h"
 #include "fstext/fstext-lib.h"
 #include "lat/lattice-functions.h"
+#include "lat/sausages.h"
 #include "lat/word-align-lattice-lexicon.h"
 #include "online2/online-endpoint.h"
 #include "online2/online-feature-pipeline.h"
@@ -43,47 +44,76 @@ namespace kaldi
  */
 
 GmmOnlineDecoderWrapper::GmmOnlineDecoderWrapper(GmmOnlineModelWrapper *aModel)
-    : model(aModel)
+    : model(aModel), decode_config(aModel->decode_config), endpoint_config(aModel->endpoint_config)
 {
   decoder = NULL;
-  adaptation_state = NULL;
+  utterance_config = NULL;
+  utterance_adaptation_state = NULL;
+  carry_adaptation_state = false;
+  second_pass_mode = kSecondPassSync;
+  pending_second_pass = NULL;
 
   tot_frames = 0;
   tot_frames_decoded = 0;
+  utterance_frames_decoded = 0;
+
+#if VERBOSE
+  KALDI_LOG << "alloc: OnlineGmmAdaptationState";
+#endif
+  adaptation_state = new OnlineGmmAdaptationState();
 }
 
-GmmOnlineDecoderWrapper::~GmmOnlineDecoderWrapper() { free_decoder(); }
+GmmOnlineDecoderWrapper::~GmmOnlineDecoderWrapper()
+{
+  free_decoder();
+  delete pending_second_pass;
+  if (adaptation_state)
+  {
+    delete adaptation_state;
+    adaptation_state = NULL;
+  }
+}
 
 void GmmOnlineDecoderWrapper::start_decoding(void)
 {
 #if VERBOSE
   KALDI_LOG << "start_decoding...";
   KALDI_LOG << "max_active  :"
-            << model->decode_config.faster_decoder_opts.max_active;
+            << decode_config.faster_decoder_opts.max_active;
   KALDI_LOG << "min_active  :"
-            << model->decode_config.faster_decoder_opts.min_active;
-  KALDI_LOG << "beam        :" << model->decode_config.faster_decoder_opts.beam;
+            << decode_config.faster_decoder_opts.min_active;
+  KALDI_LOG << "beam        :" << decode_config.faster_decoder_opts.beam;
   KALDI_LOG << "lattice_beam:"
-            << model->decode_config.faster_decoder_opts.lattice_beam;
+            << decode_config.faster_decoder_opts.lattice_beam;
 #endif
   free_decoder();
-#if VERBOSE
-  KALDI_LOG << "alloc: OnlineGmmAdaptationState";
-#endif
-  adaptation_state = new OnlineGmmAdaptationState();
+  // The decoder refers to its initial adaptation state until it is freed, so
+  // it gets its own copy that is not affected by set_adaptation_state
+  {
+    std::lock_guard<std::mutex> lock(adaptation_mutex);
+    utterance_adaptation_state = new OnlineGmmAdaptationState(*adaptation_state);
+  }
+  utterance_config = new OnlineGmmDecodingConfig(decode_config);
 #if VERBOSE
   KALDI_LOG << "alloc: SingleUtteranceGmmDecoder";
 #endif
   decoder =
-      new SingleUtteranceGmmDecoder(model->decode_config, *model->gmm_models,
+      new SingleUtteranceGmmDecoder(*utterance_config, *model->gmm_models,
                                     *model->feature_pipeline_prototype,
                                     *model->decode_fst,  // ok
-                                    *adaptation_state);
+                                    *utterance_adaptation_state);
 #if VERBOSE
   KALDI_LOG << "start_decoding...done";
 #endif
 }
 
+void GmmOnlineDecoderWrapper::reset(void)
+{
+  // drop the current utterance without finalizing it
+  free_decoder();
+  tot_frames = 0;
+}
+
 void GmmOnlineDecoderWrapper::free_decoder(void)
 {
   if (decoder)
@@ -94,13 +124,124 @@ void GmmOnlineDecoderWrapper::free_decoder(void)
     delete decoder;
     decoder = NULL;
   }
-  if (adaptation_state)
+  utterance_frames_decoded = 0;
+  if (utterance_adaptation_state)
   {
-    delete adaptation_state;
-    adaptation_state = NULL;
+    delete utterance_adaptation_state;
+    utterance_adaptation_state = NULL;
+  }
+  if (utterance_config)
+  {
+    delete utterance_config;
+    utterance_config = NULL;
   }
 }
 
+std::string GmmOnlineDecoderWrapper::get_adaptation_state(void)
+{
+  OnlineGmmAdaptationState state;
+  {
+    std::lock_guard<std::mutex> lock(adaptation_mutex);
+    state = *adaptation_state;
+  }
+  if (decoder) decoder->GetAdaptationState(&state);
+
+  std::ostringstream os;
+  InitKaldiOutputStream(os, true);
+  state.Write(os, true);
+  return os.str();
+}
+
+void GmmOnlineDecoderWrapper::set_adaptation_state(const std::string &state)
+{
+  std::istringstream is(state);
+  bool binary;
+  if (!InitKaldiInputStream(is, &binary)) KALDI_ERR << "Could not read adaptation state";
+
+  OnlineGmmAdaptationState new_state;
+  new_state.Read(is, binary);
+  if (!model->adaptation_state_fits(new_state))
+    KALDI_ERR << "Adaptation state does not match the features of the model";
+
+  // takes effect from the next utterance on
+  std::lock_guard<std::mutex> lock(adaptation_mutex);
+  *adaptation_state = new_state;
+  carry_adaptation_state = true;
+}
+
+void GmmOnlineDecoderWrapper::reset_adaptation_state(bool carry)
+{
+  std::lock_guard<std::mutex> lock(adaptation_mutex);
+  *adaptation_state = OnlineGmmAdaptationState();
+  carry_adaptation_state = carry;
+}
+
+void GmmOnlineDecoderWrapper::set_search_options(BaseFloat beam, int32 max_active, BaseFloat lattice_beam)
+{
+  LatticeFasterDecoderConfig &config = decode_config.faster_decoder_opts;
+  if (beam <= 0.0 || max_active <= config.min_active || lattice_beam <= 0.0)
+    KALDI_ERR << "Invalid search options: beam " << beam << ", max_active " << max_active << ", lattice_beam "
+              << lattice_beam;
+  // every utterance decodes with a copy of the options, so they only apply from
+  // the next utterance on
+  config.beam = beam;
+  config.max_active = max_active;
+  config.lattice_beam = lattice_beam;
+}
+
+void GmmOnlineDecoderWrapper::get_search_options(BaseFloat &beam, int32 &max_active, BaseFloat &lattice_beam)
+{
+  beam = decode_config.faster_decoder_opts.beam;
+  max_active = decode_config.faster_decoder_opts.max_active;
+  lattice_beam = decode_config.faster_decoder_opts.lattice_beam;
+}
+
+void GmmOnlineDecoderWrapper::set_endpoint_options(const std::string &options)
+{
+  // options not given keep their values
+  OnlineEndpointConfig config = endpoint_config;
+  ParseOptions po("");
+  config.Register(&po);
+  parse_options(options, "endpoint options", &po);
+  endpoint_config = config;
+}
+
+bool GmmOnlineDecoderWrapper::endpoint_detected(void)
+{
+  return decoder ? decoder->EndpointDetected(endpoint_config) : false;
+}
+
+DecoderStats GmmOnlineDecoderWrapper::get_stats(void)
+{
+  // AdvanceDecoding decodes all frames ready, so none are left pending
+  stats.frames_pending = 0;
+  return stats;
+}
+
+void GmmOnlineDecoderWrapper::reset_stats(void) { stats.reset(); }
+
+void GmmOnlineDecoderWrapper::set_second_pass_mode(int32 mode)
+{
+  if (mode != kSecondPassSync && mode != kSecondPassDeferred && mode != kSecondPassSkip)
+    KALDI_ERR << "Invalid second pass mode " << mode;
+  second_pass_mode = mode;
+}
+
+GmmSecondPass *GmmOnlineDecoderWrapper::take_second_pass(void)
+{
+  GmmSecondPass *second_pass = pending_second_pass;
+  pending_second_pass = NULL;
+  return second_pass;
+}
+
+void GmmOnlineDecoderWrapper::carry_adaptation_state_from(const GmmSecondPass &second_pass)
+{
+  if (!second_pass.ok) return;
+  std::lock_guard<std::mutex> lock(adaptation_mutex);
+  if (carry_adaptation_state) *adaptation_state = second_pass.adaptation_state;
+  stats.set_lattice(second_pass.final_clat);
+}
+
 void GmmOnlineDecoderWrapper::get_decoded_string(std::string &decoded_string,
                                                  double &likelihood)
 {
@@ -127,6 +268,13 @@ void GmmOnlineDecoderWrapper::get_decoded_string(std::string &decoded_string,
   {
     ConvertLattice(best_path_clat, &best_path_lat);
   }
+  best_path_string(model, best_path_lat, decoded_string, likelihood);
+}
+
+void GmmOnlineDecoderWrapper::best_path_string(GmmOnlineModelWrapper *model, const Lattice &best_path_lat,
+                                               std::string &decoded_string, double &likelihood)
+{
+  decoded_string = "";
 
   std::vector<int32> words;
   std::vector<int32> alignment;
@@ -144,9 +292,24 @@ void GmmOnlineDecoderWrapper::get_decoded_string(std::string &decoded_string,
   }
 }
 
-bool GmmOnlineDecoderWrapper::get_word_alignment(std::vector<string> &words,
-                                                 std::vector<int32> &times,
-                                                 std::vector<int32> &lengths)
+void GmmOnlineDecoderWrapper::lookup_words(GmmOnlineModelWrapper *model, const std::vector<int32> &word_idxs,
+                                           std::vector<string> &words)
+{
+  words.clear();
+  for (size_t i = 0; i < word_idxs.size(); i++)
+  {
+    std::string s = model->word_syms->Find(word_idxs[i]);
+    if (s == "")
+    {
+      KALDI_ERR << "Word-id " << word_idxs[i] << " not in symbol table.";
+    }
+    words.push_back(s);
+  }
+}
+
+bool GmmOnlineDecoderWrapper::align_words(GmmOnlineModelWrapper *model, const CompactLattice &best_path_clat,
+                                          std::vector<int32> &word_idxs, std::vector<int32> &times,
+                                          std::vector<int32> &lengths)
 {
   WordAlignLatticeLexiconInfo lexicon_info(model->word_alignment_lexicon);
 
@@ -165,48 +328,89 @@ bool GmmOnlineDecoderWrapper::get_word_alignment(std::vector<string> &words,
     KALDI_WARN << "Lattice did not align correctly";
     return false;
   }
-  else
+  if (aligned_clat.Start() == fst::kNoStateId)
   {
-    if (aligned_clat.Start() == fst::kNoStateId)
-    {
-      KALDI_WARN << "Lattice was empty";
-      return false;
-    }
-    else
-    {
+    KALDI_WARN << "Lattice was empty";
+    return false;
+  }
 #if VERBOSE
-      KALDI_LOG << "Aligned lattice.";
+  KALDI_LOG << "Aligned lattice.";
 #endif
-      TopSortCompactLatticeIfNeeded(&aligned_clat);
+  TopSortCompactLatticeIfNeeded(&aligned_clat);
 
-      // lattice-1best
+  // lattice-1best
 
-      CompactLattice best_path_aligned;
-      CompactLatticeShortestPath(aligned_clat, &best_path_aligned);
+  CompactLattice best_path_aligned;
+  CompactLatticeShortestPath(aligned_clat, &best_path_aligned);
 
-      // nbest-to-ctm
+  // nbest-to-ctm
 
-      std::vector<int32> word_idxs;
-      if (!CompactLatticeToWordAlignment(best_path_aligned, &word_idxs, &times,
-                                         &lengths))
-      {
-        KALDI_WARN << "CompactLatticeToWordAlignment failed.";
-        return false;
-      }
+  if (!CompactLatticeToWordAlignment(best_path_aligned, &word_idxs, &times, &lengths))
+  {
+    KALDI_WARN << "CompactLatticeToWordAlignment failed.";
+    return false;
+  }
+  return true;
+}
 
-      // lexicon lookup
-      words.clear();
-      for (size_t i = 0; i < word_idxs.size(); i++)
-      {
-        std::string s = model->word_syms->Find(word_idxs[i]);
-        if (s == "")
-        {
-          KALDI_ERR << "Word-id " << word_idxs[i] << " not in symbol table.";
-        }
-        words.push_back(s);
-      }
-    }
+bool GmmOnlineDecoderWrapper::get_word_alignment(std::vector<string> &words,
+                                                 std::vector<int32> &times,
+                                                 std::vector<int32> &lengths)
+{
+  std::vector<int32> word_idxs;
+  if (!align_words(model, best_path_clat, word_idxs, times, lengths)) return false;
+
+  lookup_words(model, word_idxs, words);
+  return true;
+}
+
+bool GmmOnlineDecoderWrapper::get_word_confidences(std::vector<string> &words,
+                                                  std::vector<int32> &times,
+                                                  std::vector<int32> &lengths,
+                                                  std::vector<BaseFloat> &confidences)
+{
+  return word_confidences(model, best_path_clat, final_clat, words, times, lengths, confidences);
+}
+
+bool GmmOnlineDecoderWrapper::word_confidences(GmmOnlineModelWrapper *model, const CompactLattice &best_path_clat,
+                                               const CompactLattice &final_clat, std::vector<string> &words,
+                                               std::vector<int32> &times, std::vector<int32> &lengths,
+                                               std::vector<BaseFloat> &confidences)
+{
+  if (final_clat.Start() == fst::kNoStateId)
+  {
+    KALDI_WARN << "No final lattice to compute confidences from";
+    return false;
+  }
+
+  std::vector<int32> aligned_word_idxs, aligned_times, aligned_lengths;
+  if (!align_words(model, best_path_clat, aligned_word_idxs, aligned_times, aligned_lengths)) return false;
+
+  // Confidences are computed for the words of the best path (not the MBR
+  // hypothesis), so silences and other epsilons are left out
+  std::vector<int32> word_idxs;
+  std::vector<std::pair<BaseFloat, BaseFloat> > mbr_times;
+  times.clear();
+  lengths.clear();
+  for (size_t i = 0; i < aligned_word_idxs.size(); i++)
+  {
+    if (aligned_word_idxs[i] == 0) continue;
+    word_idxs.push_back(aligned_word_idxs[i]);
+    times.push_back(aligned_times[i]);
+    lengths.push_back(aligned_lengths[i]);
+    mbr_times.push_back(std::make_pair(static_cast<BaseFloat>(aligned_times[i]),
+                                       static_cast<BaseFloat>(aligned_times[i] + aligned_lengths[i])));
   }
+
+#if VERBOSE
+  KALDI_LOG << "lattice posteriors...";
+#endif
+  MinimumBayesRiskOptions mbr_opts;
+  mbr_opts.decode_mbr = false;
+  MinimumBayesRisk mbr(final_clat, word_idxs, mbr_times, mbr_opts);
+  confidences = mbr.GetOneBestConfidences();
+
+  lookup_words(model, word_idxs, words);
   return true;
 }
 
@@ -226,10 +430,12 @@ bool GmmOnlineDecoderWrapper::decode(BaseFloat samp_freq, int32 num_frames,
     wave_part(i) = frames[i];
   }
   tot_frames += num_frames;
+  stats.samples_received += num_frames;
 
 #if VERBOSE
   KALDI_LOG << "AcceptWaveform...";
 #endif
+  Timer timer;
   decoder->FeaturePipeline().AcceptWaveform(samp_freq, wave_part);
 
   if (finalize)
@@ -237,26 +443,92 @@ bool GmmOnlineDecoderWrapper::decode(BaseFloat samp_freq, int32 num_frames,
     // no more input. flush out last frames
     decoder->FeaturePipeline().InputFinished();
   }
+  stats.accept_waveform_seconds += timer.Elapsed();
 
+  // all frames ready are decoded
+  timer.Reset();
   decoder->AdvanceDecoding();
+  stats.advance_decoding_seconds += timer.Elapsed();
+  int32 num_ready = decoder->FeaturePipeline().NumFramesReady();
+  stats.frames_decoded += num_ready - utterance_frames_decoded;
+  utterance_frames_decoded = num_ready;
 
   if (finalize)
   {
+    timer.Reset();
     decoder->FinalizeDecoding();
 
-    CompactLattice clat;
     bool end_of_utterance = true;
-    decoder->EstimateFmllr(end_of_utterance);
-    bool rescore_if_needed = true;
-    decoder->GetLattice(rescore_if_needed, end_of_utterance, &clat);
-
-    if (clat.NumStates() == 0)
+    if (second_pass_mode == kSecondPassDeferred)
     {
-      KALDI_WARN << "Empty lattice.";
-      return false;
+      // the best path is all the first pass result needs, the lattice is left
+      // to the second pass
+      Lattice best_path_lat;
+      decoder->GetBestPath(end_of_utterance, &best_path_lat);
+
+      if (carry_adaptation_state)
+      {
+        // the CMVN state, the fMLLR transform follows from the second pass
+        std::lock_guard<std::mutex> lock(adaptation_mutex);
+        decoder->GetAdaptationState(adaptation_state);
+      }
+
+      if (best_path_lat.NumStates() == 0)
+      {
+        KALDI_WARN << "Empty lattice.";
+        stats.finalize_seconds += timer.Elapsed();
+        return false;
+      }
+
+      ConvertLattice(best_path_lat, &best_path_clat);
+      final_clat = CompactLattice();
+      {
+        // until the second pass records its lattice
+        std::lock_guard<std::mutex> lock(adaptation_mutex);
+        stats.set_lattice(best_path_clat);
+      }
+
+      // the second pass takes over the decoder of the utterance
+      delete pending_second_pass;
+      pending_second_pass = new GmmSecondPass(model, utterance_config, utterance_adaptation_state, decoder,
+                                              best_path_clat);
+      decoder = NULL;
+      utterance_config = NULL;
+      utterance_adaptation_state = NULL;
     }
+    else
+    {
+      bool rescore = second_pass_mode == kSecondPassSync;
+      CompactLattice clat;
+      if (rescore) decoder->EstimateFmllr(end_of_utterance);
+      decoder->GetLattice(rescore, end_of_utterance, &clat);
 
-    CompactLatticeShortestPath(clat, &best_path_clat);
+      if (carry_adaptation_state)
+      {
+        // adapt the next utterance from where this one ended
+        std::lock_guard<std::mutex> lock(adaptation_mutex);
+        decoder->GetAdaptationState(adaptation_state);
+      }
+
+      if (clat.NumStates() == 0)
+      {
+        KALDI_WARN << "Empty lattice.";
+        stats.finalize_seconds += timer.Elapsed();
+        return false;
+      }
+
+      if (rescore && model->rescorer && !model->rescorer->Rescore(&clat))
+      {
+        KALDI_WARN << "LM rescoring failed, using first pass lattice.";
+      }
+
+      CompactLatticeShortestPath(clat, &best_path_clat);
+      final_clat = clat;
+      std::lock_guard<std::mutex> lock(adaptation_mutex);
+      stats.set_lattice(final_clat);
+    }
+    stats.finalize_seconds += timer.Elapsed();
+    stats.utterances++;
 
     tot_frames_decoded = tot_frames;
     tot_frames = 0;
@@ -267,6 +539,93 @@ bool GmmOnlineDecoderWrapper::decode(BaseFloat samp_freq, int32 num_frames,
   return true;
 }
 
+/*
+ * GmmSecondPass
+ */
+
+GmmSecondPass::GmmSecondPass(GmmOnlineModelWrapper *aModel, OnlineGmmDecodingConfig *aConfig,
+                             OnlineGmmAdaptationState *aInitialAdaptationState,
+                             SingleUtteranceGmmDecoder *aDecoder, const CompactLattice &first_pass_best_path)
+    : model(aModel),
+      config(aConfig),
+      initial_adaptation_state(aInitialAdaptationState),
+      decoder(aDecoder),
+      finished(false),
+      ok(false),
+      seconds(0.0),
+      best_path_clat(first_pass_best_path)
+{
+}
+
+GmmSecondPass::~GmmSecondPass() { free_decoder(); }
+
+void GmmSecondPass::free_decoder(void)
+{
+  delete decoder;
+  decoder = NULL;
+  delete initial_adaptation_state;
+  initial_adaptation_state = NULL;
+  delete config;
+  config = NULL;
+}
+
+bool GmmSecondPass::run(void)
+{
+  if (finished) return ok;
+
+  Timer timer;
+  bool end_of_utterance = true;
+  decoder->EstimateFmllr(end_of_utterance);
+  CompactLattice clat;
+  bool rescore_if_needed = true;
+  decoder->GetLattice(rescore_if_needed, end_of_utterance, &clat);
+  decoder->GetAdaptationState(&adaptation_state);
+  free_decoder();
+  finished = true;
+
+  if (clat.NumStates() == 0)
+  {
+    KALDI_WARN << "Empty lattice in the second pass, keeping the first pass result.";
+    seconds = timer.Elapsed();
+    return false;
+  }
+
+  if (model->rescorer && !model->rescorer->Rescore(&clat))
+  {
+    KALDI_WARN << "LM rescoring failed, using the lattice of the adapted model.";
+  }
+
+  CompactLatticeShortestPath(clat, &best_path_clat);
+  final_clat = clat;
+  ok = true;
+  seconds = timer.Elapsed();
+  return true;
+}
+
+void GmmSecondPass::get_decoded_string(std::string &decoded_string, double &likelihood)
+{
+  Lattice best_path_lat;
+  ConvertLattice(best_path_clat, &best_path_lat);
+  GmmOnlineDecoderWrapper::best_path_string(model, best_path_lat, decoded_string, likelihood);
+}
+
+bool GmmSecondPass::get_word_alignment(std::vector<string> &words, std::vector<int32> &times,
+                                       std::vector<int32> &lengths)
+{
+  std::vector<int32> word_idxs;
+  if (!GmmOnlineDecoderWrapper::align_words(model, best_path_clat, word_idxs, times, lengths)) return false;
+
+  GmmOnlineDecoderWrapper::lookup_words(model, word_idxs, words);
+  return true;
+}
+
+bool GmmSecondPass::get_word_confidences(std::vector<string> &words, std::vector<int32> &times,
+                                         std::vector<int32> &lengths, std::vector<BaseFloat> &confidences)
+{
+  return GmmOnlineDecoderWrapper::word_confidences(model, best_path_clat, final_clat, words, times, lengths,
+                                                   confidences);
+}
+
 /*
  * GmmOnlineModelWrapper
  */
@@ -290,6 +649,8 @@ GmmOnlineModelWrapper::GmmOnlineModelWrapper(
   typedef kaldi::int32 int32;
   typedef kaldi::int64 int64;
 
+  rescorer = NULL;
+
 #if VERBOSE
   KALDI_LOG << "fst_in_str:                " << fst_in_str;
   KALDI_LOG << "config:                    " << config;
@@ -316,6 +677,12 @@ GmmOnlineModelWrapper::GmmOnlineModelWrapper(
   // load model...
   gmm_models = new OnlineGmmDecodingModels(decode_config);
 
+  // dimension of the features CMVN is applied to, for checking adaptation
+  // states against
+  Matrix<double> global_cmvn_stats;
+  ReadKaldiObject(feature_config->global_cmvn_stats_rxfilename, &global_cmvn_stats);
+  cmvn_dim = global_cmvn_stats.NumCols() - 1;
+
   // Input FST is just one FST, not a table of FSTs.
   decode_fst = fst::ReadFstKaldiGeneric(fst_in_str);
 
@@ -345,6 +712,35 @@ GmmOnlineModelWrapper::~GmmOnlineModelWrapper()
   delete feature_config;
   delete feature_pipeline_prototype;
   delete gmm_models;
+  delete rescorer;
+}
+
+bool GmmOnlineModelWrapper::adaptation_state_fits(const OnlineGmmAdaptationState &state) const
+{
+  // the parts of a state are empty until an utterance fills them
+  const Matrix<double> *cmvn_stats[] = {&state.cmvn_state.speaker_cmvn_stats,
+                                        &state.cmvn_state.global_cmvn_stats, &state.cmvn_state.frozen_state};
+  for (size_t i = 0; i < 3; i++)
+  {
+    if (cmvn_stats[i]->NumRows() != 0 && (cmvn_stats[i]->NumRows() != 2 || cmvn_stats[i]->NumCols() != cmvn_dim + 1))
+      return false;
+  }
+
+  int32 dim = gmm_models->GetModel().Dim();
+  if (state.transform.NumRows() != 0 && (state.transform.NumRows() != dim || state.transform.NumCols() != dim + 1))
+    return false;
+  return state.spk_stats.Dim() == 0 || state.spk_stats.Dim() == dim;
+}
+
+void GmmOnlineModelWrapper::set_lm_rescoring(const std::string &old_lm_filename,
+                                             const std::string &new_lm_filename)
+{
+#if VERBOSE
+  KALDI_LOG << "loading rescoring LMs...";
+#endif
+  LatticeLmRescorer *new_rescorer = new LatticeLmRescorer(old_lm_filename, new_lm_filename);
+  delete rescorer;
+  rescorer = new_rescorer;
 }
 
 }  // namespace kaldi
@@ -0,0 +1,223 @@
+// graph_cache.cpp
+
+// See ../../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABLITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+//
+
+#include "graph_cache.h"
+
+#include <sys/stat.h>
+
+#include "lat/word-align-lattice-lexicon.h"
+#include "util/common-utils.h"
+
+#define VERBOSE 0
+
+namespace kaldi
+{
+static size_t file_size(const std::string &filename)
+{
+  struct stat st;
+  if (stat(filename.c_str(), &st) != 0) return 0;
+  return static_cast<size_t>(st.st_size);
+}
+
+/*
+ * DecodingGraph
+ */
+
+DecodingGraph::DecodingGraph(const std::string &name, const std::string &fst_in_str,
+                             const std::string &word_syms_filename, const std::string &align_lex_filename)
+    : name(name)
+{
+#if VERBOSE
+  KALDI_LOG << "loading graph " << name << " from " << fst_in_str;
+#endif
+  // Input FST is just one FST, not a table of FSTs.
+  decode_fst = fst::ReadFstKaldiGeneric(fst_in_str);
+
+  word_syms = NULL;
+  if (word_syms_filename != "")
+    if (!(word_syms = fst::SymbolTable::ReadText(word_syms_filename)))
+      KALDI_ERR << "Could not read symbol table from file " << word_syms_filename;
+
+#if VERBOSE
+  KALDI_LOG << "loading word alignment lexicon...";
+#endif
+  {
+    bool binary_in;
+    Input ki(align_lex_filename, &binary_in);
+    KALDI_ASSERT(!binary_in && "Not expecting binary file for lexicon");
+    if (!ReadLexiconForWordAlign(ki.Stream(), &word_alignment_lexicon))
+    {
+      KALDI_ERR << "Error reading alignment lexicon from " << align_lex_filename;
+    }
+  }
+
+  // The in-memory size of a ConstFst and the symbol table are close to their
+  // size on disk, which is good enough for the cache's memory cap
+  size_bytes = file_size(fst_in_str) + file_size(word_syms_filename) + file_size(align_lex_filename);
+}
+
+DecodingGraph::DecodingGraph(const std::string &name, std::istream &fst_is, std::istream &word_syms_is,
+                             std::istream &align_lex_is, size_t size_bytes)
+    : name(name), size_bytes(size_bytes)
+{
+#if VERBOSE
+  KALDI_LOG << "loading graph " << name << " from streams";
+#endif
+  decode_fst = fst::Fst<fst::StdArc>::Read(fst_is, fst::FstReadOptions(name));
+  if (!decode_fst) KALDI_ERR << "Could not read decoding graph " << name;
+
+  if (!(word_syms = fst::SymbolTable::ReadText(word_syms_is, name)))
+  {
+    delete decode_fst;
+    KALDI_ERR << "Could not read symbol table of graph " << name;
+  }
+
+  if (!ReadLexiconForWordAlign(align_lex_is, &word_alignment_lexicon))
+  {
+    delete decode_fst;
+    delete word_syms;
+    KALDI_ERR << "Error reading alignment lexicon of graph " << name;
+  }
+}
+
+DecodingGraph::~DecodingGraph()
+{
+  delete decode_fst;
+  delete word_syms;
+}
+
+/*
+ * DecodingGraphCache
+ */
+
+DecodingGraphCache::DecodingGraphCache(size_t max_bytes) : max_bytes(max_bytes), used_bytes(0) {}
+
+void DecodingGraphCache::add(const std::string &name, const std::string &fst_in_str,
+                             const std::string &word_syms_filename, const std::string &align_lex_filename)
+{
+  add(name, [name, fst_in_str, word_syms_filename, align_lex_filename]() {
+    return new DecodingGraph(name, fst_in_str, word_syms_filename, align_lex_filename);
+  });
+}
+
+void DecodingGraphCache::add(const std::string &name, GraphLoader loader)
+{
+  // Re-registering a name replaces the graph from the next lookup on
+  remove(name);
+
+  std::lock_guard<std::mutex> lock(mutex);
+  loaders[name] = loader;
+}
+
+void DecodingGraphCache::remove(const std::string &name)
+{
+  std::lock_guard<std::mutex> lock(mutex);
+  loaders.erase(name);
+
+  std::map<std::string, CacheEntry>::iterator it = cache.find(name);
+  if (it != cache.end())
+  {
+    used_bytes -= it->second.graph->size_bytes;
+    lru.erase(it->second.lru_position);
+    cache.erase(it);
+  }
+}
+
+bool DecodingGraphCache::has(const std::string &name)
+{
+  std::lock_guard<std::mutex> lock(mutex);
+  return loaders.count(name) > 0;
+}
+
+std::shared_ptr<const DecodingGraph> DecodingGraphCache::get(const std::string &name)
+{
+  GraphLoader loader;
+  {
+    std::lock_guard<std::mutex> lock(mutex);
+    std::map<std::string, CacheEntry>::iterator it = cache.find(name);
+    if (it != cache.end())
+    {
+      lru.splice(lru.begin(), lru, it->second.lru_position);
+      return it->second.graph;
+    }
+
+    std::map<std::string, GraphLoader>::iterator loader_it = loaders.find(name);
+    if (loader_it == loaders.end()) KALDI_ERR << "Unknown decoding graph " << name;
+    loader = loader_it->second;
+  }
+
+  // Loading takes a while, so other graphs stay available in the meantime
+  std::shared_ptr<const DecodingGraph> graph(loader());
+
+  std::lock_guard<std::mutex> lock(mutex);
+  std::map<std::string, CacheEntry>::iterator it = cache.find(name);
+  if (it != cache.end())
+  {
+    // Loaded concurrently by another decoder
+    lru.splice(lru.begin(), lru, it->second.lru_position);
+    return it->second.graph;
+  }
+
+  lru.push_front(name);
+  CacheEntry &entry = cache[name];
+  entry.graph = graph;
+  entry.lru_position = lru.begin();
+  used_bytes += graph->size_bytes;
+
+  evict(name);
+  return graph;
+}
+
+void DecodingGraphCache::set_max_bytes(size_t max_bytes)
+{
+  std::lock_guard<std::mutex> lock(mutex);
+  this->max_bytes = max_bytes;
+  evict("");
+}
+
+size_t DecodingGraphCache::memory_usage()
+{
+  std::lock_guard<std::mutex> lock(mutex);
+  return used_bytes;
+}
+
+std::vector<std::string> DecodingGraphCache::loaded_graphs()
+{
+  std::lock_guard<std::mutex> lock(mutex);
+  return std::vector<std::string>(lru.begin(), lru.end());
+}
+
+void DecodingGraphCache::evict(const std::string &keep)
+{
+  // Called with the mutex held
+  while (max_bytes > 0 && used_bytes > max_bytes && !lru.empty())
+  {
+    const std::string &name = lru.back();
+    if (name == keep) break;
+
+#if VERBOSE
+    KALDI_LOG << "evicting graph " << name;
+#endif
+    std::map<std::string, CacheEntry>::iterator it = cache.find(name);
+    used_bytes -= it->second.graph->size_bytes;
+    cache.erase(it);
+    lru.pop_back();
+  }
+}
+
+}  // namespace kaldi
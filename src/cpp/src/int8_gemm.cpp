@@ -0,0 +1,279 @@
+// int8_gemm.cpp
+
+// See ../../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABLITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+//
+
+#include "int8_gemm.h"
+
+#include <algorithm>
+#include <cmath>
+
+#if (defined(__x86_64__) || defined(__i386__)) && defined(__GNUC__)
+#define INT8_GEMM_AVX2 1
+#include <immintrin.h>
+#else
+#define INT8_GEMM_AVX2 0
+#endif
+
+namespace kaldi
+{
+// input rows per tile of the kernel
+static const int32 kTileRows = 4;
+// input rows per block, which the panels of the weights are run over in turn.
+// A block of rows as wide as a TDNN layer stays in the L2 cache
+static const int32 kRowBlock = 32;
+
+static int32 padded_depth(int32 num_cols)
+{
+  return (num_cols + kInt8DepthBlock - 1) / kInt8DepthBlock * kInt8DepthBlock;
+}
+
+// quantizes row to [-127, 127] with a symmetric scale, returning the scale
+template <typename Int>
+static BaseFloat quantize_row(const BaseFloat *row, int32 dim, Int *quantized)
+{
+  BaseFloat max_abs = 0.0;
+  for (int32 i = 0; i < dim; i++) max_abs = std::max(max_abs, std::abs(row[i]));
+  if (max_abs == 0.0)
+  {
+    std::fill(quantized, quantized + dim, 0);
+    return 0.0;
+  }
+
+  // rounds half away from zero, in a loop compilers vectorize
+  BaseFloat inv_scale = 127.0 / max_abs;
+  for (int32 i = 0; i < dim; i++)
+  {
+    BaseFloat x = row[i] * inv_scale;
+    int32 q = static_cast<int32>(x + (x < 0 ? -0.5f : 0.5f));
+    quantized[i] = static_cast<Int>(std::max(-127, std::min(127, q)));
+  }
+  return max_abs / 127.0;
+}
+
+void Int8PackedMatrix::quantize(const BaseFloat *data, int32 num_rows, int32 num_cols, int32 row_stride)
+{
+  std::vector<int8> values(static_cast<size_t>(num_rows) * num_cols);
+  std::vector<BaseFloat> row_scales(num_rows);
+  for (int32 r = 0; r < num_rows; r++)
+  {
+    row_scales[r] = quantize_row(data + static_cast<size_t>(r) * row_stride, num_cols,
+                                 &values[static_cast<size_t>(r) * num_cols]);
+  }
+  assign(values.data(), row_scales.data(), num_rows, num_cols);
+}
+
+void Int8PackedMatrix::assign(const int8 *values, const BaseFloat *row_scales, int32 num_rows, int32 num_cols)
+{
+  this->num_rows = num_rows;
+  this->num_cols = num_cols;
+  depth = padded_depth(num_cols);
+  int32 num_panels = (num_rows + kInt8PanelRows - 1) / kInt8PanelRows;
+  packed.assign(static_cast<size_t>(num_panels) * kInt8PanelRows * depth, 0);
+  scales.assign(row_scales, row_scales + num_rows);
+  for (int32 r = 0; r < num_rows; r++)
+  {
+    for (int32 c = 0; c < num_cols; c++)
+    {
+      packed[static_cast<size_t>(r / kInt8PanelRows) * kInt8PanelRows * depth +
+             (c / kInt8DepthBlock) * kInt8PanelRows * kInt8DepthBlock + (r % kInt8PanelRows) * kInt8DepthBlock +
+             c % kInt8DepthBlock] = values[static_cast<size_t>(r) * num_cols + c];
+    }
+  }
+}
+
+int8 Int8PackedMatrix::value(int32 row, int32 col) const
+{
+  return panel(row / kInt8PanelRows)[(col / kInt8DepthBlock) * kInt8PanelRows * kInt8DepthBlock +
+                                     (row % kInt8PanelRows) * kInt8DepthBlock + col % kInt8DepthBlock];
+}
+
+BaseFloat Int8PackedMatrix::max_error(const BaseFloat *data, int32 row_stride) const
+{
+  BaseFloat error = 0.0;
+  for (int32 r = 0; r < num_rows; r++)
+  {
+    for (int32 c = 0; c < num_cols; c++)
+    {
+      error = std::max(error, std::abs(value(r, c) * scales[r] - data[static_cast<size_t>(r) * row_stride + c]));
+    }
+  }
+  return error;
+}
+
+void Int8InputRows::quantize(const BaseFloat *data, int32 num_rows, int32 num_cols, int32 row_stride)
+{
+  this->num_rows = num_rows;
+  this->num_cols = num_cols;
+  depth = padded_depth(num_cols);
+  // the padding stays zero, as the memory only grows
+  size_t size = static_cast<size_t>(num_rows) * depth;
+  if (values.size() < size) values.resize(size);
+  if (scales.size() < static_cast<size_t>(num_rows)) scales.resize(num_rows);
+  for (int32 r = 0; r < num_rows; r++)
+  {
+    int16 *row = &values[static_cast<size_t>(r) * depth];
+    scales[r] = quantize_row(data + static_cast<size_t>(r) * row_stride, num_cols, row);
+    std::fill(row + num_cols, row + depth, 0);
+  }
+}
+
+// sums[i * kInt8PanelRows + j] = dot product of rows[i] and row j of the
+// panel, over depth columns
+typedef void (*Int8TileKernel)(const int16 *const *rows, const int8 *panel, int32 depth, int32 *sums);
+
+static void tile_generic(const int16 *const *rows, const int8 *panel, int32 depth, int32 *sums)
+{
+  std::fill(sums, sums + kTileRows * kInt8PanelRows, 0);
+  for (int32 k0 = 0; k0 < depth; k0 += kInt8DepthBlock)
+  {
+    const int8 *block = panel + k0 * kInt8PanelRows;
+    for (int32 i = 0; i < kTileRows; i++)
+    {
+      const int16 *x = rows[i] + k0;
+      for (int32 j = 0; j < kInt8PanelRows; j++)
+      {
+        const int8 *w = block + j * kInt8DepthBlock;
+        int32 sum = 0;
+        for (int32 k = 0; k < kInt8DepthBlock; k++) sum += x[k] * w[k];
+        sums[i * kInt8PanelRows + j] += sum;
+      }
+    }
+  }
+}
+
+#if INT8_GEMM_AVX2
+__attribute__((target("avx2"))) static inline int32 sum_lanes(__m256i v)
+{
+  __m128i sum = _mm_add_epi32(_mm256_castsi256_si128(v), _mm256_extracti128_si256(v, 1));
+  sum = _mm_hadd_epi32(sum, sum);
+  sum = _mm_hadd_epi32(sum, sum);
+  return _mm_cvtsi128_si32(sum);
+}
+
+// a block of a panel is two rows of 16 int8 weights, widened to int16 and
+// multiplied with 16 int16 inputs into 8 int32 lanes of pair sums each. The
+// products are at most 127 * 127, so the pair sums do not saturate
+__attribute__((target("avx2"))) static void tile_avx2(const int16 *const *rows, const int8 *panel, int32 depth,
+                                                      int32 *sums)
+{
+  __m256i sum00 = _mm256_setzero_si256(), sum01 = _mm256_setzero_si256();
+  __m256i sum10 = _mm256_setzero_si256(), sum11 = _mm256_setzero_si256();
+  __m256i sum20 = _mm256_setzero_si256(), sum21 = _mm256_setzero_si256();
+  __m256i sum30 = _mm256_setzero_si256(), sum31 = _mm256_setzero_si256();
+  for (int32 k0 = 0; k0 < depth; k0 += kInt8DepthBlock)
+  {
+    const int8 *block = panel + k0 * kInt8PanelRows;
+    __m256i w0 = _mm256_cvtepi8_epi16(_mm_loadu_si128(reinterpret_cast<const __m128i *>(block)));
+    __m256i w1 = _mm256_cvtepi8_epi16(_mm_loadu_si128(reinterpret_cast<const __m128i *>(block + kInt8DepthBlock)));
+
+    __m256i x = _mm256_loadu_si256(reinterpret_cast<const __m256i *>(rows[0] + k0));
+    sum00 = _mm256_add_epi32(sum00, _mm256_madd_epi16(x, w0));
+    sum01 = _mm256_add_epi32(sum01, _mm256_madd_epi16(x, w1));
+    x = _mm256_loadu_si256(reinterpret_cast<const __m256i *>(rows[1] + k0));
+    sum10 = _mm256_add_epi32(sum10, _mm256_madd_epi16(x, w0));
+    sum11 = _mm256_add_epi32(sum11, _mm256_madd_epi16(x, w1));
+    x = _mm256_loadu_si256(reinterpret_cast<const __m256i *>(rows[2] + k0));
+    sum20 = _mm256_add_epi32(sum20, _mm256_madd_epi16(x, w0));
+    sum21 = _mm256_add_epi32(sum21, _mm256_madd_epi16(x, w1));
+    x = _mm256_loadu_si256(reinterpret_cast<const __m256i *>(rows[3] + k0));
+    sum30 = _mm256_add_epi32(sum30, _mm256_madd_epi16(x, w0));
+    sum31 = _mm256_add_epi32(sum31, _mm256_madd_epi16(x, w1));
+  }
+  sums[0] = sum_lanes(sum00);
+  sums[1] = sum_lanes(sum01);
+  sums[2] = sum_lanes(sum10);
+  sums[3] = sum_lanes(sum11);
+  sums[4] = sum_lanes(sum20);
+  sums[5] = sum_lanes(sum21);
+  sums[6] = sum_lanes(sum30);
+  sums[7] = sum_lanes(sum31);
+}
+#endif
+
+static Int8TileKernel select_kernel(void)
+{
+#if INT8_GEMM_AVX2
+  __builtin_cpu_init();
+  if (__builtin_cpu_supports("avx2")) return tile_avx2;
+#endif
+  return tile_generic;
+}
+
+bool Int8GemmKernelSupported(Int8GemmKernel kernel)
+{
+#if INT8_GEMM_AVX2
+  static const Int8TileKernel best = select_kernel();
+  if (kernel == kInt8GemmAvx2) return best == tile_avx2;
+#else
+  if (kernel == kInt8GemmAvx2) return false;
+#endif
+  return true;
+}
+
+static Int8TileKernel tile_kernel(Int8GemmKernel kernel)
+{
+  static const Int8TileKernel best = select_kernel();
+  if (kernel == kInt8GemmGeneric) return tile_generic;
+  if (kernel == kInt8GemmAvx2 && !Int8GemmKernelSupported(kernel)) KALDI_ERR << "The CPU does not support AVX2";
+  return best;
+}
+
+void Int8Gemm(const Int8InputRows &input, int32 first_row, int32 row_step, int32 num_rows,
+              const Int8PackedMatrix &weights, BaseFloat *out, int32 out_stride, Int8GemmKernel kernel_choice)
+{
+  const Int8TileKernel kernel = tile_kernel(kernel_choice);
+  KALDI_ASSERT(input.NumCols() == weights.NumCols());
+  int32 depth = weights.Depth(), num_outputs = weights.NumRows();
+  int32 num_panels = (num_outputs + kInt8PanelRows - 1) / kInt8PanelRows;
+
+  const int16 *rows[kTileRows];
+  BaseFloat row_scales[kTileRows];
+  int32 sums[kTileRows * kInt8PanelRows];
+  for (int32 b0 = 0; b0 < num_rows; b0 += kRowBlock)
+  {
+    int32 b1 = std::min(num_rows, b0 + kRowBlock);
+    for (int32 p = 0; p < num_panels; p++)
+    {
+      const int8 *panel = weights.panel(p);
+      int32 c0 = p * kInt8PanelRows, num_cols = std::min(kInt8PanelRows, num_outputs - c0);
+      for (int32 r0 = b0; r0 < b1; r0 += kTileRows)
+      {
+        // a tile past the last row repeats the last row, whose sums are
+        // dropped
+        int32 tile_rows = std::min(kTileRows, b1 - r0);
+        for (int32 i = 0; i < kTileRows; i++)
+        {
+          int32 row = first_row + (r0 + std::min(i, tile_rows - 1)) * row_step;
+          rows[i] = input.row(row);
+          row_scales[i] = input.scale(row);
+        }
+        kernel(rows, panel, depth, sums);
+
+        for (int32 i = 0; i < tile_rows; i++)
+        {
+          BaseFloat *out_row = out + static_cast<size_t>(r0 + i) * out_stride + c0;
+          for (int32 j = 0; j < num_cols; j++)
+          {
+            out_row[j] += sums[i * kInt8PanelRows + j] * (row_scales[i] * weights.scale(c0 + j));
+          }
+        }
+      }
+    }
+  }
+}
+
+}  // namespace kaldi
@@ -0,0 +1,117 @@
+// lattice_rescoring.cpp
+//
+// based on Kaldi's latbin/lattice-lmrescore-const-arpa.cc and
+// latbin/lattice-lmrescore-pruned.cc
+
+// Copyright 2014  Johns Hopkins University (author: Daniel Povey)
+
+// See ../../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABLITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+//
+
+#include "lattice_rescoring.h"
+
+#include "fstext/deterministic-fst.h"
+#include "fstext/kaldi-fst-io.h"
+#include "lat/lattice-functions.h"
+
+#define VERBOSE 0
+
+namespace kaldi
+{
+static bool is_const_arpa_filename(const std::string &filename)
+{
+  const std::string suffix = ".carpa";
+  return filename.size() > suffix.size() &&
+         filename.compare(filename.size() - suffix.size(), suffix.size(), suffix) == 0;
+}
+
+LatticeLmRescorer::LatticeLmRescorer(const std::string &old_lm_filename,
+                                     const std::string &new_lm_filename)
+{
+  new_lm_fst = NULL;
+  new_lm_carpa = NULL;
+
+#if VERBOSE
+  KALDI_LOG << "old_lm_filename:           " << old_lm_filename;
+  KALDI_LOG << "new_lm_filename:           " << new_lm_filename;
+#endif
+
+  // Projected on the output side and sorted on input labels, as needed by
+  // BackoffDeterministicOnDemandFst
+  old_lm_fst = fst::ReadAndPrepareLmFst(old_lm_filename);
+
+  if (is_const_arpa_filename(new_lm_filename))
+  {
+    new_lm_carpa = new ConstArpaLm();
+    ReadKaldiObject(new_lm_filename, new_lm_carpa);
+  }
+  else
+  {
+    new_lm_fst = fst::ReadAndPrepareLmFst(new_lm_filename);
+  }
+}
+
+LatticeLmRescorer::~LatticeLmRescorer()
+{
+  delete old_lm_fst;
+  delete new_lm_fst;
+  delete new_lm_carpa;
+}
+
+bool LatticeLmRescorer::Rescore(CompactLattice *clat) const
+{
+  // The on-demand FSTs cache the states they visit, so they are created per
+  // lattice. This keeps Rescore const and memory from growing over time.
+  fst::BackoffDeterministicOnDemandFst<fst::StdArc> old_lm_dfst(*old_lm_fst);
+  fst::ScaleDeterministicOnDemandFst old_lm_scaled_dfst(-1.0, &old_lm_dfst);
+
+  fst::DeterministicOnDemandFst<fst::StdArc> *new_lm_dfst;
+  if (new_lm_carpa)
+    new_lm_dfst = new ConstArpaLmDeterministicFst(*new_lm_carpa);
+  else
+    new_lm_dfst = new fst::BackoffDeterministicOnDemandFst<fst::StdArc>(*new_lm_fst);
+
+  fst::ComposeDeterministicOnDemandFst<fst::StdArc> combined_lms(&old_lm_scaled_dfst, new_lm_dfst);
+
+#if VERBOSE
+  KALDI_LOG << "lattice rescoring starts...";
+#endif
+  CompactLattice sorted_clat(*clat);
+  ArcSort(&sorted_clat, fst::OLabelCompare<CompactLatticeArc>());
+
+  CompactLattice composed_clat;
+  ComposeCompactLatticeDeterministic(sorted_clat, &combined_lms, &composed_clat);
+  delete new_lm_dfst;
+
+  if (composed_clat.Start() == fst::kNoStateId)
+  {
+    KALDI_WARN << "Empty lattice after LM rescoring";
+    return false;
+  }
+
+  // Determinize on the word labels again
+  Lattice composed_lat;
+  ConvertLattice(composed_clat, &composed_lat);
+  Invert(&composed_lat);
+  DeterminizeLattice(composed_lat, clat);
+
+#if VERBOSE
+  KALDI_LOG << "lattice rescoring done.";
+#endif
+  return true;
+}
+
+}  // namespace kaldi
@@ -0,0 +1,265 @@
+// model_bundle.cpp
+
+// See ../../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABLITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+//
+
+#include "model_bundle.h"
+
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+#include <cstring>
+#include <sstream>
+
+#include "util/common-utils.h"
+
+#include "config_options.h"
+
+#define VERBOSE 0
+
+namespace kaldi
+{
+static std::vector<uint32> make_crc32_table()
+{
+  std::vector<uint32> table(256);
+  for (uint32 i = 0; i < 256; i++)
+  {
+    uint32 c = i;
+    for (int k = 0; k < 8; k++) c = (c & 1) ? 0xEDB88320u ^ (c >> 1) : c >> 1;
+    table[i] = c;
+  }
+  return table;
+}
+
+// CRC-32 as in zlib, so python's zlib.crc32 computes the same checksums
+static uint32 crc32(const char *data, size_t size)
+{
+  static const std::vector<uint32> table = make_crc32_table();
+
+  uint32 crc = 0xFFFFFFFFu;
+  for (size_t i = 0; i < size; i++)
+  {
+    crc = table[(crc ^ static_cast<unsigned char>(data[i])) & 0xFF] ^ (crc >> 8);
+  }
+  return crc ^ 0xFFFFFFFFu;
+}
+
+// read-only, seekable stream buffer over a member of the mapped file
+class MemberBuf : public std::streambuf
+{
+ public:
+  MemberBuf(char *begin, size_t size) { setg(begin, begin, begin + size); }
+
+ protected:
+  pos_type seekoff(off_type off, std::ios_base::seekdir dir, std::ios_base::openmode which)
+  {
+    char *pos;
+    if (dir == std::ios_base::beg)
+      pos = eback() + off;
+    else if (dir == std::ios_base::cur)
+      pos = gptr() + off;
+    else
+      pos = egptr() + off;
+    if (pos < eback() || pos > egptr()) return pos_type(off_type(-1));
+    setg(eback(), pos, egptr());
+    return pos_type(pos - eback());
+  }
+
+  pos_type seekpos(pos_type pos, std::ios_base::openmode which)
+  {
+    return seekoff(off_type(pos), std::ios_base::beg, which);
+  }
+};
+
+// the buffer is a base class, so it is constructed before the stream
+class MemberStream : private MemberBuf, public std::istream
+{
+ public:
+  MemberStream(char *begin, size_t size) : MemberBuf(begin, size), std::istream(this) {}
+};
+
+/*
+ * ModelBundle
+ */
+
+const std::string ModelBundle::magic = "YPKBNDL1";
+
+ModelBundle::ModelBundle(const std::string &filename, bool verify) : filename(filename), data(NULL), length(0)
+{
+#if VERBOSE
+  KALDI_LOG << "mapping model bundle " << filename;
+#endif
+  int fd = ::open(filename.c_str(), O_RDONLY);
+  if (fd < 0) KALDI_ERR << "Could not open model bundle " << filename << ": " << strerror(errno);
+
+  struct stat st;
+  if (fstat(fd, &st) != 0 || st.st_size < static_cast<off_t>(magic.size() + 8))
+  {
+    ::close(fd);
+    KALDI_ERR << "Model bundle " << filename << " is truncated";
+  }
+  length = static_cast<size_t>(st.st_size);
+
+  void *mapped = mmap(NULL, length, PROT_READ, MAP_PRIVATE, fd, 0);
+  ::close(fd);
+  if (mapped == MAP_FAILED) KALDI_ERR << "Could not map model bundle " << filename << ": " << strerror(errno);
+  data = static_cast<char *>(mapped);
+
+  if (std::memcmp(data, magic.data(), magic.size()) != 0)
+  {
+    munmap(data, length);
+    KALDI_ERR << filename << " is not a model bundle";
+  }
+
+  uint64 manifest_size = 0;
+  for (int i = 7; i >= 0; i--)
+  {
+    manifest_size = (manifest_size << 8) | static_cast<unsigned char>(data[magic.size() + i]);
+  }
+  size_t manifest_offset = magic.size() + 8;
+  if (manifest_size > length - manifest_offset)
+  {
+    munmap(data, length);
+    KALDI_ERR << "Model bundle " << filename << " is truncated";
+  }
+
+  std::istringstream manifest(std::string(data + manifest_offset, manifest_size));
+  std::string line;
+  while (std::getline(manifest, line))
+  {
+    if (line.empty()) continue;
+
+    std::istringstream fields(line);
+    std::string name;
+    Member m;
+    if (!std::getline(fields, name, '\t') || !(fields >> m.offset >> m.size >> m.crc32) ||
+        m.offset > length || m.size > length - m.offset)
+    {
+      munmap(data, length);
+      KALDI_ERR << "Invalid manifest entry in model bundle " << filename << ": " << line;
+    }
+    members[name] = m;
+  }
+
+  if (verify)
+  {
+    for (std::map<std::string, Member>::const_iterator it = members.begin(); it != members.end(); ++it)
+    {
+      if (crc32(data + it->second.offset, it->second.size) != it->second.crc32)
+      {
+        munmap(data, length);
+        KALDI_ERR << "Checksum mismatch of " << it->first << " in model bundle " << filename;
+      }
+    }
+  }
+}
+
+ModelBundle::~ModelBundle() { munmap(data, length); }
+
+bool ModelBundle::has(const std::string &name) const { return members.count(name) > 0; }
+
+size_t ModelBundle::size(const std::string &name) const { return member(name).size; }
+
+const ModelBundle::Member &ModelBundle::member(const std::string &name) const
+{
+  std::map<std::string, Member>::const_iterator it = members.find(name);
+  if (it == members.end()) KALDI_ERR << "Model bundle " << filename << " has no " << name;
+  return it->second;
+}
+
+std::unique_ptr<std::istream> ModelBundle::open(const std::string &name) const
+{
+  const Member &m = member(name);
+  return std::unique_ptr<std::istream>(new MemberStream(data + m.offset, m.size));
+}
+
+void ModelBundle::read_options(const std::string &name, ParseOptions *po) const
+{
+  std::unique_ptr<std::istream> is = open(name);
+  parse_options(*is, name, po);
+}
+
+template <class C>
+void ModelBundle::read_object(const std::string &name, C *object) const
+{
+  std::unique_ptr<std::istream> is = open(name);
+  bool binary;
+  if (!InitKaldiInputStream(*is, &binary)) KALDI_ERR << "Could not read " << name << " of model bundle " << filename;
+  object->Read(*is, binary);
+}
+
+DecodingGraph *ModelBundle::read_graph(const std::string &graph_name) const
+{
+  std::unique_ptr<std::istream> fst_is = open("HCLG.fst");
+  std::unique_ptr<std::istream> word_syms_is = open("words.txt");
+  std::unique_ptr<std::istream> align_lex_is = open("align_lexicon.int");
+  return new DecodingGraph(graph_name, *fst_is, *word_syms_is, *align_lex_is,
+                           size("HCLG.fst") + size("words.txt") + size("align_lexicon.int"));
+}
+
+OnlineNnet2FeaturePipelineInfo *ModelBundle::read_feature_info(const std::string &ivector_options) const
+{
+  // The same as OnlineNnet2FeaturePipelineInfo(config) and
+  // OnlineIvectorExtractionInfo::Init(config), with the files read from the
+  // bundle instead of by path
+  std::unique_ptr<OnlineNnet2FeaturePipelineInfo> info(new OnlineNnet2FeaturePipelineInfo());
+  info->feature_type = "mfcc";
+  {
+    ParseOptions po("");
+    info->mfcc_opts.Register(&po);
+    read_options("mfcc.conf", &po);
+  }
+
+  OnlineIvectorExtractionConfig ie_config;
+  {
+    ParseOptions po("");
+    ie_config.Register(&po);
+    parse_options(ivector_options, "ivector options", &po);
+  }
+
+  info->use_ivectors = true;
+  OnlineIvectorExtractionInfo &ie_info = info->ivector_extractor_info;
+  ie_info.ivector_period = ie_config.ivector_period;
+  ie_info.num_gselect = ie_config.num_gselect;
+  ie_info.min_post = ie_config.min_post;
+  ie_info.posterior_scale = ie_config.posterior_scale;
+  ie_info.max_count = ie_config.max_count;
+  ie_info.num_cg_iters = ie_config.num_cg_iters;
+  ie_info.use_most_recent_ivector = ie_config.use_most_recent_ivector;
+  ie_info.greedy_ivector_extractor = ie_config.greedy_ivector_extractor;
+  ie_info.max_remembered_frames = ie_config.max_remembered_frames;
+  {
+    ParseOptions po("");
+    ie_info.cmvn_opts.Register(&po);
+    read_options("online_cmvn.conf", &po);
+  }
+  {
+    ParseOptions po("");
+    ie_info.splice_opts.Register(&po);
+    read_options("splice.conf", &po);
+  }
+  read_object("final.mat", &ie_info.lda_mat);
+  read_object("global_cmvn.stats", &ie_info.global_cmvn_stats);
+  read_object("final.dubm", &ie_info.diag_ubm);
+  read_object("final.ie", &ie_info.extractor);
+  ie_info.Check();
+
+  return info.release();
+}
+
+}  // namespace kaldi
@@ -0,0 +1,148 @@
+// nnet3_batching.cpp
+//
+// chunking based on Kaldi's nnet3/nnet-batch-compute.cc
+
+// Copyright 2018  Johns Hopkins University (author: Daniel Povey)
+
+// See ../../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABLITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+//
+
+#include "nnet3_batching.h"
+
+#include "nnet3/nnet-utils.h"
+
+#define VERBOSE 0
+
+namespace kaldi
+{
+NNet3BatchScheduler::NNet3BatchScheduler(const nnet3::NnetBatchComputerOptions &opts,
+                                         const nnet3::AmNnetSimple &am_nnet, int32 tick_ms)
+    : opts(opts), tick(tick_ms), num_submitted(0), stopping(false)
+{
+  // every chunk has the same number of output frames, so all chunks of all
+  // streams can share minibatches
+  int32 f = this->opts.frame_subsampling_factor;
+  this->opts.frames_per_chunk = (this->opts.frames_per_chunk + f - 1) / f * f;
+
+  nnet3::ComputeSimpleNnetContext(am_nnet.GetNnet(), &nnet_left_context, &nnet_right_context);
+  computer = new nnet3::NnetBatchComputer(this->opts, am_nnet.GetNnet(), am_nnet.Priors());
+
+#if VERBOSE
+  KALDI_LOG << "batched scoring: " << this->opts.minibatch_size << " chunks of " << this->opts.frames_per_chunk
+            << " frames, context " << nnet_left_context << "/" << nnet_right_context;
+#endif
+  thread = std::thread(&NNet3BatchScheduler::run, this);
+}
+
+NNet3BatchScheduler::~NNet3BatchScheduler()
+{
+  {
+    std::lock_guard<std::mutex> lock(mutex);
+    stopping = true;
+  }
+  submitted.notify_one();
+  thread.join();
+  delete computer;
+}
+
+void NNet3BatchScheduler::compute(OnlineFeatureInterface *input, OnlineFeatureInterface *ivector,
+                                  int32 first_frame, int32 num_chunks, Matrix<BaseFloat> *loglikes)
+{
+  int32 f = opts.frame_subsampling_factor;
+  int32 frames_per_chunk = opts.frames_per_chunk, output_frames_per_chunk = frames_per_chunk / f;
+  int32 num_ready = input->NumFramesReady();
+  KALDI_ASSERT(num_ready > 0 && first_frame % f == 0);
+
+  std::vector<nnet3::NnetInferenceTask> tasks(num_chunks);
+  for (int32 c = 0; c < num_chunks; c++)
+  {
+    nnet3::NnetInferenceTask &task = tasks[c];
+    int32 begin_output_t = first_frame + c * frames_per_chunk;
+    int32 begin_input_t = begin_output_t - nnet_left_context,
+          end_input_t = begin_output_t + (output_frames_per_chunk - 1) * f + 1 + nnet_right_context;
+
+    Matrix<BaseFloat> task_input(end_input_t - begin_input_t, input->Dim(), kUndefined);
+    for (int32 t = begin_input_t; t < end_input_t; t++)
+    {
+      SubVector<BaseFloat> row(task_input, t - begin_input_t);
+      input->GetFrame(std::max(0, std::min(t, num_ready - 1)), &row);
+    }
+    task.input.Swap(&task_input);
+
+    if (ivector)
+    {
+      // the i-vector of the last frame of the chunk, as online decoding would
+      Vector<BaseFloat> task_ivector(ivector->Dim(), kUndefined);
+      int32 ivector_t = std::min(begin_output_t + frames_per_chunk, ivector->NumFramesReady()) - 1;
+      ivector->GetFrame(std::max(0, ivector_t), &task_ivector);
+      task.ivector.Swap(&task_ivector);
+    }
+
+    task.first_input_t = -nnet_left_context;
+    task.output_t_stride = f;
+    task.num_output_frames = output_frames_per_chunk;
+    task.num_initial_unused_output_frames = 0;
+    task.num_used_output_frames = output_frames_per_chunk;
+    task.is_irregular = false;
+    task.is_edge = false;
+    task.priority = 0.0;
+    task.output_to_cpu = true;
+  }
+
+  for (int32 c = 0; c < num_chunks; c++) computer->AcceptTask(&tasks[c]);
+  {
+    std::lock_guard<std::mutex> lock(mutex);
+    num_submitted += num_chunks;
+  }
+  submitted.notify_one();
+
+  for (int32 c = 0; c < num_chunks; c++) tasks[c].semaphore.Wait();
+
+  loglikes->Resize(num_chunks * output_frames_per_chunk, tasks[0].output_cpu.NumCols(), kUndefined);
+  for (int32 c = 0; c < num_chunks; c++)
+  {
+    loglikes->RowRange(c * output_frames_per_chunk, output_frames_per_chunk).CopyFromMat(tasks[c].output_cpu);
+  }
+}
+
+void NNet3BatchScheduler::run(void)
+{
+  std::unique_lock<std::mutex> lock(mutex);
+  while (!stopping)
+  {
+    if (num_submitted == 0)
+    {
+      submitted.wait(lock);
+      continue;
+    }
+    num_submitted = 0;
+    lock.unlock();
+
+    // Full minibatches right away. The other streams get one tick to submit
+    // their chunks, after which partial minibatches are computed as well.
+    while (computer->Compute(false))
+    {
+    }
+    std::this_thread::sleep_for(tick);
+    while (computer->Compute(true))
+    {
+    }
+
+    lock.lock();
+  }
+}
+
+}  // namespace kaldi
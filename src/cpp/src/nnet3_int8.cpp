@@ -0,0 +1,332 @@
+// nnet3_int8.cpp
+
+// See ../../COPYING for clarification regarding multiple authors
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//  http://www.apache.org/licenses/LICENSE-2.0
+//
+// THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+// WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+// MERCHANTABLITY OR NON-INFRINGEMENT.
+// See the Apache 2 License for the specific language governing permissions and
+// limitations under the License.
+//
+
+#include "nnet3_int8.h"
+
+#include <cmath>
+
+#include "nnet3/nnet-simple-component.h"
+
+#define VERBOSE 0
+
+namespace kaldi
+{
+std::unique_ptr<Int8InputRows> Int8InputBuffers::acquire(void)
+{
+  std::lock_guard<std::mutex> lock(mutex);
+  if (buffers.empty()) return std::unique_ptr<Int8InputRows>(new Int8InputRows());
+  std::unique_ptr<Int8InputRows> buffer = std::move(buffers.back());
+  buffers.pop_back();
+  return buffer;
+}
+
+void Int8InputBuffers::release(std::unique_ptr<Int8InputRows> buffer)
+{
+  std::lock_guard<std::mutex> lock(mutex);
+  buffers.push_back(std::move(buffer));
+}
+
+/*
+ * Int8AffineComponent
+ */
+
+Int8AffineComponent::Int8AffineComponent(const MatrixBase<BaseFloat> &linear_params,
+                                         const VectorBase<BaseFloat> &bias_params)
+{
+  KALDI_ASSERT(bias_params.Dim() == 0 || bias_params.Dim() == linear_params.NumRows());
+  weights.quantize(linear_params.Data(), linear_params.NumRows(), linear_params.NumCols(), linear_params.Stride());
+  bias.Resize(linear_params.NumRows());
+  if (bias_params.Dim() != 0) bias.CopyFromVec(bias_params);
+}
+
+void Int8AffineComponent::InitFromConfig(nnet3::ConfigLine *cfl)
+{
+  KALDI_ERR << "Int8AffineComponent is made from a trained component, see QuantizeNnetInt8";
+}
+
+std::string Int8AffineComponent::Info() const
+{
+  BaseFloat max_scale = 0.0;
+  for (int32 r = 0; r < weights.NumRows(); r++) max_scale = std::max(max_scale, weights.scale(r));
+  std::ostringstream stream;
+  stream << Type() << ", input-dim=" << InputDim() << ", output-dim=" << OutputDim() << ", row-scale-max=" << max_scale
+         << ", bias-rms=" << std::sqrt(VecVec(bias, bias) / OutputDim());
+  return stream.str();
+}
+
+void *Int8AffineComponent::Propagate(const nnet3::ComponentPrecomputedIndexes *indexes,
+                                     const CuMatrixBase<BaseFloat> &in, CuMatrixBase<BaseFloat> *out) const
+{
+  // decoding runs on the CPU, where the data of CuMatrix is a plain matrix
+  const MatrixBase<BaseFloat> &input = in.Mat();
+  MatrixBase<BaseFloat> &output = out->Mat();
+
+  std::unique_ptr<Int8InputRows> quantized = inputs.acquire();
+  quantized->quantize(input.Data(), input.NumRows(), input.NumCols(), input.Stride());
+  output.CopyRowsFromVec(bias);
+  Int8Gemm(*quantized, 0, 1, input.NumRows(), weights, output.Data(), output.Stride());
+  inputs.release(std::move(quantized));
+  return NULL;
+}
+
+void Int8AffineComponent::Backprop(const std::string &debug_info,
+                                   const nnet3::ComponentPrecomputedIndexes *indexes,
+                                   const CuMatrixBase<BaseFloat> &in_value, const CuMatrixBase<BaseFloat> &out_value,
+                                   const CuMatrixBase<BaseFloat> &out_deriv, void *memo, nnet3::Component *to_update,
+                                   CuMatrixBase<BaseFloat> *in_deriv) const
+{
+  KALDI_ERR << "Int8AffineComponent is for inference only, " << debug_info;
+}
+
+void Int8AffineComponent::Read(std::istream &is, bool binary)
+{
+  // the quantized weights are stored as floats, which hold them exactly
+  Matrix<BaseFloat> quantized;
+  Vector<BaseFloat> row_scales;
+  ExpectOneOrTwoTokens(is, binary, "<Int8AffineComponent>", "<Weights>");
+  quantized.Read(is, binary);
+  ExpectToken(is, binary, "<RowScales>");
+  row_scales.Read(is, binary);
+  ExpectToken(is, binary, "<Bias>");
+  bias.Read(is, binary);
+  ExpectToken(is, binary, "</Int8AffineComponent>");
+
+  std::vector<int8> values(static_cast<size_t>(quantized.NumRows()) * quantized.NumCols());
+  for (int32 r = 0; r < quantized.NumRows(); r++)
+  {
+    for (int32 c = 0; c < quantized.NumCols(); c++)
+      values[static_cast<size_t>(r) * quantized.NumCols() + c] = static_cast<int8>(quantized(r, c));
+  }
+  weights.assign(values.data(), row_scales.Data(), quantized.NumRows(), quantized.NumCols());
+}
+
+void Int8AffineComponent::Write(std::ostream &os, bool binary) const
+{
+  Matrix<BaseFloat> quantized(OutputDim(), InputDim());
+  Vector<BaseFloat> row_scales(OutputDim());
+  for (int32 r = 0; r < OutputDim(); r++)
+  {
+    for (int32 c = 0; c < InputDim(); c++) quantized(r, c) = weights.value(r, c);
+    row_scales(r) = weights.scale(r);
+  }
+  WriteToken(os, binary, "<Int8AffineComponent>");
+  WriteToken(os, binary, "<Weights>");
+  quantized.Write(os, binary);
+  WriteToken(os, binary, "<RowScales>");
+  row_scales.Write(os, binary);
+  WriteToken(os, binary, "<Bias>");
+  bias.Write(os, binary);
+  WriteToken(os, binary, "</Int8AffineComponent>");
+}
+
+BaseFloat Int8AffineComponent::relative_error(const MatrixBase<BaseFloat> &linear_params) const
+{
+  BaseFloat max_abs = linear_params.LargestAbsElem();
+  if (max_abs == 0.0) return 0.0;
+  return weights.max_error(linear_params.Data(), linear_params.Stride()) / max_abs;
+}
+
+/*
+ * Int8TdnnComponent
+ */
+
+Int8TdnnComponent::Int8TdnnComponent(const nnet3::TdnnComponent &tdnn)
+    : nnet3::TdnnComponent(tdnn), input_dim(tdnn.InputDim()), output_dim(tdnn.OutputDim())
+{
+  // the columns of the linear parameters are the input at one time offset
+  // after the other
+  const MatrixBase<BaseFloat> &linear_params = LinearParams().Mat();
+  int32 num_offsets = linear_params.NumCols() / input_dim;
+  parts.resize(num_offsets);
+  for (int32 i = 0; i < num_offsets; i++)
+  {
+    parts[i].quantize(linear_params.Data() + i * input_dim, output_dim, input_dim, linear_params.Stride());
+  }
+  // the bias stays in the base too, as its properties depend on it
+  if (BiasParams().Dim() != 0) bias = Vector<BaseFloat>(BiasParams());
+
+  // the copy of the float weights in the base is not used any more. The base
+  // hands it out as a CuMatrixBase, which it is a CuMatrix of
+  static_cast<CuMatrix<BaseFloat> &>(LinearParams()).Resize(0, 0);
+}
+
+void Int8TdnnComponent::InitFromConfig(nnet3::ConfigLine *cfl)
+{
+  KALDI_ERR << "Int8TdnnComponent is made from a trained component, see QuantizeNnetInt8";
+}
+
+std::string Int8TdnnComponent::Info() const
+{
+  std::ostringstream stream;
+  stream << Type() << ", input-dim=" << InputDim() << ", output-dim=" << OutputDim()
+         << ", num-time-offsets=" << parts.size() << ", use-bias=" << (bias.Dim() != 0 ? "true" : "false");
+  return stream.str();
+}
+
+void *Int8TdnnComponent::Propagate(const nnet3::ComponentPrecomputedIndexes *indexes_in,
+                                   const CuMatrixBase<BaseFloat> &in, CuMatrixBase<BaseFloat> *out) const
+{
+  const PrecomputedIndexes *indexes = dynamic_cast<const PrecomputedIndexes *>(indexes_in);
+  KALDI_ASSERT(indexes != NULL && indexes->row_offsets.size() == parts.size());
+  const MatrixBase<BaseFloat> &input = in.Mat();
+  MatrixBase<BaseFloat> &output = out->Mat();
+  int32 num_rows = output.NumRows(), row_stride = indexes->row_stride;
+
+  // as in TdnnComponent, the output is set to the bias, or added to without
+  // one (the kPropagateAdds property)
+  if (bias.Dim() != 0) output.CopyRowsFromVec(bias);
+
+  // every input row is quantized once, for all the time offsets it is at
+  std::unique_ptr<Int8InputRows> quantized = inputs.acquire();
+  quantized->quantize(input.Data(), input.NumRows(), input.NumCols(), input.Stride());
+  for (size_t i = 0; i < parts.size(); i++)
+  {
+    // the input of time offset i is every row_stride-th row from its offset
+    int32 row_offset = indexes->row_offsets[i];
+    KALDI_ASSERT(row_offset >= 0 && row_stride >= 1 && input.NumRows() > row_offset + row_stride * (num_rows - 1));
+    Int8Gemm(*quantized, row_offset, row_stride, num_rows, parts[i], output.Data(), output.Stride());
+  }
+  inputs.release(std::move(quantized));
+  return NULL;
+}
+
+void Int8TdnnComponent::Backprop(const std::string &debug_info, const nnet3::ComponentPrecomputedIndexes *indexes,
+                                 const CuMatrixBase<BaseFloat> &in_value, const CuMatrixBase<BaseFloat> &out_value,
+                                 const CuMatrixBase<BaseFloat> &out_deriv, void *memo, nnet3::Component *to_update,
+                                 CuMatrixBase<BaseFloat> *in_deriv) const
+{
+  KALDI_ERR << "Int8TdnnComponent is for inference only, " << debug_info;
+}
+
+void Int8TdnnComponent::Read(std::istream &is, bool binary)
+{
+  KALDI_ERR << "Int8TdnnComponent is not read from models, quantize the float model after loading it";
+}
+
+void Int8TdnnComponent::Write(std::ostream &os, bool binary) const
+{
+  KALDI_ERR << "Int8TdnnComponent is not written to models, write the float model instead";
+}
+
+BaseFloat Int8TdnnComponent::relative_error(const MatrixBase<BaseFloat> &linear_params) const
+{
+  BaseFloat max_abs = linear_params.LargestAbsElem(), max_error = 0.0;
+  if (max_abs == 0.0) return 0.0;
+  for (size_t i = 0; i < parts.size(); i++)
+  {
+    max_error = std::max(max_error, parts[i].max_error(linear_params.Data() + i * InputDim(), linear_params.Stride()));
+  }
+  return max_error / max_abs;
+}
+
+/*
+ * QuantizeNnetInt8
+ */
+
+// weights of component an int8 component replaces, or 0 if none does
+static int64 num_quantized_params(nnet3::Component *component)
+{
+  // NaturalGradientAffineComponent derives from AffineComponent
+  if (nnet3::AffineComponent *affine = dynamic_cast<nnet3::AffineComponent *>(component))
+    return affine->LinearParams().NumRows() * static_cast<int64>(affine->LinearParams().NumCols());
+  if (nnet3::FixedAffineComponent *fixed = dynamic_cast<nnet3::FixedAffineComponent *>(component))
+    return fixed->LinearParams().NumRows() * static_cast<int64>(fixed->LinearParams().NumCols());
+  if (nnet3::LinearComponent *linear = dynamic_cast<nnet3::LinearComponent *>(component))
+    return linear->Params().NumRows() * static_cast<int64>(linear->Params().NumCols());
+  if (nnet3::TdnnComponent *tdnn = dynamic_cast<nnet3::TdnnComponent *>(component))
+    return tdnn->LinearParams().NumRows() * static_cast<int64>(tdnn->LinearParams().NumCols());
+  return 0;
+}
+
+// int8 replacement of a component num_quantized_params counts, with the
+// relative error of its weights
+static nnet3::Component *quantize_component(nnet3::Component *component, BaseFloat *relative_error)
+{
+  if (nnet3::AffineComponent *affine = dynamic_cast<nnet3::AffineComponent *>(component))
+  {
+    Matrix<BaseFloat> linear_params(affine->LinearParams());
+    Int8AffineComponent *quantized = new Int8AffineComponent(linear_params, Vector<BaseFloat>(affine->BiasParams()));
+    *relative_error = quantized->relative_error(linear_params);
+    return quantized;
+  }
+  if (nnet3::FixedAffineComponent *fixed = dynamic_cast<nnet3::FixedAffineComponent *>(component))
+  {
+    Matrix<BaseFloat> linear_params(fixed->LinearParams());
+    Int8AffineComponent *quantized = new Int8AffineComponent(linear_params, Vector<BaseFloat>(fixed->BiasParams()));
+    *relative_error = quantized->relative_error(linear_params);
+    return quantized;
+  }
+  if (nnet3::LinearComponent *linear = dynamic_cast<nnet3::LinearComponent *>(component))
+  {
+    Matrix<BaseFloat> linear_params(linear->Params());
+    Int8AffineComponent *quantized = new Int8AffineComponent(linear_params, Vector<BaseFloat>());
+    *relative_error = quantized->relative_error(linear_params);
+    return quantized;
+  }
+  nnet3::TdnnComponent &tdnn = dynamic_cast<nnet3::TdnnComponent &>(*component);
+  Int8TdnnComponent *quantized = new Int8TdnnComponent(tdnn);
+  *relative_error = quantized->relative_error(tdnn.LinearParams().Mat());
+  return quantized;
+}
+
+Int8QuantizationStats QuantizeNnetInt8(nnet3::Nnet *nnet)
+{
+  Int8QuantizationStats stats;
+  std::vector<int32> quantizable;
+  for (int32 c = 0; c < nnet->NumComponents(); c++)
+  {
+    nnet3::Component *component = nnet->GetComponent(c);
+    int64 num_params = num_quantized_params(component);
+    if (num_params != 0)
+    {
+      quantizable.push_back(c);
+      stats.num_params += num_params;
+    }
+    else if (component->Properties() & nnet3::kUpdatableComponent)
+    {
+      stats.num_skipped++;
+      stats.num_skipped_params += dynamic_cast<nnet3::UpdatableComponent *>(component)->NumParameters();
+#if VERBOSE
+      KALDI_LOG << "left in float: " << nnet->GetComponentName(c) << ": " << component->Info();
+#endif
+    }
+  }
+  if (stats.num_skipped_params > stats.num_params)
+  {
+    KALDI_ERR << "Only " << stats.num_params << " of the " << stats.num_params + stats.num_skipped_params
+              << " parameters of the model are in affine, linear or TDNN components, which can be quantized to "
+              << "int8. " << stats.num_skipped << " components would run in float";
+  }
+
+  for (size_t i = 0; i < quantizable.size(); i++)
+  {
+    int32 c = quantizable[i];
+    BaseFloat relative_error;
+    nnet3::Component *quantized = quantize_component(nnet->GetComponent(c), &relative_error);
+    stats.max_relative_error = std::max(stats.max_relative_error, relative_error);
+    stats.num_components++;
+#if VERBOSE
+    KALDI_LOG << "quantized " << nnet->GetComponentName(c) << ": " << quantized->Info();
+#endif
+    // takes ownership, and deletes the float component
+    nnet->SetComponent(c, quantized);
+  }
+  return stats;
+}
+
+}  // namespace kaldi
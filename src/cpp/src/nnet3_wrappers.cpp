@@ -24,10 +24,14 @@
 
 #include "nnet3_wrappers.h"
 
+#include "lat/determinize-lattice-pruned.h"
 #include "lat/lattice-functions.h"
+#include "lat/sausages.h"
 #include "lat/word-align-lattice-lexicon.h"
 #include "nnet3/nnet-utils.h"
 
+#include <thread>
+
 #define VERBOSE 0
 
 namespace kaldi
@@ -37,13 +41,21 @@ namespace kaldi
  */
 
 NNet3OnlineDecoderWrapper::NNet3OnlineDecoderWrapper(NNet3OnlineModelWrapper *aModel)
-    : model(aModel)
+    : model(aModel), graph_name(NNet3OnlineModelWrapper::default_graph),
+      search_config(aModel->lattice_faster_decoder_config)
 {
   decoder = NULL;
+  batch_search = NULL;
+  batch_decodable = NULL;
+  batch_input_frames = 0;
   silence_weighting = NULL;
   feature_pipeline = NULL;
   adaptation_state = NULL;
-  decodable_info = NULL;
+  carry_adaptation_state = false;
+  lazy_lattice = false;
+  finished_decoder = NULL;
+  finished_feature_pipeline = NULL;
+  finished_batch_search = NULL;
 
   tot_frames = 0;
   tot_frames_decoded = 0;
@@ -53,66 +65,121 @@ NNet3OnlineDecoderWrapper::NNet3OnlineDecoderWrapper(NNet3OnlineModelWrapper *aM
 #endif
   adaptation_state =
       new OnlineIvectorExtractorAdaptationState(model->feature_info->ivector_extractor_info);
-
-#if VERBOSE
-  KALDI_LOG << "alloc: OnlineSilenceWeighting";
-#endif
-  silence_weighting =
-      new OnlineSilenceWeighting(model->trans_model, model->feature_info->silence_weighting_config,
-                                 model->decodable_opts.frame_subsampling_factor);
-
-#if VERBOSE
-  KALDI_LOG << "alloc: nnet3::DecodableNnetSimpleLoopedInfo";
-#endif
-  decodable_info = new nnet3::DecodableNnetSimpleLoopedInfo(model->decodable_opts, &model->am_nnet);
 }
 
 NNet3OnlineDecoderWrapper::~NNet3OnlineDecoderWrapper()
 {
   free_decoder();
-  if (silence_weighting)
-  {
-    delete silence_weighting;
-    silence_weighting = NULL;
-  }
+  free_finished_search();
   if (adaptation_state)
   {
     delete adaptation_state;
     adaptation_state = NULL;
   }
-  if (decodable_info)
-  {
-    delete decodable_info;
-    decodable_info = NULL;
-  }
 }
 
 void NNet3OnlineDecoderWrapper::start_decoding(void)
 {
 #if VERBOSE
   KALDI_LOG << "start_decoding...";
-  KALDI_LOG << "max_active  :" << model->lattice_faster_decoder_config.max_active;
-  KALDI_LOG << "min_active  :" << model->lattice_faster_decoder_config.min_active;
-  KALDI_LOG << "beam        :" << model->lattice_faster_decoder_config.beam;
-  KALDI_LOG << "lattice_beam:" << model->lattice_faster_decoder_config.lattice_beam;
+  KALDI_LOG << "max_active  :" << search_config.max_active;
+  KALDI_LOG << "min_active  :" << search_config.min_active;
+  KALDI_LOG << "beam        :" << search_config.beam;
+  KALDI_LOG << "lattice_beam:" << search_config.lattice_beam;
 #endif
   free_decoder();
+  free_finished_search();
+  // the result of the last utterance is only reported until the next starts
+  best_path_clat = CompactLattice();
+  final_clat = CompactLattice();
+  // the graph is fixed for the duration of the utterance
+  graph = model->graphs->get(graph_name);
 #if VERBOSE
   KALDI_LOG << "alloc: OnlineNnet2FeaturePipeline";
 #endif
   feature_pipeline = new OnlineNnet2FeaturePipeline(*model->feature_info);
   feature_pipeline->SetAdaptationState(*adaptation_state);
+  // the weighting keeps state for every frame of the utterance, so it starts
+  // afresh with each one
+#if VERBOSE
+  KALDI_LOG << "alloc: OnlineSilenceWeighting";
+#endif
+  silence_weighting = new OnlineSilenceWeighting(model->trans_model, model->feature_info->silence_weighting_config,
+                                                 model->decodable_opts.frame_subsampling_factor);
+  if (model->batch_scheduler)
+  {
+    // the acoustic scores come from the batch scheduler of the model
+#if VERBOSE
+    KALDI_LOG << "alloc: LatticeFasterOnlineDecoder";
+#endif
+    batch_search = new LatticeFasterOnlineDecoder(*graph->decode_fst, search_config);
+    batch_search->InitDecoding();
+    batch_decodable = new DecodableMatrixMappedOffset(model->trans_model);
+    batch_input_frames = 0;
+  }
+  else
+  {
 #if VERBOSE
-  KALDI_LOG << "alloc: SingleUtteranceNnet3Decoder";
+    KALDI_LOG << "alloc: SingleUtteranceNnet3Decoder";
 #endif
-  decoder =
-      new SingleUtteranceNnet3Decoder(model->lattice_faster_decoder_config, model->trans_model,
-                                      *decodable_info, *model->decode_fst, feature_pipeline);
+    decoder = new SingleUtteranceNnet3Decoder(search_config, model->trans_model, *model->decodable_info,
+                                              *graph->decode_fst, feature_pipeline);
+  }
 #if VERBOSE
   KALDI_LOG << "start_decoding...done";
 #endif
 }
 
+void NNet3OnlineDecoderWrapper::reset(void)
+{
+  // drop the current utterance without finalizing it, and the result of the
+  // one before
+  free_decoder();
+  free_finished_search();
+  best_path_clat = CompactLattice();
+  final_clat = CompactLattice();
+  tot_frames = 0;
+}
+
+std::string NNet3OnlineDecoderWrapper::get_adaptation_state(void)
+{
+  OnlineIvectorExtractorAdaptationState state(*adaptation_state);
+  if (feature_pipeline) feature_pipeline->GetAdaptationState(&state);
+
+  std::ostringstream os;
+  InitKaldiOutputStream(os, true);
+  state.Write(os, true);
+  return os.str();
+}
+
+void NNet3OnlineDecoderWrapper::set_adaptation_state(const std::string &state)
+{
+  std::istringstream is(state);
+  bool binary;
+  if (!InitKaldiInputStream(is, &binary)) KALDI_ERR << "Could not read adaptation state";
+
+  OnlineIvectorExtractorAdaptationState *new_state =
+      new OnlineIvectorExtractorAdaptationState(model->feature_info->ivector_extractor_info);
+  new_state->Read(is, binary);
+  if (new_state->ivector_stats.IvectorDim() != model->feature_info->ivector_extractor_info.extractor.IvectorDim())
+  {
+    delete new_state;
+    KALDI_ERR << "Adaptation state does not match the i-vector extractor of the model";
+  }
+
+  // takes effect from the next utterance on
+  delete adaptation_state;
+  adaptation_state = new_state;
+  carry_adaptation_state = true;
+}
+
+void NNet3OnlineDecoderWrapper::reset_adaptation_state(bool carry)
+{
+  delete adaptation_state;
+  adaptation_state = new OnlineIvectorExtractorAdaptationState(model->feature_info->ivector_extractor_info);
+  carry_adaptation_state = carry;
+}
+
 void NNet3OnlineDecoderWrapper::free_decoder(void)
 {
   if (decoder)
@@ -123,6 +190,18 @@ void NNet3OnlineDecoderWrapper::free_decoder(void)
     delete decoder;
     decoder = NULL;
   }
+  if (batch_search)
+  {
+    delete batch_search;
+    batch_search = NULL;
+    delete batch_decodable;
+    batch_decodable = NULL;
+  }
+  if (silence_weighting)
+  {
+    delete silence_weighting;
+    silence_weighting = NULL;
+  }
   if (feature_pipeline)
   {
     delete feature_pipeline;
@@ -139,44 +218,73 @@ void NNet3OnlineDecoderWrapper::get_decoded_string(std::string &decoded_string,
 
   decoded_string = "";
 
-  if (decoder)
+  if (feature_pipeline)
   {
     // decoding is not finished yet, so we will look up the best partial result so far
+    const LatticeFasterOnlineDecoder &search = decoder ? decoder->Decoder() : *batch_search;
 
-    if (decoder->NumFramesDecoded() == 0)
+    if (search.NumFramesDecoded() == 0)
     {
       likelihood = 0.0;
       return;
     }
 
-    decoder->GetBestPath(false, &best_path_lat);
+    search.GetBestPath(&best_path_lat, false);
   }
-  else
+  else if (graph)
   {
     ConvertLattice(best_path_clat, &best_path_lat);
   }
+  else
+  {
+    likelihood = 0.0;
+    return;
+  }
 
   std::vector<int32> words;
   std::vector<int32> alignment;
   LatticeWeight weight;
-  int32 num_frames;
   GetLinearSymbolSequence(best_path_lat, &alignment, &words, &weight);
-  num_frames = alignment.size();
-  likelihood = -(weight.Value1() + weight.Value2()) / num_frames;
+  if (alignment.empty())
+  {
+    // no result, e.g. after a reset or a failed utterance
+    likelihood = 0.0;
+    return;
+  }
+  likelihood = -(weight.Value1() + weight.Value2()) / alignment.size();
 
   for (size_t i = 0; i < words.size(); i++)
   {
-    std::string s = model->word_syms->Find(words[i]);
+    std::string s = graph->word_syms->Find(words[i]);
     if (s == "") KALDI_ERR << "Word-id " << words[i] << " not in symbol table.";
     decoded_string += s + ' ';
   }
 }
 
-bool NNet3OnlineDecoderWrapper::get_word_alignment(std::vector<string> &words,
-                                                   std::vector<int32> &times,
-                                                   std::vector<int32> &lengths)
+void NNet3OnlineDecoderWrapper::lookup_words(const std::vector<int32> &word_idxs, std::vector<string> &words)
+{
+  words.clear();
+  for (size_t i = 0; i < word_idxs.size(); i++)
+  {
+    std::string s = graph->word_syms->Find(word_idxs[i]);
+    if (s == "")
+    {
+      KALDI_ERR << "Word-id " << word_idxs[i] << " not in symbol table.";
+    }
+    words.push_back(s);
+  }
+}
+
+bool NNet3OnlineDecoderWrapper::align_words(std::vector<int32> &word_idxs, std::vector<int32> &times,
+                                            std::vector<int32> &lengths)
 {
-  WordAlignLatticeLexiconInfo lexicon_info(model->word_alignment_lexicon);
+  if (!graph)
+  {
+    KALDI_WARN << "Nothing decoded yet";
+    return false;
+  }
+
+  WordAlignLatticeLexiconInfo lexicon_info(graph->word_alignment_lexicon);
 
 #if VERBOSE
   KALDI_LOG << "word alignment starts...";
@@ -184,55 +292,90 @@ bool NNet3OnlineDecoderWrapper::get_word_alignment(std::vector<string> &words,
   CompactLattice aligned_clat;
   WordAlignLatticeLexiconOpts opts;
 
-  bool ok = WordAlignLatticeLexicon(best_path_clat, model->trans_model, lexicon_info, opts,
-                                    &aligned_clat);
+  bool ok = WordAlignLatticeLexicon(best_path_clat, model->trans_model, lexicon_info, opts, &aligned_clat);
 
   if (!ok)
   {
     KALDI_WARN << "Lattice did not align correctly";
     return false;
   }
-  else
+  if (aligned_clat.Start() == fst::kNoStateId)
   {
-    if (aligned_clat.Start() == fst::kNoStateId)
-    {
-      KALDI_WARN << "Lattice was empty";
-      return false;
-    }
-    else
-    {
+    KALDI_WARN << "Lattice was empty";
+    return false;
+  }
 #if VERBOSE
-      KALDI_LOG << "Aligned lattice.";
+  KALDI_LOG << "Aligned lattice.";
 #endif
-      TopSortCompactLatticeIfNeeded(&aligned_clat);
+  TopSortCompactLatticeIfNeeded(&aligned_clat);
 
-      // lattice-1best
+  // lattice-1best
 
-      CompactLattice best_path_aligned;
-      CompactLatticeShortestPath(aligned_clat, &best_path_aligned);
+  CompactLattice best_path_aligned;
+  CompactLatticeShortestPath(aligned_clat, &best_path_aligned);
 
-      // nbest-to-ctm
+  // nbest-to-ctm
 
-      std::vector<int32> word_idxs;
-      if (!CompactLatticeToWordAlignment(best_path_aligned, &word_idxs, &times, &lengths))
-      {
-        KALDI_WARN << "CompactLatticeToWordAlignment failed.";
-        return false;
-      }
+  if (!CompactLatticeToWordAlignment(best_path_aligned, &word_idxs, &times, &lengths))
+  {
+    KALDI_WARN << "CompactLatticeToWordAlignment failed.";
+    return false;
+  }
+  return true;
+}
 
-      // lexicon lookup
-      words.clear();
-      for (size_t i = 0; i < word_idxs.size(); i++)
-      {
-        std::string s = model->word_syms->Find(word_idxs[i]);
-        if (s == "")
-        {
-          KALDI_ERR << "Word-id " << word_idxs[i] << " not in symbol table.";
-        }
-        words.push_back(s);
-      }
-    }
+bool NNet3OnlineDecoderWrapper::get_word_alignment(std::vector<string> &words,
+                                                   std::vector<int32> &times,
+                                                   std::vector<int32> &lengths)
+{
+  std::vector<int32> word_idxs;
+  if (!align_words(word_idxs, times, lengths)) return false;
+
+  lookup_words(word_idxs, words);
+  return true;
+}
+
+bool NNet3OnlineDecoderWrapper::get_word_confidences(std::vector<string> &words,
+                                                    std::vector<int32> &times,
+                                                    std::vector<int32> &lengths,
+                                                    std::vector<BaseFloat> &confidences)
+{
+  // with a lazy lattice, it is generated now
+  build_lattice();
+  if (final_clat.Start() == fst::kNoStateId)
+  {
+    KALDI_WARN << "No final lattice to compute confidences from";
+    return false;
   }
+
+  std::vector<int32> aligned_word_idxs, aligned_times, aligned_lengths;
+  if (!align_words(aligned_word_idxs, aligned_times, aligned_lengths)) return false;
+
+  // Confidences are computed for the words of the best path (not the MBR
+  // hypothesis), so silences and other epsilons are left out
+  std::vector<int32> word_idxs;
+  std::vector<std::pair<BaseFloat, BaseFloat> > mbr_times;
+  times.clear();
+  lengths.clear();
+  for (size_t i = 0; i < aligned_word_idxs.size(); i++)
+  {
+    if (aligned_word_idxs[i] == 0) continue;
+    word_idxs.push_back(aligned_word_idxs[i]);
+    times.push_back(aligned_times[i]);
+    lengths.push_back(aligned_lengths[i]);
+    mbr_times.push_back(std::make_pair(static_cast<BaseFloat>(aligned_times[i]),
+                                       static_cast<BaseFloat>(aligned_times[i] + aligned_lengths[i])));
+  }
+
+#if VERBOSE
+  KALDI_LOG << "lattice posteriors...";
+#endif
+  MinimumBayesRiskOptions mbr_opts;
+  mbr_opts.decode_mbr = false;
+  MinimumBayesRisk mbr(final_clat, word_idxs, mbr_times, mbr_opts);
+  confidences = mbr.GetOneBestConfidences();
+
+  lookup_words(word_idxs, words);
   return true;
 }
 
@@ -241,7 +384,7 @@ bool NNet3OnlineDecoderWrapper::decode(BaseFloat samp_freq, int32 num_frames, Ba
 {
   using fst::VectorFst;
 
-  if (!decoder)
+  if (!feature_pipeline)
   {
     start_decoding();
   }
@@ -252,10 +395,12 @@ bool NNet3OnlineDecoderWrapper::decode(BaseFloat samp_freq, int32 num_frames, Ba
     wave_part(i) = frames[i];
   }
   tot_frames += num_frames;
+  stats.samples_received += num_frames;
 
 #if VERBOSE
   KALDI_LOG << "AcceptWaveform...";
 #endif
+  Timer timer;
   feature_pipeline->AcceptWaveform(samp_freq, wave_part);
 
   if (finalize)
@@ -263,121 +408,1150 @@ bool NNet3OnlineDecoderWrapper::decode(BaseFloat samp_freq, int32 num_frames, Ba
     // no more input. flush out last frames
     feature_pipeline->InputFinished();
   }
+  stats.accept_waveform_seconds += timer.Elapsed();
 
   if (silence_weighting->Active() && feature_pipeline->IvectorFeature() != NULL)
   {
-    silence_weighting->ComputeCurrentTraceback(decoder->Decoder());
+    silence_weighting->ComputeCurrentTraceback(decoder ? decoder->Decoder() : *batch_search);
     silence_weighting->GetDeltaWeights(feature_pipeline->NumFramesReady(), &delta_weights);
     feature_pipeline->IvectorFeature()->UpdateFrameWeights(delta_weights);
   }
 
-  decoder->AdvanceDecoding();
+  timer.Reset();
+  int32 first_frame = current_search().NumFramesDecoded();
+  if (batch_search)
+    advance_batched(finalize);
+  else
+    decoder->AdvanceDecoding();
+  stats.advance_decoding_seconds += timer.Elapsed();
+  add_search_stats(current_search(), first_frame);
 
   if (finalize)
   {
-    decoder->FinalizeDecoding();
-
-    CompactLattice clat;
-    bool end_of_utterance = true;
-    decoder->GetLattice(end_of_utterance, &clat);
+    timer.Reset();
+    if (batch_search)
+      batch_search->FinalizeDecoding();
+    else
+      decoder->FinalizeDecoding();
 
-    if (clat.NumStates() == 0)
+    bool lazy = lazy_lattice && !model->get_rescorer(graph->name);
+    bool ok;
+    if (lazy)
+    {
+      ok = finish_utterance_best_path(current_search());
+    }
+    else
     {
-      KALDI_WARN << "Empty lattice.";
-      return false;
+      CompactLattice clat;
+      if (batch_search)
+      {
+        get_lattice(*batch_search, &clat);
+      }
+      else
+      {
+        bool end_of_utterance = true;
+        decoder->GetLattice(end_of_utterance, &clat);
+      }
+      ok = finish_utterance(clat);
     }
+    stats.finalize_seconds += timer.Elapsed();
+    if (!ok) return false;
 
-    CompactLatticeShortestPath(clat, &best_path_clat);
+    if (carry_adaptation_state)
+    {
+      // adapt the next utterance from where this one ended
+      feature_pipeline->GetAdaptationState(adaptation_state);
+    }
 
     tot_frames_decoded = tot_frames;
     tot_frames = 0;
 
+    if (lazy) keep_finished_search();
     free_decoder();
   }
 
   return true;
 }
 
-/*
- * NNet3OnlineModelWrapper
- */
+void NNet3OnlineDecoderWrapper::advance_batched(bool finalize)
+{
+  // Chunks are scored once all frames of their right context are there, and
+  // at the end of the utterance, the rest with the last frame repeated
+  NNet3BatchScheduler *scheduler = model->batch_scheduler;
+  int32 f = model->decodable_opts.frame_subsampling_factor;
+  int32 frames_per_chunk = scheduler->frames_per_chunk();
+  int32 num_ready = feature_pipeline->NumFramesReady();
 
-// typedef void (*LogHandler)(const LogMessageEnvelope &envelope,
-//                            const char *message);
-static void silent_log_handler(const LogMessageEnvelope &envelope, const char *message)
+  int32 num_chunks;
+  if (finalize)
+    num_chunks = (num_ready - batch_input_frames + frames_per_chunk - 1) / frames_per_chunk;
+  else
+    num_chunks = (num_ready - batch_input_frames + (f - 1) - scheduler->right_context()) / frames_per_chunk;
+
+  if (num_chunks > 0)
+  {
+    Matrix<BaseFloat> loglikes;
+    scheduler->compute(feature_pipeline->InputFeature(), feature_pipeline->IvectorFeature(), batch_input_frames,
+                       num_chunks, &loglikes);
+    batch_input_frames += num_chunks * frames_per_chunk;
+
+    if (finalize)
+    {
+      // drop the output frames of the padding after the last frame
+      int32 num_output_frames = (num_ready + f - 1) / f - batch_decodable->NumFramesReady();
+      loglikes.Resize(num_output_frames, loglikes.NumCols(), kCopyData);
+    }
+    // the frames the search is done with are not kept
+    int32 frames_to_discard = batch_search->NumFramesDecoded() - batch_decodable->FirstAvailableFrame();
+    batch_decodable->AcceptLoglikes(&loglikes, frames_to_discard);
+  }
+
+  if (finalize) batch_decodable->InputIsFinished();
+  batch_search->AdvanceDecoding(batch_decodable);
+}
+
+void NNet3OnlineDecoderWrapper::get_lattice(const LatticeFasterOnlineDecoder &search, CompactLattice *clat)
 {
-  // nothing - this handler simply keeps silent
+  Lattice raw_lat;
+  search.GetRawLattice(&raw_lat, true);
+  DeterminizeLatticePhonePrunedWrapper(model->trans_model, &raw_lat, search_config.lattice_beam, clat,
+                                       search_config.det_opts);
 }
 
-NNet3OnlineModelWrapper::NNet3OnlineModelWrapper(
-    BaseFloat beam, int32 max_active, int32 min_active, BaseFloat lattice_beam,
-    BaseFloat acoustic_scale, int32 frame_subsampling_factor, std::string &word_syms_filename,
-    std::string &model_in_filename, std::string &fst_in_str, std::string &mfcc_config,
-    std::string &ie_conf_filename, std::string &align_lex_filename)
+bool NNet3OnlineDecoderWrapper::finish_utterance(CompactLattice &clat)
+{
+  if (clat.NumStates() == 0)
+  {
+    KALDI_WARN << "Empty lattice.";
+    return false;
+  }
+
+  std::shared_ptr<const LatticeLmRescorer> rescorer = model->get_rescorer(graph->name);
+  if (rescorer && !rescorer->Rescore(&clat))
+  {
+    KALDI_WARN << "LM rescoring failed, using first pass lattice.";
+  }
+
+  CompactLatticeShortestPath(clat, &best_path_clat);
+  final_clat = clat;
+
+  stats.utterances++;
+  stats.set_lattice(final_clat);
+  return true;
+}
+
+bool NNet3OnlineDecoderWrapper::finish_utterance_best_path(const LatticeFasterOnlineDecoder &search)
+{
+  Lattice best_path_lat;
+  bool use_final_probs = true;
+  search.GetBestPath(&best_path_lat, use_final_probs);
+  if (best_path_lat.NumStates() == 0)
+  {
+    KALDI_WARN << "Empty lattice.";
+    return false;
+  }
+
+  ConvertLattice(best_path_lat, &best_path_clat);
+  final_clat = CompactLattice();
+
+  stats.utterances++;
+  return true;
+}
 
+void NNet3OnlineDecoderWrapper::keep_finished_search(void)
 {
-  using namespace kaldi;
-  using namespace fst;
+  // the search refers to the graph, and the decoder to the features
+  free_finished_search();
+  finished_decoder = decoder;
+  finished_feature_pipeline = feature_pipeline;
+  finished_batch_search = batch_search;
+  finished_graph = graph;
+  decoder = NULL;
+  feature_pipeline = NULL;
+  batch_search = NULL;
+  delete batch_decodable;
+  batch_decodable = NULL;
+}
 
-  typedef kaldi::int32 int32;
-  typedef kaldi::int64 int64;
+void NNet3OnlineDecoderWrapper::free_finished_search(void)
+{
+  delete finished_decoder;
+  finished_decoder = NULL;
+  delete finished_feature_pipeline;
+  finished_feature_pipeline = NULL;
+  delete finished_batch_search;
+  finished_batch_search = NULL;
+  finished_graph.reset();
+}
 
-#if VERBOSE
-  KALDI_LOG << "model_in_filename:         " << model_in_filename;
-  KALDI_LOG << "fst_in_str:                " << fst_in_str;
-  KALDI_LOG << "mfcc_config:               " << mfcc_config;
-  KALDI_LOG << "ie_conf_filename:          " << ie_conf_filename;
-  KALDI_LOG << "align_lex_filename:        " << align_lex_filename;
-#else
-  // silence kaldi output as well
-  SetLogHandler(silent_log_handler);
-#endif
+void NNet3OnlineDecoderWrapper::set_lazy_lattice(bool lazy) { lazy_lattice = lazy; }
 
-  feature_config.mfcc_config = mfcc_config;
-  feature_config.ivector_extraction_config = ie_conf_filename;
+bool NNet3OnlineDecoderWrapper::build_lattice(void)
+{
+  if (!finished_decoder && !finished_batch_search) return final_clat.Start() != fst::kNoStateId;
 
-  lattice_faster_decoder_config.max_active = max_active;
-  lattice_faster_decoder_config.min_active = min_active;
-  lattice_faster_decoder_config.beam = beam;
-  lattice_faster_decoder_config.lattice_beam = lattice_beam;
-  decodable_opts.acoustic_scale = acoustic_scale;
-  decodable_opts.frame_subsampling_factor = frame_subsampling_factor;
+  get_lattice(finished_decoder ? finished_decoder->Decoder() : *finished_batch_search, &final_clat);
+  free_finished_search();
+  stats.set_lattice(final_clat);
+  return final_clat.Start() != fst::kNoStateId;
+}
 
-  feature_info = new OnlineNnet2FeaturePipelineInfo(this->feature_config);
+void NNet3OnlineDecoderWrapper::extract_features(BaseFloat samp_freq, int32 num_frames, BaseFloat *frames,
+                                                 Matrix<BaseFloat> &input_feats, Matrix<BaseFloat> &ivector_feats)
+{
+  // A separate pipeline, so an utterance in progress is not disturbed. There
+  // is no traceback to weight the i-vector statistics by, so silence
+  // weighting does not apply to these i-vectors.
+  OnlineNnet2FeaturePipeline pipeline(*model->feature_info);
+  pipeline.SetAdaptationState(*adaptation_state);
+
+  SubVector<BaseFloat> wave(frames, num_frames);
+  pipeline.AcceptWaveform(samp_freq, wave);
+  pipeline.InputFinished();
+
+#if VERBOSE
+  KALDI_LOG << "extracting features...";
+#endif
+  OnlineFeatureInterface *input = pipeline.InputFeature();
+  int32 num_feats = input->NumFramesReady();
+  input_feats.Resize(num_feats, input->Dim(), kUndefined);
+  for (int32 t = 0; t < num_feats; t++)
+  {
+    SubVector<BaseFloat> row(input_feats, t);
+    input->GetFrame(t, &row);
+  }
 
-  // load model...
+  OnlineIvectorFeature *ivector = pipeline.IvectorFeature();
+  if (ivector == NULL)
+  {
+    ivector_feats.Resize(0, 0);
+    return;
+  }
+  int32 num_ivectors = ivector->NumFramesReady();
+  ivector_feats.Resize(num_ivectors, ivector->Dim(), kUndefined);
+  for (int32 t = 0; t < num_ivectors; t++)
   {
-    bool binary;
-    Input ki(model_in_filename, &binary);
-    this->trans_model.Read(ki.Stream(), binary);
-    this->am_nnet.Read(ki.Stream(), binary);
-    SetBatchnormTestMode(true, &(this->am_nnet.GetNnet()));
-    SetDropoutTestMode(true, &(this->am_nnet.GetNnet()));
-    nnet3::CollapseModel(nnet3::CollapseModelConfig(), &(this->am_nnet.GetNnet()));
+    SubVector<BaseFloat> row(ivector_feats, t);
+    ivector->GetFrame(t, &row);
   }
+}
+
+// options of the frames of the front end features, for the samples they
+// cover
+static const FrameExtractionOptions &frame_options(const OnlineNnet2FeaturePipelineInfo &info)
+{
+  if (info.feature_type == "plp") return info.plp_opts.frame_opts;
+  if (info.feature_type == "fbank") return info.fbank_opts.frame_opts;
+  return info.mfcc_opts.frame_opts;
+}
+
+// columns of the pitch features the front end appends to the base features
+static int32 pitch_dim(const OnlineNnet2FeaturePipelineInfo &info)
+{
+  if (!info.add_pitch) return 0;
+  const ProcessPitchOptions &opts = info.pitch_process_opts;
+  return (opts.add_pov_feature ? 1 : 0) + (opts.add_normalized_log_pitch ? 1 : 0) +
+         (opts.add_delta_pitch ? 1 : 0) + (opts.add_raw_log_pitch ? 1 : 0);
+}
 
-  // Input FST is just one FST, not a table of FSTs.
-  decode_fst = fst::ReadFstKaldiGeneric(fst_in_str);
+bool NNet3OnlineDecoderWrapper::decode_features(const MatrixBase<BaseFloat> &input_feats,
+                                                const MatrixBase<BaseFloat> *ivector_feats)
+{
+  // the features are a whole utterance, which would drop the one in progress
+  if (feature_pipeline)
+    KALDI_ERR << "An utterance is being decoded, finalize or reset it before decoding features";
+  if (input_feats.NumCols() != model->am_nnet.InputDim())
+    KALDI_ERR << "Feature dimension " << input_feats.NumCols() << " does not match the model input dimension "
+              << model->am_nnet.InputDim();
+  if (ivector_feats && ivector_feats->NumRows() == 0) ivector_feats = NULL;
+  if ((ivector_feats ? ivector_feats->NumCols() : 0) != model->am_nnet.IvectorDim())
+    KALDI_ERR << "I-vector dimension " << (ivector_feats ? ivector_feats->NumCols() : 0)
+              << " does not match the model i-vector dimension " << model->am_nnet.IvectorDim();
+
+  free_decoder();
+  free_finished_search();
+  best_path_clat = CompactLattice();
+  final_clat = CompactLattice();
+  graph = model->graphs->get(graph_name);
 
-  word_syms = NULL;
-  if (word_syms_filename != "")
-    if (!(word_syms = fst::SymbolTable::ReadText(word_syms_filename)))
-      KALDI_ERR << "Could not read symbol table from file " << word_syms_filename;
+  // the features are used in place, without copying them
+  OnlineMatrixFeature input(input_feats);
+  std::unique_ptr<OnlineMatrixFeature> ivector;
+  if (ivector_feats) ivector.reset(new OnlineMatrixFeature(*ivector_feats));
+
+  nnet3::DecodableAmNnetLoopedOnline decodable(model->trans_model, *model->decodable_info, &input, ivector.get());
+  LatticeFasterOnlineDecoder search(*graph->decode_fst, search_config);
 
 #if VERBOSE
-  KALDI_LOG << "loading word alignment lexicon...";
+  KALDI_LOG << "decoding " << input_feats.NumRows() << " frames of features...";
 #endif
+  Timer timer;
+  search.InitDecoding();
+  search.AdvanceDecoding(&decodable);
+  stats.advance_decoding_seconds += timer.Elapsed();
+  add_search_stats(search, 0);
+
+  timer.Reset();
+  search.FinalizeDecoding();
+
+  if (search.NumFramesDecoded() == 0)
   {
-    bool binary_in;
-    Input ki(align_lex_filename, &binary_in);
-    KALDI_ASSERT(!binary_in && "Not expecting binary file for lexicon");
-    if (!ReadLexiconForWordAlign(ki.Stream(), &word_alignment_lexicon))
-    {
-      KALDI_ERR << "Error reading alignment lexicon from " << align_lex_filename;
-    }
+    KALDI_WARN << "No frames decoded.";
+    return false;
+  }
+
+  CompactLattice clat;
+  get_lattice(search, &clat);
+
+  bool ok = finish_utterance(clat);
+  stats.finalize_seconds += timer.Elapsed();
+  if (!ok) return false;
+
+  const OnlineNnet2FeaturePipelineInfo &info = *model->feature_info;
+  if (carry_adaptation_state && info.use_ivectors)
+  {
+    // The i-vectors give no statistics to adapt the next utterance with, so
+    // the extractor runs over the base features once more, without silence
+    // weighting as in extract_features
+    SubMatrix<BaseFloat> base_feats(input_feats, 0, input_feats.NumRows(), 0,
+                                    input_feats.NumCols() - pitch_dim(info));
+    OnlineMatrixFeature base(base_feats);
+    OnlineIvectorFeature extractor(info.ivector_extractor_info, &base);
+    extractor.SetAdaptationState(*adaptation_state);
+    Vector<BaseFloat> last_ivector(extractor.Dim(), kUndefined);
+    extractor.GetFrame(extractor.NumFramesReady() - 1, &last_ivector);
+    extractor.GetAdaptationState(adaptation_state);
+  }
+
+  tot_frames_decoded = static_cast<int64>(input_feats.NumRows()) * frame_options(info).WindowShift();
+  tot_frames = 0;
+  return true;
+}
+
+void NNet3OnlineDecoderWrapper::set_graph(const std::string &name)
+{
+  if (!model->has_graph(name)) KALDI_ERR << "Unknown decoding graph " << name;
+  graph_name = name;
+}
+
+std::string NNet3OnlineDecoderWrapper::get_graph(void) { return graph_name; }
+
+void NNet3OnlineDecoderWrapper::set_search_options(BaseFloat beam, int32 max_active, BaseFloat lattice_beam)
+{
+  if (beam <= 0.0 || max_active <= search_config.min_active || lattice_beam <= 0.0)
+    KALDI_ERR << "Invalid search options: beam " << beam << ", max_active " << max_active << ", lattice_beam "
+              << lattice_beam;
+  search_config.beam = beam;
+  search_config.max_active = max_active;
+  search_config.lattice_beam = lattice_beam;
+
+  // the search of the utterance in progress continues with the new options
+  if (decoder || batch_search)
+    const_cast<LatticeFasterOnlineDecoder &>(current_search()).SetOptions(search_config);
+}
+
+void NNet3OnlineDecoderWrapper::get_search_options(BaseFloat &beam, int32 &max_active, BaseFloat &lattice_beam)
+{
+  beam = search_config.beam;
+  max_active = search_config.max_active;
+  lattice_beam = search_config.lattice_beam;
+}
+
+const LatticeFasterOnlineDecoder &NNet3OnlineDecoderWrapper::current_search(void)
+{
+  return decoder ? decoder->Decoder() : *batch_search;
+}
+
+void NNet3OnlineDecoderWrapper::add_search_stats(const LatticeFasterOnlineDecoder &search, int32 first_frame)
+{
+  int32 num_decoded = search.NumFramesDecoded();
+  int32 max_active = search_config.max_active;
+  for (int32 frame = first_frame; frame < num_decoded; frame++)
+  {
+    stats.add_active_tokens(ActiveTokenCounter<LatticeFasterOnlineDecoder>::count(search, frame), max_active);
+  }
+  stats.frames_decoded += num_decoded - first_frame;
+}
+
+void NNet3OnlineDecoderWrapper::set_endpoint_options(const std::string &options)
+{
+  // options not given keep their values
+  OnlineEndpointConfig config = endpoint_config;
+  ParseOptions po("");
+  config.Register(&po);
+  parse_options(options, "endpoint options", &po);
+  endpoint_config = config;
+}
+
+bool NNet3OnlineDecoderWrapper::endpoint_detected(void)
+{
+  if (decoder) return decoder->EndpointDetected(endpoint_config);
+  if (batch_search)
+  {
+    BaseFloat frame_shift =
+        model->feature_info->FrameShiftInSeconds() * model->decodable_opts.frame_subsampling_factor;
+    return EndpointDetected(endpoint_config, model->trans_model, frame_shift, *batch_search);
+  }
+  return false;
+}
+
+DecoderStats NNet3OnlineDecoderWrapper::get_stats(void)
+{
+  stats.frames_pending = 0;
+  if (feature_pipeline && (decoder || batch_search))
+  {
+    int32 f = model->decodable_opts.frame_subsampling_factor;
+    stats.frames_pending =
+        std::max(0, feature_pipeline->NumFramesReady() - current_search().NumFramesDecoded() * f);
+  }
+  return stats;
+}
+
+void NNet3OnlineDecoderWrapper::reset_stats(void) { stats.reset(); }
+
+/*
+ * NNet3OnlineModelWrapper
+ */
+
+const std::string NNet3OnlineModelWrapper::default_graph = "default";
+
+// typedef void (*LogHandler)(const LogMessageEnvelope &envelope,
+//                            const char *message);
+static void silent_log_handler(const LogMessageEnvelope &envelope, const char *message)
+{
+  // nothing - this handler simply keeps silent
+}
+
+// run load on a new thread, keeping an exception to rethrow after joining it
+static std::thread load_async(std::function<void()> load, std::exception_ptr &error)
+{
+  return std::thread([load, &error]() {
+    try
+    {
+      load();
+    }
+    catch (...)
+    {
+      error = std::current_exception();
+    }
+  });
+}
+
+NNet3OnlineModelWrapper::NNet3OnlineModelWrapper(
+    BaseFloat beam, int32 max_active, int32 min_active, BaseFloat lattice_beam,
+    BaseFloat acoustic_scale, int32 frame_subsampling_factor, std::string &word_syms_filename,
+    std::string &model_in_filename, std::string &fst_in_str, std::string &mfcc_config,
+    std::string &ie_conf_filename, std::string &align_lex_filename, bool int8, LoadProgress progress)
+
+{
+#if VERBOSE
+  KALDI_LOG << "model_in_filename:         " << model_in_filename;
+  KALDI_LOG << "fst_in_str:                " << fst_in_str;
+  KALDI_LOG << "mfcc_config:               " << mfcc_config;
+  KALDI_LOG << "ie_conf_filename:          " << ie_conf_filename;
+  KALDI_LOG << "align_lex_filename:        " << align_lex_filename;
+#endif
+  init(beam, max_active, min_active, lattice_beam, acoustic_scale, frame_subsampling_factor, int8);
+
+  feature_config.mfcc_config = mfcc_config;
+  feature_config.ivector_extraction_config = ie_conf_filename;
+
+  add_graph(default_graph, fst_in_str, word_syms_filename, align_lex_filename);
+
+  load(
+      [this]() { feature_info = new OnlineNnet2FeaturePipelineInfo(this->feature_config); },
+      [this, model_in_filename]() {
+        bool binary;
+        Input ki(model_in_filename, &binary);
+        read_model(ki.Stream(), binary);
+      },
+      progress);
+}
+
+NNet3OnlineModelWrapper::NNet3OnlineModelWrapper(BaseFloat beam, int32 max_active, int32 min_active,
+                                                 BaseFloat lattice_beam, BaseFloat acoustic_scale,
+                                                 int32 frame_subsampling_factor, const std::string &bundle_filename,
+                                                 const std::string &ivector_options, bool verify, bool int8,
+                                                 LoadProgress progress)
+{
+#if VERBOSE
+  KALDI_LOG << "bundle_filename:           " << bundle_filename;
+  KALDI_LOG << "ivector_options:           " << ivector_options;
+#endif
+  init(beam, max_active, min_active, lattice_beam, acoustic_scale, frame_subsampling_factor, int8);
+
+  std::shared_ptr<const ModelBundle> bundle;
+  try
+  {
+    bundle.reset(new ModelBundle(bundle_filename, verify));
+  }
+  catch (...)
+  {
+    delete graphs;
+    throw;
+  }
+
+  // the bundle stays mapped as long as the graph can be (re)loaded from it
+  graphs->add(default_graph, [bundle]() { return bundle->read_graph(default_graph); });
+
+  load([this, bundle, ivector_options]() { feature_info = bundle->read_feature_info(ivector_options); },
+       [this, bundle]() {
+         std::unique_ptr<std::istream> is = bundle->open("final.mdl");
+         bool binary;
+         if (!InitKaldiInputStream(*is, &binary)) KALDI_ERR << "Could not read final.mdl of the model bundle";
+         read_model(*is, binary);
+       },
+       progress);
+}
+
+void NNet3OnlineModelWrapper::init(BaseFloat beam, int32 max_active, int32 min_active, BaseFloat lattice_beam,
+                                   BaseFloat acoustic_scale, int32 frame_subsampling_factor, bool int8)
+{
+#if !VERBOSE
+  // silence kaldi output as well
+  SetLogHandler(silent_log_handler);
+#endif
+
+  lattice_faster_decoder_config.max_active = max_active;
+  lattice_faster_decoder_config.min_active = min_active;
+  lattice_faster_decoder_config.beam = beam;
+  lattice_faster_decoder_config.lattice_beam = lattice_beam;
+  decodable_opts.acoustic_scale = acoustic_scale;
+  decodable_opts.frame_subsampling_factor = frame_subsampling_factor;
+
+  feature_info = NULL;
+  decodable_info = NULL;
+  batch_scheduler = NULL;
+  this->int8 = int8;
+
+  // unlimited until set_graph_cache_size is called
+  graphs = new DecodingGraphCache(0);
+}
+
+void NNet3OnlineModelWrapper::read_model(std::istream &is, bool binary)
+{
+  trans_model.Read(is, binary);
+  am_nnet.Read(is, binary);
+  SetBatchnormTestMode(true, &(am_nnet.GetNnet()));
+  SetDropoutTestMode(true, &(am_nnet.GetNnet()));
+  nnet3::CollapseModel(nnet3::CollapseModelConfig(), &(am_nnet.GetNnet()));
+  if (int8)
+  {
+    quantization = QuantizeNnetInt8(&am_nnet.GetNnet());
+#if VERBOSE
+    KALDI_LOG << "quantized " << quantization.num_components << " components, " << quantization.num_params
+              << " weights to int8";
+#endif
+  }
+
+  // compiles the looped computation once, shared by all decoders
+  decodable_info = new nnet3::DecodableNnetSimpleLoopedInfo(decodable_opts, &am_nnet);
+}
+
+void NNet3OnlineModelWrapper::load(std::function<void()> load_features, std::function<void()> load_model,
+                                   LoadProgress progress)
+{
+  std::mutex progress_mutex;
+  int32 num_loaded = 0;
+  auto report = [&](const std::string &artifact) {
+    std::lock_guard<std::mutex> lock(progress_mutex);
+    num_loaded++;
+    if (progress) progress(artifact, num_loaded, 3);
+  };
+
+  // The graph, the feature pipeline (i-vector extractor) and the acoustic
+  // model are independent, so they are loaded concurrently
+  std::exception_ptr graph_error, feature_error, model_error;
+  std::thread graph_thread = load_async(
+      [&]() {
+        load_graph(default_graph);
+        report("decoding graph");
+      },
+      graph_error);
+  std::thread feature_thread = load_async(
+      [&]() {
+        load_features();
+        report("feature pipeline");
+      },
+      feature_error);
+
+  try
+  {
+    load_model();
+    report("acoustic model");
+  }
+  catch (...)
+  {
+    model_error = std::current_exception();
+  }
+
+  graph_thread.join();
+  feature_thread.join();
+
+  std::exception_ptr error = model_error ? model_error : (graph_error ? graph_error : feature_error);
+  if (error)
+  {
+    // the destructor does not run when the constructor throws
+    delete decodable_info;
+    delete feature_info;
+    delete graphs;
+    std::rethrow_exception(error);
+  }
+}
+
+NNet3OnlineModelWrapper::~NNet3OnlineModelWrapper()
+{
+  delete batch_scheduler;
+  delete decodable_info;
+  delete feature_info;
+  delete graphs;
+}
+
+void NNet3OnlineModelWrapper::enable_batching(int32 minibatch_size, int32 frames_per_chunk, int32 tick_ms)
+{
+  if (batch_scheduler) KALDI_ERR << "Batched scoring is already enabled";
+
+  nnet3::NnetBatchComputerOptions opts;
+  opts.acoustic_scale = decodable_opts.acoustic_scale;
+  opts.frame_subsampling_factor = decodable_opts.frame_subsampling_factor;
+  opts.frames_per_chunk = frames_per_chunk;
+  opts.minibatch_size = minibatch_size;
+  opts.edge_minibatch_size = minibatch_size;
+  batch_scheduler = new NNet3BatchScheduler(opts, am_nnet, tick_ms);
+}
+
+void NNet3OnlineModelWrapper::set_lm_rescoring(const std::string &old_lm_filename,
+                                               const std::string &new_lm_filename,
+                                               const std::string &graph_name)
+{
+#if VERBOSE
+  KALDI_LOG << "loading rescoring LMs for graph " << graph_name << "...";
+#endif
+  std::shared_ptr<const LatticeLmRescorer> rescorer(new LatticeLmRescorer(old_lm_filename, new_lm_filename));
+
+  std::lock_guard<std::mutex> lock(rescorers_mutex);
+  rescorers[graph_name] = rescorer;
+}
+
+std::shared_ptr<const LatticeLmRescorer> NNet3OnlineModelWrapper::get_rescorer(const std::string &graph_name)
+{
+  std::lock_guard<std::mutex> lock(rescorers_mutex);
+  std::map<std::string, std::shared_ptr<const LatticeLmRescorer> >::iterator it = rescorers.find(graph_name);
+  if (it == rescorers.end()) return std::shared_ptr<const LatticeLmRescorer>();
+  return it->second;
+}
+
+void NNet3OnlineModelWrapper::add_graph(const std::string &name, const std::string &fst_in_str,
+                                        const std::string &word_syms_filename,
+                                        const std::string &align_lex_filename)
+{
+  graphs->add(name, fst_in_str, word_syms_filename, align_lex_filename);
+
+  // the LMs of a graph registered before under the name do not fit this one
+  std::lock_guard<std::mutex> lock(rescorers_mutex);
+  rescorers.erase(name);
+}
+
+void NNet3OnlineModelWrapper::remove_graph(const std::string &name)
+{
+  if (name == default_graph) KALDI_ERR << "The default graph cannot be removed";
+  graphs->remove(name);
+
+  std::lock_guard<std::mutex> lock(rescorers_mutex);
+  rescorers.erase(name);
+}
+
+bool NNet3OnlineModelWrapper::has_graph(const std::string &name) { return graphs->has(name); }
+
+void NNet3OnlineModelWrapper::load_graph(const std::string &name) { graphs->get(name); }
+
+void NNet3OnlineModelWrapper::set_graph_cache_size(size_t max_bytes) { graphs->set_max_bytes(max_bytes); }
+
+size_t NNet3OnlineModelWrapper::get_graph_cache_usage() { return graphs->memory_usage(); }
+
+std::vector<std::string> NNet3OnlineModelWrapper::get_loaded_graphs() { return graphs->loaded_graphs(); }
+
+/*
+ * NNet3MultiGraphDecoderWrapper
+ */
+
+NNet3MultiGraphDecoderWrapper::NNet3MultiGraphDecoderWrapper(NNet3OnlineModelWrapper *aModel,
+                                                             const std::vector<std::string> &graph_names)
+    : model(aModel), graph_names(graph_names), search_config(aModel->lattice_faster_decoder_config)
+{
+  if (graph_names.empty()) KALDI_ERR << "No decoding graphs to decode with";
+  for (size_t i = 0; i < graph_names.size(); i++)
+  {
+    if (!model->has_graph(graph_names[i])) KALDI_ERR << "Unknown decoding graph " << graph_names[i];
+    for (size_t j = 0; j < i; j++)
+    {
+      if (graph_names[j] == graph_names[i]) KALDI_ERR << "Decoding graph " << graph_names[i] << " given twice";
+    }
+  }
+
+  feature_pipeline = NULL;
+  silence_weighting = NULL;
+  scorer = NULL;
+  decodable = NULL;
+  frames_scored = 0;
+
+  searches.resize(graph_names.size());
+  for (size_t i = 0; i < searches.size(); i++)
+  {
+    searches[i].search = NULL;
+    searches[i].ok = false;
+  }
+
+  worker_step = NULL;
+  stopping = false;
+  workers.resize(searches.size() - 1);
+  for (size_t i = 0; i < workers.size(); i++)
+  {
+    workers[i].pending = false;
+    workers[i].thread = std::thread(&NNet3MultiGraphDecoderWrapper::run_worker, this, i);
+  }
+}
+
+NNet3MultiGraphDecoderWrapper::~NNet3MultiGraphDecoderWrapper()
+{
+  {
+    std::lock_guard<std::mutex> lock(worker_mutex);
+    stopping = true;
+  }
+  work_ready.notify_all();
+  for (size_t i = 0; i < workers.size(); i++) workers[i].thread.join();
+  free_decoder();
+}
+
+void NNet3MultiGraphDecoderWrapper::start_decoding(void)
+{
+  free_decoder();
+#if VERBOSE
+  KALDI_LOG << "alloc: OnlineNnet2FeaturePipeline";
+#endif
+  feature_pipeline = new OnlineNnet2FeaturePipeline(*model->feature_info);
+  silence_weighting = new OnlineSilenceWeighting(model->trans_model, model->feature_info->silence_weighting_config,
+                                                 model->decodable_opts.frame_subsampling_factor);
+  scorer = new nnet3::DecodableNnetLoopedOnline(*model->decodable_info, feature_pipeline->InputFeature(),
+                                                feature_pipeline->IvectorFeature());
+  decodable = new DecodableMatrixMappedOffset(model->trans_model);
+  frames_scored = 0;
+
+  for (size_t i = 0; i < searches.size(); i++)
+  {
+    // the graphs are fixed for the duration of the utterance
+    GraphSearch &graph_search = searches[i];
+    graph_search.graph = model->graphs->get(graph_names[i]);
+#if VERBOSE
+    KALDI_LOG << "alloc: LatticeFasterOnlineDecoder for graph " << graph_names[i];
+#endif
+    graph_search.search = new LatticeFasterOnlineDecoder(*graph_search.graph->decode_fst, search_config);
+    graph_search.search->InitDecoding();
+    graph_search.ok = false;
+    graph_search.best_path_clat = CompactLattice();
+    graph_search.final_clat = CompactLattice();
+  }
+}
+
+void NNet3MultiGraphDecoderWrapper::free_decoder(void)
+{
+  for (size_t i = 0; i < searches.size(); i++)
+  {
+    delete searches[i].search;
+    searches[i].search = NULL;
+  }
+  delete decodable;
+  decodable = NULL;
+  delete scorer;
+  scorer = NULL;
+  delete silence_weighting;
+  silence_weighting = NULL;
+  delete feature_pipeline;
+  feature_pipeline = NULL;
+}
+
+void NNet3MultiGraphDecoderWrapper::reset(void)
+{
+  free_decoder();
+  for (size_t i = 0; i < searches.size(); i++)
+  {
+    searches[i].graph.reset();
+    searches[i].ok = false;
+  }
+}
+
+bool NNet3MultiGraphDecoderWrapper::decode(BaseFloat samp_freq, int32 num_frames, BaseFloat *frames,
+                                           bool finalize)
+{
+  if (!feature_pipeline)
+  {
+    start_decoding();
+  }
+
+  SubVector<BaseFloat> wave_part(frames, num_frames);
+  stats.samples_received += num_frames;
+
+  Timer timer;
+  feature_pipeline->AcceptWaveform(samp_freq, wave_part);
+  if (finalize)
+  {
+    // no more input. flush out last frames
+    feature_pipeline->InputFinished();
+  }
+  stats.accept_waveform_seconds += timer.Elapsed();
+
+  // the i-vectors are weighted by the traceback of the first graph
+  const LatticeFasterOnlineDecoder &first_search = *searches[0].search;
+  if (silence_weighting->Active() && feature_pipeline->IvectorFeature() != NULL)
+  {
+    silence_weighting->ComputeCurrentTraceback(first_search);
+    silence_weighting->GetDeltaWeights(feature_pipeline->NumFramesReady(), &delta_weights);
+    feature_pipeline->IvectorFeature()->UpdateFrameWeights(delta_weights);
+  }
+
+  timer.Reset();
+  int32 first_frame = first_search.NumFramesDecoded();
+  score_frames(finalize);
+  DecodableMatrixMappedOffset *scores = decodable;
+  for_each_search([scores](GraphSearch &graph_search) { graph_search.search->AdvanceDecoding(scores); });
+  stats.advance_decoding_seconds += timer.Elapsed();
+
+  int32 num_decoded = first_search.NumFramesDecoded();
+  for (size_t i = 0; i < searches.size(); i++)
+  {
+    for (int32 frame = first_frame; frame < num_decoded; frame++)
+    {
+      stats.add_active_tokens(ActiveTokenCounter<LatticeFasterOnlineDecoder>::count(*searches[i].search, frame),
+                              search_config.max_active);
+    }
+  }
+  stats.frames_decoded += num_decoded - first_frame;
+
+  if (!finalize) return true;
+
+  // determinization and rescoring of the lattices run in parallel as well
+  timer.Reset();
+  for_each_search([this](GraphSearch &graph_search) { finish_search(graph_search); });
+  stats.finalize_seconds += timer.Elapsed();
+  free_decoder();
+
+  bool ok = false;
+  for (size_t i = 0; i < searches.size(); i++)
+  {
+    if (searches[i].ok)
+      ok = true;
+    else
+      KALDI_WARN << "Decoding with graph " << graph_names[i] << " failed";
+  }
+  if (!ok) return false;
+
+  stats.utterances++;
+  stats.set_lattice(searches[0].final_clat);
+  return true;
+}
+
+// Reads the nnet output of a DecodableNnetLoopedOnline a block of rows at a
+// time, which it keeps in protected members, instead of through a virtual
+// LogLikelihood call per frame and pdf.
+class LoopedOutputReader : public nnet3::DecodableNnetLoopedOnline
+{
+ public:
+  // copies the output of the frames from begin on into the rows of output
+  static void copy_frames(nnet3::DecodableNnetLoopedOnline &scorer, int32 begin, MatrixBase<BaseFloat> *output)
+  {
+    auto compute = &LoopedOutputReader::EnsureFrameIsComputed;
+    const auto log_post = &LoopedOutputReader::current_log_post_;
+    const auto log_post_offset = &LoopedOutputReader::current_log_post_subsampled_offset_;
+    int32 end = begin + output->NumRows();
+    for (int32 frame = begin; frame < end;)
+    {
+      int32 subsampled_frame = frame + scorer.GetFrameOffset();
+      (scorer.*compute)(subsampled_frame);
+      // the output of the last chunk computed, in which the frame now is
+      const Matrix<BaseFloat> &chunk = scorer.*log_post;
+      int32 row = subsampled_frame - scorer.*log_post_offset;
+      int32 num_rows = std::min(end - frame, chunk.NumRows() - row);
+      output->RowRange(frame - begin, num_rows).CopyFromMat(chunk.RowRange(row, num_rows));
+      frame += num_rows;
+    }
+  }
+};  // class LoopedOutputReader
+
+void NNet3MultiGraphDecoderWrapper::score_frames(bool finalize)
+{
+  // the nnet output of the frames ready, in the layout of the batched scores:
+  // a row per output frame, a column per pdf
+  int32 num_ready = scorer->NumFramesReady();
+  if (num_ready > frames_scored)
+  {
+    Matrix<BaseFloat> loglikes(num_ready - frames_scored, scorer->NumIndices(), kUndefined);
+    LoopedOutputReader::copy_frames(*scorer, frames_scored, &loglikes);
+    frames_scored = num_ready;
+
+    // all searches are done with the frames before the one they are at
+    int32 frames_to_discard = searches[0].search->NumFramesDecoded() - decodable->FirstAvailableFrame();
+    decodable->AcceptLoglikes(&loglikes, frames_to_discard);
+  }
+  if (finalize) decodable->InputIsFinished();
+}
+
+void NNet3MultiGraphDecoderWrapper::for_each_search(const std::function<void(GraphSearch &)> &step)
+{
+  // the first search runs in the calling thread, every other in its worker
+  {
+    std::lock_guard<std::mutex> lock(worker_mutex);
+    worker_step = &step;
+    for (size_t i = 0; i < workers.size(); i++)
+    {
+      workers[i].pending = true;
+      workers[i].error = nullptr;
+    }
+  }
+  work_ready.notify_all();
+
+  std::exception_ptr error;
+  try
+  {
+    step(searches[0]);
+  }
+  catch (...)
+  {
+    error = std::current_exception();
+  }
+
+  std::unique_lock<std::mutex> lock(worker_mutex);
+  for (size_t i = 0; i < workers.size(); i++)
+  {
+    work_done.wait(lock, [this, i]() { return !workers[i].pending; });
+    if (!error) error = workers[i].error;
+  }
+  worker_step = NULL;
+  lock.unlock();
+  if (error) std::rethrow_exception(error);
+}
+
+void NNet3MultiGraphDecoderWrapper::run_worker(size_t index)
+{
+  SearchWorker &worker = workers[index];
+  std::unique_lock<std::mutex> lock(worker_mutex);
+  while (true)
+  {
+    work_ready.wait(lock, [this, &worker]() { return worker.pending || stopping; });
+    if (stopping) return;
+
+    const std::function<void(GraphSearch &)> &step = *worker_step;
+    lock.unlock();
+    try
+    {
+      step(searches[index + 1]);
+    }
+    catch (...)
+    {
+      worker.error = std::current_exception();
+    }
+    lock.lock();
+    worker.pending = false;
+    work_done.notify_all();
+  }
+}
+
+void NNet3MultiGraphDecoderWrapper::finish_search(GraphSearch &graph_search)
+{
+  LatticeFasterOnlineDecoder &search = *graph_search.search;
+  search.FinalizeDecoding();
+
+  Lattice raw_lat;
+  search.GetRawLattice(&raw_lat, true);
+  CompactLattice clat;
+  DeterminizeLatticePhonePrunedWrapper(model->trans_model, &raw_lat, search_config.lattice_beam, &clat,
+                                       search_config.det_opts);
+  if (clat.NumStates() == 0)
+  {
+    graph_search.ok = false;
+    return;
+  }
+
+  std::shared_ptr<const LatticeLmRescorer> rescorer = model->get_rescorer(graph_search.graph->name);
+  if (rescorer && !rescorer->Rescore(&clat))
+  {
+    KALDI_WARN << "LM rescoring failed, using first pass lattice.";
+  }
+
+  CompactLatticeShortestPath(clat, &graph_search.best_path_clat);
+  graph_search.final_clat = clat;
+  graph_search.ok = true;
+}
+
+NNet3MultiGraphDecoderWrapper::GraphSearch &NNet3MultiGraphDecoderWrapper::find_search(
+    const std::string &graph_name)
+{
+  for (size_t i = 0; i < graph_names.size(); i++)
+  {
+    if (graph_names[i] == graph_name) return searches[i];
+  }
+  KALDI_ERR << "Not decoding with graph " << graph_name;
+  return searches[0];  // never reached
+}
+
+void NNet3MultiGraphDecoderWrapper::get_decoded_string(const std::string &graph_name, std::string &decoded_string,
+                                                       double &likelihood)
+{
+  const GraphSearch &graph_search = find_search(graph_name);
+  Lattice best_path_lat;
+
+  decoded_string = "";
+  likelihood = 0.0;
+
+  if (graph_search.search)
+  {
+    // decoding is not finished yet, so we will look up the best partial result so far
+    if (graph_search.search->NumFramesDecoded() == 0) return;
+    graph_search.search->GetBestPath(&best_path_lat, false);
+  }
+  else if (graph_search.ok)
+  {
+    ConvertLattice(graph_search.best_path_clat, &best_path_lat);
+  }
+  else
+  {
+    return;
+  }
+
+  std::vector<int32> words;
+  std::vector<int32> alignment;
+  LatticeWeight weight;
+  GetLinearSymbolSequence(best_path_lat, &alignment, &words, &weight);
+  if (alignment.empty()) return;
+  likelihood = -(weight.Value1() + weight.Value2()) / alignment.size();
+
+  std::vector<string> word_strings;
+  lookup_words(graph_search, words, word_strings);
+  for (size_t i = 0; i < word_strings.size(); i++) decoded_string += word_strings[i] + ' ';
+}
+
+void NNet3MultiGraphDecoderWrapper::lookup_words(const GraphSearch &graph_search,
+                                                 const std::vector<int32> &word_idxs, std::vector<string> &words)
+{
+  words.clear();
+  for (size_t i = 0; i < word_idxs.size(); i++)
+  {
+    std::string s = graph_search.graph->word_syms->Find(word_idxs[i]);
+    if (s == "")
+    {
+      KALDI_ERR << "Word-id " << word_idxs[i] << " not in symbol table.";
+    }
+    words.push_back(s);
+  }
+}
+
+bool NNet3MultiGraphDecoderWrapper::align_words(const GraphSearch &graph_search, std::vector<int32> &word_idxs,
+                                                std::vector<int32> &times, std::vector<int32> &lengths)
+{
+  if (!graph_search.ok)
+  {
+    KALDI_WARN << "No final result to align";
+    return false;
+  }
+
+  WordAlignLatticeLexiconInfo lexicon_info(graph_search.graph->word_alignment_lexicon);
+  CompactLattice aligned_clat;
+  WordAlignLatticeLexiconOpts opts;
+  if (!WordAlignLatticeLexicon(graph_search.best_path_clat, model->trans_model, lexicon_info, opts, &aligned_clat))
+  {
+    KALDI_WARN << "Lattice did not align correctly";
+    return false;
+  }
+  if (aligned_clat.Start() == fst::kNoStateId)
+  {
+    KALDI_WARN << "Lattice was empty";
+    return false;
+  }
+  TopSortCompactLatticeIfNeeded(&aligned_clat);
+
+  CompactLattice best_path_aligned;
+  CompactLatticeShortestPath(aligned_clat, &best_path_aligned);
+  if (!CompactLatticeToWordAlignment(best_path_aligned, &word_idxs, &times, &lengths))
+  {
+    KALDI_WARN << "CompactLatticeToWordAlignment failed.";
+    return false;
+  }
+  return true;
+}
+
+bool NNet3MultiGraphDecoderWrapper::get_word_alignment(const std::string &graph_name, std::vector<string> &words,
+                                                       std::vector<int32> &times, std::vector<int32> &lengths)
+{
+  const GraphSearch &graph_search = find_search(graph_name);
+  std::vector<int32> word_idxs;
+  if (!align_words(graph_search, word_idxs, times, lengths)) return false;
+
+  lookup_words(graph_search, word_idxs, words);
+  return true;
+}
+
+bool NNet3MultiGraphDecoderWrapper::get_word_confidences(const std::string &graph_name, std::vector<string> &words,
+                                                         std::vector<int32> &times, std::vector<int32> &lengths,
+                                                         std::vector<BaseFloat> &confidences)
+{
+  const GraphSearch &graph_search = find_search(graph_name);
+  std::vector<int32> aligned_word_idxs, aligned_times, aligned_lengths;
+  if (!align_words(graph_search, aligned_word_idxs, aligned_times, aligned_lengths)) return false;
+
+  // as NNet3OnlineDecoderWrapper::get_word_confidences, for the words of the
+  // best path without silences
+  std::vector<int32> word_idxs;
+  std::vector<std::pair<BaseFloat, BaseFloat> > mbr_times;
+  times.clear();
+  lengths.clear();
+  for (size_t i = 0; i < aligned_word_idxs.size(); i++)
+  {
+    if (aligned_word_idxs[i] == 0) continue;
+    word_idxs.push_back(aligned_word_idxs[i]);
+    times.push_back(aligned_times[i]);
+    lengths.push_back(aligned_lengths[i]);
+    mbr_times.push_back(std::make_pair(static_cast<BaseFloat>(aligned_times[i]),
+                                       static_cast<BaseFloat>(aligned_times[i] + aligned_lengths[i])));
+  }
+
+  MinimumBayesRiskOptions mbr_opts;
+  mbr_opts.decode_mbr = false;
+  MinimumBayesRisk mbr(graph_search.final_clat, word_idxs, mbr_times, mbr_opts);
+  confidences = mbr.GetOneBestConfidences();
+
+  lookup_words(graph_search, word_idxs, words);
+  return true;
+}
+
+void NNet3MultiGraphDecoderWrapper::set_endpoint_options(const std::string &options)
+{
+  // options not given keep their values
+  OnlineEndpointConfig config = endpoint_config;
+  ParseOptions po("");
+  config.Register(&po);
+  parse_options(options, "endpoint options", &po);
+  endpoint_config = config;
+}
+
+bool NNet3MultiGraphDecoderWrapper::endpoint_detected(void)
+{
+  if (!searches[0].search) return false;
+  BaseFloat frame_shift =
+      model->feature_info->FrameShiftInSeconds() * model->decodable_opts.frame_subsampling_factor;
+  return EndpointDetected(endpoint_config, model->trans_model, frame_shift, *searches[0].search);
+}
+
+DecoderStats NNet3MultiGraphDecoderWrapper::get_stats(void)
+{
+  stats.frames_pending = 0;
+  if (feature_pipeline)
+  {
+    int32 f = model->decodable_opts.frame_subsampling_factor;
+    stats.frames_pending =
+        std::max(0, feature_pipeline->NumFramesReady() - searches[0].search->NumFramesDecoded() * f);
   }
+  return stats;
 }
 
-NNet3OnlineModelWrapper::~NNet3OnlineModelWrapper() { delete feature_info; }
+void NNet3MultiGraphDecoderWrapper::reset_stats(void) { stats.reset(); }
 
 }  // namespace kaldi
@@ -1,3 +1,9 @@
 from .version import __version__
 from .gmm import KaldiGmmOnlineModel, KaldiGmmOnlineDecoder
-from .nnet3 import KaldiNNet3OnlineModel, KaldiNNet3OnlineDecoder
+from .nnet3 import KaldiNNet3OnlineModel, KaldiNNet3OnlineDecoder, KaldiNNet3MultiGraphDecoder
+from .adaptation import AdaptationStateCache
+from .result_cache import DecodeResultCache
+from .features import FeatureCache
+from .beam_control import BeamController
+from .workers import SharedAudioRing, DecodingWorker
+from .long_audio import LongAudioDecoder
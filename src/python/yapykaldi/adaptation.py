@@ -0,0 +1,157 @@
+"Cache of speaker adaptation states for recurring speakers"
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from .logger import logger
+from .utils import makedir_exist_ok
+
+
+__all__ = ["AdaptationStateCache"]
+
+
+class AdaptationStateCache(object):
+    """LRU cache of speaker adaptation states (i-vector or fMLLR), keyed by speaker or device ID
+
+    States are kept in memory and, when a cache directory is given, written to disk in Kaldi binary format, one file
+    per speaker, so they survive restarts. Adaptation states depend on the model, so use a separate cache (directory)
+    per model.
+
+    Typical use for a session with a known speaker::
+
+        cache.restore(decoder, speaker_id)
+        ...  # decode the utterances of the session
+        cache.save(decoder, speaker_id)
+    """
+
+    SUFFIX = ".adapt"
+
+    def __init__(self, cache_dir=None, capacity=128, disk_capacity=None):
+        """
+        :param cache_dir: (default None) Directory to store the adaptation states in. None keeps them in memory only
+        :param capacity: (default 128) Number of adaptation states kept in memory
+        :param disk_capacity: (default None) Number of adaptation states kept on disk. None for no limit
+        """
+        self.cache_dir = cache_dir
+        self.capacity = capacity
+        self.disk_capacity = disk_capacity
+
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+        if self.cache_dir:
+            makedir_exist_ok(self.cache_dir)
+
+    def get(self, key):
+        """Adaptation state of a speaker
+
+        :param key: Speaker or device ID
+        :return: (bytes) adaptation state, or None if the speaker is unknown
+        """
+        with self._lock:
+            state = self._states.pop(key, None)
+            if state is not None:
+                self._states[key] = state
+                return state
+
+        path = self._path(key)
+        if not path or not os.path.isfile(path):
+            return None
+
+        with open(path, 'rb') as state_file:
+            state = state_file.read()
+        os.utime(path, None)
+
+        with self._lock:
+            self._insert(key, state)
+        return state
+
+    def put(self, key, state):
+        """Store the adaptation state of a speaker
+
+        :param key: Speaker or device ID
+        :param state: (bytes) adaptation state as returned by the get_adaptation_state method of a decoder
+        """
+        with self._lock:
+            self._states.pop(key, None)
+            self._insert(key, state)
+
+        path = self._path(key)
+        if path:
+            # Write to a temporary file first, so a crash never leaves a truncated state behind
+            tmp_path = "{}.{}.tmp".format(path, os.getpid())
+            with open(tmp_path, 'wb') as state_file:
+                state_file.write(state)
+            os.rename(tmp_path, path)
+            self._evict_disk()
+
+    def remove(self, key):
+        """Forget the adaptation state of a speaker"""
+        with self._lock:
+            self._states.pop(key, None)
+
+        path = self._path(key)
+        if path and os.path.isfile(path):
+            os.remove(path)
+
+    def restore(self, decoder, key):
+        """Start the next utterance of the decoder from the adaptation state of a speaker
+
+        Unknown speakers start from the default adaptation state, which is carried over between utterances from then
+        on, so it can be saved at the end of the session.
+
+        :param decoder: KaldiNNet3OnlineDecoder or KaldiGmmOnlineDecoder
+        :param key: Speaker or device ID
+        :return: (bool) True if a stored adaptation state was restored
+        """
+        state = self.get(key)
+        if state is None:
+            decoder.reset_adaptation_state(carry=True)
+            return False
+
+        try:
+            decoder.set_adaptation_state(state)
+        except RuntimeError as e:  # pylint: disable=invalid-name
+            logger.warning("Discarding unusable adaptation state of %s: %s", key, e)
+            self.remove(key)
+            decoder.reset_adaptation_state(carry=True)
+            return False
+        return True
+
+    def save(self, decoder, key):
+        """Store the current adaptation state of the decoder for a speaker
+
+        :param decoder: KaldiNNet3OnlineDecoder or KaldiGmmOnlineDecoder
+        :param key: Speaker or device ID
+        """
+        self.put(key, decoder.get_adaptation_state())
+
+    def _insert(self, key, state):
+        """Internal method to add a state to the in-memory LRU, called with the lock held"""
+        self._states[key] = state
+        while len(self._states) > self.capacity:
+            self._states.popitem(last=False)
+
+    def _path(self, key):
+        """Internal method to get the file of a speaker in the cache directory"""
+        if not self.cache_dir:
+            return None
+        digest = hashlib.sha1(str(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest + self.SUFFIX)
+
+    def _evict_disk(self):
+        """Internal method to remove the least recently used states from disk beyond disk_capacity"""
+        if not self.disk_capacity:
+            return
+
+        paths = [os.path.join(self.cache_dir, fname) for fname in os.listdir(self.cache_dir)
+                 if fname.endswith(self.SUFFIX)]
+        if len(paths) <= self.disk_capacity:
+            return
+
+        paths.sort(key=os.path.getmtime)
+        for path in paths[:len(paths) - self.disk_capacity]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -9,14 +9,26 @@ __all__ = [
     # From .pipeline
     "AsrPipeline",
 
+    # From .dispatch
+    "CallbackDispatcher",
+
     # From .sources
-    "PyAudioMicrophoneSource", "WaveFileSource",
+    "PyAudioMicrophoneSource", "WaveFileSource", "SoundFileSource",
 
     # From .sinks
-    "WaveFileSink"
+    "WaveFileSink", "TranscriptSink", "JsonlTranscriptSink", "CtmTranscriptSink",
+
+    # From .flight_recorder
+    "FlightRecorder", "replay_recording",
+
+    # From .kws
+    "KeywordSpotter"
 ]
 
 from .asr import Asr
 from .pipeline import AsrPipeline
-from .sources import PyAudioMicrophoneSource, WaveFileSource
-from .sinks import WaveFileSink
+from .dispatch import CallbackDispatcher
+from .sources import PyAudioMicrophoneSource, WaveFileSource, SoundFileSource
+from .sinks import WaveFileSink, TranscriptSink, JsonlTranscriptSink, CtmTranscriptSink
+from .flight_recorder import FlightRecorder, replay_recording
+from .kws import KeywordSpotter
@@ -3,9 +3,11 @@ Yapykaldi ASR: Class definition for ASR component. It connects to a source and a
 """
 from __future__ import (print_function, division, absolute_import, unicode_literals)
 from builtins import *
-import struct
+import time
+from threading import Event
 import numpy as np
 from ._base import AsrPipelineElementBase
+from .flight_recorder import FlightRecorder
 from ..logger import logger
 from ..nnet3 import KaldiNNet3OnlineDecoder, KaldiNNet3OnlineModel
 from ..gmm import KaldiGmmOnlineDecoder, KaldiGmmOnlineModel
@@ -20,7 +22,8 @@ class Asr(AsrPipelineElementBase):
     """API for ASR"""
     # pylint: disable=too-many-instance-attributes, useless-object-inheritance
 
-    def __init__(self, model_dir, model_type, rate=16000, chunksize=1024, debug=False, source=None, sink=None):
+    def __init__(self, model_dir, model_type, rate=16000, chunksize=1024, debug=False, source=None, sink=None,
+                 continuous=False, stream_id="stream", second_pass="sync", dispatcher=None):
         """
         :param model_dir: Path to model directory
         :param model_type: Type of ASR model 'nnet3' or 'hmm'
@@ -32,10 +35,24 @@ class Asr(AsrPipelineElementBase):
         :type source: AsrPipelineElementBase
         :param sink: (default None) Element to be connected as sink when constructing an AsrPipeline
         :type sink: AsrPipelineElementBase
+        :param continuous: (default False) Segment the stream at the endpoints the decoder detects. Every segment is
+        finalized and reported as a full recognition, and its features and lattice are freed, so memory stays bounded
+        however long the stream runs. Speaker adaptation carries over from one segment to the next
+        :param stream_id: (default "stream") Name of the stream in the results passed to result callbacks
+        :param second_pass: (default "sync") For GMM models, "deferred" reports the first pass result of every
+        utterance right away and the result of fMLLR adaptation and rescoring later to the second pass callbacks,
+        "skip" leaves the second pass out. See KaldiGmmOnlineDecoder.set_second_pass
+        :param dispatcher: (default None) CallbackDispatcher to call the callbacks from, so slow callbacks do not hold
+        up decoding. Partial results are coalesced, a callback that falls behind gets the latest one. None calls the
+        callbacks in the decoding thread
+        :type dispatcher: CallbackDispatcher
         """
         super().__init__(chunksize=chunksize, rate=rate, source=source, sink=sink)
         self.model_dir = model_dir
         self.model_type = model_type
+        if second_pass != "sync" and model_type != 'gmm':
+            raise Exception("Only GMM models have a second pass to defer or skip")
+        self.second_pass = second_pass
 
         self._model = None
         self._decoder = None
@@ -44,26 +61,80 @@ class Asr(AsrPipelineElementBase):
 
         self._string_partially_recognized_callbacks = []
         self._string_fully_recognized_callbacks = []
+        self._result_callbacks = []
+        self._second_pass_callbacks = []
+        self._dispatcher = dispatcher
+
+        self._end_utterance = Event()
+        self._utterance_reported = False
 
         self._debug = debug
+        self._continuous = continuous
+
+        self.stream_id = stream_id
+        self._utterance_index = 0
+        # stream position in samples, of the audio decoded so far and of the start of the current utterance
+        self._stream_samples = 0
+        self._utterance_start = 0
+        self._chunk_time = None
+        self._in_utterance = False
+
+        self._recorder = None
 
     def open(self):
         # No definition for this method while inheriting abstract class AsrPipelineElementBase
         pass
 
     def close(self):
-        # No definition for this method while inheriting abstract class AsrPipelineElementBase
-        pass
+        if self._recorder:
+            self._recorder.close()
 
     def next_chunk(self, chunk):
-        """Method to start the recognition process on audio stream added to process queue"""
+        """Method to start the recognition process on audio stream added to process queue
+
+        Chunks are usually of chunksize samples, but may be longer when an upstream element releases buffered audio
+        """
+        if not self._recorder:
+            return self._decode_chunk(chunk)
+
+        start = time.time()
+        try:
+            return self._decode_chunk(chunk)
+        finally:
+            self._recorder.record(chunk, start, time.time(), self._decoder.counters, self._decoder.search_options)
+
+    def enable_flight_recorder(self, directory, threshold=0.2, window=100, max_dumps=10):
+        """Keep the audio, decoder statistics and timings of the last chunks, and write them to disk when a chunk takes
+        longer than the threshold. See yapykaldi.asr.flight_recorder.replay_recording to profile a recording
+
+        :param directory: Directory to write the recordings to
+        :param threshold: (default 0.2) Seconds a chunk may take before the recent chunks are written
+        :param window: (default 100) Number of chunks kept
+        :param max_dumps: (default 10) Number of recordings to write at most
+        :return: (FlightRecorder) the recorder, e.g. for the paths of its recordings
+        """
+        self._recorder = FlightRecorder(directory, threshold=threshold, window=window, rate=self.rate,
+                                        chunksize=self.chunksize, max_dumps=max_dumps,
+                                        metadata={"model_dir": self.model_dir, "model_type": self.model_type,
+                                                  "stream": self.stream_id})
+        if self._decoder:
+            self._recorder.reset(self._decoder.counters)
+        return self._recorder
+
+    def _decode_chunk(self, chunk):
+        """Internal method decoding a chunk, see next_chunk"""
         try:
-            data = np.array(struct.unpack_from('<%dh' % self.chunksize, chunk), dtype=np.float32)
+            data = np.frombuffer(chunk, dtype='<i2').astype(np.float32)
         except Exception as e:  # pylint: disable=invalid-name, broad-except
             logger.error("Other exception happened: %s", e)
             raise
         else:
-            if self._decoder.decode(self.rate, data, self._finalize.is_set()):
+            self._chunk_time = time.time()
+            end_utterance = self._end_utterance.is_set() and not self._finalize.is_set()
+            final = self._finalize.is_set() or end_utterance
+            self._stream_samples += len(data)
+            if self._decode(data, final):
+                self._in_utterance = not final
                 if self._finalize.is_set():
                     logger.info("Finalized decoding with latest data chunk")
 
@@ -73,8 +144,17 @@ class Asr(AsrPipelineElementBase):
                     logger.info("Chunk volume level: %s", chunk_volume_level)
                     logger.info("Partially decoded (%s): %s", self._likelihood, self._decoded_string)
 
-                for callback in self._string_partially_recognized_callbacks:
-                    callback(self._decoded_string)
+                for i, callback in enumerate(self._string_partially_recognized_callbacks):
+                    self._call(callback, (self._decoded_string,), key=(id(self), i))
+
+                if end_utterance:
+                    self._end_utterance.clear()
+                    logger.info("Utterance result (%s): %s", self._likelihood, self._decoded_string)
+                    self._report_utterance()
+                elif self._continuous and not self._finalize.is_set() and self._decoder.endpoint_detected():
+                    self._commit_segment()
+                else:
+                    self._utterance_reported = False
 
                 return chunk
 
@@ -84,11 +164,113 @@ class Asr(AsrPipelineElementBase):
         """Stop ASR process"""
         logger.info("Stop ASR")
 
+        if self._in_utterance:
+            # the stream ended without a last chunk to finalize with
+            if self._finalize_utterance():
+                self._decoded_string, self._likelihood = self._decoder.get_decoded_string()
+            else:
+                logger.warning("Could not finalize the last utterance")
+
         logger.info("Decoding of input stream is complete")
         logger.info("Final result (%s): %s", self._likelihood, self._decoded_string)
 
+        if not self._utterance_reported:
+            self._report_utterance()
+
+        if self.second_pass == "deferred":
+            self._decoder.wait_second_pass()
+        if self._dispatcher:
+            self._dispatcher.wait()
+
+    def end_utterance(self):
+        """Finalize the current utterance with the next chunk and report it as a full recognition, without stopping
+        the ASR. Decoding continues with a new utterance from the chunk after."""
+        self._end_utterance.set()
+
+    def _decode(self, data, finalize, skip_blank=False):
+        """Internal method decoding samples, which tags the deferred second pass of a finalized GMM utterance with
+        the index the utterance is reported under
+
+        :param skip_blank: (default False) The utterance is not reported if its result is blank
+        :return: (bool) True if decoding succeeded
+        """
+        if self.model_type == 'gmm':
+            return self._decoder.decode(self.rate, data, finalize, utterance=self._utterance_index,
+                                        skip_blank=skip_blank)
+        return self._decoder.decode(self.rate, data, finalize)
+
+    def _finalize_utterance(self, skip_blank=False):
+        """Internal method to finalize the utterance in progress with the audio decoded so far
+
+        :param skip_blank: (default False) The utterance is not reported if its result is blank
+        :return: (bool) True if decoding succeeded
+        """
+        self._in_utterance = False
+        return self._decode(np.zeros(0, dtype=np.float32), True, skip_blank=skip_blank)
+
+    def _commit_segment(self):
+        """Internal method to finalize the segment up to an endpoint and report it, unless nothing was said"""
+        if not self._finalize_utterance(skip_blank=True):
+            # A stream running for hours should not end over one bad segment
+            logger.warning("Could not finalize segment, dropping it")
+            self._decoder.reset()
+            self._utterance_reported = True
+            self._utterance_start = self._stream_samples
+            return
+
+        self._decoded_string, self._likelihood = self._decoder.get_decoded_string()
+        if self._decoded_string.strip():
+            logger.info("Segment result (%s): %s", self._likelihood, self._decoded_string)
+            self._report_utterance()
+        else:
+            self._utterance_reported = True
+            self._utterance_start = self._stream_samples
+
+    def _report_utterance(self):
+        """Internal method to call the full recognition callbacks with the result of the finalized utterance"""
+        self._utterance_reported = True
         for callback in self._string_fully_recognized_callbacks:
-            callback(self._decoded_string)
+            self._call(callback, (self._decoded_string,))
+
+        if self._result_callbacks:
+            result = self._utterance_result()
+            for callback in self._result_callbacks:
+                self._call(callback, (result,))
+
+        self._utterance_index += 1
+        self._utterance_start = self._stream_samples
+
+    def _call(self, callback, args, key=None):
+        """Internal method to call a callback, through the dispatcher if there is one
+
+        :param key: (default None) Key of the dispatcher to coalesce calls by
+        """
+        if self._dispatcher:
+            self._dispatcher.dispatch(callback, *args, key=key)
+        else:
+            callback(*args)
+
+    def _utterance_result(self):
+        """Internal method to collect the result of the finalized utterance for the result callbacks"""
+        start = self._utterance_start / self.rate
+        words = []
+        alignment = self._decoder.get_word_alignment()
+        if alignment:
+            frame_shift = self._model.frame_shift
+            for word, time_, length in zip(*alignment):
+                if word and word != "<eps>":
+                    words.append([word, round(start + time_ * frame_shift, 3), round(length * frame_shift, 3)])
+
+        return {
+            "stream": self.stream_id,
+            "utterance": self._utterance_index,
+            "text": self._decoded_string.strip(),
+            "likelihood": self._likelihood,
+            "start": round(start, 3),
+            "end": round(self._stream_samples / self.rate, 3),
+            "words": words,
+            "latency": round(time.time() - self._chunk_time, 4) if self._chunk_time else None,
+        }
 
     def start(self):
         """Begin ASR process"""
@@ -96,6 +278,13 @@ class Asr(AsrPipelineElementBase):
         # Reset internal states at the start of a new call
 
         self._finalize.clear()
+        self._end_utterance.clear()
+        self._utterance_reported = False
+        self._utterance_index = 0
+        self._stream_samples = 0
+        self._utterance_start = 0
+        self._chunk_time = None
+        self._in_utterance = False
 
         logger.info("Trying to initialize %s model from %s", self.model_type, self.model_dir)
         self._model = ONLINE_MODELS[self.model_type](self.model_dir)
@@ -104,9 +293,20 @@ class Asr(AsrPipelineElementBase):
         logger.info("Trying to initialize %s model decoder", self.model_type)
         self._decoder = ONLINE_DECODERS[self.model_type](self._model)
         logger.info("Successfully initialized %s model decoder", self.model_type)
+        if self.model_type == 'nnet3':
+            # the results need the best path and word alignment only
+            self._decoder.set_lazy_lattice(True)
+        if self.model_type == 'gmm':
+            self._decoder.set_second_pass(self.second_pass)
+            for callback in self._second_pass_callbacks:
+                self._decoder.register_second_pass_callback(callback)
+        if self._continuous:
+            self._decoder.reset_adaptation_state(carry=True)
 
         self._decoded_string = ""
         self._likelihood = None
+        if self._recorder:
+            self._recorder.reset(self._decoder.counters)
 
     def register_callback(self, callback, partial=False):
         """
@@ -120,3 +320,32 @@ class Asr(AsrPipelineElementBase):
             self._string_partially_recognized_callbacks += [callback]
         else:
             self._string_fully_recognized_callbacks += [callback]
+
+    def register_result_callback(self, callback):
+        """
+        Register a callback to receive the structured result of every full recognition, e.g. a transcript sink.
+
+        :param callback: a function taking a dict with the keys stream, utterance (index in the stream), text,
+        likelihood, start and end (seconds into the stream), words (list of [word, start, duration], in seconds into
+        the stream) and latency (seconds from receiving the last chunk of the utterance to the result)
+        :return: None
+        """
+        self._result_callbacks += [callback]
+
+    def register_second_pass_callback(self, callback):
+        """
+        Register a callback to receive the results of deferred second passes, see the second_pass parameter. It is
+        called from a background thread.
+
+        :param callback: a function taking a dict, see KaldiGmmOnlineDecoder.register_second_pass_callback, with the
+        key stream added. Its utterance is the index the result callbacks report the utterance under, and blank
+        segments of a continuous stream, which are not reported, have no second pass result either
+        :return: None
+        """
+        def with_stream(result):
+            result["stream"] = self.stream_id
+            callback(result)
+
+        self._second_pass_callbacks += [with_stream]
+        if self._decoder and self.model_type == 'gmm':
+            self._decoder.register_second_pass_callback(with_stream)
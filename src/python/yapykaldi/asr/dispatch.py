@@ -0,0 +1,200 @@
+"""Dispatch of the callbacks of the ASR pipeline in a thread of their own"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+from builtins import *
+import time
+from collections import OrderedDict, deque
+from threading import Condition, Thread, current_thread
+from ..logger import logger
+
+
+class CallbackDispatcher(object):
+    """Calls callbacks in a background thread, in the order they were dispatched, so slow subscribers never hold up
+    decoding
+
+    Calls dispatched with a key, such as partial hypotheses, are coalesced: a new call with the same key replaces one
+    still pending, so a subscriber that falls behind only gets the latest partial hypothesis. When calls with more
+    than max_pending different keys are pending, the oldest of them is dropped. Calls without a key, such as final
+    results, are never dropped: when max_pending of them are pending, dispatching waits until the oldest one is made.
+    """
+    # pylint: disable=too-many-instance-attributes, useless-object-inheritance
+
+    def __init__(self, max_pending=1000, name="CallbackDispatcher"):
+        """
+        :param max_pending: (default 1000) Number of pending calls with a key from which the oldest ones are dropped,
+        and of pending calls without a key from which dispatching waits
+        :param name: (default "CallbackDispatcher") Name of the dispatching thread
+        """
+        self.max_pending = max_pending
+        self.name = name
+
+        self._condition = Condition()
+        # pending calls, as [callback, args, time dispatched, key]. Calls replaced by a newer one with the same key, or
+        # dropped, have their callback set to None, and are removed once they make up half of the queue
+        self._pending = deque()
+        # pending calls with a key, oldest first
+        self._pending_by_key = OrderedDict()
+        self._num_pending = 0
+        self._num_discarded = 0
+        self._busy = False
+        self._stopping = False
+        self._thread = None  # type: Thread
+
+        self._dispatched = 0
+        self._delivered = 0
+        self._coalesced = 0
+        self._dropped = 0
+        self._waits = 0
+        self._errors = 0
+        self._lag_total = 0.0
+        self._lag_max = 0.0
+        self._lag_last = 0.0
+
+    def dispatch(self, callback, *args, **kwargs):
+        """Queue a call of callback with args. Only waits for calls without a key, when max_pending of them are pending
+
+        :param callback: function to call
+        :param args: arguments of the call
+        :param key: (keyword only, default None) Key identifying calls that supersede each other, e.g. the partial
+        results of one subscriber. A pending call with the same key is replaced by this one
+        """
+        key = kwargs.pop("key", None)
+        if kwargs:
+            raise TypeError("Unexpected keyword arguments {}".format(sorted(kwargs)))
+
+        with self._condition:
+            if self._thread is None:
+                self._start()
+
+            self._dispatched += 1
+            if key is None:
+                # a callback dispatching from the dispatching thread would wait for itself
+                if self._num_pending - len(self._pending_by_key) >= self.max_pending and \
+                        current_thread() is not self._thread:
+                    self._waits += 1
+                    while self._num_pending - len(self._pending_by_key) >= self.max_pending:
+                        self._condition.wait()
+            else:
+                superseded = self._pending_by_key.pop(key, None)
+                if superseded is not None:
+                    self._discard(superseded)
+                    self._coalesced += 1
+                elif len(self._pending_by_key) >= self.max_pending:
+                    _, dropped = self._pending_by_key.popitem(last=False)
+                    self._discard(dropped)
+                    self._dropped += 1
+                    if self._dropped == 1 or self._dropped % 1000 == 0:
+                        logger.warning("%s fell behind, dropped %d callbacks so far", self.name, self._dropped)
+
+            call = [callback, args, time.time(), key]
+            self._pending.append(call)
+            self._num_pending += 1
+            if key is not None:
+                self._pending_by_key[key] = call
+            self._condition.notify_all()
+
+    def _start(self):
+        """Internal method starting the dispatching thread, with the condition held"""
+        self._stopping = False
+        self._thread = Thread(target=self._run, name=self.name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _discard(self, call):
+        """Internal method to take a pending call out of the queue, with the condition held"""
+        call[0] = None
+        self._num_pending -= 1
+        self._num_discarded += 1
+        if self._num_discarded > len(self._pending) // 2:
+            self._pending = deque(pending for pending in self._pending if pending[0] is not None)
+            self._num_discarded = 0
+
+    def _forget(self, call):
+        """Internal method removing a call from the pending calls by key, with the condition held"""
+        if call[3] is not None and self._pending_by_key.get(call[3]) is call:
+            del self._pending_by_key[call[3]]
+
+    def _run(self):
+        """Internal method calling the pending callbacks until stop"""
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopping:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                callback, args, dispatched, _ = call = self._pending.popleft()
+                self._forget(call)
+                if callback is None:
+                    self._num_discarded -= 1
+                    continue
+                self._num_pending -= 1
+                self._busy = True
+                lag = time.time() - dispatched
+                self._lag_last = lag
+                self._lag_total += lag
+                self._lag_max = max(self._lag_max, lag)
+
+            try:
+                callback(*args)
+            except Exception as e:  # pylint: disable=invalid-name, broad-except
+                self._errors += 1
+                logger.error("Callback %s failed: %s", getattr(callback, '__name__', callback), e)
+
+            with self._condition:
+                self._busy = False
+                self._delivered += 1
+                self._condition.notify_all()
+
+    def wait(self, timeout=None):
+        """Wait until the calls dispatched so far are done
+
+        :param timeout: (default None) Seconds to wait at most, None to wait as long as it takes
+        :return: (bool) True if no calls are pending
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while (self._pending or self._busy) and self._thread is not None:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    def stop(self, timeout=None):
+        """Call the pending callbacks and stop the dispatching thread. Dispatching again starts a new one
+
+        :param timeout: (default None) Seconds to wait for the pending callbacks
+        """
+        with self._condition:
+            thread = self._thread
+            self._stopping = True
+            self._condition.notify_all()
+        if thread is not None:
+            thread.join(timeout)
+        with self._condition:
+            if self._thread is thread:
+                self._thread = None
+
+    @property
+    def metrics(self):
+        """Counters of the dispatcher since it was created
+
+        Keys: dispatched, delivered, coalesced (calls replaced by a newer one with the same key), dropped (calls with
+        a key dropped because too many were pending), waits (dispatches of calls without a key that waited for room),
+        errors (callbacks that raised), pending, and the dispatch lag, the seconds from dispatching a call to making
+        it: lag_last, lag_mean and lag_max.
+
+        :return: (dict) metrics
+        """
+        with self._condition:
+            return {
+                "dispatched": self._dispatched,
+                "delivered": self._delivered,
+                "coalesced": self._coalesced,
+                "dropped": self._dropped,
+                "waits": self._waits,
+                "errors": self._errors,
+                "pending": self._num_pending,
+                "lag_last": self._lag_last,
+                "lag_mean": self._lag_total / self._delivered if self._delivered else 0.0,
+                "lag_max": self._lag_max,
+            }
@@ -0,0 +1,219 @@
+"""Flight recorder keeping the recent chunks of an Asr, dumped to disk when a chunk is slow, and their replay"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+from builtins import *
+import os
+import json
+import time
+from threading import Thread
+import numpy as np
+from ..logger import logger
+
+
+CHUNK_RECORD = np.dtype([
+    ("position", np.int64),         # position of the audio of the chunk in the audio ring
+    ("length", np.int32),           # samples of the chunk
+    ("wall", np.float64),           # time the chunk came in
+    ("total", np.float64),          # seconds Asr.next_chunk took
+    ("accept_waveform", np.float64),
+    ("advance_decoding", np.float64),
+    ("finalize", np.float64),
+    ("frames_decoded", np.int64),
+    ("active_tokens", np.int64),    # total over the frames decoded
+    ("utterances", np.int32),       # utterances finalized with the chunk
+    ("beam", np.float32),
+    ("max_active", np.int32),
+])
+
+STAGES = ("accept_waveform", "advance_decoding", "finalize")
+
+# the counters of a decoder, see KaldiNNet3OnlineDecoder.counters
+UTTERANCES, FRAMES_DECODED, ACTIVE_TOKENS, STAGE_SECONDS = 0, 1, 2, 3
+
+
+class FlightRecorder(object):
+    # pylint: disable=too-many-instance-attributes, useless-object-inheritance
+
+    def __init__(self, directory, threshold=0.2, window=100, rate=16000, chunksize=1024, max_dumps=10, metadata=None):
+        """Rolling record of the last chunks of a stream: their audio, decoder statistics and timings per stage, in
+        arrays allocated once. When a chunk takes longer than the threshold, the window is written to a .npz file in
+        the background, which replay_recording feeds back through a decoder configured the same way.
+
+        :param directory: Directory to write the recordings to
+        :param threshold: (default 0.2) Seconds a chunk may take before the window is dumped
+        :param window: (default 100) Number of chunks kept
+        :param rate: (default 16000) Sampling frequency of the audio
+        :param chunksize: (default 1024) Usual size of the chunks. The audio ring holds twice window chunks of this
+        size, so longer chunks fit too
+        :param max_dumps: (default 10) Number of recordings to write at most
+        :param metadata: (default None) Dict of the decoder configuration to store in the recordings, e.g. model_dir
+        and model_type
+        """
+        self.directory = directory
+        self.threshold = threshold
+        self.window = window
+        self.rate = rate
+        self.max_dumps = max_dumps
+        self.metadata = metadata or {}
+        self.dumps = []
+
+        self._audio = np.zeros(2 * window * chunksize, dtype=np.int16)
+        self._audio_pos = 0
+        self._records = np.zeros(window, dtype=CHUNK_RECORD)
+        self._count = 0
+        self._next_dump = 0
+        self._last_counters = None
+        self._writers = []
+
+    def reset(self, counters=None):
+        """Start over, e.g. for a new stream
+
+        :param counters: (default None) Counters of the decoder as the stream starts, see
+        KaldiNNet3OnlineDecoder.counters
+        """
+        self._audio_pos = 0
+        self._count = 0
+        self._next_dump = 0
+        self._last_counters = counters
+
+    def record(self, chunk, start, end, counters, search_options=None):
+        """Record a chunk, and dump the window if it was slow
+
+        :param chunk: (bytes) the chunk, as 16 bit little endian PCM
+        :param start: (float) time the chunk came in
+        :param end: (float) time it was done with
+        :param counters: (tuple) counters of the decoder after the chunk, see KaldiNNet3OnlineDecoder.counters
+        :param search_options: (default None) (beam, max_active, lattice_beam) the chunk was decoded with
+        :return: (str) path of the recording if one is written, else None
+        """
+        samples = np.frombuffer(chunk, dtype='<i2')
+        capacity = len(self._audio)
+        if len(samples) > capacity:
+            samples = samples[-capacity:]
+        count = len(samples)
+        offset = self._audio_pos % capacity
+        first = min(count, capacity - offset)
+        self._audio[offset:offset + first] = samples[:first]
+        self._audio[:count - first] = samples[first:]
+
+        record = self._records[self._count % self.window]
+        record["position"] = self._audio_pos
+        record["length"] = count
+        record["wall"] = start
+        record["total"] = end - start
+        last = self._last_counters or counters
+        for i, stage in enumerate(STAGES):
+            record[stage] = counters[STAGE_SECONDS + i] - last[STAGE_SECONDS + i]
+        record["frames_decoded"] = counters[FRAMES_DECODED] - last[FRAMES_DECODED]
+        record["active_tokens"] = counters[ACTIVE_TOKENS] - last[ACTIVE_TOKENS]
+        record["utterances"] = counters[UTTERANCES] - last[UTTERANCES]
+        if search_options:
+            record["beam"], record["max_active"] = search_options[0], search_options[1]
+        self._last_counters = counters
+        self._audio_pos += count
+        self._count += 1
+
+        if end - start > self.threshold and self._count >= self._next_dump and len(self.dumps) < self.max_dumps:
+            return self.dump("chunk took {:.3f}s".format(end - start))
+        return None
+
+    def dump(self, reason=""):
+        """Write the window to disk, in a background thread
+
+        :param reason: (default "") Why the window is dumped, stored with it
+        :return: (str) path of the recording
+        """
+        order = np.arange(max(0, self._count - self.window), self._count) % self.window
+        records = self._records[order].copy()
+        # leave out chunks whose audio has been overwritten since
+        records = records[records["position"] >= self._audio_pos - len(self._audio)]
+        if len(records):
+            offsets = records["position"][0] + np.arange(self._audio_pos - records["position"][0])
+            audio = self._audio[offsets % len(self._audio)]
+            records["position"] -= records["position"][0]
+        else:
+            audio = np.zeros(0, dtype=np.int16)
+
+        meta = dict(self.metadata, rate=self.rate, threshold=self.threshold, reason=reason, time=time.time())
+        path = os.path.join(self.directory, "flight-{}-{}.npz".format(time.strftime("%Y%m%d-%H%M%S"), len(self.dumps)))
+        self.dumps.append(path)
+        # dumps do not overlap
+        self._next_dump = self._count + self.window
+
+        writer = Thread(target=self._write, args=(path, audio, records, meta))
+        writer.daemon = True
+        writer.start()
+        self._writers = [thread for thread in self._writers if thread.is_alive()] + [writer]
+        return path
+
+    @staticmethod
+    def _write(path, audio, records, meta):
+        """Internal method writing a recording"""
+        try:
+            np.savez(path, audio=audio, chunks=records, meta=np.array(json.dumps(meta)))
+            logger.warning("Slow chunk, recorded the last %d chunks in %s", len(records), path)
+        except (IOError, OSError) as e:  # pylint: disable=invalid-name
+            logger.error("Could not write flight recording %s: %s", path, e)
+
+    def close(self):
+        """Wait for the recordings being written"""
+        for writer in self._writers:
+            writer.join()
+        self._writers = []
+
+
+def load_recording(path):
+    """Load a recording of a FlightRecorder
+
+    :param path: Path of the .npz file
+    :return: (dict, numpy.ndarray, numpy.ndarray) metadata, chunk records (see CHUNK_RECORD) and 16 bit audio
+    """
+    with np.load(path) as recording:
+        return json.loads(str(recording["meta"])), recording["chunks"], recording["audio"]
+
+
+def replay_recording(path, model=None):
+    """Feed the chunks of a recording through a new decoder, the way Asr decoded them, and time them again
+
+    The decoder starts a new utterance with the first chunk of the recording, so chunks early in an utterance that
+    began before the window are decoded with less history than they were live.
+
+    :param path: Path of the .npz file
+    :param model: (default None) Model to decode with. None loads the model_dir and model_type of the recording
+    :return: (list) dict per chunk with its recorded and replayed timings, frames_decoded and active_tokens
+    """
+    from .asr import ONLINE_MODELS, ONLINE_DECODERS  # pylint: disable=import-outside-toplevel
+
+    meta, records, audio = load_recording(path)
+    model_type = meta.get("model_type", "nnet3")
+    if model is None:
+        model = ONLINE_MODELS[model_type](meta["model_dir"])
+    decoder = ONLINE_DECODERS[model_type](model)
+    rate = meta["rate"]
+
+    replayed = []
+    for record in records:
+        samples = audio[record["position"]:record["position"] + record["length"]].astype(np.float32)
+        beam, max_active, _ = decoder.search_options
+        if record["max_active"] and (abs(beam - record["beam"]) > 1e-3 or max_active != record["max_active"]):
+            decoder.set_search_options(float(record["beam"]), int(record["max_active"]))
+
+        before = decoder.counters
+        start = time.time()
+        ok = decoder.decode(rate, samples, False)
+        if ok and record["utterances"]:
+            ok = decoder.decode(rate, np.zeros(0, dtype=np.float32), True)
+        decoder.get_decoded_string()
+        total = time.time() - start
+        after = decoder.counters
+
+        result = {"recorded_" + name: record[name].item() for name in ("total",) + STAGES}
+        result["total"] = total
+        for i, stage in enumerate(STAGES):
+            result[stage] = after[STAGE_SECONDS + i] - before[STAGE_SECONDS + i]
+        result["frames_decoded"] = after[FRAMES_DECODED] - before[FRAMES_DECODED]
+        result["active_tokens"] = after[ACTIVE_TOKENS] - before[ACTIVE_TOKENS]
+        result["ok"] = ok
+        replayed.append(result)
+        if not ok:
+            decoder.reset()
+    return replayed
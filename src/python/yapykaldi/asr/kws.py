@@ -0,0 +1,160 @@
+"""
+Yapykaldi ASR: Keyword spotting element that gates the audio going to a full ASR element
+"""
+from __future__ import (print_function, division, absolute_import, unicode_literals)
+from builtins import *
+from collections import deque
+import numpy as np
+from ._base import AsrPipelineElementBase
+from ..logger import logger
+from ..nnet3 import KaldiNNet3OnlineDecoder, KaldiNNet3OnlineModel
+
+
+class KeywordSpotter(AsrPipelineElementBase):
+    """Lightweight keyword spotter in front of an Asr element
+
+    Audio is decoded with a small keyword graph and a narrow beam. Until one of the keywords is recognized, no audio
+    is passed on to the sink. When a keyword fires, the buffered pre-roll audio and the audio of the following
+    listen_time seconds are passed on, after which the utterance of the sink is ended and spotting resumes.
+    """
+    # pylint: disable=too-many-instance-attributes, too-many-arguments
+
+    def __init__(self, model_dir, keywords, model='kws', beam=5.0, max_active=1000, min_active=50, lattice_beam=2.0,
+                 preroll_time=1.0, listen_time=5.0, reset_time=10.0, rate=16000, chunksize=1024, source=None,
+                 sink=None):
+        """
+        :param model_dir: Path to nnet3 model directory
+        :param keywords: Words that trigger the sink, as they appear in the words.txt of the keyword graph
+        :param model: (default 'kws') Name of the directory in model_dir with final.mdl and the keyword graph
+        :param beam: (default 5.0) Decoding beam of the keyword search
+        :param max_active: (default 1000) Maximum number of active tokens of the keyword search
+        :param min_active: (default 50) Minimum number of active tokens of the keyword search
+        :param lattice_beam: (default 2.0) Lattice beam of the keyword search
+        :param preroll_time: (default 1.0) Seconds of audio before the keyword that are passed on to the sink
+        :param listen_time: (default 5.0) Seconds of audio after the keyword that are passed on to the sink
+        :param reset_time: (default 10.0) Seconds after which the keyword search is restarted when nothing fired. The
+        new search starts with the pre-roll audio, so reset_time must be longer than preroll_time
+        :param rate: (default 16000) sampling frequency of audio data. This must be the same as the audio source
+        :param chunksize: (default 1024) size of audio data buffer. This must be the same as the audio source
+        :param source: (default None) Element to be connected as source when constructing an AsrPipeline
+        :type source: AsrPipelineElementBase
+        :param sink: (default None) Element to be connected as sink, usually an Asr element
+        :type sink: AsrPipelineElementBase
+        """
+        super().__init__(chunksize=chunksize, rate=rate, source=source, sink=sink)
+        if reset_time <= preroll_time:
+            raise Exception("reset_time {} must be longer than preroll_time {}".format(reset_time, preroll_time))
+        self.model_dir = model_dir
+        self.model = model
+        self.keywords = set(keywords)
+        self.beam = beam
+        self.max_active = max_active
+        self.min_active = min_active
+        self.lattice_beam = lattice_beam
+
+        self._preroll = deque(maxlen=max(1, int(preroll_time * rate / chunksize)))
+        self._listen_samples = int(listen_time * rate)
+        self._reset_samples = int(reset_time * rate)
+
+        self._model = None
+        self._decoder = None
+        self._listening = False
+        self._listened_samples = 0
+        self._spotted_samples = 0
+
+        self._keyword_callbacks = []
+
+    def open(self):
+        # No definition for this method while inheriting abstract class AsrPipelineElementBase
+        pass
+
+    def close(self):
+        # No definition for this method while inheriting abstract class AsrPipelineElementBase
+        pass
+
+    def start(self):
+        """Load the keyword model and start spotting"""
+        self._finalize.clear()
+
+        logger.info("Trying to initialize keyword model from %s", self.model_dir)
+        self._model = KaldiNNet3OnlineModel(self.model_dir, model=self.model, beam=self.beam,
+                                            max_active=self.max_active, min_active=self.min_active,
+                                            lattice_beam=self.lattice_beam)
+        self._decoder = KaldiNNet3OnlineDecoder(self._model)
+        logger.info("Successfully initialized keyword model from %s", self.model_dir)
+
+        self._preroll.clear()
+        self._listening = False
+        self._listened_samples = 0
+        self._spotted_samples = 0
+
+    def next_chunk(self, chunk):
+        """Spot keywords in the chunk. Returns the audio for the sink, or None while no keyword fired"""
+        num_samples = len(chunk) // 2
+
+        if self._listening:
+            self._listened_samples += num_samples
+            if self._listened_samples >= self._listen_samples:
+                logger.info("Keyword listen time is over")
+                self._listening = False
+                if hasattr(self._sink, 'end_utterance'):
+                    self._sink.end_utterance()
+            return chunk
+
+        self._preroll.append(chunk)
+        if self._finalize.is_set():
+            return None
+
+        self._decode(chunk)
+
+        decoded_string, _ = self._decoder.get_decoded_string()
+        spotted = self.keywords.intersection(decoded_string.split())
+        if spotted:
+            keyword = sorted(spotted)[0]
+            logger.info("Spotted keyword '%s'", keyword)
+            self._restart_search()
+
+            self._listening = True
+            self._listened_samples = 0
+
+            for callback in self._keyword_callbacks:
+                callback(keyword)
+
+            preroll = b''.join(bytes(c) for c in self._preroll)
+            self._preroll.clear()
+            return preroll
+
+        if self._spotted_samples >= self._reset_samples:
+            # Keep the keyword search short, its traceback grows with the utterance. The new search starts with the
+            # pre-roll audio, so it overlaps the old one and a keyword spanning the restart is still spotted
+            self._restart_search()
+            for buffered in self._preroll:
+                self._decode(buffered)
+
+        return None
+
+    def stop(self):
+        """Stop spotting keywords"""
+        logger.info("Stop keyword spotting")
+        self._restart_search()
+
+    def register_callback(self, callback):
+        """
+        Register a callback that is called with the keyword whenever a keyword fires
+
+        :param callback: a function taking a single string as it's parameter
+        """
+        self._keyword_callbacks += [callback]
+
+    def _decode(self, chunk):
+        """Internal method to decode a chunk with the keyword search"""
+        data = np.frombuffer(chunk, dtype='<i2').astype(np.float32)
+        if not self._decoder.decode(self.rate, data, False):
+            raise RuntimeError("Keyword decoding failed")
+        self._spotted_samples += len(chunk) // 2
+
+    def _restart_search(self):
+        """Internal method to start a new keyword search"""
+        if self._decoder:
+            self._decoder.reset()
+        self._spotted_samples = 0
@@ -9,7 +9,13 @@ class AsrPipeline(object):
     """Class AsrPipeline"""
     # pylint: disable=useless-object-inheritance
 
-    def __init__(self):
+    def __init__(self, dispatcher=None):
+        """
+        :param dispatcher: (default None) CallbackDispatcher to call the callbacks from, so slow callbacks do not hold
+        up the pipeline. None calls them after every iteration, in the thread of the pipeline
+        :type dispatcher: CallbackDispatcher
+        """
+        self._dispatcher = dispatcher
         self._source = None
         self._sink = None
         self._elements = []
@@ -108,10 +114,17 @@ class AsrPipeline(object):
                     self._stop_state.set()
                     return
 
+                # An element returning no chunk holds the data back from the rest of the pipeline
+                if chunk is None:
+                    break
+
             self._iterations += 1
 
             for callback in self._callbacks:
-                callback()
+                if self._dispatcher:
+                    self._dispatcher.dispatch(callback)
+                else:
+                    callback()
 
     def stop(self):
         """Stop the flow of data across the pipeline.
@@ -134,6 +147,9 @@ class AsrPipeline(object):
             element.stop()
             element = element._sink
 
+        if self._dispatcher:
+            # the callbacks of the last chunks and results are done when start returns
+            self._dispatcher.wait()
         logger.info("Successfully stopped the pipeline")
 
     def _set_finalize(self):
@@ -1,9 +1,22 @@
 """Audio sinks supported by Yapykaldi"""
 from __future__ import absolute_import, division, print_function, unicode_literals
 from builtins import *
+import io
+import os
+import json
+import time
 import wave
+from abc import abstractmethod
+from threading import Thread
+from queue import Empty, Queue
 import pyaudio
 from ._base import AsrPipelineElementBase
+from ..logger import logger
+
+try:
+    from typing import Optional
+except ImportError:
+    pass
 
 
 class WaveFileSink(AsrPipelineElementBase):
@@ -56,3 +69,129 @@ class WaveFileSink(AsrPipelineElementBase):
         self._wavf.close()
         self.frames = []
         self._wavf = None
+
+
+class TranscriptSink(AsrPipelineElementBase):
+    """Base class for sinks writing the results of an Asr to a file
+
+    Linked as the sink of an Asr, the element registers itself for the results of the Asr and passes the audio chunks
+    on. Elsewhere in a pipeline, register write_result with Asr.register_result_callback instead. Results are
+    formatted in the decoding thread and written by a background thread, which syncs the file to disk in batches, so
+    writing never blocks decoding.
+    """
+
+    def __init__(self, path, fsync_interval=1.0, source=None, sink=None):
+        """
+        :param path: Path of the transcript file. Results are appended to it
+        :param fsync_interval: (default 1.0) Seconds between syncs of the file to disk. 0 syncs after every batch of
+        results, None leaves syncing to the operating system
+        :param source: (default None) Asr to be connected as source
+        :type source: AsrPipelineElementBase
+        :param sink: (default None) Element to be connected as sink
+        :type sink: AsrPipelineElementBase
+        """
+        self.path = path
+        self.fsync_interval = fsync_interval
+
+        self._file = None
+        self._queue = Queue()
+        self._writer = None  # type: Optional[Thread]
+        super().__init__(source=source, sink=sink)
+
+    def link(self, source=None, sink=None):
+        linked = self._source
+        super().link(source=source, sink=sink)
+        if not linked and self._source and hasattr(self._source, 'register_result_callback'):
+            self._source.register_result_callback(self.write_result)
+
+    @abstractmethod
+    def format_result(self, result):
+        """Abstract method to format a result, see Asr.register_result_callback, as lines of the file
+
+        :return: (str) text to append to the file
+        """
+
+    def write_result(self, result):
+        """Queue a result for writing
+
+        :param result: (dict) result of an Asr, see Asr.register_result_callback
+        """
+        self._queue.put(self.format_result(result))
+
+    def open(self):
+        if not self._file:
+            self._file = io.open(self.path, 'a', encoding='utf-8')
+            self._writer = Thread(target=self._write)
+            self._writer.daemon = True
+            self._writer.start()
+            logger.info("Transcript opened at %s", self.path)
+
+    def next_chunk(self, chunk):
+        return chunk
+
+    def _write(self):
+        """Internal method writing queued results in batches until close"""
+        last_sync = time.time()
+        unsynced = False
+        stop = False
+        while not stop:
+            try:
+                batch = [self._queue.get(block=True, timeout=self.fsync_interval or 1.0)]
+            except Empty:
+                batch = []
+            while True:
+                try:
+                    batch.append(self._queue.get(block=False))
+                except Empty:
+                    break
+
+            if None in batch:
+                batch = batch[:batch.index(None)]
+                stop = True
+            if batch:
+                self._file.write("".join(batch))
+                self._file.flush()
+                unsynced = True
+
+            if unsynced and self.fsync_interval is not None:
+                if stop or time.time() - last_sync >= self.fsync_interval:
+                    os.fsync(self._file.fileno())
+                    last_sync = time.time()
+                    unsynced = False
+
+    def close(self):
+        if self._file:
+            self._queue.put(None)
+            self._writer.join()
+            self._file.close()
+            self._file = None
+            self._writer = None
+            logger.info("Transcript closed at %s", self.path)
+
+
+class JsonlTranscriptSink(TranscriptSink):
+    """Transcript with one JSON object per utterance, as passed to the result callbacks of Asr"""
+
+    def format_result(self, result):
+        return json.dumps(result, ensure_ascii=False) + "\n"
+
+
+class CtmTranscriptSink(TranscriptSink):
+    """Transcript in CTM format, one "stream channel start duration word" line per word"""
+
+    def __init__(self, path, channel=1, fsync_interval=1.0, source=None, sink=None):
+        """
+        :param path: Path of the transcript file. Results are appended to it
+        :param channel: (default 1) Channel written in the second column
+        :param fsync_interval: (default 1.0) Seconds between syncs of the file to disk, see TranscriptSink
+        :param source: (default None) Asr to be connected as source
+        :type source: AsrPipelineElementBase
+        :param sink: (default None) Element to be connected as sink
+        :type sink: AsrPipelineElementBase
+        """
+        self.channel = channel
+        super().__init__(path, fsync_interval=fsync_interval, source=source, sink=sink)
+
+    def format_result(self, result):
+        return "".join("{} {} {:.3f} {:.3f} {}\n".format(result["stream"], self.channel, start, duration, word)
+                       for word, start, duration in result["words"])
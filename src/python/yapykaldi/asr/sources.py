@@ -5,6 +5,8 @@ import math
 import wave
 from threading import Event, Thread
 from queue import Empty, Queue
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
 import pyaudio
 
 from ._base import AsrPipelineElementBase
@@ -15,6 +17,11 @@ try:
 except ImportError:
     pass
 
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
 
 class PyAudioMicrophoneSource(AsrPipelineElementBase):
     def __init__(self, fmt=pyaudio.paInt16, channels=1, rate=16000, chunksize=1024, timeout=1, sink=None):
@@ -137,3 +144,165 @@ class WaveFileSource(AsrPipelineElementBase):
         self.total_num_frames = None
         self.total_chunks = None
         self.read_chunks = None
+
+
+class SoundFileSource(AsrPipelineElementBase):
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, filename, rate=16000, chunksize=1024, offset=0.0, duration=None, sink=None):
+        """Stream a compressed audio file, e.g. FLAC or Ogg Opus, decoding it chunk by chunk. Needs the soundfile
+        package, and libsndfile 1.0.31 or later for Opus.
+
+        Files sampled at another frequency, such as Opus at 48 kHz or CD audio at 44.1 kHz, are resampled on the way
+        by a polyphase low-pass filter, which only computes the output samples, and several channels are mixed down
+        to one. Decoding, mixing and resampling work in buffers allocated once when the file is opened.
+
+        :param filename: path to the audio file
+        :type filename: str
+        :param rate: (default 16000) sampling frequency of audio data
+        :param chunksize: (default 1024) size of audio data buffer
+        :param offset: (default 0.0) Seconds into the file to start streaming from
+        :param duration: (default None) Seconds to stream, None up to the end of the file
+        :param sink: Element to be connected as sink
+        :type sink: AsrPipelineElementBase
+        """
+        super().__init__(rate=rate, chunksize=chunksize, sink=sink)
+        self.filename = filename
+        self.offset = offset
+        self.duration = duration
+
+        self.soundf = None
+        # the file is resampled by up / down, in lowest terms
+        self.up = None
+        self.down = None
+        self.remaining_frames = None
+        self._frames = None
+        self._mono = None
+        self._phases = None
+        self._filter_input = None
+        self._filtered = None
+        # position of the next output sample in the upsampled frames of the file, from the first frame of the next
+        # chunk on
+        self._position = 0
+        self._out = np.zeros(chunksize, dtype=np.int16)
+
+    def open(self):
+        if soundfile is None:
+            raise Exception("Streaming compressed audio needs the soundfile package")
+        if self.soundf:
+            logger.error("Stream already open from %s. Call the close() method first", self.filename)
+            return
+
+        self.soundf = soundfile.SoundFile(self.filename, 'r')
+        divisor = math.gcd(self.rate, self.soundf.samplerate)
+        self.up, self.down = self.rate // divisor, self.soundf.samplerate // divisor
+
+        # frames of the file a chunk takes at most, see next_chunk
+        max_frames = (self.chunksize * self.down + self.up - 1) // self.up
+        self._frames = np.zeros((max_frames, self.soundf.channels), dtype=np.int16)
+        if self.up > 1 or self.down > 1:
+            # designed at the upsampled frequency, with the gain of the zeros the upsampling inserts
+            taps = _lowpass_filter(max(self.up, self.down)) * self.up
+            width = (len(taps) + self.up - 1) // self.up
+            taps = np.concatenate([taps, np.zeros(width * self.up - len(taps), dtype=np.float32)])
+            # row p holds the taps of phase p, every up-th one from p, reversed to take the dot products of the
+            # windows of the filter input with it
+            self._phases = taps.reshape(width, self.up).T[:, ::-1].copy()
+            # the last frames of the previous chunk, as far as the filter reaches back, then those of this chunk
+            self._filter_input = np.zeros(width - 1 + max_frames, dtype=np.float32)
+            self._mono = self._filter_input[width - 1:]
+            self._filtered = np.zeros(self.chunksize, dtype=np.float32)
+        else:
+            self._mono = np.zeros(self.chunksize, dtype=np.float32)
+        logger.info("Stream opened from %s (%d Hz, %d channels)", self.filename, self.soundf.samplerate,
+                    self.soundf.channels)
+
+    def start(self):
+        self.seek(self.offset)
+        if self.duration is None:
+            self.remaining_frames = self.soundf.frames - self.soundf.tell()
+        else:
+            self.remaining_frames = int(self.duration * self.soundf.samplerate)
+
+    def seek(self, seconds):
+        """Continue streaming from a position in the file. Only the blocks of the file from there on are decoded
+
+        :param seconds: Seconds into the file
+        """
+        self.soundf.seek(min(int(seconds * self.soundf.samplerate), self.soundf.frames))
+        self._position = 0
+        if self._filter_input is not None:
+            self._filter_input[:self._phases.shape[1] - 1] = 0
+
+    def next_chunk(self, chunk=None):
+        if self._phases is None:
+            wanted = self.chunksize
+        else:
+            # up to the frame the last output sample of the chunk falls on
+            wanted = (self._position + (self.chunksize - 1) * self.down) // self.up + 1
+        wanted = min(wanted, self.remaining_frames)
+        if wanted <= 0:
+            raise StopIteration()
+        read = len(self.soundf.read(wanted, dtype='int16', always_2d=True, out=self._frames[:wanted]))
+        if read == 0:
+            raise StopIteration()
+        self.remaining_frames -= read
+
+        mono = self._mono[:read]
+        mono[:] = self._frames[:read, 0]
+        if self.soundf.channels > 1:
+            # channel by channel, as np.mean converts the whole chunk in a temporary array
+            for channel in range(1, self.soundf.channels):
+                np.add(mono, self._frames[:read, channel], out=mono)
+            np.multiply(mono, 1.0 / self.soundf.channels, out=mono)
+
+        if self._phases is not None:
+            samples = self._resample(read)
+        else:
+            samples = mono
+
+        out = self._out[:len(samples)]
+        np.rint(samples, out=samples)
+        np.clip(samples, -32768, 32767, out=samples)
+        out[:] = samples
+        return out.tobytes()
+
+    def _resample(self, read):
+        """Internal method filtering the frames read into the filter input at the output samples they reach
+
+        Output sample i of the chunk falls on position + i * down in the upsampled frames. The samples q * up + r
+        for a remainder r share the phase of the filter, on windows of the filter input down frames apart, so each
+        phase is the product of a strided view of its windows with its taps.
+        """
+        width = self._phases.shape[1]
+        num_samples = max(0, (read * self.up - self._position + self.down - 1) // self.down)
+        itemsize = self._filter_input.itemsize
+        for r in range(min(self.up, num_samples)):
+            position = self._position + r * self.down
+            # the window ends at the frame the sample falls on
+            windows = as_strided(self._filter_input[position // self.up:],
+                                 shape=((num_samples - r + self.up - 1) // self.up, width),
+                                 strides=(self.down * itemsize, itemsize))
+            np.matmul(windows, self._phases[position % self.up], out=self._filtered[r:num_samples:self.up])
+        self._position += num_samples * self.down - read * self.up
+
+        # the filter continues over the end of the chunk into the next one
+        self._filter_input[:width - 1] = self._filter_input[read:read + width - 1]
+        return self._filtered[:num_samples]
+
+    def close(self):
+        if self.soundf:
+            self.soundf.close()
+            logger.info("Stream closed from %s", self.filename)
+
+        self.soundf = None
+        self.remaining_frames = None
+
+
+def _lowpass_filter(factor, taps_per_factor=16):
+    """Internal function designing a windowed sinc low-pass filter to resample by factor, at the higher frequency"""
+    num_taps = taps_per_factor * factor + 1
+    cutoff = 0.9 / factor / 2
+    n = np.arange(num_taps) - (num_taps - 1) / 2
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(num_taps)
+    return (taps / taps.sum()).astype(np.float32)
@@ -0,0 +1,147 @@
+"""
+Adaptive search beam for streaming decoding
+
+A decoder that gets its audio in real time falls behind when decoding a chunk takes longer than the chunk lasts.
+BeamController tracks that lag and narrows the beam and max_active of the search while the decoder is behind, trading
+some accuracy for latency, and widens them again once decoding runs faster than real time.
+"""
+import time
+
+
+__all__ = ["BeamController", "BeamControlMixin"]
+
+
+class BeamController(object):
+    def __init__(self, beam, max_active, min_beam, min_max_active, max_lag=0.5, relax_rtf=0.5, num_steps=10,
+                 min_active=0):
+        """
+        :param beam: Widest beam, used while the decoder keeps up
+        :param max_active: Largest max_active, used while the decoder keeps up
+        :param min_beam: Narrowest beam, above 0
+        :param min_max_active: Smallest max_active, above min_active
+        :param max_lag: (default 0.5) Lag in seconds behind real time from which the search is narrowed
+        :param relax_rtf: (default 0.5) Real-time factor of a chunk below which the search is widened again, once the
+        lag is caught up
+        :param num_steps: (default 10) Number of steps from the widest to the narrowest search, one step per chunk
+        :param min_active: (default 0) Minimum number of active tokens per frame of the decoder. The search keeps that
+        many tokens whatever max_active is, so a max_active at or below it would not narrow the search any further
+        """
+        if not 0 < min_beam <= beam or not 0 < min_max_active <= max_active:
+            raise Exception("Invalid beam bounds: beam {} to {}, max_active {} to {}".format(
+                min_beam, beam, min_max_active, max_active))
+        if min_max_active <= min_active:
+            raise Exception("Smallest max_active {} is not above the min_active {} of the decoder".format(
+                min_max_active, min_active))
+        self.beam = beam
+        self.max_active = max_active
+        self.min_beam = min_beam
+        self.min_max_active = min_max_active
+        self.max_lag = max_lag
+        self.relax_rtf = relax_rtf
+        self.num_steps = num_steps
+
+        self.lag = 0.0
+        self.level = 0
+
+    def update(self, audio_seconds, decode_seconds):
+        """Account for a decoded chunk of audio
+
+        :param audio_seconds: Duration of the chunk
+        :param decode_seconds: Wall time it took to decode the chunk
+        :return: (beam, max_active) to decode with from now on, or None to keep the current ones
+        """
+        # Audio arrives in real time, so while decoding is slower than the audio the backlog grows
+        self.lag = max(0.0, self.lag + decode_seconds - audio_seconds)
+
+        level = self.level
+        if self.lag > self.max_lag:
+            level = min(self.num_steps, level + 1)
+        elif self.lag == 0.0 and decode_seconds < self.relax_rtf * audio_seconds:
+            level = max(0, level - 1)
+        if level == self.level:
+            return None
+        self.level = level
+        return self.search_options
+
+    @property
+    def search_options(self):
+        """(beam, max_active) for the current lag, the beam narrowed linearly and max_active geometrically"""
+        fraction = float(self.level) / self.num_steps
+        beam = self.beam - fraction * (self.beam - self.min_beam)
+        max_active = int(round(self.max_active * (float(self.min_max_active) / self.max_active) ** fraction))
+        return beam, max_active
+
+    def reset(self):
+        """Forget the lag, e.g. after a pause in the audio, and go back to the widest search"""
+        self.lag = 0.0
+        self.level = 0
+
+
+class BeamControlMixin(object):
+    """Search options and beam control of a decoder, for the decoder classes. They decode with self.decoder_wrapper
+    and keep their model, with its min_active, in self.model"""
+
+    def decode(self, samp_freq, samples, finalize):
+        """Decode a chunk of samples of the utterance in progress, adapting the search options to the lag behind real
+        time if beam control is enabled
+
+        :param samp_freq: Sampling frequency of the samples
+        :param samples: float32 numpy array of the samples
+        :param finalize: Finalize the utterance with this chunk
+        :return: (bool) True if decoding succeeded
+        """
+        self._cached_result = None
+        if not self.beam_controller:
+            return self.decoder_wrapper.decode(samp_freq, samples, finalize)
+
+        start = time.time()
+        result = self.decoder_wrapper.decode(samp_freq, samples, finalize)
+        options = self.beam_controller.update(len(samples) / float(samp_freq), time.time() - start)
+        if options:
+            self.set_search_options(*options)
+        return result
+
+    def set_search_options(self, beam=None, max_active=None, lattice_beam=None):
+        """Change the search options of the decoder, which start out as configured in the model. The nnet3 decoder
+        applies them to the utterance in progress right away, the GMM decoder from the next utterance on.
+
+        :param beam: (default None) Decoding beam, None to keep it
+        :param max_active: (default None) Maximum number of active tokens per frame, None to keep it
+        :param lattice_beam: (default None) Lattice generation beam, None to keep it
+        """
+        current = self.search_options
+        self.decoder_wrapper.set_search_options(beam if beam is not None else current[0],
+                                                max_active if max_active is not None else current[1],
+                                                lattice_beam if lattice_beam is not None else current[2])
+
+    @property
+    def search_options(self):
+        """(beam, max_active, lattice_beam) the decoder searches with"""
+        return tuple(self.decoder_wrapper.get_search_options())
+
+    def enable_beam_control(self, min_beam, min_max_active, max_lag=0.5, relax_rtf=0.5, num_steps=10):
+        """Narrow the beam and max_active while decoding falls behind real time, and widen them again, up to the
+        current search options, when it catches up. See BeamController. A GMM decoder applies new search options
+        from the next utterance on, so its search adapts from one utterance to the next
+
+        :param min_beam: Narrowest beam, above 0
+        :param min_max_active: Smallest max_active, above the min_active of the model
+        :param max_lag: (default 0.5) Lag in seconds behind real time from which the search is narrowed
+        :param relax_rtf: (default 0.5) Real-time factor of a chunk below which the search is widened again
+        :param num_steps: (default 10) Number of steps from the widest to the narrowest search, one step per chunk
+        :return: (BeamController) the controller, e.g. to watch its lag
+        """
+        beam, max_active, _ = self.search_options
+        if self.beam_controller:
+            beam, max_active = self.beam_controller.beam, self.beam_controller.max_active
+        controller = BeamController(beam, max_active, min_beam, min_max_active, max_lag=max_lag, relax_rtf=relax_rtf,
+                                    num_steps=num_steps, min_active=self.model.min_active)
+        self.disable_beam_control()
+        self.beam_controller = controller
+        return self.beam_controller
+
+    def disable_beam_control(self):
+        """Stop adapting the search options and go back to the widest ones"""
+        if self.beam_controller:
+            self.set_search_options(self.beam_controller.beam, self.beam_controller.max_active)
+            self.beam_controller = None
@@ -0,0 +1,201 @@
+"""
+Single-file nnet3 model bundles
+
+A bundle packs the files KaldiNNet3OnlineModel otherwise finds by path convention in a model directory, see
+NNET3_MEMBERS and OPTIONAL_NNET3_MEMBERS, into one uncompressed file, which the C++ model loader memory-maps and reads
+in place. The layout is the magic b"YPKBNDL1", the length of the manifest as a little endian uint64 and the manifest,
+one "name<TAB>offset<TAB>size<TAB>crc32" line per member. Members follow, each at a page-aligned offset from the start
+of the file.
+
+Build a bundle from a model directory with::
+
+    python -m yapykaldi.bundle pack MODEL_DIR MODEL.ypk
+"""
+import os
+import sys
+import struct
+import zlib
+import argparse
+from collections import OrderedDict
+
+
+__all__ = ["pack", "read_manifest", "read_member", "verify"]
+
+
+MAGIC = b"YPKBNDL1"
+PAGE_SIZE = 4096
+BLOCK_SIZE = 1 << 20
+
+# Member name: path in the model directory, model being the name of the directory with final.mdl and the graph
+NNET3_MEMBERS = OrderedDict([
+    ("mfcc.conf", "conf/mfcc_hires.conf"),
+    ("online_cmvn.conf", "conf/online_cmvn.conf"),
+    ("splice.conf", "ivectors_test_hires/conf/splice.conf"),
+    ("final.mat", "extractor/final.mat"),
+    ("global_cmvn.stats", "extractor/global_cmvn.stats"),
+    ("final.dubm", "extractor/final.dubm"),
+    ("final.ie", "extractor/final.ie"),
+    ("final.mdl", "{model}/final.mdl"),
+    ("HCLG.fst", "{model}/graph/HCLG.fst"),
+    ("words.txt", "{model}/graph/words.txt"),
+    ("align_lexicon.int", "{model}/graph/phones/align_lexicon.int"),
+])
+
+# Members packed when the model directory has them: the silence phones of the graph, for the trailing silence rules
+# of endpoint detection
+OPTIONAL_NNET3_MEMBERS = OrderedDict([
+    ("silence.csl", "{model}/graph/phones/silence.csl"),
+])
+
+
+def _align(offset):
+    """Internal function to round an offset up to the next page"""
+    return (offset + PAGE_SIZE - 1) // PAGE_SIZE * PAGE_SIZE
+
+
+def _crc32(path):
+    """Internal function to compute the CRC-32 of a file"""
+    crc = 0
+    with open(path, 'rb') as member_file:
+        for block in iter(lambda: member_file.read(BLOCK_SIZE), b''):
+            crc = zlib.crc32(block, crc)
+    return crc & 0xffffffff
+
+
+def pack(model_dir, bundle_path, model='model'):
+    """Pack an nnet3 model directory into a bundle
+
+    :param model_dir: Path to model directory, as for KaldiNNet3OnlineModel
+    :param bundle_path: Path of the bundle to write
+    :param model: (default 'model') Name of the directory in model_dir with final.mdl and the decoding graph
+    :return: (OrderedDict) manifest of the bundle, see read_manifest
+    """
+    paths = OrderedDict()
+    for name, path in NNET3_MEMBERS.items():
+        paths[name] = os.path.join(model_dir, path.format(model=model))
+        if not os.path.isfile(paths[name]):
+            raise Exception("{} not found".format(paths[name]))
+    for name, path in OPTIONAL_NNET3_MEMBERS.items():
+        path = os.path.join(model_dir, path.format(model=model))
+        if os.path.isfile(path):
+            paths[name] = path
+
+    sizes = OrderedDict((name, os.path.getsize(path)) for name, path in paths.items())
+    crcs = OrderedDict((name, _crc32(path)) for name, path in paths.items())
+
+    # The offsets are written in the manifest in front of the members, so lay out until the manifest fits
+    data_offset = PAGE_SIZE
+    while True:
+        manifest = OrderedDict()
+        offset = data_offset
+        for name, size in sizes.items():
+            manifest[name] = (offset, size, crcs[name])
+            offset = _align(offset + size)
+        manifest_bytes = "".join("{}\t{}\t{}\t{}\n".format(name, *entry) for name, entry in manifest.items())
+        manifest_bytes = manifest_bytes.encode('utf-8')
+        header_size = len(MAGIC) + 8 + len(manifest_bytes)
+        if header_size <= data_offset:
+            break
+        data_offset = _align(header_size)
+
+    tmp_path = "{}.{}.tmp".format(bundle_path, os.getpid())
+    with open(tmp_path, 'wb') as bundle_file:
+        bundle_file.write(MAGIC)
+        bundle_file.write(struct.pack('<Q', len(manifest_bytes)))
+        bundle_file.write(manifest_bytes)
+        for name, (offset, _, _) in manifest.items():
+            bundle_file.write(b'\0' * (offset - bundle_file.tell()))
+            with open(paths[name], 'rb') as member_file:
+                for block in iter(lambda: member_file.read(BLOCK_SIZE), b''):
+                    bundle_file.write(block)
+    os.rename(tmp_path, bundle_path)
+    return manifest
+
+
+def read_manifest(bundle_path):
+    """Manifest of a bundle
+
+    :param bundle_path: Path of the bundle
+    :return: (OrderedDict) (offset, size, crc32) by member name
+    """
+    with open(bundle_path, 'rb') as bundle_file:
+        if bundle_file.read(len(MAGIC)) != MAGIC:
+            raise Exception("{} is not a model bundle".format(bundle_path))
+        manifest_size, = struct.unpack('<Q', bundle_file.read(8))
+        manifest_bytes = bundle_file.read(manifest_size)
+
+    manifest = OrderedDict()
+    for line in manifest_bytes.decode('utf-8').splitlines():
+        if line:
+            name, offset, size, crc = line.split('\t')
+            manifest[name] = (int(offset), int(size), int(crc))
+    return manifest
+
+
+def read_member(bundle_path, name):
+    """Contents of a member of a bundle
+
+    :param bundle_path: Path of the bundle
+    :param name: Name of the member, e.g. 'mfcc.conf'
+    :return: (bytes) contents
+    """
+    offset, size, _ = read_manifest(bundle_path)[name]
+    with open(bundle_path, 'rb') as bundle_file:
+        bundle_file.seek(offset)
+        return bundle_file.read(size)
+
+
+def verify(bundle_path):
+    """Check the members of a bundle against the checksums in its manifest
+
+    :param bundle_path: Path of the bundle
+    :return: (list) names of the members that do not match, empty if the bundle is intact
+    """
+    mismatches = []
+    with open(bundle_path, 'rb') as bundle_file:
+        for name, (offset, size, crc) in read_manifest(bundle_path).items():
+            bundle_file.seek(offset)
+            member_crc = 0
+            remaining = size
+            while remaining > 0:
+                block = bundle_file.read(min(remaining, BLOCK_SIZE))
+                if not block:
+                    break
+                member_crc = zlib.crc32(block, member_crc)
+                remaining -= len(block)
+            if remaining or member_crc & 0xffffffff != crc:
+                mismatches.append(name)
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pack and check single-file nnet3 model bundles")
+    commands = parser.add_subparsers(dest='command')
+
+    pack_parser = commands.add_parser('pack', help="Pack a model directory into a bundle")
+    pack_parser.add_argument('model_dir', help="Path to model directory")
+    pack_parser.add_argument('bundle', help="Path of the bundle to write")
+    pack_parser.add_argument('--model', default='model',
+                             help="Name of the directory in model_dir with final.mdl and the decoding graph")
+
+    verify_parser = commands.add_parser('verify', help="Check the checksums of a bundle")
+    verify_parser.add_argument('bundle', help="Path of the bundle")
+
+    args = parser.parse_args(argv)
+    if args.command == 'pack':
+        manifest = pack(args.model_dir, args.bundle, model=args.model)
+        for name, (offset, size, crc) in manifest.items():
+            print("{:<20} {:>12} {:>12} {:08x}".format(name, offset, size, crc))
+    elif args.command == 'verify':
+        mismatches = verify(args.bundle)
+        for name in mismatches:
+            print("{}: checksum mismatch".format(name))
+        return 1 if mismatches else 0
+    else:
+        parser.print_help()
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
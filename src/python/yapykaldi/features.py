@@ -0,0 +1,109 @@
+"Cache of front end features, to decode the same audio with different graphs or decoding options"
+import os
+import hashlib
+import numpy as np
+from .logger import logger
+from .utils import makedir_exist_ok
+
+
+__all__ = ["FeatureCache"]
+
+
+class FeatureCache(object):
+    """On-disk cache of the MFCC and i-vector features of utterances, stored as .npy files
+
+    Features are extracted once per recording and memory-mapped when they are needed again, so parameter sweeps over
+    beams and A/B evaluations of decoding graphs skip the front end. Pass the cache to decode_wav_file of a
+    KaldiNNet3OnlineDecoder::
+
+        features = FeatureCache("features")
+        for beam in [7.0, 10.0, 13.0]:
+            decoder = KaldiNNet3OnlineDecoder(KaldiNNet3OnlineModel(model_dir, beam=beam))
+            for wavfile in wavfiles:
+                decoder.decode_wav_file(wavfile, feature_cache=features)
+
+    Entries are keyed by the audio content and the feature_fingerprint of the decoder, so models sharing a front end
+    share the cached features.
+    """
+
+    FEATS_SUFFIX = ".feats.npy"
+    IVECTORS_SUFFIX = ".ivectors.npy"
+
+    def __init__(self, cache_dir):
+        """
+        :param cache_dir: Directory to store the features in
+        """
+        self.cache_dir = cache_dir
+        makedir_exist_ok(self.cache_dir)
+
+    @staticmethod
+    def key(pcm, samp_freq, fingerprint):
+        """Key of the features of audio
+
+        :param pcm: (bytes) Raw PCM data of the audio
+        :param samp_freq: Sampling frequency of the audio
+        :param fingerprint: Fingerprint of the front end, see the feature_fingerprint property of the decoder
+        :return: (str) key
+        """
+        digest = hashlib.sha1(pcm)
+        digest.update("{}:{}".format(samp_freq, fingerprint).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Look up cached features
+
+        :param key: Key as returned by key
+        :return: (input_feats, ivector_feats) as read-only memory-mapped arrays, ivector_feats None for models
+        without i-vectors, or None if the features are not cached
+        """
+        feats_path, ivectors_path = self._paths(key)
+        if not os.path.isfile(feats_path):
+            return None
+
+        input_feats = np.load(feats_path, mmap_mode='r')
+        ivector_feats = np.load(ivectors_path, mmap_mode='r') if os.path.isfile(ivectors_path) else None
+        return input_feats, ivector_feats
+
+    def put(self, key, input_feats, ivector_feats=None):
+        """Store features
+
+        :param key: Key as returned by key
+        :param input_feats: (numpy.ndarray) MFCC features
+        :param ivector_feats: (default None) (numpy.ndarray) i-vectors
+        """
+        feats_path, ivectors_path = self._paths(key)
+        # The features file is written last, its presence marks a complete entry
+        if ivector_feats is not None:
+            self._save(ivectors_path, ivector_feats)
+        self._save(feats_path, input_feats)
+
+    def features(self, decoder, samp_freq, pcm):
+        """Features of audio for a decoder, extracted with the decoder and stored first if they are not cached yet
+
+        :param decoder: KaldiNNet3OnlineDecoder
+        :param samp_freq: Sampling frequency of the audio
+        :param pcm: (bytes) 16 bit little-endian PCM data
+        :return: (input_feats, ivector_feats) as for get
+        """
+        key = self.key(pcm, samp_freq, decoder.feature_fingerprint)
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        logger.debug("Extracting features for %s", key)
+        samples = np.frombuffer(pcm, dtype='<i2').astype(np.float32)
+        self.put(key, *decoder.extract_features(samp_freq, samples))
+        return self.get(key)
+
+    def _paths(self, key):
+        """Internal method to get the files of an entry"""
+        base = os.path.join(self.cache_dir, key)
+        return base + self.FEATS_SUFFIX, base + self.IVECTORS_SUFFIX
+
+    @staticmethod
+    def _save(path, array):
+        """Internal method to write an array atomically"""
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, 'wb') as array_file:
+            np.save(array_file, np.ascontiguousarray(array, dtype=np.float32))
+        os.rename(tmp_path, path)
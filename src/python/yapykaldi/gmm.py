@@ -3,44 +3,88 @@ import wave
 import struct
 import re
 from tempfile import NamedTemporaryFile
+from threading import Thread
+from queue import Queue
 import numpy as np
 from ._Extensions import GmmOnlineDecoderWrapper, GmmOnlineModelWrapper, StringList, IntList
+from .logger import logger
+from .utils import fingerprint, endpoint_options
+from .beam_control import BeamControlMixin
 
 
 __all__ = ["KaldiGmmOnlineModel", "KaldiGmmOnlineDecoder"]
 
 
 class KaldiGmmOnlineModel(object):
-    def __init__(self, model_dir, graph_dir, beam=7.0, max_active=7000, min_active=200, lattice_beam=8.0):
+    def __init__(self, model_dir, graph_dir, beam=7.0, max_active=7000, min_active=200, lattice_beam=8.0,
+                 old_lm=None, new_lm=None):
+        """
+        :param model_dir: Path to model directory
+        :param graph_dir: Path to the directory with the decoding graph
+        :param beam: (default 7.0) Decoding beam
+        :param max_active: (default 7000) Maximum number of active tokens per frame
+        :param min_active: (default 200) Minimum number of active tokens per frame
+        :param lattice_beam: (default 8.0) Lattice generation beam
+        :param old_lm: (default None) Path to the G.fst the decoding graph was compiled with. Required for lattice
+        rescoring
+        :param new_lm: (default None) Path to the LM used to rescore the final lattice of every utterance, either a
+        G.fst or a ConstArpa LM (G.carpa)
+        """
         self.model_dir = model_dir
         self.graph_dir = graph_dir
+        self.min_active = min_active
 
         config = "{}/conf/online_decoding.conf".format(self.model_dir)
         word_symbol_table = "{}/graph/words.txt".format(self.graph_dir)
         fst_in_str = "{}/graph/HCLG.fst".format(self.graph_dir)
         align_lex_filename = "{}/graph/phones/align_lexicon.int".format(self.graph_dir)
 
+        if bool(old_lm) != bool(new_lm):
+            raise Exception("Lattice rescoring needs both old_lm and new_lm")
+        rescore_lms = [old_lm, new_lm] if new_lm else []
+
         # Check all files exist
-        for fname in [config, word_symbol_table, fst_in_str, align_lex_filename]:
+        for fname in [config, word_symbol_table, fst_in_str, align_lex_filename] + rescore_lms:
             if not os.path.isfile(fname):
                 raise Exception("{} not found".format(fname))
-            if not os.access(fname. os.R_OK):
+            if not os.access(fname, os.R_OK):
                 raise Exception("{} is not readable".format(fname))
 
         # Generate config files
         self.conf_file = NamedTemporaryFile(prefix='py_online_decoding_', suffix='.conf', delete=True)
+        conf_files = []
+        mfcc_config = None
         with open(config) as conf_fh:
             for line in conf_fh:
                 # modify any path, then write
                 line = re.sub(r'=(.*/.*)',
                               lambda match: '=' + os.path.join(self.model_dir, '..', '..', match.group(1)),
                               line)
+                if '/' in line:
+                    conf_files.append(line.split('=', 1)[1].strip())
+                if line.startswith('--mfcc-config='):
+                    mfcc_config = line.split('=', 1)[1].strip()
                 self.conf_file.write(line)
         self.conf_file.flush()
 
+        # Identify everything the decoding results depend on, for caching them
+        self.fingerprint = fingerprint(config, beam, max_active, min_active, lattice_beam, word_symbol_table,
+                                       fst_in_str, align_lex_filename, *(conf_files + rescore_lms))
+
+        # Seconds per frame of the word alignments
+        self.frame_shift = 0.01
+        if mfcc_config and os.path.isfile(mfcc_config):
+            with open(mfcc_config) as mfcc_fh:
+                for line in mfcc_fh:
+                    if line.startswith("--frame-shift="):
+                        self.frame_shift = float(line.split('=', 1)[1]) / 1000.0
+
         self.model_wrapper = GmmOnlineModelWrapper(beam, max_active, min_active, lattice_beam, word_symbol_table,
                                                    fst_in_str, self.conf_file.name, align_lex_filename)
 
+        if rescore_lms:
+            self.model_wrapper.set_lm_rescoring(*rescore_lms)
+
     def __del__(self):
         if self.conf_file:
             self.conf_file.close()
@@ -49,22 +93,211 @@ class KaldiGmmOnlineModel(object):
             del self.model_wrapper
 
 
-class KaldiGmmOnlineDecoder(object):
-    def __init__(self, model):
+# What decode does once the first pass of an utterance is finalized, see set_second_pass
+SECOND_PASS_MODES = {"sync": 0, "deferred": 1, "skip": 2}
+
+
+class KaldiGmmOnlineDecoder(BeamControlMixin):
+    def __init__(self, model, second_pass="sync"):
+        """
+        :param model: Model to decode with
+        :type model: KaldiGmmOnlineModel
+        :param second_pass: (default "sync") What to do once the first pass of an utterance is finalized, see
+        set_second_pass
+        """
         assert isinstance(model, KaldiGmmOnlineModel)
 
         self.decoder_wrapper = GmmOnlineDecoderWrapper(model.model_wrapper)
+        self.model = model
+        self._adapted = False
+        self._cached_result = None
+        self._default_search_options = self.search_options
+        self.beam_controller = None
+
+        self._utterances = 0
+        self._second_pass_callbacks = []
+        self._second_passes = None  # type: Queue
+        self.set_second_pass(second_pass)
 
     def __del__(self):
+        if self._second_passes:
+            self._second_passes.put(None)
         del self.decoder_wrapper
 
-    def decode(self, samp_freq, samples, finalize):
-        return self.decoder_wrapper.decode(samp_freq, samples, finalize)
+    def decode(self, samp_freq, samples, finalize, utterance=None, skip_blank=False):
+        """Decode a chunk of samples of the utterance in progress
+
+        :param samp_freq: Sampling frequency of the samples
+        :param samples: float32 numpy array of the samples
+        :param finalize: Finalize the utterance with this chunk
+        :param utterance: (default None) Index to tag the result of the deferred second pass of the utterance with,
+        e.g. the index the caller reports the utterance under. None counts the utterances finalized with a reported
+        second pass
+        :param skip_blank: (default False) Do not report the deferred second pass of the utterance if its first pass
+        result is blank, e.g. a segment of a continuous stream the caller drops. It still runs, for the adaptation
+        state it carries over
+        :return: (bool) True if decoding succeeded
+        """
+        result = super().decode(samp_freq, samples, finalize)
+        if finalize and result:
+            second_pass = self.decoder_wrapper.take_second_pass()
+            if skip_blank and not self.decoder_wrapper.get_decoded_string(0.0)[0].strip():
+                utterance = None
+            elif utterance is None:
+                utterance = self._utterances
+                self._utterances += 1
+            if second_pass:
+                self._second_passes.put((utterance, second_pass))
+        return result
+
+    def set_second_pass(self, mode):
+        """Choose what decode does once the first pass of an utterance is finalized. Applies from the next finalized
+        utterance on
+
+        "sync": estimate fMLLR and rescore the lattice with the adapted model, and with the new LM of the model if it
+        has one, before decode returns. "deferred": decode returns with the best path of the first pass, and the
+        second pass runs in a background thread, which hands its result to the callbacks registered with
+        register_second_pass_callback. Utterances started before a second pass is done adapt from the state before it.
+        "skip": no fMLLR estimation and no rescoring at all, for latency-critical commands.
+
+        :param mode: "sync", "deferred" or "skip"
+        """
+        if mode not in SECOND_PASS_MODES:
+            raise Exception("Unknown second pass mode {}, use one of {}".format(mode, sorted(SECOND_PASS_MODES)))
+        self.decoder_wrapper.set_second_pass_mode(SECOND_PASS_MODES[mode])
+        if mode == "deferred" and not self._second_passes:
+            self._second_passes = Queue()
+            worker = Thread(target=_run_second_passes,
+                            args=(self._second_passes, self.decoder_wrapper, self._second_pass_callbacks))
+            worker.daemon = True
+            worker.start()
+
+    @property
+    def second_pass(self):
+        """Second pass mode, see set_second_pass"""
+        modes = {value: mode for mode, value in SECOND_PASS_MODES.items()}
+        return modes[self.decoder_wrapper.get_second_pass_mode()]
+
+    def register_second_pass_callback(self, callback):
+        """
+        Register a callback to receive the results of deferred second passes, in the order of the utterances. It is
+        called from a background thread.
+
+        :param callback: a function taking a dict with the keys utterance (index passed to decode, or among the
+        utterances the decoder finalized without one), text, likelihood, alignment (words, times, lengths as with
+        get_word_alignment, or None), ok (False if the second pass failed and the result is the first pass one) and
+        seconds (the second pass took)
+        :return: None
+        """
+        self._second_pass_callbacks.append(callback)
+
+    def wait_second_pass(self):
+        """Wait until the deferred second passes of the utterances finalized so far are done and reported"""
+        if self._second_passes:
+            self._second_passes.join()
+
+    def reset(self):
+        """Drop the current utterance without finalizing it"""
+        self._cached_result = None
+        self.decoder_wrapper.reset()
+
+    def get_adaptation_state(self):
+        """Speaker adaptation state reached so far, serialized in Kaldi binary format
+
+        :return: (bytes) adaptation state
+        """
+        return self.decoder_wrapper.get_adaptation_state()
+
+    def set_adaptation_state(self, state):
+        """Start the next utterance from a stored speaker adaptation state. From then on, the adaptation state is
+        carried over from one utterance to the next
+
+        :param state: (bytes) adaptation state as returned by get_adaptation_state
+        """
+        self.decoder_wrapper.set_adaptation_state(state)
+        self._adapted = True
+
+    def reset_adaptation_state(self, carry=False):
+        """Start the next utterance from the default adaptation state
+
+        :param carry: (default False) Carry the adaptation state over from one utterance to the next, as for a new
+        speaker without a stored adaptation state
+        """
+        self.decoder_wrapper.reset_adaptation_state(carry)
+        self._adapted = carry
+
+    def set_endpoint_options(self, silence_phones=None, **options):
+        """Configure endpoint detection, see Kaldi's OnlineEndpointConfig. Options not given keep their values,
+        which start out as in the online_decoding.conf of the model
+
+        :param silence_phones: (default None) Silence phone ids, as a list or a colon separated string. None keeps them
+        :param options: Endpoint rule options such as rule2_min_trailing_silence=0.5, see
+        yapykaldi.utils.endpoint_options
+        """
+        self.decoder_wrapper.set_endpoint_options(endpoint_options(silence_phones, **options))
+
+    def endpoint_detected(self):
+        """Whether the utterance in progress has reached an endpoint, e.g. enough trailing silence after speech. The
+        caller then finalizes the utterance, see Asr(continuous=True)
+
+        :return: (bool) True at an endpoint
+        """
+        return self.decoder_wrapper.endpoint_detected()
+
+    @property
+    def stats(self):
+        """Search statistics since the decoder was created or last reset_stats, see KaldiNNet3OnlineDecoder.stats
+
+        The GMM decoder does not expose its tokens, so the active token counts stay zero.
+
+        :return: (dict) statistics
+        """
+        return self.decoder_wrapper.get_stats()
+
+    @property
+    def counters(self):
+        """The counters of stats that change with every chunk, read without building the dict of stats, so they are
+        cheap to take after every chunk, e.g. by a flight recorder
+
+        :return: (tuple) utterances, frames_decoded, active_tokens_total, accept_waveform_seconds,
+        advance_decoding_seconds and finalize_seconds
+        """
+        return self.decoder_wrapper.get_counters()
+
+    def reset_stats(self):
+        """Restart the search statistics from zero"""
+        self.decoder_wrapper.reset_stats()
+
+    @property
+    def fingerprint(self):
+        """Digest identifying the results of this decoder for the next utterance, see yapykaldi.utils.fingerprint"""
+        model_fingerprint = self.model.fingerprint
+        if self.search_options != self._default_search_options:
+            model_fingerprint = fingerprint(model_fingerprint, *self.search_options)
+        if self.second_pass != "sync":
+            model_fingerprint = fingerprint(model_fingerprint, self.second_pass)
+        if not self._adapted:
+            return model_fingerprint
+        return fingerprint(model_fingerprint, self.decoder_wrapper.get_adaptation_state())
 
     def get_decoded_string(self, likelihood=0.0):
+        if self._cached_result:
+            return self._cached_result[0], self._cached_result[1]
         return self.decoder_wrapper.get_decoded_string(likelihood)
 
-    def get_word_alignment(self):
+    def get_word_alignment(self, confidence=False):
+        """Word alignment of the best path of the last finalized utterance
+
+        :param confidence: (default False) Also return the lattice posterior of every word as its confidence. Times,
+        lengths and confidences are then numpy arrays and silences are left out of the alignment
+        :return: (words, times, lengths) or (words, times, lengths, confidences), with times and lengths in frames, or
+        None if the alignment failed. Confidences are not available for results from a DecodeResultCache
+        """
+        if self._cached_result:
+            return None if confidence else self._cached_result[2]
+        if confidence:
+            return self.decoder_wrapper.get_word_confidences()
+
         words = StringList()
         times = IntList()
         lengths = IntList()
@@ -73,7 +306,14 @@ class KaldiGmmOnlineDecoder(object):
             return None
         return words, times, lengths
 
-    def decode_wav_file(self, wavfile):
+    def decode_wav_file(self, wavfile, cache=None):
+        """Decode a whole wave file as one utterance
+
+        :param wavfile: Path of a 16 bit mono wave file
+        :param cache: (default None) DecodeResultCache to look the result up in before decoding and to store it in
+        after. A cached result is available through get_decoded_string and get_word_alignment as usual
+        :return: (bool) True if decoding succeeded
+        """
         wavf = wave.open(wavfile, 'rb')
 
         # Check format
@@ -84,9 +324,59 @@ class KaldiGmmOnlineDecoder(object):
         # Read the whole file into memory, for now
         num_frames = wavf.getnframes()
         frames = wavf.readframes(num_frames)
+        samp_freq = wavf.getframerate()
+        wavf.close()
+
+        key = None
+        if cache is not None:
+            key = cache.key(frames, samp_freq, self.fingerprint)
+            result = cache.get(key)
+            if result is not None:
+                self._cached_result = result
+                return True
 
         samples = struct.unpack_from('<%dh' % num_frames, frames)
 
-        wavf.close()
+        if not self.decode(samp_freq, np.array(samples, dtype=np.float32), True):
+            return False
+
+        if key is not None:
+            transcript, likelihood = self.get_decoded_string()
+            alignment = self.get_word_alignment()
+            if alignment is not None:
+                alignment = tuple(list(field) for field in alignment)
+            cache.put(key, transcript, likelihood, alignment)
+        return True
+
+
+def _run_second_passes(second_passes, decoder_wrapper, callbacks):
+    """Internal function running the deferred second passes of a decoder in order, until it is deleted"""
+    while True:
+        item = second_passes.get()
+        if item is None:
+            second_passes.task_done()
+            return
+
+        utterance, second_pass = item
+        try:
+            ok = second_pass.run()
+            decoder_wrapper.carry_adaptation_state_from(second_pass)
+            if utterance is None:
+                continue
+
+            text, likelihood = second_pass.get_decoded_string(0.0)
+            words = StringList()
+            times = IntList()
+            lengths = IntList()
+            alignment = None
+            if second_pass.get_word_alignment(words, times, lengths):
+                alignment = (list(words), list(times), list(lengths))
 
-        return self.decode(wavf.getframerate(), np.array(samples, dtype=np.float32), True)
+            result = {"utterance": utterance, "text": text, "likelihood": likelihood, "alignment": alignment,
+                      "ok": ok, "seconds": second_pass.get_seconds()}
+            for callback in callbacks:
+                callback(result)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.error("Second pass of utterance %s failed: %s", utterance, e)
+        finally:
+            second_passes.task_done()
@@ -0,0 +1,193 @@
+"""
+Decoding of long recordings on all cores
+
+A recording is scanned once with a cheap energy voice activity detector and split at silences into segments of
+bounded length. The segments are decoded concurrently by a pool of decoders sharing one model, and their results are
+stitched back together with word times relative to the start of the recording.
+
+Only nnet3 decoding releases the GIL, so GMM models gain little from the pool.
+"""
+import time
+import wave
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .logger import logger
+from .nnet3 import KaldiNNet3OnlineModel, KaldiNNet3OnlineDecoder
+from .gmm import KaldiGmmOnlineDecoder
+
+
+__all__ = ["split_at_silences", "LongAudioDecoder"]
+
+
+def split_at_silences(samples, samp_freq, max_segment=30.0, min_segment=5.0, min_silence=0.3, margin_db=10.0,
+                      frame_length=0.01, align=1, floor_percentile=2.0):
+    """Split audio at silences into segments of at most max_segment seconds
+
+    Frames quieter than the noise floor plus margin_db count as silent. The noise floor is a low percentile of the
+    energies of the frames that are not digital silence, so that it is the level of the pauses even in recordings that
+    pause only a few percent of the time.
+    Every segment ends in the middle of the longest silence of at least min_silence seconds that leaves it between
+    min_segment and max_segment seconds long. Where there is no such silence, it ends at the quietest frame of its
+    second half. Segments without a single frame above the threshold are left out, unless no frame of the recording is.
+
+    :param samples: (numpy.ndarray) samples
+    :param samp_freq: Sampling frequency of the samples
+    :param max_segment: (default 30.0) Longest segment in seconds
+    :param min_segment: (default 5.0) Shortest segment in seconds, but for the last one
+    :param min_silence: (default 0.3) Shortest silence in seconds to split at
+    :param margin_db: (default 10.0) Decibels above the noise floor from which frames count as speech
+    :param frame_length: (default 0.01) Seconds per frame of the energy computation
+    :param align: (default 1) Segments start at multiples of this many samples, e.g. the frame shift of the model
+    :param floor_percentile: (default 2.0) Percentile of the frame energies taken as the noise floor
+    :return: (list) (start, end) of every segment, in samples
+    """
+    if min_segment > max_segment:
+        raise Exception("min_segment {} is longer than max_segment {}".format(min_segment, max_segment))
+    hop = max(1, int(round(frame_length * samp_freq)))
+    num_frames = len(samples) // hop
+    if num_frames == 0:
+        return [(0, len(samples))] if len(samples) else []
+
+    frames = np.asarray(samples[:num_frames * hop], dtype=np.float32).reshape(num_frames, hop)
+    power = np.mean(frames * frames, axis=1)
+    energy_db = 10.0 * np.log10(power + 1e-10)
+    # digital silence, e.g. padding, would pull the floor far below the noise of the pauses
+    audible = energy_db[power > 0]
+    noise_floor = np.percentile(audible if len(audible) else energy_db, floor_percentile)
+    speech = energy_db > noise_floor + margin_db
+    if not speech.any():
+        # no dynamics to tell speech from silence by, e.g. steady noise: nothing is left out
+        speech[:] = True
+
+    # the middle of every silence long enough to split at, scored by the length of the silence
+    cut_scores = np.zeros(num_frames, dtype=np.int64)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], (~speech).astype(np.int8), [0]))))
+    for start, end in zip(edges[::2], edges[1::2]):
+        if (end - start) * frame_length >= min_silence:
+            cut_scores[(start + end) // 2] = end - start
+
+    max_frames = max(1, int(max_segment / frame_length))
+    min_frames = int(min_segment / frame_length)
+    cuts = [0]
+    while num_frames - cuts[-1] > max_frames:
+        first, last = cuts[-1] + max(1, min_frames), cuts[-1] + max_frames
+        window = cut_scores[first:last + 1]
+        if window.any():
+            # the longest silence, the latest of equally long ones
+            cut = first + len(window) - 1 - int(np.argmax(window[::-1]))
+        else:
+            middle = cuts[-1] + max_frames // 2
+            cut = middle + int(np.argmin(energy_db[middle:last + 1]))
+        cuts.append(max(cut, cuts[-1] + 1))
+    cuts.append(num_frames)
+
+    segments = []
+    for start, end in zip(cuts[:-1], cuts[1:]):
+        if not speech[start:end].any():
+            continue
+        start_sample = start * hop // align * align
+        end_sample = len(samples) if end == num_frames else end * hop // align * align
+        segments.append((start_sample, end_sample))
+    return segments
+
+
+def _default_decoder(model):
+    """Internal function creating the decoder matching a model"""
+    if isinstance(model, KaldiNNet3OnlineModel):
+        return KaldiNNet3OnlineDecoder(model)
+    return KaldiGmmOnlineDecoder(model)
+
+
+class LongAudioDecoder(object):
+    def __init__(self, model, num_decoders=4, decoder_factory=None, max_segment=30.0, min_segment=5.0,
+                 min_silence=0.3, margin_db=10.0):
+        """Decoder of long recordings, split at silences and decoded segment by segment on a pool of decoders
+
+        Word times come out relative to the start of the recording, though words at the edges of segments may differ
+        from decoding the recording as one utterance, since every segment starts without context.
+
+        :param model: Model the decoders share
+        :type model: KaldiNNet3OnlineModel or KaldiGmmOnlineModel
+        :param num_decoders: (default 4) Number of segments decoded at once, e.g. the number of cores
+        :param decoder_factory: (default None) Function creating a decoder for the model, e.g. to configure its search
+        options. None picks KaldiNNet3OnlineDecoder or KaldiGmmOnlineDecoder by the type of the model
+        :param max_segment: (default 30.0) Longest segment in seconds, see split_at_silences
+        :param min_segment: (default 5.0) Shortest segment in seconds
+        :param min_silence: (default 0.3) Shortest silence in seconds to split at
+        :param margin_db: (default 10.0) Decibels above the noise floor from which audio counts as speech
+        """
+        self.model = model
+        self.num_decoders = num_decoders
+        self.split_options = {"max_segment": max_segment, "min_segment": min_segment, "min_silence": min_silence,
+                              "margin_db": margin_db}
+        self._decoders = Queue()
+        for _ in range(num_decoders):
+            self._decoders.put((decoder_factory or _default_decoder)(model))
+
+    def decode_wav_file(self, wavfile):
+        """Decode a whole 16 bit mono wave file, see decode
+
+        :param wavfile: Path of the wave file
+        :return: (dict) result, see decode
+        """
+        wavf = wave.open(wavfile, 'rb')
+        assert wavf.getnchannels() == 1
+        assert wavf.getsampwidth() == 2
+        samp_freq = wavf.getframerate()
+        samples = np.frombuffer(wavf.readframes(wavf.getnframes()), dtype='<i2')
+        wavf.close()
+        return self.decode(samp_freq, samples)
+
+    def decode(self, samp_freq, samples):
+        """Decode a recording
+
+        :param samp_freq: Sampling frequency of the samples
+        :param samples: (numpy.ndarray) samples, converted to float32 segment by segment
+        :return: (dict) with the keys text, words, times and lengths (the word alignment of the whole recording, in
+        frames of model.frame_shift seconds from its start), segments (a dict per segment with its start and end in
+        seconds, text, likelihood and ok) and decode_seconds
+        """
+        start_time = time.time()
+        align = max(1, int(round(self.model.frame_shift * samp_freq)))
+        segments = split_at_silences(samples, samp_freq, align=align, **self.split_options)
+        logger.info("Decoding %.1f s of audio in %d segments on %d decoders", len(samples) / float(samp_freq),
+                    len(segments), self.num_decoders)
+
+        with ThreadPoolExecutor(max_workers=self.num_decoders) as executor:
+            results = list(executor.map(lambda segment: self._decode_segment(samp_freq, samples, *segment),
+                                        segments))
+
+        words, times, lengths = [], [], []
+        for (start, _), result in zip(segments, results):
+            offset = start // align
+            words.extend(result.pop("words"))
+            times.extend(offset + time_ for time_ in result.pop("times"))
+            lengths.extend(result.pop("lengths"))
+        return {
+            "text": " ".join(result["text"] for result in results if result["text"]),
+            "words": words,
+            "times": times,
+            "lengths": lengths,
+            "segments": results,
+            "decode_seconds": time.time() - start_time,
+        }
+
+    def _decode_segment(self, samp_freq, samples, start, end):
+        """Internal method decoding a segment on a decoder of the pool"""
+        decoder = self._decoders.get()
+        try:
+            ok = decoder.decode(samp_freq, np.asarray(samples[start:end], dtype=np.float32), True)
+            text, likelihood = decoder.get_decoded_string() if ok else ("", None)
+            alignment = decoder.get_word_alignment() if ok else None
+            if not ok:
+                # a failed utterance is not finalized, it would carry over into the next segment
+                decoder.reset()
+        finally:
+            self._decoders.put(decoder)
+        if not ok:
+            logger.warning("Decoding the segment from %.2f s to %.2f s failed", start / float(samp_freq),
+                           end / float(samp_freq))
+        words, times, lengths = (list(field) for field in alignment) if alignment is not None else ([], [], [])
+        return {"start": start / float(samp_freq), "end": end / float(samp_freq), "text": text.strip(),
+                "likelihood": likelihood, "ok": ok, "words": words, "times": times, "lengths": lengths}
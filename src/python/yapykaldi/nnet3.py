@@ -3,52 +3,250 @@ import struct
 import wave
 from tempfile import NamedTemporaryFile
 import numpy as np
-from ._Extensions import NNet3OnlineModelWrapper, NNet3OnlineDecoderWrapper, StringList, IntList
+from ._Extensions import (NNet3OnlineModelWrapper, NNet3OnlineDecoderWrapper, NNet3MultiGraphDecoderWrapper,
+                          StringList, IntList)
+from .utils import fingerprint, endpoint_options
+from .logger import logger
+from .beam_control import BeamControlMixin
+from . import bundle
 
 
-__all__ = ["KaldiNNet3OnlineModel", "KaldiNNet3OnlineDecoder"]
+__all__ = ["KaldiNNet3OnlineModel", "KaldiNNet3OnlineDecoder", "KaldiNNet3MultiGraphDecoder"]
+
+
+DEFAULT_GRAPH = NNet3OnlineModelWrapper.default_graph
 
 
 class KaldiNNet3OnlineModel(object):
     def __init__(self, model_dir, model='model', beam=7.0, max_active=7000, min_active=200, lattice_beam=8.0,
                  acoustic_scale=1.0, frame_subsampling_factor=3, num_gselect=5, min_post=0.025, posterior_scale=0.1,
-                 max_count=0, online_ivector_period=10):
+                 max_count=0, online_ivector_period=10, old_lm=None, new_lm=None, graph_cache_size=0, progress=None,
+                 warmup=False, verify_bundle=True, int8=False):
+        """
+        :param model_dir: Path to model directory, or to a model bundle made with yapykaldi.bundle.pack
+        :param model: (default 'model') Name of the directory in model_dir with final.mdl and the decoding graph.
+        Not used for bundles
+        :param beam: (default 7.0) Decoding beam
+        :param max_active: (default 7000) Maximum number of active tokens per frame
+        :param min_active: (default 200) Minimum number of active tokens per frame
+        :param lattice_beam: (default 8.0) Lattice generation beam
+        :param acoustic_scale: (default 1.0) Scaling factor for acoustic log-likelihoods
+        :param frame_subsampling_factor: (default 3) Frame subsampling factor of the nnet3 model
+        :param num_gselect: (default 5) i-vector extractor option, number of Gaussians selected per frame
+        :param min_post: (default 0.025) i-vector extractor option, pruning threshold for posteriors
+        :param posterior_scale: (default 0.1) i-vector extractor option, scale for posteriors
+        :param max_count: (default 0) i-vector extractor option, maximum stats count (0 for no limit)
+        :param online_ivector_period: (default 10) Number of frames between i-vector re-estimations
+        :param old_lm: (default None) Path to the G.fst the decoding graph was compiled with. Required for lattice
+        rescoring
+        :param new_lm: (default None) Path to the LM used to rescore the final lattice of every utterance, either a
+        G.fst or a ConstArpa LM (G.carpa)
+        :param graph_cache_size: (default 0) Memory cap in bytes for the decoding graphs kept loaded. Least recently
+        used graphs are unloaded first. 0 keeps all graphs loaded
+        :param progress: (default None) Function called as progress(artifact, num_loaded, num_total) whenever one of
+        the decoding graph, the feature pipeline and the acoustic model is loaded. These are loaded concurrently, so
+        the function is called from other threads
+        :param warmup: (default False) Decode a second of synthetic audio before returning, so the first utterance
+        does not pay for first-use costs
+        :param verify_bundle: (default True) Check the checksums of the members of a model bundle when loading it
+        :param int8: (default False) Quantize the weights of the affine, linear and TDNN components of the acoustic
+        model to int8, with a scale per row, and run them with integer matrix products. Saves CPU time per stream at a
+        small cost in accuracy, see test/test_int8.py. Fails for models with most of their parameters in other
+        components. The statistics of the quantization are in the quantization attribute
+        """
 
         self.model_dir = model_dir
         self.model = model
+        self.min_active = min_active
+
+        if bool(old_lm) != bool(new_lm):
+            raise Exception("Lattice rescoring needs both old_lm and new_lm")
+        rescore_lms = [old_lm, new_lm] if new_lm else []
+
+        ie_options = [
+            "--ivector-period={}\n".format(online_ivector_period),
+            "--num-gselect={}\n".format(num_gselect),
+            "--min-post={}\n".format(min_post),
+            "--posterior-scale={}\n".format(posterior_scale),
+            "--max-remembered-frames=1000\n",
+            "--max-count={}\n".format(max_count),
+        ]
+        decoding_options = [beam, max_active, min_active, lattice_beam, acoustic_scale, frame_subsampling_factor]
+        self.ie_conf_f = None
+        # Silence phones for endpoint detection, from the lang directory the graph was made with if it is there
+        self.silence_phones = None
+
+        if os.path.isfile(self.model_dir):
+            bundle_path = self.model_dir
+            for fname in [bundle_path] + rescore_lms:
+                if not os.access(fname, os.R_OK):
+                    raise Exception("{} is not readable".format(fname))
+
+            # Identify everything the features and the decoding results depend on, for caching them
+            self.feature_fingerprint = fingerprint(bundle_path, ie_options)
+            self.fingerprint = fingerprint(self.feature_fingerprint, *decoding_options)
+            self._graph_fingerprints = {DEFAULT_GRAPH: fingerprint(bundle_path, *rescore_lms)}
+
+            self.model_wrapper = NNet3OnlineModelWrapper(beam, max_active, min_active, lattice_beam, acoustic_scale,
+                                                         frame_subsampling_factor, bundle_path, "".join(ie_options),
+                                                         verify_bundle, int8, progress)
+            mfcc_conf = bundle.read_member(bundle_path, "mfcc.conf").decode('utf-8').splitlines()
+
+            if "silence.csl" in bundle.read_manifest(bundle_path):
+                self.silence_phones = bundle.read_member(bundle_path, "silence.csl").decode('utf-8').strip()
+            else:
+                logger.warning("Model bundle %s has no silence.csl, endpoints are only detected by utterance length. "
+                               "Pack it again from a model directory with graph/phones/silence.csl", bundle_path)
+        else:
+            mfcc_config = "{}/conf/mfcc_hires.conf".format(self.model_dir)
+            word_symbol_table = "{}/{}/graph/words.txt".format(self.model_dir, self.model)
+            model_in_filename = "{}/{}/final.mdl".format(self.model_dir, self.model)
+            splice_conf_filename = "{}/ivectors_test_hires/conf/splice.conf".format(self.model_dir)
+            fst_in_str = "{}/{}/graph/HCLG.fst".format(self.model_dir, self.model)
+            align_lex_filename = "{}/{}/graph/phones/align_lexicon.int".format(self.model_dir, self.model)
+
+            for fname in [mfcc_config, word_symbol_table, model_in_filename, splice_conf_filename, fst_in_str,
+                          align_lex_filename] + rescore_lms:
+                if not os.path.isfile(fname):
+                    raise Exception("{} not found".format(fname))
+                if not os.access(fname, os.R_OK):
+                    raise Exception("{} is not readable".format(fname))
+
+            ie_files = [
+                "--cmvn-config={}/conf/online_cmvn.conf\n".format(self.model_dir),
+                "--splice-config={}\n".format(splice_conf_filename),
+                "--lda-matrix={}/extractor/final.mat\n".format(self.model_dir),
+                "--global-cmvn-stats={}/extractor/global_cmvn.stats\n".format(self.model_dir),
+                "--diag-ubm={}/extractor/final.dubm\n".format(self.model_dir),
+                "--ivector-extractor={}/extractor/final.ie\n".format(self.model_dir),
+            ]
+            self.ie_conf_f = NamedTemporaryFile(prefix='ivector_extractor_', suffix='.conf', delete=True, mode="w")
+            self.ie_conf_f.writelines(ie_files + ie_options)
+            self.ie_conf_f.flush()
+
+            # Identify everything the features and the decoding results depend on, for caching them
+            extractor_files = [line.split('=', 1)[1].strip() for line in ie_files]
+            self.feature_fingerprint = fingerprint(mfcc_config, ie_options, *extractor_files)
+            self.fingerprint = fingerprint(self.feature_fingerprint, model_in_filename, *decoding_options)
+            self._graph_fingerprints = {DEFAULT_GRAPH: fingerprint(fst_in_str, word_symbol_table, align_lex_filename,
+                                                                   *rescore_lms)}
+
+            self.model_wrapper = NNet3OnlineModelWrapper(beam, max_active, min_active, lattice_beam, acoustic_scale,
+                                                         frame_subsampling_factor, word_symbol_table,
+                                                         model_in_filename, fst_in_str, mfcc_config,
+                                                         self.ie_conf_f.name, align_lex_filename, int8, progress)
+            with open(mfcc_config) as mfcc_fh:
+                mfcc_conf = mfcc_fh.readlines()
+
+            silence_csl = "{}/{}/graph/phones/silence.csl".format(self.model_dir, self.model)
+            if os.path.isfile(silence_csl):
+                with open(silence_csl) as silence_fh:
+                    self.silence_phones = silence_fh.read().strip()
+
+        if rescore_lms:
+            self.model_wrapper.set_lm_rescoring(old_lm, new_lm, DEFAULT_GRAPH)
 
-        mfcc_config = "{}/conf/mfcc_hires.conf".format(self.model_dir)
-        word_symbol_table = "{}/{}/graph/words.txt".format(self.model_dir, self.model)
-        model_in_filename = "{}/{}/final.mdl".format(self.model_dir, self.model)
-        splice_conf_filename = "{}/ivectors_test_hires/conf/splice.conf".format(self.model_dir)
-        fst_in_str = "{}/{}/graph/HCLG.fst".format(self.model_dir, self.model)
-        align_lex_filename = "{}/{}/graph/phones/align_lexicon.int".format(self.model_dir, self.model)
+        if graph_cache_size:
+            self.model_wrapper.set_graph_cache_size(graph_cache_size)
 
-        for fname in [mfcc_config, word_symbol_table, model_in_filename, splice_conf_filename, fst_in_str,
-                      align_lex_filename]:
+        # components and weights quantized, components and parameters skipped (left in float) and
+        # max_relative_error of the int8 quantization
+        self.quantization = None
+        if int8:
+            self.quantization = self.model_wrapper.get_quantization()
+            self.fingerprint = fingerprint(self.fingerprint, "int8")
+
+        self.samp_freq = 16000
+        frame_shift_ms = 10.0
+        for line in mfcc_conf:
+            if line.startswith("--sample-frequency="):
+                self.samp_freq = int(float(line.split('=', 1)[1]))
+            elif line.startswith("--frame-shift="):
+                frame_shift_ms = float(line.split('=', 1)[1])
+        # Seconds per frame of the word alignments, after frame subsampling
+        self.frame_shift = frame_shift_ms / 1000.0 * frame_subsampling_factor
+
+        if warmup:
+            self.warm_up()
+
+    def warm_up(self, duration=1.0, graph=DEFAULT_GRAPH):
+        """Decode synthetic audio, so memory is touched and lazily initialized state is set up before the first
+        utterance
+
+        :param duration: (default 1.0) Seconds of audio to decode
+        :param graph: (default DEFAULT_GRAPH) Name of the decoding graph to decode with
+        """
+        decoder = KaldiNNet3OnlineDecoder(self)
+        decoder.set_graph(graph)
+        noise = np.random.RandomState(0).normal(0.0, 100.0, int(duration * self.samp_freq)).astype(np.float32)
+        decoder.decode(self.samp_freq, noise, True)
+
+    def enable_batching(self, minibatch_size=128, frames_per_chunk=51, tick=0.005):
+        """Score the audio of all decoders of this model in shared nnet3 minibatches
+
+        Instead of a forward pass per stream, decoders hand chunks of frames to a scheduler, which runs them through
+        the nnet together. This raises the throughput of many concurrent streams, at the cost of latency: a chunk is
+        only scored once its frames and right context are there. Run every decoder in a thread of its own, decode
+        blocks until the chunks of its stream are scored. Takes effect from the next utterance of every decoder.
+
+        :param minibatch_size: (default 128) Maximum number of chunks scored together
+        :param frames_per_chunk: (default 51) Chunk size in frames, before frame subsampling
+        :param tick: (default 0.005) Seconds to wait for the chunks of other streams before scoring a partial
+        minibatch
+        """
+        self.model_wrapper.enable_batching(minibatch_size, frames_per_chunk, int(tick * 1000))
+
+    def add_graph(self, name, graph_dir, old_lm=None, new_lm=None, preload=False):
+        """Register an additional decoding graph for the acoustic model of this model
+
+        The graph is loaded on first use, after which decoders can switch to it without reloading the model. Registering
+        a graph under the name of another replaces it, along with its rescoring LMs.
+
+        :param name: Name the graph is selected with in KaldiNNet3OnlineDecoder.set_graph
+        :param graph_dir: Directory with HCLG.fst, words.txt and phones/align_lexicon.int
+        :param old_lm: (default None) Path to the G.fst the graph was compiled with, for lattice rescoring
+        :param new_lm: (default None) Path to the LM to rescore the final lattices of this graph with
+        :param preload: (default False) Load the graph now instead of at the first utterance decoded with it
+        """
+        fst_in_str = "{}/HCLG.fst".format(graph_dir)
+        word_symbol_table = "{}/words.txt".format(graph_dir)
+        align_lex_filename = "{}/phones/align_lexicon.int".format(graph_dir)
+
+        if bool(old_lm) != bool(new_lm):
+            raise Exception("Lattice rescoring needs both old_lm and new_lm")
+
+        for fname in [fst_in_str, word_symbol_table, align_lex_filename] + ([old_lm, new_lm] if new_lm else []):
             if not os.path.isfile(fname):
                 raise Exception("{} not found".format(fname))
             if not os.access(fname, os.R_OK):
                 raise Exception("{} is not readable".format(fname))
 
-        self.ie_conf_f = NamedTemporaryFile(prefix='ivector_extractor_', suffix='.conf', delete=True, mode="w")
-        self.ie_conf_f.write("--cmvn-config={}/conf/online_cmvn.conf\n".format(self.model_dir))
-        self.ie_conf_f.write("--ivector-period={}\n".format(online_ivector_period))
-        self.ie_conf_f.write("--splice-config={}\n".format(splice_conf_filename))
-        self.ie_conf_f.write("--lda-matrix={}/extractor/final.mat\n".format(self.model_dir))
-        self.ie_conf_f.write("--global-cmvn-stats={}/extractor/global_cmvn.stats\n".format(self.model_dir))
-        self.ie_conf_f.write("--diag-ubm={}/extractor/final.dubm\n".format(self.model_dir))
-        self.ie_conf_f.write("--ivector-extractor={}/extractor/final.ie\n".format(self.model_dir))
-        self.ie_conf_f.write("--num-gselect={}\n".format(num_gselect))
-        self.ie_conf_f.write("--min-post={}\n".format(min_post))
-        self.ie_conf_f.write("--posterior-scale={}\n".format(posterior_scale))
-        self.ie_conf_f.write("--max-remembered-frames=1000\n")
-        self.ie_conf_f.write("--max-count={}\n".format(max_count))
-        self.ie_conf_f.flush()
-
-        self.model_wrapper = NNet3OnlineModelWrapper(beam, max_active, min_active, lattice_beam, acoustic_scale, frame_subsampling_factor,
-                                                     word_symbol_table, model_in_filename, fst_in_str, mfcc_config,
-                                                     self.ie_conf_f.name, align_lex_filename)
+        self.model_wrapper.add_graph(name, fst_in_str, word_symbol_table, align_lex_filename)
+        self._graph_fingerprints[name] = fingerprint(fst_in_str, word_symbol_table, align_lex_filename,
+                                                     *([old_lm, new_lm] if new_lm else []))
+        if new_lm:
+            self.model_wrapper.set_lm_rescoring(old_lm, new_lm, name)
+        if preload:
+            self.model_wrapper.load_graph(name)
+
+    def remove_graph(self, name):
+        """Unregister a decoding graph. Decoders using it keep it until their current utterance is finalized."""
+        self.model_wrapper.remove_graph(name)
+        self._graph_fingerprints.pop(name, None)
+
+    def graph_fingerprint(self, name):
+        """Digest identifying the results of decoding with a graph of this model, see yapykaldi.utils.fingerprint"""
+        return fingerprint(self.fingerprint, self._graph_fingerprints[name])
+
+    @property
+    def loaded_graphs(self):
+        """Names of the graphs currently in memory, most recently used first"""
+        return list(self.model_wrapper.get_loaded_graphs())
+
+    @property
+    def graph_cache_usage(self):
+        """Approximate memory used by the loaded graphs in bytes"""
+        return self.model_wrapper.get_graph_cache_usage()
 
     def __del__(self):
         if self.ie_conf_f:
@@ -58,22 +256,200 @@ class KaldiNNet3OnlineModel(object):
             del self.model_wrapper
 
 
-class KaldiNNet3OnlineDecoder(object):
-    def __init__(self, model):
+class KaldiNNet3OnlineDecoder(BeamControlMixin):
+    def __init__(self, model, lazy_lattice=False):
+        """
+        :param model: Model to decode with
+        :type model: KaldiNNet3OnlineModel
+        :param lazy_lattice: (default False) Take the final result of an utterance straight from the best path of the
+        search and generate its lattice only when confidences are asked for, see set_lazy_lattice
+        """
         assert isinstance(model, KaldiNNet3OnlineModel)
 
         self.decoder_wrapper = NNet3OnlineDecoderWrapper(model.model_wrapper)
+        self.model = model
+        self._adapted = False
+        self._cached_result = None
+        self._default_search_options = self.search_options
+        self.beam_controller = None
+        if model.silence_phones:
+            self.set_endpoint_options(silence_phones=model.silence_phones)
+        self.set_lazy_lattice(lazy_lattice)
 
     def __del__(self):
         del self.decoder_wrapper
 
-    def decode(self, samp_freq, samples, finalize):
-        return self.decoder_wrapper.decode(samp_freq, samples, finalize)
+    def extract_features(self, samp_freq, samples):
+        """Run only the front end on a whole utterance, to decode its features later with decode_features
+
+        The i-vectors start from the current adaptation state of the decoder. Unlike in decode, they are estimated
+        without silence weighting, so the results can differ slightly from decoding the audio.
+
+        :param samp_freq: Sampling frequency of the samples
+        :param samples: (numpy.ndarray) float32 samples
+        :return: (input_feats, ivector_feats) as float32 numpy arrays with one row per frame. ivector_feats is None
+        for models without i-vectors
+        """
+        return self.decoder_wrapper.extract_features(samp_freq, samples)
+
+    def decode_features(self, input_feats, ivector_feats=None):
+        """Decode a whole utterance from features as returned by extract_features, skipping the front end
+
+        The features are used in place, so memory-mapped arrays (numpy.load(..., mmap_mode='r')) are not copied. An
+        utterance decoded with decode has to be finalized or reset first. Where the adaptation state is carried over,
+        the i-vector extractor runs over the features once more to update it.
+
+        :param input_feats: (numpy.ndarray) float32 MFCC features, one row per frame
+        :param ivector_feats: (default None) (numpy.ndarray) float32 i-vectors, one row per frame
+        :return: (bool) True if decoding succeeded
+        """
+        self._cached_result = None
+        return self.decoder_wrapper.decode_features(input_feats, ivector_feats)
+
+    def reset(self):
+        """Drop the current utterance without finalizing it"""
+        self._cached_result = None
+        self.decoder_wrapper.reset()
+
+    def get_adaptation_state(self):
+        """Speaker adaptation state reached so far, serialized in Kaldi binary format
+
+        :return: (bytes) adaptation state
+        """
+        return self.decoder_wrapper.get_adaptation_state()
+
+    def set_adaptation_state(self, state):
+        """Start the next utterance from a stored speaker adaptation state. From then on, the adaptation state is
+        carried over from one utterance to the next
+
+        :param state: (bytes) adaptation state as returned by get_adaptation_state
+        """
+        self.decoder_wrapper.set_adaptation_state(state)
+        self._adapted = True
+
+    def reset_adaptation_state(self, carry=False):
+        """Start the next utterance from the default adaptation state
+
+        :param carry: (default False) Carry the adaptation state over from one utterance to the next, as for a new
+        speaker without a stored adaptation state
+        """
+        self.decoder_wrapper.reset_adaptation_state(carry)
+        self._adapted = carry
+
+    def set_graph(self, name):
+        """Select the decoding graph by name. The graph is switched at the start of the next utterance."""
+        self.decoder_wrapper.set_graph(name)
+
+    @property
+    def graph(self):
+        """Name of the decoding graph used for the next utterance"""
+        return self.decoder_wrapper.get_graph()
+
+    def set_endpoint_options(self, silence_phones=None, **options):
+        """Configure endpoint detection, see Kaldi's OnlineEndpointConfig. Options not given keep their values. The
+        silence phones of the model are set up already if the model directory has them
+
+        :param silence_phones: (default None) Silence phone ids, as a list or a colon separated string. None keeps them
+        :param options: Endpoint rule options such as rule2_min_trailing_silence=0.5, see
+        yapykaldi.utils.endpoint_options
+        """
+        self.decoder_wrapper.set_endpoint_options(endpoint_options(silence_phones, **options))
+
+    def endpoint_detected(self):
+        """Whether the utterance in progress has reached an endpoint, e.g. enough trailing silence after speech. The
+        caller then finalizes the utterance, see Asr(continuous=True)
+
+        :return: (bool) True at an endpoint
+        """
+        return self.decoder_wrapper.endpoint_detected()
+
+    @property
+    def stats(self):
+        """Search statistics since the decoder was created or last reset_stats, to tune beam and max_active
+
+        Keys: utterances, samples_received, frames_decoded (after frame subsampling), frames_pending (features of the
+        current utterance not decoded yet), active_tokens_histogram (numpy array: decoded frames by active tokens,
+        bin 0 for none, bin i for 2**(i-1) up to 2**i - 1, the last bin for more), active_tokens_total,
+        active_tokens_max, frames_at_max_active, lattice_states and lattice_arcs (of the last final lattice), and the
+        wall time accept_waveform_seconds, advance_decoding_seconds and finalize_seconds.
+
+        :return: (dict) statistics
+        """
+        return self.decoder_wrapper.get_stats()
+
+    @property
+    def counters(self):
+        """The counters of stats that change with every chunk, read without building the dict of stats, so they are
+        cheap to take after every chunk, e.g. by a flight recorder
+
+        :return: (tuple) utterances, frames_decoded, active_tokens_total, accept_waveform_seconds,
+        advance_decoding_seconds and finalize_seconds
+        """
+        return self.decoder_wrapper.get_counters()
+
+    def reset_stats(self):
+        """Restart the search statistics from zero"""
+        self.decoder_wrapper.reset_stats()
+
+    def set_lazy_lattice(self, lazy):
+        """Whether finalizing an utterance takes its best path straight from the traceback of the search and leaves
+        lattice determinization until the lattice is needed. The final result and word alignment are then available
+        sooner, and unchanged. The lattice, for confidences, is generated by get_word_alignment(confidence=True) or
+        build_lattice, until the next utterance starts. Models with LM rescoring always generate the lattice, since
+        the best path comes from the rescored lattice.
+
+        :param lazy: (bool) True for a lazy lattice
+        """
+        self.decoder_wrapper.set_lazy_lattice(lazy)
+
+    @property
+    def lazy_lattice(self):
+        """Whether the lattice is generated only once it is needed, see set_lazy_lattice"""
+        return self.decoder_wrapper.get_lazy_lattice()
+
+    def build_lattice(self):
+        """Generate the lattice of the last finalized utterance if it was left for later, e.g. while waiting for the
+        next utterance
+
+        :return: (bool) False if there is no lattice, e.g. because the next utterance started already
+        """
+        return self.decoder_wrapper.build_lattice()
+
+    @property
+    def fingerprint(self):
+        """Digest identifying the results of this decoder for the next utterance, see yapykaldi.utils.fingerprint"""
+        model_fingerprint = self.model.graph_fingerprint(self.graph)
+        if self.search_options != self._default_search_options:
+            model_fingerprint = fingerprint(model_fingerprint, *self.search_options)
+        if not self._adapted:
+            return model_fingerprint
+        return fingerprint(model_fingerprint, self.decoder_wrapper.get_adaptation_state())
+
+    @property
+    def feature_fingerprint(self):
+        """Digest identifying the features extract_features returns, see yapykaldi.utils.fingerprint"""
+        if not self._adapted:
+            return self.model.feature_fingerprint
+        return fingerprint(self.model.feature_fingerprint, self.decoder_wrapper.get_adaptation_state())
 
     def get_decoded_string(self, likelihood=0.0):
+        if self._cached_result:
+            return self._cached_result[0], self._cached_result[1]
         return self.decoder_wrapper.get_decoded_string(likelihood)
 
-    def get_word_alignment(self):
+    def get_word_alignment(self, confidence=False):
+        """Word alignment of the best path of the last finalized utterance
+
+        :param confidence: (default False) Also return the lattice posterior of every word as its confidence. Times,
+        lengths and confidences are then numpy arrays and silences are left out of the alignment
+        :return: (words, times, lengths) or (words, times, lengths, confidences), with times and lengths in frames, or
+        None if the alignment failed. Confidences are not available for results from a DecodeResultCache
+        """
+        if self._cached_result:
+            return None if confidence else self._cached_result[2]
+        if confidence:
+            return self.decoder_wrapper.get_word_confidences()
+
         words = StringList()
         times = IntList()
         lengths = IntList()
@@ -82,7 +458,16 @@ class KaldiNNet3OnlineDecoder(object):
             return None
         return words, times, lengths
 
-    def decode_wav_file(self, wavfile):
+    def decode_wav_file(self, wavfile, cache=None, feature_cache=None):
+        """Decode a whole wave file as one utterance
+
+        :param wavfile: Path of a 16 bit mono wave file
+        :param cache: (default None) DecodeResultCache to look the result up in before decoding and to store it in
+        after. A cached result is available through get_decoded_string and get_word_alignment as usual
+        :param feature_cache: (default None) FeatureCache to take the features from, so the front end only runs the
+        first time a file is decoded
+        :return: (bool) True if decoding succeeded
+        """
         wavf = wave.open(wavfile, 'rb')
 
         # Check format
@@ -93,8 +478,140 @@ class KaldiNNet3OnlineDecoder(object):
         # Read the whole file into memory, for now
         num_frames = wavf.getnframes()
         frames = wavf.readframes(num_frames)
-
-        samples = struct.unpack_from('<%dh' % num_frames, frames)
+        samp_freq = wavf.getframerate()
         wavf.close()
 
-        return self.decode(wavf.getframerate(), np.array(samples, dtype=np.float32), True)
+        key = None
+        if cache is not None:
+            key = cache.key(frames, samp_freq, self.fingerprint)
+            result = cache.get(key)
+            if result is not None:
+                self._cached_result = result
+                return True
+
+        if feature_cache is not None:
+            decoded = self.decode_features(*feature_cache.features(self, samp_freq, frames))
+        else:
+            samples = struct.unpack_from('<%dh' % num_frames, frames)
+            decoded = self.decode(samp_freq, np.array(samples, dtype=np.float32), True)
+        if not decoded:
+            return False
+
+        if key is not None:
+            transcript, likelihood = self.get_decoded_string()
+            alignment = self.get_word_alignment()
+            if alignment is not None:
+                alignment = tuple(list(field) for field in alignment)
+            cache.put(key, transcript, likelihood, alignment)
+        return True
+
+
+class KaldiNNet3MultiGraphDecoder(object):
+    def __init__(self, model, graphs):
+        """Decoder running one stream against several decoding graphs of a model at once, e.g. a command grammar and
+        a dictation graph
+
+        The front end (MFCC, i-vectors) and the forward pass of the nnet run once per chunk, and every graph gets a
+        search of its own on the same acoustic scores. The first search runs in the decoding thread, every other one
+        in a thread the decoder starts when it is created and keeps until it is deleted. Another graph costs its search,
+        not another run of the acoustic model. Results are per graph.
+
+        :param model: Model to decode with
+        :type model: KaldiNNet3OnlineModel
+        :param graphs: Names of the graphs to decode with, see KaldiNNet3OnlineModel.add_graph. The first one drives
+        the silence weighting of the i-vectors and endpoint detection
+        """
+        assert isinstance(model, KaldiNNet3OnlineModel)
+        if not graphs:
+            raise Exception("No decoding graphs to decode with")
+
+        self.decoder_wrapper = NNet3MultiGraphDecoderWrapper(model.model_wrapper, StringList(graphs))
+        self.model = model
+        if model.silence_phones:
+            self.set_endpoint_options(silence_phones=model.silence_phones)
+
+    def __del__(self):
+        del self.decoder_wrapper
+
+    @property
+    def graphs(self):
+        """Names of the graphs decoded with"""
+        return list(self.decoder_wrapper.get_graphs())
+
+    def decode(self, samp_freq, samples, finalize):
+        """Decode a chunk with all graphs
+
+        :return: (bool) True if decoding succeeded with at least one of the graphs
+        """
+        return self.decoder_wrapper.decode(samp_freq, samples, finalize)
+
+    def reset(self):
+        """Drop the current utterance without finalizing it"""
+        self.decoder_wrapper.reset()
+
+    def get_decoded_string(self, graph, likelihood=0.0):
+        """Best hypothesis so far, or final result, of a graph
+
+        :param graph: Name of the graph
+        :return: (str, float) decoded string and likelihood. Empty if the utterance failed to decode with the graph
+        """
+        return self.decoder_wrapper.get_decoded_string(graph, likelihood)
+
+    def get_decoded_strings(self):
+        """Results of all graphs
+
+        :return: (dict) (decoded string, likelihood) by graph name
+        """
+        return {graph: self.get_decoded_string(graph) for graph in self.graphs}
+
+    def get_word_alignment(self, graph, confidence=False):
+        """Word alignment of the best path of the last finalized utterance with a graph, see
+        KaldiNNet3OnlineDecoder.get_word_alignment
+
+        :param graph: Name of the graph
+        :param confidence: (default False) Also return the lattice posterior of every word as its confidence
+        :return: (words, times, lengths) or (words, times, lengths, confidences), or None if the alignment failed
+        """
+        if confidence:
+            return self.decoder_wrapper.get_word_confidences(graph)
+
+        words = StringList()
+        times = IntList()
+        lengths = IntList()
+
+        if not self.decoder_wrapper.get_word_alignment(graph, words, times, lengths):
+            return None
+        return words, times, lengths
+
+    def set_endpoint_options(self, silence_phones=None, **options):
+        """Configure endpoint detection on the search of the first graph, see
+        KaldiNNet3OnlineDecoder.set_endpoint_options
+        """
+        self.decoder_wrapper.set_endpoint_options(endpoint_options(silence_phones, **options))
+
+    def endpoint_detected(self):
+        """Whether the utterance in progress has reached an endpoint, by the search of the first graph"""
+        return self.decoder_wrapper.endpoint_detected()
+
+    @property
+    def stats(self):
+        """Search statistics, see KaldiNNet3OnlineDecoder.stats. The active tokens of all searches are counted, and
+        the lattice is that of the first graph
+
+        :return: (dict) statistics
+        """
+        return self.decoder_wrapper.get_stats()
+
+    @property
+    def counters(self):
+        """The counters of stats that change with every chunk, read without building the dict of stats, so they are
+        cheap to take after every chunk, e.g. by a flight recorder
+
+        :return: (tuple) utterances, frames_decoded, active_tokens_total, accept_waveform_seconds,
+        advance_decoding_seconds and finalize_seconds
+        """
+        return self.decoder_wrapper.get_counters()
+
+    def reset_stats(self):
+        """Restart the search statistics from zero"""
+        self.decoder_wrapper.reset_stats()
@@ -0,0 +1,153 @@
+"Cache of decoding results for repeated offline decodes of the same audio"
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from .logger import logger
+from .utils import makedir_exist_ok
+
+
+__all__ = ["DecodeResultCache"]
+
+
+class DecodeResultCache(object):
+    """Size-bounded on-disk cache of decoding results, keyed by audio content and decoding configuration
+
+    Results are stored in an SQLite database: the transcript, its likelihood and the word alignment. The least
+    recently used results are evicted when the stored results exceed max_bytes. Pass the cache to the decode_wav_file
+    method of a decoder, so decoding an unchanged recording again only costs hashing it::
+
+        cache = DecodeResultCache("results.sqlite")
+        decoder.decode_wav_file(wavfile, cache=cache)
+        transcript, likelihood = decoder.get_decoded_string()
+    """
+    # number of least recently used results looked up at a time when evicting
+    EVICTION_BATCH = 64
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024):
+        """
+        :param path: Path of the SQLite database file. It is created when it does not exist
+        :param max_bytes: (default 256 MiB) Approximate cap on the size of the stored results in bytes. 0 for no limit
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+
+        dirpath = os.path.dirname(os.path.abspath(path))
+        makedir_exist_ok(dirpath)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS results ("
+                             "key TEXT PRIMARY KEY, transcript TEXT, likelihood REAL, words TEXT, times BLOB, "
+                             "lengths BLOB, size INTEGER, last_used REAL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self._used_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    @staticmethod
+    def key(pcm, samp_freq, fingerprint):
+        """Key of the result of decoding audio
+
+        :param pcm: (bytes) Raw PCM data of the audio
+        :param samp_freq: Sampling frequency of the audio
+        :param fingerprint: Fingerprint of the decoder configuration, see the fingerprint property of the decoders
+        :return: (str) key
+        """
+        digest = hashlib.sha1(pcm)
+        digest.update("{}:{}".format(samp_freq, fingerprint).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Look up a decoding result
+
+        :param key: Key as returned by key
+        :return: (transcript, likelihood, alignment) with alignment (words, times, lengths) or None, or None if the
+        result is not cached
+        """
+        with self._lock:
+            row = self._db.execute("SELECT transcript, likelihood, words, times, lengths FROM results WHERE key = ?",
+                                   (key,)).fetchone()
+            if row is None:
+                return None
+            with self._db:
+                self._db.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+
+        transcript, likelihood, words, times, lengths = row
+        alignment = None
+        if words is not None:
+            alignment = (words.split(), np.frombuffer(times, dtype='<i4').tolist(),
+                         np.frombuffer(lengths, dtype='<i4').tolist())
+        return transcript, likelihood, alignment
+
+    def put(self, key, transcript, likelihood, alignment=None):
+        """Store a decoding result
+
+        :param key: Key as returned by key
+        :param transcript: Decoded string
+        :param likelihood: Likelihood of the decoded string
+        :param alignment: (default None) Word alignment (words, times, lengths) as returned by get_word_alignment
+        """
+        words = times = lengths = None
+        if alignment is not None:
+            words = " ".join(alignment[0])
+            times = sqlite3.Binary(np.asarray(list(alignment[1]), dtype='<i4').tobytes())
+            lengths = sqlite3.Binary(np.asarray(list(alignment[2]), dtype='<i4').tobytes())
+        size = len(key) + len(transcript.encode('utf-8')) + 8
+        if words is not None:
+            size += len(words.encode('utf-8')) + len(times) + len(lengths)
+
+        with self._lock:
+            with self._db:
+                old = self._db.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+                if old is not None:
+                    self._used_bytes -= old[0]
+                self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                 (key, transcript, likelihood, words, times, lengths, size, time.time()))
+                self._used_bytes += size
+                self._evict()
+
+    def clear(self):
+        """Remove all stored results"""
+        with self._lock:
+            with self._db:
+                self._db.execute("DELETE FROM results")
+            self._used_bytes = 0
+
+    def close(self):
+        """Close the database"""
+        with self._lock:
+            self._db.close()
+
+    @property
+    def size(self):
+        """Approximate size of the stored results in bytes"""
+        return self._used_bytes
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def _evict(self):
+        """Internal method to remove the least recently used results beyond max_bytes, called within a transaction"""
+        if not self.max_bytes or self._used_bytes <= self.max_bytes:
+            return
+
+        # the oldest results, a batch at a time through the index on last_used, until the cache fits again
+        evicted = 0
+        while self._used_bytes > self.max_bytes:
+            rows = self._db.execute("SELECT key, size FROM results ORDER BY last_used LIMIT ?",
+                                    (self.EVICTION_BATCH,)).fetchall()
+            if not rows:
+                self._used_bytes = 0
+                break
+            keys = []
+            for key, size in rows:
+                if self._used_bytes <= self.max_bytes:
+                    break
+                keys.append((key,))
+                self._used_bytes -= size
+            self._db.executemany("DELETE FROM results WHERE key = ?", keys)
+            evicted += len(keys)
+        logger.debug("Evicted %d decoding results from %s", evicted, self.path)
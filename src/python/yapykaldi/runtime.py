@@ -0,0 +1,322 @@
+"""
+Process and thread placement for hosts running many decoders
+
+The BLAS library behind Kaldi may run every matrix multiplication of the nnet3 forward pass on threads of its own.
+With a decoder per core that oversubscribes the cores, so decoding processes usually want a single BLAS thread. Pinning
+decoders to CPUs, and to the CPUs of one NUMA node with the memory of the node, keeps them from moving between cores
+and sockets. This module sets these up for a process or a thread and reports the configuration in effect.
+
+CPU pinning and NUMA nodes are Linux only. Elsewhere, pinning raises and the host counts as a single node.
+"""
+import os
+import ctypes
+import ctypes.util
+import logging
+from .logger import logger
+
+
+__all__ = ["set_blas_threads", "blas_threads", "available_cpus", "numa_nodes", "pin_process", "pin_thread",
+           "bind_numa_node", "plan_placement", "configure", "runtime_report", "log_runtime_report"]
+
+
+# variables the BLAS and OpenMP runtimes read when they are loaded, and processes started later inherit
+BLAS_THREAD_VARIABLES = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "BLIS_NUM_THREADS",
+                         "VECLIB_MAXIMUM_THREADS")
+
+# (library name, setter, getter) of the thread count of the BLAS and OpenMP runtimes
+BLAS_LIBRARIES = [
+    ("libopenblas", "openblas_set_num_threads", "openblas_get_num_threads"),
+    ("libmkl_rt", "MKL_Set_Num_Threads", "MKL_Get_Max_Threads"),
+    ("libgomp", "omp_set_num_threads", "omp_get_max_threads"),
+    ("libiomp5", "omp_set_num_threads", "omp_get_max_threads"),
+    ("libomp", "omp_set_num_threads", "omp_get_max_threads"),
+]
+
+
+def _loaded_libraries():
+    """Internal function listing the paths of the shared libraries mapped into this process"""
+    try:
+        with open("/proc/self/maps") as maps:
+            paths = [line.split()[-1] for line in maps if ".so" in line]
+    except (IOError, OSError):
+        return []
+    return sorted(set(path for path in paths if path.startswith("/")))
+
+
+def _blas_libraries():
+    """Internal function finding the BLAS and OpenMP runtimes loaded, e.g. by the Kaldi extension
+
+    :return: (list) (path, setter, getter) of every runtime loaded, setter and getter being the ctypes functions of
+    its thread count
+    """
+    found = []
+    for path in _loaded_libraries():
+        name = os.path.basename(path)
+        for library_name, setter, getter in BLAS_LIBRARIES:
+            if not name.startswith(library_name + "."):
+                continue
+            try:
+                library = ctypes.CDLL(path)
+            except OSError:
+                continue
+            if hasattr(library, setter) and hasattr(library, getter):
+                found.append((path, getattr(library, setter), getattr(library, getter)))
+            break
+    return found
+
+
+def set_blas_threads(num_threads):
+    """Set the number of threads BLAS and OpenMP use for every operation
+
+    Runtimes loaded already, e.g. by importing yapykaldi._Extensions, are changed right away. The environment
+    variables are set too, for runtimes loaded later and for processes started from this one.
+
+    :param num_threads: Number of threads, usually 1 when several decoders run on the host
+    :return: (list) paths of the runtimes changed right away
+    """
+    num_threads = int(num_threads)
+    if num_threads < 1:
+        raise Exception("BLAS needs at least one thread, not {}".format(num_threads))
+    for variable in BLAS_THREAD_VARIABLES:
+        os.environ[variable] = str(num_threads)
+
+    changed = []
+    for path, setter, _ in _blas_libraries():
+        setter(ctypes.c_int(num_threads))
+        changed.append(path)
+    return changed
+
+
+def blas_threads():
+    """Number of threads of the BLAS and OpenMP runtimes loaded
+
+    :return: (dict) thread count by path of the runtime
+    """
+    return {path: int(getter()) for path, _, getter in _blas_libraries()}
+
+
+def parse_cpu_list(cpu_list):
+    """CPUs of a list in the kernel format, e.g. "0-3,8,10-11"
+
+    :return: (list) sorted CPU numbers
+    """
+    cpus = set()
+    for part in cpu_list.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return sorted(cpus)
+
+
+def available_cpus():
+    """CPUs this process may run on
+
+    :return: (list) sorted CPU numbers
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def numa_nodes():
+    """NUMA nodes of the host with their CPUs, limited to the CPUs this process may run on. Nodes without any of these
+    are left out. A host without NUMA information counts as a single node 0
+
+    :return: (dict) sorted CPU numbers by node number
+    """
+    allowed = set(available_cpus())
+    nodes = {}
+    root = "/sys/devices/system/node"
+    if os.path.isdir(root):
+        for name in os.listdir(root):
+            if not name.startswith("node") or not name[4:].isdigit():
+                continue
+            with open(os.path.join(root, name, "cpulist")) as cpulist:
+                cpus = [cpu for cpu in parse_cpu_list(cpulist.read()) if cpu in allowed]
+            if cpus:
+                nodes[int(name[4:])] = cpus
+    return nodes or {0: sorted(allowed)}
+
+
+def _check_cpus(cpus):
+    """Internal function validating a CPU set to pin to"""
+    if not hasattr(os, "sched_setaffinity"):
+        raise Exception("CPU pinning is not supported on this platform")
+    cpus = set(int(cpu) for cpu in cpus)
+    if not cpus:
+        raise Exception("No CPUs to pin to")
+    return cpus
+
+
+def pin_thread(cpus):
+    """Pin the calling thread to CPUs. Threads it starts afterwards, such as the search threads of a
+    KaldiNNet3MultiGraphDecoder created afterwards, inherit the CPUs
+
+    :param cpus: CPU numbers
+    """
+    # on Linux, the affinity of pid 0 is the one of the calling thread
+    os.sched_setaffinity(0, _check_cpus(cpus))
+
+
+def pin_process(cpus):
+    """Pin all threads of this process to CPUs, including threads of the BLAS runtime started already
+
+    :param cpus: CPU numbers
+    """
+    cpus = _check_cpus(cpus)
+    try:
+        threads = [int(tid) for tid in os.listdir("/proc/self/task")]
+    except (IOError, OSError):
+        threads = [0]
+    for tid in threads:
+        try:
+            os.sched_setaffinity(tid, cpus)
+        except ProcessLookupError:
+            # the thread has exited in the meantime
+            pass
+
+
+def _prefer_numa_memory(node):
+    """Internal function asking the kernel to allocate the memory of the calling thread, and of threads it starts, on a
+    NUMA node, through libnuma
+
+    :return: (bool) False if libnuma is not available, in which case memory is still allocated on the node of the
+    CPU first touching it
+    """
+    name = ctypes.util.find_library("numa")
+    if not name:
+        return False
+    try:
+        libnuma = ctypes.CDLL(name)
+    except OSError:
+        return False
+    if libnuma.numa_available() < 0:
+        return False
+    libnuma.numa_set_preferred(ctypes.c_int(node))
+    return True
+
+
+def bind_numa_node(node, thread=False):
+    """Run on the CPUs of a NUMA node, with memory preferably allocated on the node. Bind before loading the model,
+    so the model is allocated where it is read
+
+    :param node: Node number, see numa_nodes
+    :param thread: (default False) Bind only the calling thread instead of the whole process
+    :return: (bool) True if the memory policy was set as well, see _prefer_numa_memory
+    """
+    nodes = numa_nodes()
+    if node not in nodes:
+        raise Exception("Unknown NUMA node {}, this process runs on nodes {}".format(node, sorted(nodes)))
+    if thread:
+        pin_thread(nodes[node])
+    else:
+        pin_process(nodes[node])
+    return _prefer_numa_memory(node)
+
+
+def plan_placement(num_workers, cpus_per_worker=None):
+    """Spread decoding workers over the NUMA nodes and CPUs of the host, for configure or DecodingWorker
+
+    Workers are divided evenly over the nodes, in consecutive groups, and the workers of a node get disjoint sets of
+    its CPUs as long as there are enough of them. More workers than CPUs share them.
+
+    :param num_workers: Number of workers
+    :param cpus_per_worker: (default None) CPUs per worker, None to divide the CPUs of a node among its workers
+    :return: (list) dict per worker with its numa_node and cpus
+    """
+    nodes = sorted(numa_nodes().items())
+    groups = [[] for _ in nodes]
+    for worker in range(num_workers):
+        groups[worker * len(nodes) // num_workers].append(worker)
+
+    placement = [None] * num_workers
+    for (node, cpus), workers in zip(nodes, groups):
+        if not workers:
+            continue
+        count = cpus_per_worker or max(1, len(cpus) // len(workers))
+        count = min(count, len(cpus))
+        for i, worker in enumerate(workers):
+            start = i * count
+            placement[worker] = {"numa_node": node,
+                                 "cpus": [cpus[(start + j) % len(cpus)] for j in range(count)]}
+    return placement
+
+
+def configure(blas_threads=None, cpus=None, numa_node=None, thread=False):  # pylint: disable=redefined-outer-name
+    """Set up a decoding process or thread: BLAS threads, CPUs and NUMA node
+
+    :param blas_threads: (default None) Number of BLAS threads, see set_blas_threads. None keeps them
+    :param cpus: (default None) CPU numbers to pin to, None for the CPUs of numa_node or no pinning
+    :param numa_node: (default None) NUMA node to bind to, None for none. With cpus, memory is allocated on the node
+    and the given CPUs are used, which should belong to it
+    :param thread: (default False) Pin only the calling thread, not the whole process. BLAS threads are always set
+    for the process
+    :return: (dict) configuration in effect, see runtime_report
+    """
+    if blas_threads is not None:
+        set_blas_threads(blas_threads)
+    if numa_node is not None and cpus is None:
+        bind_numa_node(numa_node, thread=thread)
+    else:
+        if cpus is not None:
+            if thread:
+                pin_thread(cpus)
+            else:
+                pin_process(cpus)
+        if numa_node is not None:
+            _prefer_numa_memory(numa_node)
+    return runtime_report()
+
+
+def runtime_report():
+    """Configuration in effect for the calling thread: CPUs, NUMA nodes and BLAS threads
+
+    :return: (dict) with the keys pid, cpu_count (of the host), cpus (the calling thread may run on), numa_nodes (the
+    nodes of these CPUs), blas_threads (by runtime path, see blas_threads) and environment (the BLAS thread
+    variables set)
+    """
+    cpus = available_cpus()
+    nodes = numa_nodes()
+    return {
+        "pid": os.getpid(),
+        "cpu_count": os.cpu_count(),
+        "cpus": cpus,
+        "numa_nodes": sorted(node for node, node_cpus in nodes.items() if set(node_cpus) & set(cpus)),
+        "blas_threads": blas_threads(),
+        "environment": {variable: os.environ[variable] for variable in BLAS_THREAD_VARIABLES
+                        if variable in os.environ},
+    }
+
+
+def log_runtime_report(level=logging.INFO):
+    """Log the configuration in effect, see runtime_report, e.g. once at startup
+
+    :param level: (default logging.INFO) Level to log at
+    :return: (dict) the report
+    """
+    report = runtime_report()
+    logger.log(level, "Process %d runs on %d of %d CPUs (%s), NUMA nodes %s", report["pid"], len(report["cpus"]),
+               report["cpu_count"], _format_cpu_list(report["cpus"]), report["numa_nodes"])
+    if report["blas_threads"]:
+        for path, count in sorted(report["blas_threads"].items()):
+            logger.log(level, "%s runs %d threads", path, count)
+    else:
+        logger.log(level, "No BLAS or OpenMP runtime with a thread count loaded, environment %s",
+                   report["environment"] or "not set")
+    most_threads = max(list(report["blas_threads"].values()) or [1])
+    if most_threads > 1 and most_threads >= len(report["cpus"]):
+        logger.log(max(level, logging.WARNING), "BLAS runs %d threads on %d CPUs, several decoders will contend for "
+                   "them, see yapykaldi.runtime.set_blas_threads", most_threads, len(report["cpus"]))
+    return report
+
+
+def _format_cpu_list(cpus):
+    """Internal function formatting CPU numbers in the kernel format, e.g. "0-3,8" """
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(first) if first == last else "{}-{}".format(first, last) for first, last in ranges)
@@ -1,6 +1,7 @@
 "Common utilities used by other modules"
 import os
 import errno
+import hashlib
 import numpy as np
 
 
@@ -29,3 +30,45 @@ def volume_indicator(data, bitsize=16, bars=79):
     peak = np.abs(np.max(data) - np.min(data))/2**bitsize
     volume_level_string = "[" + "#"*int(peak*bars) + "-"*int(bars - peak*bars) + "]"
     return volume_level_string
+
+
+def fingerprint(*items):
+    """Digest identifying a configuration, e.g. to key caches of results that depend on it
+
+    Paths of existing files are identified by their size and modification time along with the path, so the digest
+    changes when a model file is replaced.
+
+    :param items: Values and file paths making up the configuration
+    :return: (str) hex digest
+    """
+    signature = []
+    for item in items:
+        if isinstance(item, str) and os.path.isfile(item):
+            stat = os.stat(item)
+            item = (os.path.abspath(item), stat.st_size, int(stat.st_mtime))
+        signature.append(item)
+    return hashlib.sha1(repr(signature).encode('utf-8')).hexdigest()
+
+
+def endpoint_options(silence_phones=None, **options):
+    """Endpoint detection options in Kaldi config file syntax, for set_endpoint_options of the decoders
+
+    :param silence_phones: (default None) Silence phone ids, as a list or a colon separated string like silence.csl of
+    a lang directory. None keeps them
+    :param options: Endpoint rule options, named like the Kaldi options with the prefix left out and dots and dashes
+    replaced by underscores, e.g. rule2_min_trailing_silence=0.5 for --endpoint.rule2.min-trailing-silence=0.5
+    :return: (str) options, one per line
+    """
+    lines = []
+    if silence_phones is not None:
+        if not isinstance(silence_phones, str):
+            silence_phones = ":".join(str(phone) for phone in silence_phones)
+        lines.append("--endpoint.silence-phones={}".format(silence_phones.strip()))
+    for name, value in sorted(options.items()):
+        rule, _, option = name.partition('_')
+        if not rule.startswith('rule') or not option:
+            raise Exception("Unknown endpoint option {}".format(name))
+        if isinstance(value, bool):
+            value = str(value).lower()
+        lines.append("--endpoint.{}.{}={}".format(rule, option.replace('_', '-'), value))
+    return "".join(line + "\n" for line in lines)
@@ -0,0 +1,308 @@
+"""
+Multi-process decoding with shared-memory audio
+
+A DecodingWorker runs a decoder in a process of its own. The front process writes the audio of the stream into a
+SharedAudioRing, a ring buffer of float32 samples in shared memory, and the worker decodes straight from views of the
+ring, so audio is never pickled or copied between processes. Only small control messages and the results go through
+multiprocessing queues. Decoders in separate processes do not contend for the GIL, and a crash in Kaldi code takes
+down the worker, not the process capturing the audio.
+
+Requires Python 3.8 or later for multiprocessing.shared_memory.
+"""
+import time
+import multiprocessing
+from queue import Empty
+import numpy as np
+from . import runtime
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+
+__all__ = ["SharedAudioRing", "DecodingWorker"]
+
+
+HEADER_SIZE = 64
+# header fields, as int64
+WRITE_POS, READ_POS, OVERRUNS, CAPACITY = range(4)
+
+
+class SharedAudioRing(object):
+    def __init__(self, capacity=None, name=None):
+        """Ring buffer of float32 samples in shared memory, for one writing and one reading process
+
+        Positions count samples since the start of the stream. The writer only moves the write position and the reader
+        only the read position, so no lock is needed.
+
+        :param capacity: (default None) Number of samples the ring holds. Creates a new ring, owned by this process
+        :param name: (default None) Name of an existing ring to attach to, see name
+        """
+        if shared_memory is None:
+            raise Exception("Shared memory audio rings need Python 3.8 or later")
+        if (capacity is None) == (name is None):
+            raise Exception("Give either the capacity of a new ring or the name of an existing one")
+
+        self.owner = name is None
+        if self.owner:
+            self._shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + 4 * capacity)
+        else:
+            self._shm = _attach(name)
+        self._header = np.ndarray((HEADER_SIZE // 8,), dtype=np.int64, buffer=self._shm.buf)
+        if self.owner:
+            self._header[:] = 0
+            self._header[CAPACITY] = capacity
+        self.capacity = int(self._header[CAPACITY])
+        self._samples = np.ndarray((self.capacity,), dtype=np.float32, buffer=self._shm.buf, offset=HEADER_SIZE)
+
+    @property
+    def name(self):
+        """Name to attach to the ring from another process"""
+        return self._shm.name
+
+    @property
+    def write_pos(self):
+        return int(self._header[WRITE_POS])
+
+    @property
+    def read_pos(self):
+        return int(self._header[READ_POS])
+
+    @property
+    def overruns(self):
+        """Number of writes dropped because the reader fell behind by more than the capacity"""
+        return int(self._header[OVERRUNS])
+
+    def write(self, samples):
+        """Append samples, converted to float32. Never blocks: if the ring has no room for all of them, none are
+        written and the overrun is counted
+
+        :param samples: (numpy.ndarray or bytes) samples, bytes being 16 bit little endian PCM
+        :return: (bool) True if the samples were written
+        """
+        if isinstance(samples, (bytes, bytearray, memoryview)):
+            samples = np.frombuffer(samples, dtype='<i2')
+        count = len(samples)
+        write_pos = self.write_pos
+        if write_pos + count - self.read_pos > self.capacity:
+            self._header[OVERRUNS] += 1
+            return False
+
+        start = write_pos % self.capacity
+        first = min(count, self.capacity - start)
+        self._samples[start:start + first] = samples[:first]
+        self._samples[:count - first] = samples[first:]
+        # the samples are in place before the reader can see them
+        self._header[WRITE_POS] = write_pos + count
+        return True
+
+    def views(self, end_pos=None):
+        """Views of the unread samples, without copying them. Two views when the samples wrap around the end
+
+        :param end_pos: (default None) Position to read up to instead of the write position
+        :return: (list) float32 numpy arrays, valid until advance is called
+        """
+        read_pos = self.read_pos
+        end_pos = self.write_pos if end_pos is None else min(end_pos, self.write_pos)
+        if end_pos <= read_pos:
+            return []
+        start = read_pos % self.capacity
+        first = min(end_pos - read_pos, self.capacity - start)
+        views = [self._samples[start:start + first]]
+        if end_pos - read_pos > first:
+            views.append(self._samples[:end_pos - read_pos - first])
+        return views
+
+    def advance(self, count):
+        """Release samples read, so the writer can reuse their space"""
+        self._header[READ_POS] = self.read_pos + count
+
+    def close(self):
+        """Detach from the ring, and free it if this process created it"""
+        self._header = None
+        self._samples = None
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
+
+
+def _attach(name):
+    """Internal function to attach to shared memory created by another process, which frees it"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching registers the memory with the resource tracker again. Processes started by
+        # multiprocessing share the tracker of their parent, so that is harmless
+        return shared_memory.SharedMemory(name=name)
+
+
+def _default_decoder(model):
+    """Internal function to create the decoder matching a model"""
+    from .nnet3 import KaldiNNet3OnlineModel, KaldiNNet3OnlineDecoder
+    from .gmm import KaldiGmmOnlineDecoder
+    if isinstance(model, KaldiNNet3OnlineModel):
+        return KaldiNNet3OnlineDecoder(model)
+    return KaldiGmmOnlineDecoder(model)
+
+
+def _run_worker(ring_name, data_event, control, results, model_factory, decoder_factory, samp_freq, partial, poll,
+                placement):
+    """Internal function decoding the audio of a ring in the worker process"""
+    ring = SharedAudioRing(name=ring_name)
+    try:
+        # placed before loading the model, so its memory is allocated on the NUMA node of the worker
+        report = runtime.configure(**placement)
+        model = model_factory()
+        decoder = (decoder_factory or _default_decoder)(model)
+        results.put({"type": "ready", "runtime": report})
+
+        utterance = 0
+        # stream positions at which utterances end, in order
+        utterance_ends = []
+        stopping = False
+        while True:
+            data_event.clear()
+            while True:
+                try:
+                    message = control.get(block=False)
+                except Empty:
+                    break
+                if message[0] == "end":
+                    utterance_ends.append(message[1])
+                elif message[0] == "stop":
+                    stopping = True
+
+            end_pos = utterance_ends[0] if utterance_ends else None
+            views = ring.views(end_pos)
+            finalize = end_pos is not None and ring.read_pos + sum(len(view) for view in views) >= end_pos
+            if not views and not finalize:
+                if stopping:
+                    break
+                data_event.wait(poll)
+                continue
+
+            start = time.time()
+            ok = True
+            for i, view in enumerate(views):
+                ok = decoder.decode(samp_freq, view, finalize and i == len(views) - 1) and ok
+                ring.advance(len(view))
+            if finalize and not views:
+                ok = decoder.decode(samp_freq, np.zeros(0, dtype=np.float32), True)
+
+            if finalize:
+                utterance_ends.pop(0)
+                text, likelihood = decoder.get_decoded_string() if ok else ("", None)
+                results.put({"type": "final", "utterance": utterance, "text": text, "likelihood": likelihood,
+                             "ok": ok, "decode_seconds": time.time() - start})
+                utterance += 1
+            elif partial:
+                text, likelihood = decoder.get_decoded_string()
+                results.put({"type": "partial", "utterance": utterance, "text": text, "likelihood": likelihood})
+    except Exception as e:  # pylint: disable=broad-except
+        results.put({"type": "error", "error": repr(e)})
+        raise
+    finally:
+        ring.close()
+
+
+class DecodingWorker(object):
+    def __init__(self, model_factory, decoder_factory=None, samp_freq=16000, ring_seconds=30.0, partial=False,
+                 poll=0.1, context=None, blas_threads=None, cpus=None, numa_node=None):
+        """Decoder of one stream in a process of its own
+
+        :param model_factory: Picklable function loading the model in the worker process, e.g.
+        functools.partial(KaldiNNet3OnlineModel, model_dir)
+        :param decoder_factory: (default None) Picklable function creating the decoder for the model. None picks
+        KaldiNNet3OnlineDecoder or KaldiGmmOnlineDecoder by the type of the model
+        :param samp_freq: (default 16000) Sampling frequency of the audio
+        :param ring_seconds: (default 30.0) Seconds of audio the shared ring holds. Audio fed while the worker is
+        that far behind is dropped
+        :param partial: (default False) Also send a partial result after every decoded batch of audio
+        :param poll: (default 0.1) Seconds the worker waits for audio before checking its control messages again
+        :param context: (default None) multiprocessing context to start the worker with, e.g.
+        multiprocessing.get_context('spawn'). None for the default one
+        :param blas_threads: (default None) Number of BLAS threads of the worker, usually 1 with a worker per core.
+        None keeps the default of the BLAS library. See yapykaldi.runtime.set_blas_threads
+        :param cpus: (default None) CPU numbers to pin the worker to, see yapykaldi.runtime.plan_placement
+        :param numa_node: (default None) NUMA node to bind the worker and its memory to
+        """
+        self.context = context or multiprocessing
+        self.samp_freq = samp_freq
+        self.ring = SharedAudioRing(capacity=int(ring_seconds * samp_freq))
+        # configuration in effect in the worker, see yapykaldi.runtime.runtime_report, once it is started
+        self.runtime = None
+        self._data_event = self.context.Event()
+        self._control = self.context.Queue()
+        self.results = self.context.Queue()
+        self._process = self.context.Process(
+            target=_run_worker,
+            args=(self.ring.name, self._data_event, self._control, self.results, model_factory, decoder_factory,
+                  samp_freq, partial, poll, {"blas_threads": blas_threads, "cpus": cpus, "numa_node": numa_node}))
+        self._process.daemon = True
+
+    def start(self, timeout=None):
+        """Start the worker process and wait until it has loaded the model
+
+        :param timeout: (default None) Seconds to wait for the model to load, None to wait as long as it takes
+        """
+        self._process.start()
+        message = self.results.get(timeout=timeout)
+        if message["type"] != "ready":
+            raise Exception("Decoding worker failed to start: {}".format(message.get("error")))
+        self.runtime = message["runtime"]
+
+    def feed(self, samples):
+        """Hand audio to the worker, without waiting for it to be decoded
+
+        :param samples: (numpy.ndarray or bytes) samples, bytes being 16 bit little endian PCM
+        :return: (bool) False if the worker is too far behind and the audio was dropped
+        """
+        if not self.ring.write(samples):
+            return False
+        self._data_event.set()
+        return True
+
+    def end_utterance(self):
+        """Finalize the utterance with the audio fed so far. Its final result follows on the results queue"""
+        self._control.put(("end", self.ring.write_pos))
+        self._data_event.set()
+
+    def get_result(self, timeout=None):
+        """Next result of the worker
+
+        :param timeout: (default None) Seconds to wait, None to wait as long as it takes
+        :return: (dict) result with the keys type ("final", "partial" or "error"), utterance (index in the stream),
+        text and likelihood. Final results also have ok and decode_seconds
+        """
+        while True:
+            try:
+                return self.results.get(timeout=timeout if timeout is not None else 1.0)
+            except Empty:
+                if timeout is not None:
+                    raise
+                if not self.is_alive():
+                    raise Exception("Decoding worker exited with code {}".format(self._process.exitcode))
+
+    def is_alive(self):
+        """False once the worker process has exited, e.g. after a crash in the decoder"""
+        return self._process.is_alive()
+
+    @property
+    def overruns(self):
+        """Number of feeds dropped because the worker fell behind"""
+        return self.ring.overruns
+
+    def stop(self, timeout=None):
+        """Stop the worker once it has decoded the audio fed so far, and free the ring
+
+        :param timeout: (default None) Seconds to wait for the worker, after which it is terminated
+        """
+        if self._process.is_alive():
+            self._control.put(("stop",))
+            self._data_event.set()
+            self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.terminate()
+                self._process.join()
+        self.ring.close()
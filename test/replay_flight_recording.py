@@ -0,0 +1,63 @@
+#! /usr/bin/env python
+"""Replay a recording of the flight recorder of an Asr, see Asr.enable_flight_recorder
+
+Feeds the recorded chunks through a decoder configured as the recording says, and prints the recorded and the replayed
+timings per chunk next to each other. With --profile, the replay runs under cProfile.
+
+    python replay_flight_recording.py flight-20240101-120000-0.npz --profile
+"""
+
+from __future__ import print_function, division, absolute_import, unicode_literals
+from builtins import *
+import argparse
+import cProfile
+import pstats
+import logging
+from yapykaldi.asr import replay_recording
+from yapykaldi.asr.flight_recorder import load_recording
+
+logging.basicConfig(level=logging.WARNING,
+                    format='[%(asctime)s](%(processName)-9s) %(message)s',)
+
+parser = argparse.ArgumentParser(description='Replay a flight recording of slow chunks')
+parser.add_argument('recording', type=str,
+                    help='.npz file written by the flight recorder')
+parser.add_argument('--model-dir', type=str, default=None,
+                    help='Model directory, instead of the one in the recording')
+parser.add_argument('--profile', action='store_true',
+                    help='Profile the replay with cProfile')
+parser.add_argument('--top', type=int, default=25,
+                    help='Number of functions of the profile to print')
+
+args = parser.parse_args()
+
+meta, _, audio = load_recording(args.recording)
+print("Recording of stream {}: {}, {:.2f} s of audio".format(meta.get("stream"), meta.get("reason"),
+                                                           len(audio) / meta["rate"]))
+
+model = None
+if args.model_dir:
+    from yapykaldi.asr.asr import ONLINE_MODELS
+    model = ONLINE_MODELS[meta.get("model_type", "nnet3")](args.model_dir)
+elif "model_dir" not in meta:
+    parser.error("The recording has no model directory, pass --model-dir")
+
+profiler = cProfile.Profile() if args.profile else None
+if profiler:
+    profiler.enable()
+chunks = replay_recording(args.recording, model=model)
+if profiler:
+    profiler.disable()
+
+print("{:>5}  {:>10}  {:>10}  {:>10}  {:>10}  {:>10}  {:>7}  {:>9}".format(
+    "chunk", "recorded", "replayed", "accept", "advance", "finalize", "frames", "tokens/fr"))
+for i, chunk in enumerate(chunks):
+    print("{:5d}  {:9.1f}ms  {:9.1f}ms  {:9.1f}ms  {:9.1f}ms  {:9.1f}ms  {:7d}  {:9.0f}{}".format(
+        i, chunk["recorded_total"] * 1000, chunk["total"] * 1000, chunk["accept_waveform"] * 1000,
+        chunk["advance_decoding"] * 1000, chunk["finalize"] * 1000, chunk["frames_decoded"],
+        chunk["active_tokens"] / max(1, chunk["frames_decoded"]),
+        "  slow" if chunk["recorded_total"] > meta["threshold"] else ""))
+
+if profiler:
+    print()
+    pstats.Stats(profiler).sort_stats("cumulative").print_stats(args.top)
@@ -0,0 +1,111 @@
+#! /usr/bin/env python
+"""Checks of SharedAudioRing: writing and reading across the end of the ring, overruns and attaching by name
+
+    python test_audio_ring.py
+"""
+
+from __future__ import print_function, division, absolute_import, unicode_literals
+from builtins import *
+import multiprocessing
+import numpy as np
+from yapykaldi import SharedAudioRing
+
+
+def read_all(ring):
+    """Copy of the unread samples of a ring, advancing past them"""
+    views = ring.views()
+    samples = np.concatenate(views) if views else np.zeros(0, dtype=np.float32)
+    ring.advance(len(samples))
+    return samples
+
+
+def test_wrap_around():
+    ring = SharedAudioRing(capacity=10)
+    try:
+        assert ring.write(np.arange(7))
+        assert read_all(ring).tolist() == list(range(7))
+
+        # the next write wraps around the end, and is read back in two views
+        assert ring.write(np.arange(7, 13))
+        views = ring.views()
+        assert [view.tolist() for view in views] == [[7, 8, 9], [10, 11, 12]]
+        # the views are the ring itself, not copies
+        assert all(view.base is not None for view in views)
+
+        # up to an end position, within the first view
+        assert [view.tolist() for view in ring.views(9)] == [[7, 8]]
+        ring.advance(2)
+        assert read_all(ring).tolist() == [9, 10, 11, 12]
+        assert ring.write_pos == ring.read_pos == 13
+        assert ring.views() == []
+    finally:
+        ring.close()
+
+
+def test_overrun():
+    ring = SharedAudioRing(capacity=8)
+    try:
+        assert ring.write(np.ones(6))
+        # no room for all of them: none are written
+        assert not ring.write(np.ones(3))
+        assert ring.overruns == 1 and ring.write_pos == 6
+
+        # the ring fills up exactly, after which every write is dropped until the reader catches up
+        assert ring.write(np.ones(2))
+        assert not ring.write(np.ones(1))
+        assert ring.overruns == 2
+        ring.advance(4)
+        assert ring.write(np.full(4, 2.0))
+        assert read_all(ring).tolist() == [1.0] * 4 + [2.0] * 4
+    finally:
+        ring.close()
+
+
+def test_pcm_bytes():
+    ring = SharedAudioRing(capacity=16)
+    try:
+        assert ring.write(np.array([-32768, -1, 0, 1, 32767], dtype='<i2').tobytes())
+        samples = read_all(ring)
+        assert samples.dtype == np.float32
+        assert samples.tolist() == [-32768.0, -1.0, 0.0, 1.0, 32767.0]
+    finally:
+        ring.close()
+
+
+def _read_in_child(name, count, results):
+    ring = SharedAudioRing(name=name)
+    try:
+        results.put(read_all(ring)[:count].tolist())
+    finally:
+        ring.close()
+
+
+def test_other_process():
+    ring = SharedAudioRing(capacity=32)
+    try:
+        assert ring.write(np.arange(20))
+        results = multiprocessing.Queue()
+        child = multiprocessing.Process(target=_read_in_child, args=(ring.name, 20, results))
+        child.start()
+        assert results.get(timeout=30) == list(range(20))
+        child.join()
+        # the reader advanced the shared read position
+        assert ring.read_pos == 20
+    finally:
+        ring.close()
+
+
+def test_arguments():
+    for kwargs in ({}, {"capacity": 8, "name": "ring"}):
+        try:
+            SharedAudioRing(**kwargs)
+        except Exception:  # pylint: disable=broad-except
+            pass
+        else:
+            raise AssertionError("SharedAudioRing({}) was accepted".format(kwargs))
+
+
+if __name__ == '__main__':
+    for test in (test_wrap_around, test_overrun, test_pcm_bytes, test_other_process, test_arguments):
+        test()
+        print("{} ok".format(test.__name__))
@@ -0,0 +1,164 @@
+#! /usr/bin/env python
+"""Checks of CallbackDispatcher: ordering, coalescing and dropping of keyed calls, waiting for finals and metrics
+
+    python test_dispatch.py
+"""
+
+from __future__ import print_function, division, absolute_import, unicode_literals
+from builtins import *
+import threading
+from yapykaldi.asr import CallbackDispatcher
+
+
+def blocked_dispatcher(max_pending=1000):
+    """Dispatcher whose thread is held in a first callback until the returned event is set, so calls pile up"""
+    dispatcher = CallbackDispatcher(max_pending=max_pending)
+    entered, release = threading.Event(), threading.Event()
+
+    def block():
+        entered.set()
+        release.wait(30)
+
+    dispatcher.dispatch(block)
+    assert entered.wait(30)
+    return dispatcher, release
+
+
+def test_order():
+    dispatcher = CallbackDispatcher()
+    calls = []
+    for i in range(100):
+        dispatcher.dispatch(calls.append, i)
+    assert dispatcher.wait(30)
+    assert calls == list(range(100))
+    metrics = dispatcher.metrics
+    assert metrics["dispatched"] == metrics["delivered"] == 100
+    assert metrics["pending"] == 0 and metrics["dropped"] == 0 and metrics["coalesced"] == 0
+    assert 0.0 <= metrics["lag_mean"] <= metrics["lag_max"]
+    dispatcher.stop()
+
+
+def test_coalescing():
+    dispatcher, release = blocked_dispatcher()
+    calls = []
+    for i in range(10):
+        dispatcher.dispatch(calls.append, ("partial", i), key="partial")
+    dispatcher.dispatch(calls.append, ("final", 0))
+    for i in range(10, 15):
+        dispatcher.dispatch(calls.append, ("partial", i), key="partial")
+    assert dispatcher.metrics["pending"] == 2
+
+    release.set()
+    assert dispatcher.wait(30)
+    # a newer call replaces the pending one with the same key, where the newer one is in the queue
+    assert calls == [("final", 0), ("partial", 14)]
+    metrics = dispatcher.metrics
+    assert metrics["coalesced"] == 14 and metrics["delivered"] == 3 and metrics["dispatched"] == 17
+    dispatcher.stop()
+
+
+def test_dropping():
+    dispatcher, release = blocked_dispatcher(max_pending=5)
+    calls = []
+    for i in range(20):
+        dispatcher.dispatch(calls.append, i, key=i)
+    assert dispatcher.metrics["pending"] == 5
+
+    release.set()
+    assert dispatcher.wait(30)
+    # the oldest calls with a key are dropped. The blocking call counts as delivered
+    assert calls == list(range(15, 20))
+    metrics = dispatcher.metrics
+    assert metrics["dropped"] == 15 and metrics["delivered"] == 6
+    dispatcher.stop()
+
+
+def test_finals_never_dropped():
+    dispatcher, release = blocked_dispatcher(max_pending=3)
+    calls = []
+    for i in range(10):
+        dispatcher.dispatch(calls.append, ("partial", i), key="partial")
+    for i in range(3):
+        dispatcher.dispatch(calls.append, ("final", i))
+
+    # the fourth call without a key waits for the dispatcher to make the oldest one
+    producer = threading.Thread(target=dispatcher.dispatch, args=(calls.append, ("final", 3)))
+    producer.start()
+    producer.join(0.2)
+    assert producer.is_alive() and dispatcher.metrics["pending"] == 4
+
+    release.set()
+    producer.join(30)
+    assert not producer.is_alive()
+    assert dispatcher.wait(30)
+    assert calls == [("partial", 9), ("final", 0), ("final", 1), ("final", 2), ("final", 3)]
+    metrics = dispatcher.metrics
+    assert metrics["dropped"] == 0 and metrics["waits"] == 1
+    dispatcher.stop()
+
+
+def test_coalesced_calls_removed():
+    dispatcher, release = blocked_dispatcher(max_pending=10)
+    calls = []
+    for i in range(10000):
+        dispatcher.dispatch(calls.append, i, key=i % 3)
+    # calls replaced by newer ones do not pile up in the queue
+    assert dispatcher.metrics["pending"] == 3
+    assert len(dispatcher._pending) <= 7  # pylint: disable=protected-access
+
+    release.set()
+    assert dispatcher.wait(30)
+    assert calls == [9997, 9998, 9999]
+    dispatcher.stop()
+
+
+def test_coalesced_not_counted_as_dropped():
+    dispatcher, release = blocked_dispatcher(max_pending=2)
+    calls = []
+    dispatcher.dispatch(calls.append, "a", key="k")
+    dispatcher.dispatch(calls.append, "b", key="k")
+    dispatcher.dispatch(calls.append, "c")
+    assert dispatcher.metrics["pending"] == 2
+    release.set()
+    assert dispatcher.wait(30)
+    assert calls == ["b", "c"]
+    assert dispatcher.metrics["dropped"] == 0 and dispatcher.metrics["coalesced"] == 1
+    dispatcher.stop()
+
+
+def test_errors():
+    dispatcher = CallbackDispatcher()
+    calls = []
+
+    def fail():
+        raise ValueError("callback failed")
+
+    dispatcher.dispatch(fail)
+    dispatcher.dispatch(calls.append, "after")
+    assert dispatcher.wait(30)
+    # a failing callback does not stop the ones after it
+    assert calls == ["after"] and dispatcher.metrics["errors"] == 1
+    dispatcher.stop()
+
+
+def test_stop_and_restart():
+    dispatcher, release = blocked_dispatcher()
+    calls = []
+    dispatcher.dispatch(calls.append, 1)
+    release.set()
+    # stopping calls what is pending first
+    dispatcher.stop(30)
+    assert calls == [1]
+
+    dispatcher.dispatch(calls.append, 2)
+    assert dispatcher.wait(30)
+    assert calls == [1, 2]
+    dispatcher.stop()
+    assert dispatcher.wait(0)
+
+
+if __name__ == '__main__':
+    for test in (test_order, test_coalescing, test_dropping, test_finals_never_dropped, test_coalesced_calls_removed,
+                 test_coalesced_not_counted_as_dropped, test_errors, test_stop_and_restart):
+        test()
+        print("{} ok".format(test.__name__))
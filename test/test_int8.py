@@ -0,0 +1,135 @@
+#! /usr/bin/env python
+"""Accuracy against speed of int8 quantized nnet3 decoding, see KaldiNNet3OnlineModel(int8=True)
+
+Decodes the test audio with the float model and with the int8 model, and reports for every file the real-time factor
+of both and the word error rate of the int8 transcript, against a reference transcript where one is given and against
+the float transcript otherwise. Fails (exit status 1) when the int8 model is not faster than the float one by
+--min-speedup over all files.
+
+    python test_int8.py --repeat=3
+"""
+
+from __future__ import print_function, division, absolute_import, unicode_literals
+from builtins import *
+import argparse
+import glob
+import os
+import sys
+import time
+import wave
+import logging
+from yapykaldi import KaldiNNet3OnlineModel, KaldiNNet3OnlineDecoder
+from yapykaldi import runtime
+
+logging.basicConfig(level=logging.WARNING,
+                    format='[%(asctime)s](%(processName)-9s) %(message)s',)
+
+parser = argparse.ArgumentParser(description='Compare int8 quantized to float nnet3 decoding')
+parser.add_argument('--model-dir', type=str, default="../data/kaldi-generic-en-tdnn_fl-latest",
+                    help='Model directory')
+parser.add_argument('--files', type=str, nargs='+', default=sorted(glob.glob("../data/*.wav")),
+                    help='Wave files to decode')
+parser.add_argument('--references', type=str, default=None,
+                    help='File of reference transcripts, a line "<wave file name> <words>" per file')
+parser.add_argument('--repeat', type=int, default=1,
+                    help='Times every file is decoded, the fastest one counts')
+parser.add_argument('--blas-threads', type=int, default=1,
+                    help='BLAS threads, 1 to compare the cost of a stream on a core of its own')
+parser.add_argument('--min-speedup', type=float, default=1.0,
+                    help='Speedup of int8 over float decoding below which the test fails')
+
+args = parser.parse_args()
+
+
+def word_errors(reference, hypothesis):
+    """Levenshtein distance between two word sequences"""
+    distances = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        previous, distances[0] = distances[0], i
+        for j, hyp_word in enumerate(hypothesis, 1):
+            previous, distances[j] = distances[j], min(distances[j] + 1, distances[j - 1] + 1,
+                                                       previous + (ref_word != hyp_word))
+    return distances[-1]
+
+
+def duration(filename):
+    wavf = wave.open(filename, 'rb')
+    seconds = wavf.getnframes() / wavf.getframerate()
+    wavf.close()
+    return seconds
+
+
+def decode(decoder, filename):
+    """Fastest of args.repeat decodings of a file
+
+    :return: (transcript, seconds)
+    """
+    best = None
+    for _ in range(args.repeat):
+        start = time.time()
+        if not decoder.decode_wav_file(filename):
+            raise RuntimeError("Decoding {} failed".format(filename))
+        seconds = time.time() - start
+        best = seconds if best is None else min(best, seconds)
+    return decoder.get_decoded_string()[0].strip(), best
+
+
+if not args.files:
+    print("No wave files to decode, pass them with --files")
+    sys.exit(2)
+
+references = {}
+if args.references:
+    with open(args.references) as reference_fh:
+        for line in reference_fh:
+            name, _, words = line.strip().partition(' ')
+            references[os.path.basename(name)] = words.split()
+
+runtime.set_blas_threads(args.blas_threads)
+float_model = KaldiNNet3OnlineModel(args.model_dir, warmup=True)
+int8_model = KaldiNNet3OnlineModel(args.model_dir, warmup=True, int8=True)
+quantization = int8_model.quantization
+print("Quantized {} components with {} weights to int8, {} with {} parameters left in float, max relative weight "
+      "error {:.4f}".format(quantization["components"], quantization["weights"], quantization["skipped"],
+                            quantization["skipped_parameters"], quantization["max_relative_error"]))
+print()
+
+float_decoder = KaldiNNet3OnlineDecoder(float_model)
+int8_decoder = KaldiNNet3OnlineDecoder(int8_model)
+
+print("{:<24}  {:>8}  {:>9}  {:>9}  {:>7}  {:>9}  {}".format(
+    "file", "audio", "float rtf", "int8 rtf", "speedup", "int8 wer", "reference"))
+totals = {"audio": 0.0, "float": 0.0, "int8": 0.0, "errors": 0, "words": 0}
+for filename in args.files:
+    float_text, float_seconds = decode(float_decoder, filename)
+    int8_text, int8_seconds = decode(int8_decoder, filename)
+    audio_seconds = duration(filename)
+
+    name = os.path.basename(filename)
+    reference = references.get(name)
+    against = "given" if reference is not None else "float"
+    if reference is None:
+        reference = float_text.split()
+    errors = word_errors(reference, int8_text.split())
+
+    totals["audio"] += audio_seconds
+    totals["float"] += float_seconds
+    totals["int8"] += int8_seconds
+    totals["errors"] += errors
+    totals["words"] += len(reference)
+    print("{:<24}  {:7.2f}s  {:9.3f}  {:9.3f}  {:6.2f}x  {:8.1f}%  {}".format(
+        name[:24], audio_seconds, float_seconds / audio_seconds, int8_seconds / audio_seconds,
+        float_seconds / max(int8_seconds, 1e-9), 100.0 * errors / max(len(reference), 1), against))
+    if float_text != int8_text:
+        print("    float: {}".format(float_text))
+        print("    int8:  {}".format(int8_text))
+
+speedup = totals["float"] / max(totals["int8"], 1e-9)
+print()
+print("Total {:.1f}s of audio: float rtf {:.3f}, int8 rtf {:.3f}, speedup {:.2f}x, int8 wer {:.1f}%".format(
+    totals["audio"], totals["float"] / totals["audio"], totals["int8"] / totals["audio"], speedup,
+    100.0 * totals["errors"] / max(totals["words"], 1)))
+if speedup < args.min_speedup:
+    print("FAILED: int8 decoding is {:.2f}x as fast as float decoding, below --min-speedup={}".format(
+        speedup, args.min_speedup))
+    sys.exit(1)
@@ -0,0 +1,59 @@
+#! /usr/bin/env python
+"""Checks of the int8 matrix products of the int8 nnet3 components, with every kernel the CPU runs, against float
+products of the same inputs and weights, within the error the quantization of both allows
+
+    python test_int8_gemm.py
+"""
+
+from __future__ import print_function, division, absolute_import, unicode_literals
+from builtins import *
+import numpy as np
+from yapykaldi._Extensions import int8_gemm, int8_gemm_kernels
+
+# (input rows, columns, weight rows), odd ones not filling the tiles, panels and blocks of the kernels
+SHAPES = [(1, 1, 1), (3, 5, 7), (5, 17, 3), (33, 40, 7), (37, 161, 129), (21, 1536, 161)]
+
+
+def quantization_bound(input_rows, weights):
+    """Largest error of the products of rows quantized symmetrically to [-127, 127] with a scale per row"""
+    input_scales = np.abs(input_rows).max(axis=1) / 127.0
+    weight_scales = np.abs(weights).max(axis=1) / 127.0
+    # every value is off by at most half its scale
+    return (np.outer(input_scales / 2, np.abs(weights).sum(axis=1)) +
+            np.outer(np.abs(input_rows).sum(axis=1), weight_scales / 2) +
+            np.outer(input_scales, weight_scales) * input_rows.shape[1] / 4)
+
+
+def test_against_float():
+    rng = np.random.RandomState(0)
+    kernels = list(int8_gemm_kernels())
+    assert "generic" in kernels
+    for num_rows, num_cols, num_outputs in SHAPES:
+        input_rows = rng.normal(0, 1, (num_rows, num_cols)).astype(np.float32)
+        weights = rng.normal(0, 0.1, (num_outputs, num_cols)).astype(np.float32)
+        exact = np.dot(input_rows.astype(np.float64), weights.astype(np.float64).T)
+        bound = quantization_bound(input_rows.astype(np.float64), weights.astype(np.float64))
+
+        products = [int8_gemm(input_rows, weights, kernel) for kernel in kernels]
+        for kernel, product in zip(kernels, products):
+            assert product.shape == (num_rows, num_outputs)
+            assert np.all(np.abs(product - exact) <= bound * 1.001 + 1e-5), (kernel, num_rows, num_cols, num_outputs)
+        # the kernels sum the same integer products
+        for product in products[1:]:
+            assert np.array_equal(product, products[0])
+
+
+def test_zero_rows():
+    input_rows = np.zeros((3, 19), dtype=np.float32)
+    input_rows[1] = 1.0
+    weights = np.ones((5, 19), dtype=np.float32)
+    for kernel in int8_gemm_kernels():
+        product = int8_gemm(input_rows, weights, kernel)
+        assert np.array_equal(product[0], np.zeros(5)) and np.array_equal(product[2], np.zeros(5))
+        assert np.allclose(product[1], 19.0)
+
+
+if __name__ == '__main__':
+    for test in (test_against_float, test_zero_rows):
+        test()
+        print(test.__name__, "ok")
@@ -0,0 +1,109 @@
+#! /usr/bin/env python
+"""Checks of the audio gating of KeywordSpotter, with a scripted decoder in place of the keyword model
+
+Every chunk of the test audio holds a single sample value. The scripted decoder recognizes the keyword when it decoded
+the chunks 7 and 8 in a row since its last reset.
+
+    python test_kws.py
+"""
+
+from __future__ import print_function, division, absolute_import, unicode_literals
+from builtins import *
+import numpy as np
+from yapykaldi.asr import KeywordSpotter
+
+RATE = 1000
+CHUNKSIZE = 100
+
+
+class ScriptedDecoder(object):
+    def __init__(self):
+        self.values = []
+        self.resets = 0
+
+    def decode(self, samp_freq, samples, finalize):
+        self.values.append(int(samples[0]))
+        return True
+
+    def get_decoded_string(self):
+        spotted = any(self.values[i:i + 2] == [7, 8] for i in range(len(self.values)))
+        return ("hello" if spotted else ""), 0.0
+
+    def reset(self):
+        self.values = []
+        self.resets += 1
+
+
+class RecordingSink(object):
+    def __init__(self):
+        self.utterances_ended = 0
+
+    def link(self, source=None, sink=None):
+        pass
+
+    def end_utterance(self):
+        self.utterances_ended += 1
+
+
+def chunk(value):
+    return np.full(CHUNKSIZE, value, dtype='<i2').tobytes()
+
+
+def spotter(**kwargs):
+    """KeywordSpotter with 0.1 s chunks, 3 chunks of pre-roll and 4 of listen time, without its model"""
+    options = {"preroll_time": 0.3, "listen_time": 0.4, "reset_time": 1.0}
+    options.update(kwargs)
+    sink = RecordingSink()
+    kws = KeywordSpotter("model_dir", ["hello"], rate=RATE, chunksize=CHUNKSIZE, sink=sink, **options)
+    kws._decoder = ScriptedDecoder()  # pylint: disable=protected-access
+    fired = []
+    kws.register_callback(fired.append)
+    return kws, sink, fired
+
+
+def test_gating():
+    kws, sink, fired = spotter()
+    for value in (1, 2, 3, 4, 7):
+        assert kws.next_chunk(chunk(value)) is None
+
+    # the keyword passes on the pre-roll, ending with the keyword
+    assert kws.next_chunk(chunk(8)) == chunk(4) + chunk(7) + chunk(8)
+    assert fired == ["hello"]
+
+    # the listen time passes on the audio unchanged, then the sink ends its utterance
+    for value in (10, 11, 12):
+        assert kws.next_chunk(chunk(value)) == chunk(value)
+        assert sink.utterances_ended == 0
+    assert kws.next_chunk(chunk(13)) == chunk(13)
+    assert sink.utterances_ended == 1
+
+    # and spotting resumes
+    assert kws.next_chunk(chunk(1)) is None
+    assert fired == ["hello"]
+
+
+def test_keyword_across_restart():
+    # the search restarts after the chunk 7, the pre-roll carries it into the new search
+    kws, _, fired = spotter(reset_time=0.5)
+    for value in (1, 2, 3, 4, 7):
+        assert kws.next_chunk(chunk(value)) is None
+    assert kws._decoder.resets == 1  # pylint: disable=protected-access
+    assert kws._decoder.values == [3, 4, 7]  # pylint: disable=protected-access
+
+    assert kws.next_chunk(chunk(8)) is not None
+    assert fired == ["hello"]
+
+
+def test_reset_time_checked():
+    try:
+        spotter(preroll_time=1.0, reset_time=1.0)
+    except Exception:  # pylint: disable=broad-except
+        pass
+    else:
+        raise AssertionError("reset_time not longer than preroll_time was accepted")
+
+
+if __name__ == '__main__':
+    for test in (test_gating, test_keyword_across_restart, test_reset_time_checked):
+        test()
+        print("{} ok".format(test.__name__))
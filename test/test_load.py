@@ -0,0 +1,224 @@
+#! /usr/bin/env python
+"""Load test: how many simultaneous real-time streams one model sustains on this host
+
+Every simulated stream replays wave files at the pace of real time, in chunks, through a decoder of its own, and all
+decoders share one model, as a server decoding several calls would. The test ramps the number of streams up, level by
+level, until the 99th percentile of the lag behind real time or of the latency of final results passes its threshold,
+then reports the largest number of streams that stayed within both, with the CPU and the memory each stream costs.
+No audio hardware is needed.
+
+The lag of a chunk is the time from the moment its last sample would have arrived in real time to the moment it is
+decoded. The latency of a final result is the time from the arrival of the last chunk of an utterance to its result.
+
+    python test_load.py --start=2 --step=2 --level-seconds=60
+"""
+
+from __future__ import print_function, division, absolute_import, unicode_literals
+from builtins import *
+import argparse
+import glob
+import os
+import sys
+import time
+import wave
+import logging
+import resource
+import threading
+import numpy as np
+from yapykaldi import KaldiNNet3OnlineModel, KaldiNNet3OnlineDecoder, KaldiGmmOnlineModel, KaldiGmmOnlineDecoder
+from yapykaldi import runtime
+
+logging.basicConfig(level=logging.WARNING,
+                    format='[%(asctime)s](%(processName)-9s) %(message)s',)
+
+ONLINE_MODELS = {'nnet3': KaldiNNet3OnlineModel, 'gmm': KaldiGmmOnlineModel}
+ONLINE_DECODERS = {'nnet3': KaldiNNet3OnlineDecoder, 'gmm': KaldiGmmOnlineDecoder}
+
+parser = argparse.ArgumentParser(description='Find the number of real-time streams a host sustains')
+parser.add_argument('--model-dir', type=str, default="../data/kaldi-generic-en-tdnn_fl-latest",
+                    help='Model directory')
+parser.add_argument('--model-type', type=str, default="nnet3", choices=sorted(ONLINE_MODELS),
+                    help='Type of the model')
+parser.add_argument('--files', type=str, nargs='+', default=sorted(glob.glob("../data/*.wav")),
+                    help='16 kHz mono wave files the streams replay, one utterance each')
+parser.add_argument('--start', type=int, default=1,
+                    help='Number of streams of the first level')
+parser.add_argument('--step', type=int, default=1,
+                    help='Streams added at every level')
+parser.add_argument('--max-streams', type=int, default=256,
+                    help='Number of streams to stop at even if the thresholds still hold')
+parser.add_argument('--level-seconds', type=float, default=30.0,
+                    help='Seconds every level runs')
+parser.add_argument('--max-lag', type=float, default=0.5,
+                    help='Seconds the p99 lag behind real time may reach')
+parser.add_argument('--max-final-latency', type=float, default=1.0,
+                    help='Seconds the p99 latency of final results may reach')
+parser.add_argument('--chunk', type=int, default=1024,
+                    help='Samples per chunk')
+parser.add_argument('--batching', action='store_true',
+                    help='Score the nnet3 streams in shared minibatches')
+parser.add_argument('--blas-threads', type=int, default=None,
+                    help='BLAS threads of the process, e.g. 1 to keep the streams from oversubscribing the cores')
+parser.add_argument('--pin', action='store_true',
+                    help='Pin every stream to CPUs of its own, spread over the NUMA nodes')
+
+args = parser.parse_args()
+
+
+def rss_mb():
+    """Current resident set size in MB, or the peak where /proc is not available"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2.0**20
+    except (IOError, OSError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2.0**10
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def read_wav(filename):
+    wavf = wave.open(filename, 'rb')
+    assert wavf.getnchannels() == 1
+    assert wavf.getsampwidth() == 2
+    assert wavf.getframerate() == 16000
+    samples = np.frombuffer(wavf.readframes(wavf.getnframes()), dtype='<i2').astype(np.float32)
+    wavf.close()
+    return samples
+
+
+class PacedStream(threading.Thread):
+    """Replays utterances through a decoder at the pace of real time, recording lags and final latencies"""
+
+    def __init__(self, model, utterances, offset, stop_event, rate=16000, chunksize=1024, cpus=None):
+        super().__init__()
+        self.daemon = True
+        self.decoder = ONLINE_DECODERS[args.model_type](model)
+        self.utterances = utterances
+        self.offset = offset
+        self.stop_event = stop_event
+        self.rate = rate
+        self.chunksize = chunksize
+        self.cpus = cpus
+        self.lags = []
+        self.final_latencies = []
+        self.failures = 0
+
+    def run(self):
+        if self.cpus:
+            runtime.pin_thread(self.cpus)
+        chunk_seconds = self.chunksize / self.rate
+        # streams start at different times, as calls do
+        due = time.time() + self.offset
+        utterance = int(self.offset * 1000) % len(self.utterances)
+        while not self.stop_event.is_set():
+            samples = self.utterances[utterance]
+            utterance = (utterance + 1) % len(self.utterances)
+            for start in range(0, len(samples), self.chunksize):
+                chunk = samples[start:start + self.chunksize]
+                due += len(chunk) / self.rate
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+                final = start + self.chunksize >= len(samples)
+                if not self.decoder.decode(self.rate, chunk, final):
+                    self.failures += 1
+                    self.decoder.reset()
+                    break
+                if final:
+                    self.decoder.get_decoded_string()
+                    self.final_latencies.append(time.time() - due)
+                else:
+                    self.lags.append(time.time() - due)
+                if self.stop_event.is_set():
+                    return
+            # a chunk of silence between utterances keeps the pace of the stream realistic
+            due += chunk_seconds
+
+
+def run_level(model, utterances, num_streams):
+    """Run num_streams streams for the duration of a level
+
+    :return: (dict) p99 lag and final latency, CPU cores and RSS of the level
+    """
+    stop_event = threading.Event()
+    audio_seconds = sum(len(samples) for samples in utterances) / 16000 / len(utterances)
+    placement = runtime.plan_placement(num_streams) if args.pin else [{"cpus": None}] * num_streams
+    streams = [PacedStream(model, utterances, audio_seconds * i / num_streams, stop_event, chunksize=args.chunk,
+                           cpus=placement[i]["cpus"])
+               for i in range(num_streams)]
+
+    start_time, start_cpu = time.time(), cpu_seconds()
+    for stream in streams:
+        stream.start()
+    time.sleep(args.level_seconds)
+    stop_event.set()
+    for stream in streams:
+        stream.join()
+    wall, cpu = time.time() - start_time, cpu_seconds() - start_cpu
+
+    lags = np.concatenate([stream.lags for stream in streams] + [[0.0]])
+    latencies = np.concatenate([stream.final_latencies for stream in streams] + [[0.0]])
+    level = {
+        "streams": num_streams,
+        "p99_lag": np.percentile(lags, 99),
+        "p99_final_latency": np.percentile(latencies, 99),
+        "finals": sum(len(stream.final_latencies) for stream in streams),
+        "failures": sum(stream.failures for stream in streams),
+        "cpu_cores": cpu / wall,
+        "rss": rss_mb(),
+    }
+    # free the decoders before the next level
+    del streams[:]
+    return level
+
+
+if not args.files:
+    print("No wave files to replay, pass them with --files")
+    sys.exit(2)
+
+utterances = [read_wav(os.path.expanduser(filename)) for filename in args.files]
+base_rss = rss_mb()
+print("Loading {} model from {}".format(args.model_type, args.model_dir))
+model = ONLINE_MODELS[args.model_type](args.model_dir)
+if args.batching and args.model_type == 'nnet3':
+    model.enable_batching()
+model_rss = rss_mb()
+if args.blas_threads:
+    runtime.set_blas_threads(args.blas_threads)
+report = runtime.runtime_report()
+print("Model RSS {:.1f} MB, {} cores, {} CPUs on NUMA nodes {}, BLAS threads {}".format(
+    model_rss - base_rss, os.cpu_count(), len(report["cpus"]), report["numa_nodes"],
+    report["blas_threads"] or report["environment"] or "default"))
+print("{:>7}  {:>9}  {:>13}  {:>6}  {:>9}  {:>13}  {:>10}".format(
+    "streams", "p99 lag", "p99 final lat", "finals", "cpu/strm", "rss/strm", "status"))
+
+sustained = None
+num_streams = args.start
+while num_streams <= args.max_streams:
+    level = run_level(model, utterances, num_streams)
+    ok = (level["p99_lag"] <= args.max_lag and level["p99_final_latency"] <= args.max_final_latency
+          and not level["failures"])
+    print("{:7d}  {:8.3f}s  {:12.3f}s  {:6d}  {:8.2f}c  {:10.1f} MB  {:>10}".format(
+        num_streams, level["p99_lag"], level["p99_final_latency"], level["finals"], level["cpu_cores"] / num_streams,
+        (level["rss"] - model_rss) / num_streams, "ok" if ok else "overloaded"))
+    sys.stdout.flush()
+    if not ok:
+        break
+    sustained = level
+    num_streams += args.step
+
+print()
+if sustained is None:
+    print("Not even {} streams keep up within a p99 lag of {}s and a p99 final latency of {}s".format(
+        args.start, args.max_lag, args.max_final_latency))
+    sys.exit(1)
+
+print("Sustainable streams: {}{}".format(sustained["streams"],
+                                         " (the maximum tried)" if num_streams > args.max_streams else ""))
+print("CPU per stream: {:.2f} cores, RSS per stream: {:.1f} MB, model RSS: {:.1f} MB".format(
+    sustained["cpu_cores"] / sustained["streams"], (sustained["rss"] - model_rss) / sustained["streams"],
+    model_rss - base_rss))
@@ -0,0 +1,58 @@
+#! /usr/bin/env python
+"""Decode a long recording split at silences on a pool of decoders, and compare with decoding it as one utterance
+
+    python test_long_audio.py --wavfile=lecture.wav --decoders=8
+"""
+
+from __future__ import print_function, division, absolute_import, unicode_literals
+from builtins import *
+import argparse
+import time
+import logging
+from yapykaldi import KaldiNNet3OnlineModel, KaldiNNet3OnlineDecoder, LongAudioDecoder
+from yapykaldi import runtime
+
+logging.basicConfig(level=logging.INFO,
+                    format='[%(asctime)s](%(processName)-9s) %(message)s',)
+
+parser = argparse.ArgumentParser(description='Decode a long recording on several cores')
+parser.add_argument('--model-dir', type=str, default="../data/kaldi-generic-en-tdnn_fl-latest",
+                    help='Model directory')
+parser.add_argument('--wavfile', type=str, default="../data/lsen1.wav",
+                    help='16 bit mono wave file')
+parser.add_argument('--decoders', type=int, default=4,
+                    help='Number of segments decoded at once')
+parser.add_argument('--max-segment', type=float, default=30.0,
+                    help='Longest segment in seconds')
+parser.add_argument('--single', action='store_true',
+                    help='Also decode the recording as one utterance on one core, to compare')
+
+args = parser.parse_args()
+
+# every decoder runs on a core of its own, without BLAS threads competing for them
+runtime.set_blas_threads(1)
+model = KaldiNNet3OnlineModel(args.model_dir, warmup=True)
+
+long_decoder = LongAudioDecoder(model, num_decoders=args.decoders, max_segment=args.max_segment)
+result = long_decoder.decode_wav_file(args.wavfile)
+audio_seconds = result["segments"][-1]["end"] if result["segments"] else 0.0
+for segment in result["segments"]:
+    print("{:8.2f}s - {:8.2f}s  {}{}".format(segment["start"], segment["end"], segment["text"],
+                                             "" if segment["ok"] else "  (failed)"))
+print()
+print("** {}".format(result["text"]))
+for word, start, length in list(zip(result["words"], result["times"], result["lengths"]))[:20]:
+    print("   {:8.2f}s  {:6.2f}s  {}".format(start * model.frame_shift, length * model.frame_shift, word))
+print("{} segments on {} decoders: {:.2f}s for {:.1f}s of audio".format(
+    len(result["segments"]), args.decoders, result["decode_seconds"], audio_seconds))
+
+if args.single:
+    decoder = KaldiNNet3OnlineDecoder(model)
+    start_time = time.time()
+    if not decoder.decode_wav_file(args.wavfile):
+        raise RuntimeError("Decoding {} failed".format(args.wavfile))
+    single_seconds = time.time() - start_time
+    print()
+    print("** {}".format(decoder.get_decoded_string()[0]))
+    print("One utterance on one decoder: {:.2f}s, {:.2f}x slower".format(
+        single_seconds, single_seconds / max(result["decode_seconds"], 1e-9)))
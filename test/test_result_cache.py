@@ -0,0 +1,83 @@
+#! /usr/bin/env python
+"""Checks of DecodeResultCache: round trip of results, least recently used eviction and reopening
+
+    python test_result_cache.py
+"""
+
+from __future__ import print_function, division, absolute_import, unicode_literals
+from builtins import *
+import os
+import time
+import shutil
+import tempfile
+from yapykaldi import DecodeResultCache
+
+
+def put(cache, number):
+    """Store a result of a fixed size for a number, returning its key"""
+    name = "{:04d}".format(number)
+    key = DecodeResultCache.key(name.encode('utf-8'), 16000, "fingerprint")
+    cache.put(key, "transcript of " + name, -1.5, (["transcript", "of", name], [0, 10, 20], [10, 10, 5]))
+    # results stored or used in the same clock tick would be equally old
+    time.sleep(0.01)
+    return key
+
+
+def test_round_trip(path):
+    cache = DecodeResultCache(path)
+    key = put(cache, 1)
+    assert cache.get(key) == ("transcript of 0001", -1.5, (["transcript", "of", "0001"], [0, 10, 20], [10, 10, 5]))
+    assert cache.get(DecodeResultCache.key(b"0001", 8000, "fingerprint")) is None
+    assert DecodeResultCache.key(b"0001", 16000, "other") != key
+
+    alignment_free = DecodeResultCache.key(b"b", 16000, "fingerprint")
+    cache.put(alignment_free, "b", -2.0)
+    assert cache.get(alignment_free) == ("b", -2.0, None)
+    cache.close()
+
+
+def test_eviction(path):
+    cache = DecodeResultCache(path, max_bytes=0)
+    put(cache, 9999)
+    entry_size = cache.size
+    cache.close()
+    os.remove(path)
+
+    # room for four results
+    cache = DecodeResultCache(path, max_bytes=4 * entry_size)
+    keys = [put(cache, number) for number in range(4)]
+    assert len(cache) == 4 and cache.size == 4 * entry_size
+
+    # using the first keeps it, the second is the least recently used
+    assert cache.get(keys[0]) is not None
+    time.sleep(0.01)
+    keys.append(put(cache, 4))
+    assert len(cache) == 4 and cache.size == 4 * entry_size
+    assert cache.get(keys[1]) is None
+    assert all(cache.get(key) is not None for key in keys[:1] + keys[2:])
+
+    # more than a batch of evictions at once
+    cache.max_bytes = entry_size * (DecodeResultCache.EVICTION_BATCH + 10)
+    many = [put(cache, 100 + i) for i in range(DecodeResultCache.EVICTION_BATCH + 10)]
+    cache.max_bytes = 2 * entry_size
+    put(cache, 9000)
+    assert len(cache) == 2 and cache.size == 2 * entry_size
+    assert cache.get(many[-1]) is not None
+    cache.close()
+
+    # the size of the stored results is read back on opening
+    cache = DecodeResultCache(path, max_bytes=2 * entry_size)
+    assert len(cache) == 2 and cache.size == 2 * entry_size
+    cache.clear()
+    assert len(cache) == 0 and cache.size == 0
+    cache.close()
+
+
+if __name__ == '__main__':
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for number, test in enumerate((test_round_trip, test_eviction)):
+            test(os.path.join(tmpdir, "results{}.sqlite".format(number)))
+            print("{} ok".format(test.__name__))
+    finally:
+        shutil.rmtree(tmpdir)
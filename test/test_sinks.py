@@ -0,0 +1,130 @@
+#! /usr/bin/env python
+"""Checks of the transcript sinks: formats, batched writing, syncing and flushing on close
+
+    python test_sinks.py
+"""
+
+from __future__ import print_function, division, absolute_import, unicode_literals
+from builtins import *
+import io
+import os
+import json
+import shutil
+import tempfile
+from yapykaldi.asr import TranscriptSink, JsonlTranscriptSink, CtmTranscriptSink
+from yapykaldi.asr import sinks
+
+RESULT = {"stream": "s1", "utterance": 0, "text": "hello world", "words": [["hello", 0.5, 0.25], ["world", 0.75, 0.5]]}
+
+
+class CountingFile(object):
+    """File wrapper counting the writes and syncs of the transcript writer"""
+
+    def __init__(self, wrapped):
+        self.wrapped = wrapped
+        self.writes = 0
+
+    def write(self, text):
+        self.writes += 1
+        return self.wrapped.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+
+class ResultSource(object):
+    def __init__(self):
+        self.result_callbacks = []
+
+    def link(self, source=None, sink=None):
+        pass
+
+    def register_result_callback(self, callback):
+        self.result_callbacks.append(callback)
+
+
+def read_lines(path):
+    with io.open(path, encoding='utf-8') as transcript:
+        return transcript.read().splitlines()
+
+
+def test_abstract():
+    try:
+        TranscriptSink("transcript.txt")  # pylint: disable=abstract-class-instantiated
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("TranscriptSink without format_result was instantiated")
+
+
+def test_jsonl_flushed_on_close(tmpdir):
+    path = os.path.join(tmpdir, "results.jsonl")
+    sink = JsonlTranscriptSink(path, fsync_interval=60.0)
+    sink.open()
+    for utterance in range(100):
+        sink.write_result(dict(RESULT, utterance=utterance))
+    # the sync interval is far off, closing writes and syncs what is queued
+    sink.close()
+    assert [json.loads(line)["utterance"] for line in read_lines(path)] == list(range(100))
+
+    # results are appended
+    sink.open()
+    sink.write_result(RESULT)
+    sink.close()
+    assert len(read_lines(path)) == 101
+
+
+def test_batching(tmpdir):
+    syncs, files = [], []
+    fsync, open_file = sinks.os.fsync, sinks.io.open
+    sinks.os.fsync = syncs.append
+    sinks.io.open = lambda *args, **kwargs: files.append(CountingFile(open_file(*args, **kwargs))) or files[-1]
+    try:
+        path = os.path.join(tmpdir, "results.ctm")
+        sink = CtmTranscriptSink(path, channel="A", fsync_interval=60.0)
+        # results queued before the writer starts are written in one batch, and synced once
+        for _ in range(50):
+            sink.write_result(RESULT)
+        sink.open()
+        sink.close()
+    finally:
+        sinks.os.fsync, sinks.io.open = fsync, open_file
+
+    lines = read_lines(path)
+    assert len(lines) == 100
+    assert lines[:2] == ["s1 A 0.500 0.250 hello", "s1 A 0.750 0.500 world"]
+    assert files[0].writes == 1, files[0].writes
+    assert len(syncs) == 1, syncs
+
+
+def test_no_sync(tmpdir):
+    syncs = []
+    fsync = sinks.os.fsync
+    sinks.os.fsync = syncs.append
+    try:
+        sink = JsonlTranscriptSink(os.path.join(tmpdir, "unsynced.jsonl"), fsync_interval=None)
+        sink.open()
+        sink.write_result(RESULT)
+        sink.close()
+    finally:
+        sinks.os.fsync = fsync
+    assert not syncs
+
+
+def test_linked_to_source(tmpdir):
+    source = ResultSource()
+    sink = JsonlTranscriptSink(os.path.join(tmpdir, "linked.jsonl"), source=source)
+    assert source.result_callbacks == [sink.write_result]
+    assert sink.next_chunk(b'\0\0') == b'\0\0'
+
+
+if __name__ == '__main__':
+    test_abstract()
+    print("test_abstract ok")
+    tmp = tempfile.mkdtemp()
+    try:
+        for test in (test_jsonl_flushed_on_close, test_batching, test_no_sync, test_linked_to_source):
+            test(tmp)
+            print("{} ok".format(test.__name__))
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,158 @@
+#! /usr/bin/env python
+"""Soak test for continuous recognition: hours of synthetic audio through Asr(continuous=True)
+
+The stream loops the speech of a wave file with pauses in between, so the decoder segments it at the endpoints. Every
+report interval of audio, the script prints the resident memory and the latency of the chunks in the interval. RSS
+should stay flat after the first interval and the latency percentiles should not creep up.
+
+    python test_soak.py --file=audio.wav --hours=3
+"""
+
+from __future__ import print_function, division, absolute_import, unicode_literals
+from builtins import *
+import argparse
+import os
+import sys
+import time
+import wave
+import logging
+import resource
+import numpy as np
+from yapykaldi.asr import Asr, AsrPipeline
+from yapykaldi.asr._base import AsrPipelineElementBase
+
+logging.basicConfig(level=logging.WARNING,
+                    format='[%(asctime)s](%(processName)-9s) %(message)s',)
+
+model_dir = "../data/kaldi-generic-en-tdnn_fl-latest"
+model_type = "nnet3"
+
+parser = argparse.ArgumentParser(description='Soak test continuous recognition')
+parser.add_argument('--file', type=str, required=True,
+                    help='16 kHz mono wave file with speech to loop')
+parser.add_argument('--hours', type=float, default=3.0,
+                    help='Hours of audio to stream')
+parser.add_argument('--pause', type=float, default=2.0,
+                    help='Seconds of low level noise between repetitions of the speech')
+parser.add_argument('--report-every', type=float, default=600.0,
+                    help='Seconds of audio between reports')
+parser.add_argument('--max-rss-growth', type=float, default=50.0,
+                    help='MB the RSS may grow after the first report before the test fails')
+parser.add_argument('--realtime', action='store_true',
+                    help='Stream at the pace of the audio instead of as fast as possible')
+
+args = parser.parse_args()
+
+
+def rss_mb():
+    """Current resident set size in MB, or the peak where /proc is not available"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2.0**20
+    except (IOError, OSError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2.0**10
+
+
+class SyntheticSource(AsrPipelineElementBase):
+    """Speech of a wave file and pauses of noise, repeated for the requested duration"""
+
+    def __init__(self, filename, total_seconds, pause, realtime=False, rate=16000, chunksize=1024, sink=None):
+        super().__init__(rate=rate, chunksize=chunksize, sink=sink)
+        self.filename = filename
+        self.total_chunks = int(total_seconds * rate / chunksize)
+        self.pause = pause
+        self.realtime = realtime
+        self.audio = None
+        self.position = 0
+        self.sent_chunks = 0
+        self.start_time = None
+
+    def open(self):
+        wavf = wave.open(self.filename, 'rb')
+        assert wavf.getnchannels() == 1
+        assert wavf.getsampwidth() == 2
+        assert wavf.getframerate() == self.rate
+        speech = np.frombuffer(wavf.readframes(wavf.getnframes()), dtype='<i2')
+        wavf.close()
+
+        noise = np.random.RandomState(0).normal(0.0, 8.0, int(self.pause * self.rate)).astype('<i2')
+        self.audio = np.concatenate([speech, noise])
+
+    def start(self):
+        self.position = 0
+        self.sent_chunks = 0
+        self.start_time = time.time()
+
+    def next_chunk(self, chunk=None):
+        if self.sent_chunks >= self.total_chunks:
+            raise StopIteration()
+
+        end = self.position + self.chunksize
+        if end <= len(self.audio):
+            samples = self.audio[self.position:end]
+        else:
+            samples = np.concatenate([self.audio[self.position:], self.audio[:end - len(self.audio)]])
+        self.position = end % len(self.audio)
+        self.sent_chunks += 1
+
+        if self.realtime:
+            delay = self.start_time + self.sent_chunks * self.chunksize / self.rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        return samples.tobytes()
+
+    def close(self):
+        self.audio = None
+
+
+source = SyntheticSource(os.path.expanduser(args.file), args.hours * 3600, args.pause, realtime=args.realtime)
+asr = Asr(model_dir, model_type, source=source, continuous=True)
+
+pipeline = AsrPipeline()
+pipeline.add(asr, source)
+
+chunks_per_report = max(1, int(args.report_every * source.rate / source.chunksize))
+latencies = []
+reports = []
+segments = [0]
+last_time = [None]
+
+
+def got_segment(string):
+    segments[0] += 1
+
+
+def chunk_done():
+    now = time.time()
+    if last_time[0] is not None:
+        latencies.append(now - last_time[0])
+    last_time[0] = now
+
+    if len(latencies) == chunks_per_report:
+        ms = np.array(latencies) * 1000
+        audio_hours = source.sent_chunks * source.chunksize / source.rate / 3600
+        reports.append(rss_mb())
+        print("{:8.2f} h  rss {:8.1f} MB  latency p50 {:6.2f} ms  p99 {:6.2f} ms  max {:7.2f} ms  {:6d} segments"
+              .format(audio_hours, reports[-1], np.percentile(ms, 50), np.percentile(ms, 99), ms.max(), segments[0]))
+        sys.stdout.flush()
+        del latencies[:]
+
+
+asr.register_callback(got_segment)
+pipeline.register_callback(chunk_done)
+
+print("Streaming {} hours of audio, reporting every {} seconds of audio".format(args.hours, args.report_every))
+pipeline.open()
+pipeline.start()
+pipeline.close()
+
+if len(reports) < 2:
+    print("Too few reports to judge memory growth, stream more hours or report more often")
+    sys.exit(2)
+
+growth = max(reports[1:]) - reports[0]
+print("RSS growth after the first report: {:.1f} MB ({} segments)".format(growth, segments[0]))
+if growth > args.max_rss_growth:
+    print("FAIL: RSS grew by more than {} MB".format(args.max_rss_growth))
+    sys.exit(1)
+print("PASS")
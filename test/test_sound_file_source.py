@@ -0,0 +1,117 @@
+#! /usr/bin/env python
+"""Checks of SoundFileSource: mixing down, resampling and seeking in generated multichannel FLAC files, against
+the filter applied with plain numpy. Needs the soundfile package
+
+    python test_sound_file_source.py
+"""
+
+from __future__ import print_function, division, absolute_import, unicode_literals
+from builtins import *
+import os
+import shutil
+import tempfile
+import numpy as np
+import soundfile
+from yapykaldi.asr.sources import SoundFileSource, _lowpass_filter
+
+
+def write_flac(path, samplerate, seconds=1.0, channels=3):
+    """Write a FLAC file of tones and noise, a different mix on every channel, returning its int16 frames"""
+    rng = np.random.RandomState(0)
+    t = np.arange(int(samplerate * seconds)) / samplerate
+    frames = np.zeros((len(t), channels))
+    for channel in range(channels):
+        frames[:, channel] = (6000 * np.sin(2 * np.pi * (300 + 200 * channel) * t) +
+                              3000 * np.sin(2 * np.pi * 7000 * t) + rng.normal(0, 500, len(t)))
+    frames = np.round(frames).astype(np.int16)
+    soundfile.write(path, frames, samplerate, subtype='PCM_16')
+    return frames
+
+
+def reference(frames, samplerate, rate):
+    """Mix the frames down and resample them with the filter of SoundFileSource, one output sample at a time"""
+    mono = frames.astype(np.float64).mean(axis=1)
+    up, down = rate // np.gcd(rate, samplerate), samplerate // np.gcd(rate, samplerate)
+    if up == down == 1:
+        return np.round(mono)
+    taps = _lowpass_filter(max(up, down)).astype(np.float64) * up
+    if up == 1:
+        return np.round(np.convolve(mono, taps)[:len(mono):down])
+
+    # sample n takes the frames j with n * down - j * up within the taps of the upsampled frames
+    samples = []
+    for n in range((len(mono) * up + down - 1) // down):
+        j = np.arange(n * down // up, -1, -1)
+        k = n * down - j * up
+        j, k = j[k < len(taps)], k[k < len(taps)]
+        samples.append(np.dot(taps[k], mono[j]))
+    return np.round(samples)
+
+
+def read_chunks(source):
+    """Read the chunks of a started source up to the end, returning their samples and sizes"""
+    chunks = []
+    while True:
+        try:
+            chunks.append(np.frombuffer(source.next_chunk(), dtype=np.int16))
+        except StopIteration:
+            break
+    return np.concatenate(chunks), [len(chunk) for chunk in chunks]
+
+
+def check_file(path, samplerate, rate=16000, chunksize=1000):
+    frames = write_flac(path, samplerate)
+    expected = reference(frames, samplerate, rate)
+
+    source = SoundFileSource(path, rate=rate, chunksize=chunksize)
+    source.open()
+    source.start()
+    samples, sizes = read_chunks(source)
+    assert len(samples) == len(expected), (len(samples), len(expected))
+    # float32 against float64 rounds to the next integer at most
+    assert np.abs(samples - expected).max() <= 1
+    assert all(size == chunksize for size in sizes[:-1])
+
+    # after a seek, the filter starts over from the frame sought
+    offset = 0.25
+    source.seek(offset)
+    source.remaining_frames = len(frames) - int(offset * samplerate)
+    samples, _ = read_chunks(source)
+    expected = reference(frames[int(offset * samplerate):], samplerate, rate)
+    assert len(samples) == len(expected)
+    assert np.abs(samples - expected).max() <= 1
+    source.close()
+
+
+def test_decimation(path):
+    check_file(path, 48000)
+
+
+def test_rational_ratio(path):
+    check_file(path, 44100)
+    check_file(path, 22050)
+
+
+def test_same_rate(path):
+    check_file(path, 16000)
+
+
+def test_offset_and_duration(path):
+    frames = write_flac(path, 48000)
+    source = SoundFileSource(path, offset=0.5, duration=0.25)
+    source.open()
+    source.start()
+    samples, _ = read_chunks(source)
+    expected = reference(frames[24000:36000], 48000, 16000)
+    assert np.abs(samples - expected).max() <= 1
+    source.close()
+
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp()
+    try:
+        for test in (test_decimation, test_rational_ratio, test_same_rate, test_offset_and_duration):
+            test(os.path.join(directory, "audio.flac"))
+            print(test.__name__, "ok")
+    finally:
+        shutil.rmtree(directory)
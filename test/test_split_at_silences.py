@@ -0,0 +1,102 @@
+#! /usr/bin/env python
+"""Checks of split_at_silences on generated audio: cuts in the pauses, also when the recording pauses rarely, alignment
+of the segments, all-silent stretches left out and the bounds on the segment lengths
+
+    python test_split_at_silences.py
+"""
+
+from __future__ import print_function, division, absolute_import, unicode_literals
+from builtins import *
+import numpy as np
+from yapykaldi.long_audio import split_at_silences
+
+RATE = 16000
+
+
+def recording(parts, seed=0):
+    """Samples of (seconds, level) parts: syllable-like bursts of noise for speech, as loud as level times 3000, and
+    faint noise for pauses, of level 0
+
+    :return: (samples, pauses) with the (start, end) of every pause in samples
+    """
+    rng = np.random.RandomState(seed)
+    chunks, pauses, position = [], [], 0
+    for seconds, level in parts:
+        num_samples = int(seconds * RATE)
+        if level:
+            t = np.arange(num_samples) / RATE
+            envelope = 0.2 + 0.8 * np.abs(np.sin(2 * np.pi * 3 * t))
+            chunks.append(3000 * level * envelope * rng.normal(0, 1, num_samples))
+        else:
+            chunks.append(rng.normal(0, 10, num_samples))
+            pauses.append((position, position + num_samples))
+        position += num_samples
+    return np.round(np.concatenate(chunks)).astype(np.int16), pauses
+
+
+def in_pause(sample, pauses):
+    return any(start <= sample <= end for start, end in pauses)
+
+
+def test_rare_pauses():
+    # 0.4 s pauses every 8 s, 5% of the recording, and stretches of quiet speech, still 20 dB above the pauses, that
+    # are longer than the pauses and more of the recording
+    parts = []
+    for _ in range(8):
+        parts += [(3.0, 1.0), (1.2, 0.1), (3.4, 1.0), (0.4, 0)]
+    samples, pauses = recording(parts + [(3.0, 1.0)])
+    segments = split_at_silences(samples, RATE, max_segment=20.0, min_segment=5.0)
+    assert len(segments) > 1
+    for (_, end), (start, _) in zip(segments[:-1], segments[1:]):
+        assert in_pause(end, pauses) and in_pause(start, pauses), (end, start, pauses)
+    # nothing but pauses is left out
+    assert segments[0][0] == 0 and segments[-1][1] == len(samples)
+    for (_, end), (start, _) in zip(segments[:-1], segments[1:]):
+        assert end == start
+
+
+def test_alignment():
+    samples, _ = recording([(6.0, 1.0), (0.5, 0), (6.0, 1.0), (0.5, 0), (6.0, 1.0)])
+    align = 480
+    segments = split_at_silences(samples, RATE, max_segment=10.0, min_segment=3.0, align=align)
+    assert len(segments) == 3
+    for start, end in segments:
+        assert start % align == 0
+    for _, end in segments[:-1]:
+        assert end % align == 0
+    assert segments[-1][1] == len(samples)
+
+
+def test_silent_stretch_left_out():
+    samples, pauses = recording([(8.0, 1.0), (40.0, 0), (8.0, 1.0)])
+    silence_start, silence_end = pauses[0]
+    for digital in (False, True):
+        if digital:
+            # digital silence does not pull the noise floor down either
+            samples[silence_start:silence_end] = 0
+        segments = split_at_silences(samples, RATE, max_segment=10.0, min_segment=2.0)
+        for start, end in segments:
+            # no segment lies within the silence
+            assert not (start >= silence_start and end <= silence_end), (digital, start, end)
+        covered = np.zeros(len(samples), dtype=bool)
+        for start, end in segments:
+            covered[start:end] = True
+        assert covered[:silence_start].all() and covered[silence_end:].all()
+
+
+def test_segment_bounds():
+    # speech without pauses is cut at its quietest frames, within the bounds
+    samples, _ = recording([(95.0, 1.0)])
+    max_segment, min_segment = 12.0, 4.0
+    segments = split_at_silences(samples, RATE, max_segment=max_segment, min_segment=min_segment)
+    assert segments[0][0] == 0 and segments[-1][1] == len(samples)
+    for start, end in segments:
+        assert end - start <= max_segment * RATE
+    for start, end in segments[:-1]:
+        assert end - start >= min_segment * RATE
+
+
+if __name__ == '__main__':
+    for test in (test_rare_pauses, test_alignment, test_silent_stretch_left_out, test_segment_bounds):
+        test()
+        print(test.__name__, "ok")